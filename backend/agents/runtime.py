@@ -13,6 +13,7 @@ import logging # ADDED
 
 from analytics.enrichment import MessageEnrichment # Import MessageEnrichment
 from core.errors import AIAProviderError, SupabaseUnavailableError
+from core.metrics import inc_counter
 
 logger = logging.getLogger(__name__) # ADDED
 
@@ -73,6 +74,27 @@ def get_agent_runtime_config(supabase_repo: SupabaseRepo, agent_id: uuid.UUID, w
     }
 
 
+def get_context_token_budget(rules, agent_id: uuid.UUID):
+    """
+    Returns the positive integer `context_token_budget` from the agent rules, or None
+    (the KNOWLEDGE_CONTEXT_TOKEN_BUDGET default) if it is unset or invalid.
+    """
+    value = rules.get("context_token_budget") if isinstance(rules, dict) else None
+    if value is None or value == "":
+        return None
+    try:
+        budget = None if isinstance(value, bool) else int(value)
+    except (TypeError, ValueError):
+        budget = None
+    if budget is None or budget <= 0:
+        logger.warning(
+            f"Ignoring invalid context_token_budget {value!r} for agent {agent_id}; using the default budget.",
+            extra={"agent_id": str(agent_id)},
+        )
+        return None
+    return budget
+
+
 class CircuitBreaker:
     FAILURE_THRESHOLD = 3
     RECOVERY_TIMEOUT = 60  # seconds
@@ -120,6 +142,42 @@ class AgentRuntime:
         """Helper to format data as an SSE event."""
         return f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
 
+    async def _build_knowledge_context(self, query: str, agent_id: uuid.UUID, rules: dict):
+        """
+        Retrieves knowledge for `query` and packs it into the agent's context token budget
+        (`context_token_budget` in the agent rules). Returns (context_messages, citations).
+        """
+        packed = await self.hybrid_searcher.retrieve_context(
+            query=query,
+            agent_id=agent_id,
+            workspace_id=self.workspace_id,
+            token_budget=get_context_token_budget(rules, agent_id),
+        )
+        items = packed["items"]
+        if not items:
+            logger.info(f"No relevant knowledge retrieved for agent {agent_id}.")
+            return [], []
+
+        inc_counter('context_tokens', {'stage': 'retrieved'}, packed["candidate_tokens"])
+        inc_counter('context_tokens', {'stage': 'packed'}, packed["tokens"])
+        reduction = 1 - packed["tokens"] / packed["candidate_tokens"] if packed["candidate_tokens"] else 0.0
+        retrieval = packed["retrieval"]
+        logger.info(
+            f"Packed {len(items)} knowledge chunks for agent {agent_id}: {packed['tokens']} of "
+            f"{packed['candidate_tokens']} retrieved tokens ({reduction:.0%} prompt-token reduction); "
+            f"k={retrieval['k']} ({retrieval['reason']}), top similarity {retrieval['top_similarity']}, "
+            f"scores {retrieval['relative_scores']}."
+        )
+
+        context_text = "\n\n".join(item["content"] for item in items)
+        context_messages = [{"role": "system", "content": f"Use the following knowledge to answer the user's question:\n{context_text}"}]
+        # source_ids also names sources whose duplicate of this text was stored only as a reference.
+        citations = [
+            {"source_id": str(item["source_id"]), "source_ids": item.get("source_ids", [str(item["source_id"])]), "content": item["content"]}
+            for item in items
+        ]
+        return context_messages, citations
+
     async def chat_stream(self, agent_id: uuid.UUID, conversation_id: uuid.UUID | None, channel: str, user_message: dict, options: dict):
         """
         Handles the chat interaction, calls the AI model, and streams the response via SSE.
@@ -142,23 +200,8 @@ class AgentRuntime:
             runtime_version_id = agent_config_data.get("version_id") # Get the version_id used
             user_message_content = user_message.get("content", "")
 
-            # 2. Retrieve Knowledge via Hybrid Search
-            retrieved_knowledge = await self.hybrid_searcher.hybrid_knowledge_search(
-                query=user_message_content,
-                agent_id=agent_id,
-                workspace_id=self.workspace_id,
-                top_k=5 # Adjust as needed or make configurable
-            )
-
-            context_messages = []
-            citations = []
-            if retrieved_knowledge:
-                context_text = "\n\n".join([item["content"] for item in retrieved_knowledge])
-                context_messages.append({"role": "system", "content": f"Use the following knowledge to answer the user's question:\n{context_text}"})
-                citations = [{"source_id": str(item["source_id"]), "content": item["content"]} for item in retrieved_knowledge]
-                logger.info(f"Retrieved {len(retrieved_knowledge)} knowledge chunks for agent {agent_id}.")
-            else:
-                logger.info(f"No relevant knowledge retrieved for agent {agent_id}.")
+            # 2. Retrieve Knowledge via Hybrid Search, packed into the agent's token budget
+            context_messages, citations = await self._build_knowledge_context(user_message_content, agent_id, rules)
 
             messages = [
                 {"role": "system", "content": system_prompt},
@@ -251,23 +294,8 @@ class AgentRuntime:
             rules = agent_config_data.get("rules", {}) # Use 'rules' from the returned dict
             runtime_version_id = agent_config_data.get("version_id") # Get the version_id used
             
-            # 2. Retrieve Knowledge via Hybrid Search
-            retrieved_knowledge = await self.hybrid_searcher.hybrid_knowledge_search(
-                query=user_message,
-                agent_id=agent_id,
-                workspace_id=self.workspace_id,
-                top_k=5 # Adjust as needed or make configurable
-            )
-
-            context_messages = []
-            citations = []
-            if retrieved_knowledge:
-                context_text = "\n\n".join([item["content"] for item in retrieved_knowledge])
-                context_messages.append({"role": "system", "content": f"Use the following knowledge to answer the user's question:\n{context_text}"})
-                citations = [{"source_id": str(item["source_id"]), "content": item["content"]} for item in retrieved_knowledge]
-                logger.info(f"Retrieved {len(retrieved_knowledge)} knowledge chunks for agent {agent_id}.")
-            else:
-                logger.info(f"No relevant knowledge retrieved for agent {agent_id}.")
+            # 2. Retrieve Knowledge via Hybrid Search, packed into the agent's token budget
+            context_messages, citations = await self._build_knowledge_context(user_message, agent_id, rules)
 
             messages = [
                 {"role": "system", "content": system_prompt},
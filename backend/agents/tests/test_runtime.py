@@ -1,7 +1,7 @@
 import unittest
 from unittest.mock import Mock, patch
 import uuid
-from backend.agents.runtime import get_agent_runtime_config
+from backend.agents.runtime import get_agent_runtime_config, get_context_token_budget
 from backend.agents.supabase_repo import SupabaseRepo
 from rest_framework import exceptions
 
@@ -250,5 +250,23 @@ class GetAgentRuntimeConfigTest(unittest.TestCase):
         self.assertEqual(config["rules"], {}) # Should fallback to empty dict
         self.assertEqual(config["version_id"], str(draft_version_id))
 
+class GetContextTokenBudgetTest(unittest.TestCase):
+
+    def test_valid_budgets_are_used(self):
+        agent_id = uuid.uuid4()
+        self.assertEqual(get_context_token_budget({"context_token_budget": 1500}, agent_id), 1500)
+        self.assertEqual(get_context_token_budget({"context_token_budget": "800"}, agent_id), 800)
+
+    def test_missing_budget_uses_default(self):
+        agent_id = uuid.uuid4()
+        self.assertIsNone(get_context_token_budget({}, agent_id))
+        self.assertIsNone(get_context_token_budget(None, agent_id))
+
+    def test_invalid_budgets_fall_back_with_warning(self):
+        agent_id = uuid.uuid4()
+        for value in ("lots", -200, 0, [1000], True):
+            with self.assertLogs("backend.agents.runtime", level="WARNING"):
+                self.assertIsNone(get_context_token_budget({"context_token_budget": value}, agent_id))
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
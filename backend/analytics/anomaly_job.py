@@ -0,0 +1,156 @@
+"""
+Batch usage anomaly job: scores every workspace's daily usage in one pass
+(see analytics.anomaly) and stores a "usage_anomaly" insight for each
+workspace with anomalous days in the reporting window.
+
+Reads and writes go through Django's database connection (like kb_jobs), so
+the job sees all workspaces regardless of RLS. Daily usage is aggregated in
+SQL and streamed through a server-side cursor straight into the usage matrix,
+so memory is the matrix plus one chunk of rows.
+"""
+import datetime
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from django.db import connection, transaction
+
+from analytics.anomaly import EWMA_ALPHA, Z_THRESHOLD, anomaly_reports, detect_anomalies
+
+logger = logging.getLogger(__name__)
+
+ANOMALY_HISTORY_DAYS = int(os.getenv("ANOMALY_HISTORY_DAYS", "90"))
+ANOMALY_REPORT_DAYS = int(os.getenv("ANOMALY_REPORT_DAYS", "7"))
+ANOMALY_FETCH_CHUNK = int(os.getenv("ANOMALY_FETCH_CHUNK", "50000"))
+
+INSIGHT_TYPE = "usage_anomaly"
+
+_DAILY_USAGE_SQL = """
+    SELECT workspace_id::text,
+           (created_at AT TIME ZONE 'UTC')::date - %s::date AS day,
+           sum(quantity)
+    FROM public.usage_events
+    WHERE created_at >= %s AND created_at < %s
+    GROUP BY 1, 2
+"""
+
+_INSERT_INSIGHTS_SQL = """
+    INSERT INTO public.analytics_insights
+        (id, workspace_id, period_start, period_end, insight_type, title, summary, payload, created_at)
+    SELECT u.id, u.workspace_id, %s, %s, %s, u.title, u.summary, u.payload, now()
+    FROM unnest(%s::uuid[], %s::uuid[], %s::text[], %s::text[], %s::jsonb[])
+        AS u(id, workspace_id, title, summary, payload)
+    WHERE NOT EXISTS (
+        SELECT 1 FROM public.analytics_insights i
+        WHERE i.workspace_id = u.workspace_id
+          AND i.insight_type = %s
+          AND i.period_start = %s
+          AND i.period_end = %s
+    )
+"""
+
+
+def load_daily_usage(start_date: datetime.date, num_days: int, chunk_size: int = ANOMALY_FETCH_CHUNK) -> Tuple[List[str], np.ndarray]:
+    """
+    Returns (workspace ids, float32 usage matrix of shape (workspaces, num_days))
+    for the days starting at `start_date`. Every workspace gets a row, with or without usage.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT id::text FROM public.workspaces ORDER BY id")
+        workspace_ids = [row[0] for row in cursor.fetchall()]
+    index = {workspace_id: position for position, workspace_id in enumerate(workspace_ids)}
+    usage = np.zeros((len(workspace_ids), num_days), dtype=np.float32)
+
+    start = datetime.datetime.combine(start_date, datetime.time(), datetime.timezone.utc)
+    end = start + datetime.timedelta(days=num_days)
+    with transaction.atomic(), connection.chunked_cursor() as cursor:
+        cursor.execute(_DAILY_USAGE_SQL, [start_date, start, end])
+        while True:
+            chunk = cursor.fetchmany(chunk_size)
+            if not chunk:
+                break
+            known = [(index[workspace_id], day, quantity) for workspace_id, day, quantity in chunk if workspace_id in index]
+            if known:
+                rows, days, quantities = zip(*known)
+                np.add.at(usage, (np.array(rows), np.array(days)), np.array(quantities, dtype=np.float32))
+    return workspace_ids, usage
+
+
+def build_insights(reports: List[Dict]) -> List[Dict]:
+    insights = []
+    for report in reports:
+        peak = max(report["days"], key=lambda day: day["z"])
+        insights.append({
+            "id": str(uuid.uuid4()),
+            "workspace_id": report["workspace_id"],
+            "title": "Usage Anomaly Detected",
+            "summary": (
+                f"Usage was unusually high on {len(report['days'])} day(s); the largest was {peak['date']} "
+                f"with {peak['quantity']:.0f} against {peak['expected']:.0f} expected."
+            ),
+            "payload": json.dumps({
+                "method": "ewma_robust_z",
+                "anomalous_days": report["days"],
+            }),
+        })
+    return insights
+
+
+def store_insights(insights: List[Dict], period_start: datetime.date, period_end: datetime.date) -> int:
+    """
+    Writes all insights with one statement, skipping workspaces that already
+    have a usage_anomaly insight for the period. Returns the number inserted.
+    """
+    if not insights:
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(_INSERT_INSIGHTS_SQL, [
+            period_start, period_end, INSIGHT_TYPE,
+            [insight["id"] for insight in insights],
+            [insight["workspace_id"] for insight in insights],
+            [insight["title"] for insight in insights],
+            [insight["summary"] for insight in insights],
+            [insight["payload"] for insight in insights],
+            INSIGHT_TYPE, period_start, period_end,
+        ])
+        return cursor.rowcount
+
+
+def run(end_date: Optional[datetime.date] = None, history_days: int = ANOMALY_HISTORY_DAYS,
+        report_days: int = ANOMALY_REPORT_DAYS, alpha: float = EWMA_ALPHA, z_threshold: float = Z_THRESHOLD,
+        dry_run: bool = False) -> Dict:
+    """
+    Scores the `history_days` ending at `end_date` (default: yesterday, UTC)
+    and reports anomalies from its last `report_days`. Returns run stats.
+    """
+    end_date = end_date or datetime.datetime.now(datetime.timezone.utc).date() - datetime.timedelta(days=1)
+    start_date = end_date - datetime.timedelta(days=history_days - 1)
+    period_start = end_date - datetime.timedelta(days=report_days - 1)
+
+    started = time.perf_counter()
+    workspace_ids, usage = load_daily_usage(start_date, history_days)
+    loaded = time.perf_counter()
+    result = detect_anomalies(usage, alpha=alpha, z_threshold=z_threshold)
+    result["anomalies"][:, :history_days - report_days] = False  # older days were reported by earlier runs
+    reports = anomaly_reports(workspace_ids, start_date, usage, result)
+    detected = time.perf_counter()
+    stored = 0 if dry_run else store_insights(build_insights(reports), period_start, end_date)
+
+    stats = {
+        "workspaces": len(workspace_ids),
+        "days": history_days,
+        "period_start": period_start.isoformat(),
+        "period_end": end_date.isoformat(),
+        "workspaces_flagged": len(reports),
+        "anomalous_days": int(result["anomalies"].sum()),
+        "insights_stored": stored,
+        "load_seconds": round(loaded - started, 3),
+        "detect_seconds": round(detected - loaded, 3),
+        "store_seconds": round(time.perf_counter() - detected, 3),
+    }
+    logger.info(f"Usage anomaly run finished: {stats}")
+    return stats
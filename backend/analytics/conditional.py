@@ -0,0 +1,54 @@
+"""
+Conditional GETs for analytics endpoints.
+
+Overview, timeseries and insights reads are a function of the query
+parameters and of tables whose changes analytics_watermarks records
+(analytics_daily_rollup and analytics_insights). Breakdowns read live views
+the watermark does not cover, so they are always served in full. The ETag is a hash of (resource, workspace, parameters, watermark),
+so a dashboard that polls with If-None-Match gets a 304 after one primary-key
+read instead of the analytics queries.
+"""
+import datetime
+import hashlib
+import json
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from analytics.supabase_repo import AnalyticsSupabaseRepo
+
+logger = logging.getLogger(__name__)
+
+
+def watermark_etag(resource: str, workspace_id, params: Dict[str, Any], changed_at: Optional[str]) -> str:
+    key = json.dumps([resource, str(workspace_id), params, changed_at], sort_keys=True, default=str)
+    return f'"{hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]}"'
+
+
+def evaluate(request, repo: AnalyticsSupabaseRepo, resource: str, params: Dict[str, Any],
+             watermark_field: str = "data_changed_at") -> Tuple[Optional[Any], Dict[str, str]]:
+    """
+    Returns (304 response or None, validator headers to set on the full
+    response). If the watermark cannot be read, the request is served
+    unconditionally, without validators.
+    """
+    try:
+        changed_at = repo.get_watermark(request.workspace_id).get(watermark_field)
+    except Exception as e:
+        logger.warning(f"Analytics watermark unavailable, serving unconditionally: {e}")
+        return None, {}
+
+    etag = watermark_etag(resource, request.workspace_id, params, changed_at)
+    last_modified = None
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if changed_at:
+        last_modified = int(datetime.datetime.fromisoformat(changed_at).timestamp())
+        headers["Last-Modified"] = http_date(last_modified)
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        for header, value in headers.items():
+            not_modified[header] = value
+    return not_modified, headers
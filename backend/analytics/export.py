@@ -0,0 +1,68 @@
+"""
+Streaming export of the daily analytics rollup for BI tools.
+
+Rows are read with a server-side cursor (fetched `chunk_size` at a time) and
+encoded as gzip-compressed NDJSON in pieces of about `flush_bytes`, so memory
+stays at one fetch chunk plus one compression buffer whatever the range.
+Reads go through Django's database connection, so callers must check
+workspace membership first (the export view does, via IsWorkspaceMember);
+every query is scoped to that one workspace.
+"""
+import datetime
+import json
+import os
+import uuid
+import zlib
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+from django.db import connection, transaction
+
+ANALYTICS_EXPORT_FETCH_ROWS = int(os.getenv("ANALYTICS_EXPORT_FETCH_ROWS", "5000"))
+ANALYTICS_EXPORT_FLUSH_BYTES = int(os.getenv("ANALYTICS_EXPORT_FLUSH_BYTES", str(256 * 1024)))
+
+EXPORT_COLUMNS = (
+    "date", "agent_id", "channel", "total_messages", "ai_responses", "avg_response_time_sum",
+    "positive_count", "neutral_count", "negative_count",
+)
+
+_EXPORT_SQL = f"""
+    SELECT {", ".join(EXPORT_COLUMNS)}
+    FROM public.analytics_daily_rollup
+    WHERE workspace_id = %s
+      AND date BETWEEN %s AND %s
+      AND (%s::uuid IS NULL OR agent_id = %s::uuid)
+      AND (%s::text IS NULL OR channel = %s::text)
+    ORDER BY date, agent_id, channel
+"""
+
+
+def iter_rollup_rows(workspace_id: uuid.UUID, start_date: datetime.date, end_date: datetime.date,
+                     agent_id: Optional[uuid.UUID] = None, channel: Optional[str] = None,
+                     chunk_size: int = ANALYTICS_EXPORT_FETCH_ROWS) -> Iterator[Dict[str, Any]]:
+    agent = str(agent_id) if agent_id else None
+    with transaction.atomic(), connection.chunked_cursor() as cursor:
+        cursor.execute(_EXPORT_SQL, [str(workspace_id), start_date, end_date, agent, agent, channel, channel])
+        while True:
+            chunk = cursor.fetchmany(chunk_size)
+            if not chunk:
+                return
+            for row in chunk:
+                yield dict(zip(EXPORT_COLUMNS, row))
+
+
+def encode_ndjson_gzip(rows: Iterable[Dict[str, Any]], flush_bytes: int = ANALYTICS_EXPORT_FLUSH_BYTES) -> Iterator[bytes]:
+    """
+    Yields one gzip stream of the rows as NDJSON (dates, UUIDs and decimals as strings).
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+    lines, size = [], 0
+    for row in rows:
+        line = json.dumps(row, default=str, separators=(",", ":")) + "\n"
+        lines.append(line)
+        size += len(line)
+        if size >= flush_bytes:
+            compressed = compressor.compress("".join(lines).encode("utf-8"))
+            lines, size = [], 0
+            if compressed:
+                yield compressed
+    yield compressor.compress("".join(lines).encode("utf-8")) + compressor.flush()
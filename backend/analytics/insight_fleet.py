@@ -0,0 +1,265 @@
+"""
+Fleet-wide structured insights: runs InsightsEngine.generate_structured_insights
+for every workspace, outside the request cycle.
+
+Workspaces are split into `shard_count` stable shards (hash of the id) and the
+shards are processed by a spawn-context process pool. Each shard walks its
+workspaces in id order and checkpoints after every workspace in
+analytics_insight_runs, so an interrupted run resumes where each shard stopped;
+finished shards are skipped. The engine skips insight types that already exist
+for the period, so re-processing a workspace after a crash is harmless.
+
+A workspace that fails does not stop its shard: its id is added to the shard's
+failed_workspace_ids and retried once the shard has walked its workspaces. A
+shard is only marked done when none remain failed, so later runs resume it and
+retry them again; the run report lists the ids still failing.
+
+All processes share one semaphore that is held around every Supabase round
+trip, which caps concurrent Supabase calls for the whole run regardless of the
+number of processes and of each engine's fetch threads.
+"""
+import datetime
+import logging
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+
+from django.db import close_old_connections, connection
+
+logger = logging.getLogger(__name__)
+
+SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+INSIGHT_FLEET_PROCESSES = int(os.getenv("INSIGHT_FLEET_PROCESSES", "4"))
+INSIGHT_FLEET_SHARDS = int(os.getenv("INSIGHT_FLEET_SHARDS", "16"))
+INSIGHT_FLEET_SUPABASE_CONCURRENCY = int(os.getenv("INSIGHT_FLEET_SUPABASE_CONCURRENCY", "8"))
+
+_SHARD_WORKSPACES_SQL = """
+    SELECT id::text FROM public.workspaces
+    WHERE mod(abs(hashtext(id::text)), %s) = %s
+      AND (%s::uuid IS NULL OR id > %s::uuid)
+    ORDER BY id
+"""
+
+# Set in each pool process by _init_process.
+_call_gate = None
+
+
+def _init_process(call_gate):
+    # Spawned children start from a fresh interpreter; DJANGO_SETTINGS_MODULE is inherited.
+    import django
+    django.setup()
+    global _call_gate
+    _call_gate = call_gate
+
+
+def last_full_week(today: Optional[datetime.date] = None) -> Tuple[datetime.date, datetime.date]:
+    """Monday..Sunday of the last complete week (UTC)."""
+    today = today or datetime.datetime.now(datetime.timezone.utc).date()
+    period_end = today - datetime.timedelta(days=today.weekday() + 1)
+    return period_end - datetime.timedelta(days=6), period_end
+
+
+def prepare_shards(period_start: datetime.date, period_end: datetime.date, shard_count: int,
+                   restart: bool = False) -> List[int]:
+    """Creates missing checkpoint rows and returns the shards that are not done yet."""
+    with connection.cursor() as cursor:
+        if restart:
+            cursor.execute(
+                "DELETE FROM public.analytics_insight_runs WHERE period_start = %s AND period_end = %s AND shard_count = %s",
+                [period_start, period_end, shard_count],
+            )
+        cursor.execute(
+            """
+            INSERT INTO public.analytics_insight_runs (period_start, period_end, shard_count, shard)
+            SELECT %s, %s, %s, shard FROM generate_series(0, %s - 1) AS shard
+            ON CONFLICT DO NOTHING
+            """,
+            [period_start, period_end, shard_count, shard_count],
+        )
+        cursor.execute(
+            """
+            SELECT shard FROM public.analytics_insight_runs
+            WHERE period_start = %s AND period_end = %s AND shard_count = %s AND status <> 'done'
+            ORDER BY shard
+            """,
+            [period_start, period_end, shard_count],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _load_checkpoint(key: List) -> Tuple[Optional[str], List[str]]:
+    """Returns the shard's last processed workspace id and the ids still failed."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT last_workspace_id::text, failed_workspace_ids::text[] FROM public.analytics_insight_runs
+            WHERE period_start = %s AND period_end = %s AND shard_count = %s AND shard = %s
+            """,
+            key,
+        )
+        row = cursor.fetchone()
+    return (row[0], list(row[1] or [])) if row else (None, [])
+
+
+def _save_checkpoint(key: List, workspace_id: str, insights: int, error: Optional[str]) -> None:
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE public.analytics_insight_runs
+            SET last_workspace_id = %s,
+                processed = processed + 1,
+                failed = failed + %s,
+                failed_workspace_ids = CASE WHEN %s THEN array_append(failed_workspace_ids, %s::uuid)
+                                            ELSE failed_workspace_ids END,
+                insights = insights + %s,
+                last_error = coalesce(%s, last_error),
+                updated_at = now()
+            WHERE period_start = %s AND period_end = %s AND shard_count = %s AND shard = %s
+            """,
+            [workspace_id, 1 if error else 0, error is not None, workspace_id, insights, error, *key],
+        )
+
+
+def _save_retry(key: List, workspace_id: str, insights: int, error: Optional[str]) -> None:
+    """Records a retry of a failed workspace; a success removes it from the failed list."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE public.analytics_insight_runs
+            SET failed = failed - %s,
+                failed_workspace_ids = CASE WHEN %s THEN failed_workspace_ids
+                                            ELSE array_remove(failed_workspace_ids, %s::uuid) END,
+                insights = insights + %s,
+                last_error = coalesce(%s, last_error),
+                updated_at = now()
+            WHERE period_start = %s AND period_end = %s AND shard_count = %s AND shard = %s
+            """,
+            [0 if error else 1, error is not None, workspace_id, insights, error, *key],
+        )
+
+
+def _finish_shard(key: List) -> None:
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE public.analytics_insight_runs SET status = 'done', updated_at = now()
+            WHERE period_start = %s AND period_end = %s AND shard_count = %s AND shard = %s
+            """,
+            key,
+        )
+
+
+def _generate(workspace_id: str, period_start: datetime.date, period_end: datetime.date) -> Tuple[int, Optional[str]]:
+    """Returns (insights stored, error message or None) for one workspace."""
+    from analytics.insights import InsightsEngine  # needs Django settings, so import after _init_process
+
+    try:
+        engine = InsightsEngine(uuid.UUID(workspace_id), SUPABASE_SERVICE_ROLE_KEY, call_gate=_call_gate)
+        return len(engine.generate_structured_insights(period_start, period_end)), None
+    except Exception as e:
+        logger.error(f"Fleet insights failed for workspace {workspace_id}: {e}", exc_info=True)
+        return 0, f"{workspace_id}: {e}"
+
+
+def run_shard(period_start: datetime.date, period_end: datetime.date, shard: int, shard_count: int) -> Dict:
+    """
+    Generates insights for every workspace of one shard after its checkpoint,
+    then retries the shard's failed workspaces (including those of earlier
+    runs). Runs in a pool process; returns this invocation's counts and the
+    ids still failing.
+    """
+    close_old_connections()
+    key = [period_start, period_end, shard_count, shard]
+    started = time.perf_counter()
+    stats = {"shard": shard, "processed": 0, "failed": 0, "retried": 0, "recovered": 0, "insights": 0}
+    try:
+        last_workspace_id, _ = _load_checkpoint(key)
+        with connection.cursor() as cursor:
+            cursor.execute(_SHARD_WORKSPACES_SQL, [shard_count, shard, last_workspace_id, last_workspace_id])
+            workspace_ids = [row[0] for row in cursor.fetchall()]
+
+        for workspace_id in workspace_ids:
+            stored, error = _generate(workspace_id, period_start, period_end)
+            _save_checkpoint(key, workspace_id, stored, error)
+            stats["processed"] += 1
+            stats["failed"] += 1 if error else 0
+            stats["insights"] += stored
+
+        still_failed = []
+        for workspace_id in _load_checkpoint(key)[1]:
+            stored, error = _generate(workspace_id, period_start, period_end)
+            _save_retry(key, workspace_id, stored, error)
+            stats["retried"] += 1
+            stats["insights"] += stored
+            if error:
+                still_failed.append(workspace_id)
+            else:
+                stats["recovered"] += 1
+        stats["failed_workspace_ids"] = still_failed
+
+        if not still_failed:
+            _finish_shard(key)
+    finally:
+        close_old_connections()
+    stats["seconds"] = round(time.perf_counter() - started, 3)
+    return stats
+
+
+def run(period_start: Optional[datetime.date] = None, period_end: Optional[datetime.date] = None,
+        processes: int = INSIGHT_FLEET_PROCESSES, shard_count: int = INSIGHT_FLEET_SHARDS,
+        supabase_concurrency: int = INSIGHT_FLEET_SUPABASE_CONCURRENCY, restart: bool = False) -> Dict:
+    """
+    Processes every unfinished shard of the period (default: the last full
+    week) and returns the run report. A shard that crashes, or still has
+    failed workspaces after its retry pass, is left unfinished so the next run
+    resumes it; `failed_workspace_ids` lists the workspaces still failing.
+    """
+    if not SUPABASE_SERVICE_ROLE_KEY:
+        raise ValueError("SUPABASE_SERVICE_ROLE_KEY must be set to generate insights for all workspaces.")
+    if period_start is None or period_end is None:
+        period_start, period_end = last_full_week()
+
+    pending = prepare_shards(period_start, period_end, shard_count, restart=restart)
+    started = time.perf_counter()
+    shard_stats, crashed = [], []
+    if pending:
+        context = multiprocessing.get_context("spawn")
+        call_gate = context.BoundedSemaphore(supabase_concurrency)
+        with ProcessPoolExecutor(max_workers=min(processes, len(pending)), mp_context=context,
+                                 initializer=_init_process, initargs=(call_gate,)) as executor:
+            futures = {executor.submit(run_shard, period_start, period_end, shard, shard_count): shard for shard in pending}
+            for future in as_completed(futures):
+                shard = futures[future]
+                try:
+                    stats = future.result()
+                except Exception as e:
+                    logger.error(f"Fleet insights shard {shard} crashed: {e}", exc_info=True)
+                    crashed.append({"shard": shard, "error": str(e)})
+                    continue
+                logger.info(f"Fleet insights shard {shard} done: {stats}")
+                shard_stats.append(stats)
+
+    elapsed = time.perf_counter() - started
+    processed = sum(stats["processed"] for stats in shard_stats)
+    failed_ids = sorted(workspace_id for stats in shard_stats for workspace_id in stats["failed_workspace_ids"])
+    report = {
+        "period_start": period_start.isoformat(),
+        "period_end": period_end.isoformat(),
+        "shards": shard_count,
+        "shards_skipped": shard_count - len(pending),
+        "shards_done": sum(1 for stats in shard_stats if not stats["failed_workspace_ids"]),
+        "shards_crashed": crashed,
+        "workspaces_processed": processed,
+        "workspaces_failed": sum(stats["failed"] for stats in shard_stats),
+        "workspaces_retried": sum(stats["retried"] for stats in shard_stats),
+        "workspaces_recovered": sum(stats["recovered"] for stats in shard_stats),
+        "failed_workspace_ids": failed_ids,
+        "insights_stored": sum(stats["insights"] for stats in shard_stats),
+        "seconds": round(elapsed, 3),
+        "workspaces_per_second": round(processed / elapsed, 2) if elapsed > 0 else 0.0,
+    }
+    logger.info(f"Fleet insights run finished: {report}")
+    return report
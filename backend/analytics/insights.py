@@ -2,36 +2,60 @@ import logging
 import uuid
 import datetime
 import json
-from typing import Dict, Any, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Callable, Dict, Any, Iterator, List, Optional
 import os
 
 from supabase import create_client, Client
 from django.conf import settings # Assuming Django settings are accessible
 
-# NOTE: This file should import `analytics_repo` from `backend.analytics.supabase_repo`
-# which is not explicitly defined in the problem description, but a common pattern.
-# For now, we will create a direct Supabase client.
-# In a real scenario, this would be a dedicated repository.
+from analytics.supabase_repo import AnalyticsSupabaseRepo
 
 logger = logging.getLogger(__name__)
 
+# Runs the independent data fetches of one insight run concurrently.
+insights_executor = ThreadPoolExecutor(max_workers=4)
+
+USAGE_EVENTS_PAGE_SIZE = int(os.getenv("USAGE_EVENTS_PAGE_SIZE", "1000"))
+# Buckets requested per usage_event_buckets call (one row each), kept within PostgREST's max_rows.
+USAGE_BUCKETS_PER_CALL = 1000
+# Agents/channels listed by the top_agent_channel_usage insight.
+TOP_BREAKDOWN_LIMIT = 3
+
+STRUCTURED_INSIGHT_TYPES = (
+    "conversation_volume_trend",
+    "top_agent_channel_usage",
+    "message_to_order_conversion",
+    "usage_spike_detection",
+)
+
+def _bucket_key(timestamp: str, bucket: str) -> str:
+    """ Normalizes a bucket timestamp from PostgREST to "YYYY-MM-DD" (day) or "YYYY-MM-DDTHH:00" (hour), in UTC. """
+    moment = datetime.datetime.fromisoformat(timestamp.replace('Z', '+00:00')).astimezone(datetime.timezone.utc)
+    return moment.date().isoformat() if bucket == "day" else moment.strftime("%Y-%m-%dT%H:00")
+
+
 class InsightsEngine: # Renamed from InsightGenerator
     """
     Generates and stores insights from analytics data.
     """
     _client: Client
 
-    def __init__(self, workspace_id: uuid.UUID, user_jwt: str):
+    def __init__(self, workspace_id: uuid.UUID, user_jwt: str, call_gate=None):
         self.workspace_id = workspace_id
         self.user_jwt = user_jwt
         self.analytics_repo = AnalyticsSupabaseRepo(user_jwt) # Use the existing repo
+        # Held around every Supabase round trip of generate_structured_insights,
+        # e.g. a semaphore shared by all processes of a fleet run (see analytics.insight_fleet).
+        self._call_gate = call_gate
         
         # Original Supabase client (only for direct table access for insights storage/check)
         supabase_url = os.getenv("SUPABASE_URL")
         supabase_key = os.getenv("SUPABASE_ANON_KEY") # Or service key if available
         if not supabase_url or not supabase_key:
             raise ValueError("SUPABASE_URL and SUPABASE_ANON_KEY must be set.")
-        self._client = create_client(supabase_url, supabase_key)
+        self._client = create_client(supabase_url, supabase_key, options={"headers": {"Authorization": f"Bearer {user_jwt}"}})
 
     def _get_table(self, table_name: str):
         return self._client.table(table_name)
@@ -42,34 +66,93 @@ class InsightsEngine: # Renamed from InsightGenerator
             .eq("workspace_id", str(self.workspace_id)) \
             .gte("date", period_start.isoformat()) \
             .lte("date", period_end.isoformat()) \
-            .order("date", { "ascending": True }) \
+            .order("date") \
             .execute()
         return response.data if response.data else []
 
-    def _query_usage_events(self, period_start: datetime.date, period_end: datetime.date) -> List[Dict]:
-        """ Fetches usage_events for the period. """
-        response = self._get_table("usage_events").select("event_type, quantity") \
-            .eq("workspace_id", str(self.workspace_id)) \
-            .gte("created_at", period_start.isoformat()) \
-            .lte("created_at", period_end.isoformat()) \
-            .execute()
-        return response.data if response.data else []
+    @staticmethod
+    def _period_bounds(period_start: datetime.date, period_end: datetime.date):
+        """ [start, end) UTC timestamps covering every day of the period, including all of period_end. """
+        start = datetime.datetime.combine(period_start, datetime.time(), datetime.timezone.utc)
+        end = datetime.datetime.combine(period_end + datetime.timedelta(days=1), datetime.time(), datetime.timezone.utc)
+        return start, end
 
-    def _insight_exists(self, insight_type: str, period_start: datetime.date, period_end: datetime.date) -> bool:
-        """ Checks if an insight for the given type and period already exists. """
-        response = self._get_table("analytics_insights").select("id") \
+    def _query_usage_buckets(self, period_start: datetime.date, period_end: datetime.date, bucket: str = "day") -> Dict[str, int]:
+        """
+        Returns usage quantity per UTC bucket ("YYYY-MM-DD" for days, ISO hour
+        for hours), summed over event types. Bucketed in the database by the
+        usage_event_buckets RPC (one row per bucket, requested in windows of
+        USAGE_BUCKETS_PER_CALL buckets so no response hits max_rows); if that
+        fails, falls back to streaming the raw events (see _iter_usage_events)
+        and bucketing them here.
+        """
+        start, end = self._period_bounds(period_start, period_end)
+        step = datetime.timedelta(days=1) if bucket == "day" else datetime.timedelta(hours=1)
+        try:
+            rows = []
+            window_start = start
+            while window_start < end:
+                window_end = min(end, window_start + step * USAGE_BUCKETS_PER_CALL)
+                response = self._client.rpc("usage_event_buckets", {
+                    "p_workspace_id": str(self.workspace_id),
+                    "p_start": window_start.isoformat(),
+                    "p_end": window_end.isoformat(),
+                    "p_bucket": bucket,
+                }).execute()
+                rows.extend(response.data or [])
+                window_start = window_end
+        except Exception as e:
+            logger.warning(f"usage_event_buckets unavailable for workspace {self.workspace_id}, bucketing raw events: {e}")
+            rows = ({"bucket": event["created_at"], "quantity": event.get("quantity") or 0}
+                    for event in self._iter_usage_events(period_start, period_end, columns="id, created_at, quantity"))
+
+        usage: Dict[str, int] = {}
+        for row in rows:
+            key = _bucket_key(row["bucket"], bucket)
+            usage[key] = usage.get(key, 0) + (row.get("quantity") or 0)
+        return usage
+
+    def _iter_usage_events(self, period_start: datetime.date, period_end: datetime.date,
+                           columns: str = "id, event_type, quantity, created_at",
+                           page_size: int = USAGE_EVENTS_PAGE_SIZE) -> Iterator[Dict]:
+        """
+        Streams the period's usage_events in (created_at, id) order, one page at
+        a time. Pages are selected by keyset (rows after the last one seen), so
+        each page is an index range scan and memory stays at one page however
+        many events the workspace has. `columns` must include id and created_at.
+        """
+        start, end = self._period_bounds(period_start, period_end)
+        last = None
+        while True:
+            query = self._get_table("usage_events").select(columns) \
+                .eq("workspace_id", str(self.workspace_id)) \
+                .gte("created_at", start.isoformat()) \
+                .lt("created_at", end.isoformat())
+            if last is not None:
+                query = query.or_(
+                    f'created_at.gt."{last["created_at"]}",'
+                    f'and(created_at.eq."{last["created_at"]}",id.gt.{last["id"]})'
+                )
+            page = query.order("created_at").order("id").limit(page_size).execute().data or []
+            yield from page
+            if len(page) < page_size:
+                return
+            last = page[-1]
+
+    def _existing_insight_types(self, period_start: datetime.date, period_end: datetime.date) -> set:
+        """ Returns the structured insight types already stored for the period, in one query. """
+        response = self._get_table("analytics_insights").select("insight_type") \
             .eq("workspace_id", str(self.workspace_id)) \
-            .eq("insight_type", insight_type) \
+            .in_("insight_type", list(STRUCTURED_INSIGHT_TYPES)) \
             .eq("period_start", period_start.isoformat()) \
             .eq("period_end", period_end.isoformat()) \
-            .limit(1) \
             .execute()
-        return bool(response.data)
+        return {row["insight_type"] for row in response.data or []}
 
-    def _store_insight(self, insight_type: str, title: str, summary: str,
-                       payload: Dict, period_start: datetime.date, period_end: datetime.date):
-        """ Stores a generated insight. """
-        insight_data = {
+    def _build_insight(self, insight_type: str, title: str, summary: str,
+                       payload: Dict, period_start: datetime.date, period_end: datetime.date) -> Dict:
+        """ Builds an analytics_insights row. """
+        return {
             "id": str(uuid.uuid4()),
             "workspace_id": str(self.workspace_id),
             "period_start": period_start.isoformat(), # Store as ISO format for Supabase date type
@@ -80,16 +163,40 @@ class InsightsEngine: # Renamed from InsightGenerator
             "payload": json.dumps(payload), # Ensure payload is stored as JSON string
             "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
         }
-        response = self._get_table("analytics_insights").insert(insight_data).execute()
+
+    def _store_insights(self, insights: List[Dict]) -> List[Dict]:
+        """ Stores generated insights with a single multi-row insert. """
+        if not insights:
+            return []
+        response = self._get_table("analytics_insights").insert(insights).execute()
         if not response.data:
-            logger.error(f"Failed to store insight: {insight_type} for workspace {self.workspace_id}")
-        return response.data
+            logger.error(f"Failed to store {len(insights)} insights for workspace {self.workspace_id}")
+        return response.data or []
+
+    def _gated(self, call: Callable[[], Any]) -> Any:
+        with self._call_gate if self._call_gate is not None else nullcontext():
+            return call()
 
-    def _generate_conversation_volume_trend(self, daily_stats: List[Dict], period_start: datetime.date, period_end: datetime.date):
+    def _fetch_concurrently(self, fetches: Dict[str, Callable[[], Any]], optional: tuple = ()) -> Dict[str, Any]:
+        """
+        Runs `fetches` in parallel and returns their results by name. A failing
+        fetch named in `optional` is logged and yields None; any other failure is raised.
+        """
+        futures = {name: insights_executor.submit(self._gated, fetch) for name, fetch in fetches.items()}
+        results = {}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                if name not in optional:
+                    raise
+                logger.warning(f"Could not fetch {name} for workspace {self.workspace_id}: {e}")
+                results[name] = None
+        return results
+
+    def _generate_conversation_volume_trend(self, daily_stats: List[Dict], period_start: datetime.date, period_end: datetime.date) -> Optional[Dict]:
         insight_type = "conversation_volume_trend"
-        if self._insight_exists(insight_type, period_start, period_end): return
-        
-        if not daily_stats: return
+        if not daily_stats: return None
 
         first_day_conv = daily_stats[0].get("conversations_count", 0)
         last_day_conv = daily_stats[-1].get("conversations_count", 0)
@@ -112,71 +219,42 @@ class InsightsEngine: # Renamed from InsightGenerator
             "trend": trend,
             "daily_data": [{"date": s["date"], "conversations_count": s.get("conversations_count", 0)} for s in daily_stats]
         }
-        self._store_insight(insight_type, title, summary, payload, period_start, period_end)
+        return self._build_insight(insight_type, title, summary, payload, period_start, period_end)
 
-    def _generate_top_agent_channel_usage(self, daily_stats: List[Dict], period_start: datetime.date, period_end: datetime.date):
+    def _generate_top_agent_channel_usage(self, agent_breakdown: Optional[List[Dict]], channel_breakdown: Optional[List[Dict]],
+                                          period_start: datetime.date, period_end: datetime.date) -> Optional[Dict]:
         insight_type = "top_agent_channel_usage"
-        if self._insight_exists(insight_type, period_start, period_end): return
-
-        top_agents = []
-        top_channels = []
 
-        try:
-            agent_breakdown = self.analytics_repo.get_breakdown_data(
-                workspace_id=self.workspace_id,
-                start_date=period_start,
-                end_date=period_end,
-                breakdown_by="agent"
-            )
-            if agent_breakdown:
-                # Assuming agent_breakdown contains 'agent_id' and a metric like 'total_messages'
-                sorted_agents = sorted(agent_breakdown, key=lambda x: x.get("total_messages", 0), reverse=True)
-                top_agents = sorted_agents[:3] # Get top 3 agents
-        except Exception as e:
-            logger.warning(f"Could not fetch agent breakdown data: {e}")
-
-        try:
-            channel_breakdown = self.analytics_repo.get_breakdown_data(
-                workspace_id=self.workspace_id,
-                start_date=period_start,
-                end_date=period_end,
-                breakdown_by="channel"
-            )
-            if channel_breakdown:
-                # Assuming channel_breakdown contains 'channel' and 'total_messages'
-                sorted_channels = sorted(channel_breakdown, key=lambda x: x.get("total_messages", 0), reverse=True)
-                top_channels = sorted_channels[:3] # Get top 3 channels
-        except Exception as e:
-            logger.warning(f"Could not fetch channel breakdown data: {e}")
+        # Top-N breakdown rows (ranked by total_messages in the database); drop the "other" bucket.
+        top_agents = [row for row in agent_breakdown or [] if not row.get("is_other")]
+        top_channels = [row for row in channel_breakdown or [] if not row.get("is_other")]
 
         if not top_agents and not top_channels:
             logger.info("No agent or channel breakdown data to generate insight.")
-            return
+            return None
         
         title = "Top Agent & Channel Usage"
         summary_parts = []
         payload_data = {}
 
         if top_agents:
-            agent_summaries = [f"{a.get('agent_name', 'Unknown Agent')} ({a.get('total_messages', 0)} messages)" for a in top_agents]
+            agent_summaries = [f"{a.get('label') or 'Unknown Agent'} ({a.get('value') or 0:g} messages)" for a in top_agents]
             summary_parts.append(f"Top Agents: {'; '.join(agent_summaries)}")
             payload_data["top_agents"] = top_agents
         
         if top_channels:
-            channel_summaries = [f"{c.get('channel', 'Unknown Channel')} ({c.get('total_messages', 0)} messages)" for c in top_channels]
+            channel_summaries = [f"{c.get('label') or 'Unknown Channel'} ({c.get('value') or 0:g} messages)" for c in top_channels]
             summary_parts.append(f"Top Channels: {'; '.join(channel_summaries)}")
             payload_data["top_channels"] = top_channels
         
         summary = ". ".join(summary_parts) if summary_parts else "No significant agent or channel usage detected for the period."
 
-        self._store_insight(insight_type, title, summary, payload_data, period_start, period_end)
+        return self._build_insight(insight_type, title, summary, payload_data, period_start, period_end)
 
 
-    def _generate_message_to_order_conversion(self, daily_stats: List[Dict], period_start: datetime.date, period_end: datetime.date):
+    def _generate_message_to_order_conversion(self, daily_stats: List[Dict], period_start: datetime.date, period_end: datetime.date) -> Optional[Dict]:
         insight_type = "message_to_order_conversion"
-        if self._insight_exists(insight_type, period_start, period_end): return
-
-        if not daily_stats: return
+        if not daily_stats: return None
 
         total_messages = sum(s.get("messages_count", 0) for s in daily_stats)
         total_orders = sum(s.get("orders_count", 0) for s in daily_stats)
@@ -190,24 +268,15 @@ class InsightsEngine: # Renamed from InsightGenerator
             "total_orders": total_orders,
             "conversion_rate": conversion_rate,
         }
-        self._store_insight(insight_type, title, summary, payload, period_start, period_end)
+        return self._build_insight(insight_type, title, summary, payload, period_start, period_end)
 
-    def _generate_usage_spike_detection(self, usage_events: List[Dict], period_start: datetime.date, period_end: datetime.date):
+    def _generate_usage_spike_detection(self, daily_usage: Dict[str, int], period_start: datetime.date, period_end: datetime.date) -> Optional[Dict]:
         insight_type = "usage_spike_detection"
-        if self._insight_exists(insight_type, period_start, period_end): return
-
-        if not usage_events: return
+        if not daily_usage: return None
 
         # Basic spike detection: find days with significantly higher usage than average
-        daily_usage = {}
-        for event in usage_events:
-            event_date = datetime.datetime.fromisoformat(event["created_at"].replace('Z', '+00:00')).date()
-            if period_start <= event_date <= period_end:
-                date_str = event_date.isoformat()
-                daily_usage[date_str] = daily_usage.get(date_str, 0) + event.get("quantity", 0)
-
         usage_values = list(daily_usage.values())
-        if not usage_values: return
+        if not usage_values: return None
 
         average_usage = sum(usage_values) / len(usage_values)
         spike_days = []
@@ -223,29 +292,63 @@ class InsightsEngine: # Renamed from InsightGenerator
                 "spike_days": spike_days,
                 "daily_usage": daily_usage
             }
-            self._store_insight(insight_type, title, summary, payload, period_start, period_end)
-        else:
-            logger.info("No significant usage spikes detected.")
+            return self._build_insight(insight_type, title, summary, payload, period_start, period_end)
+        logger.info("No significant usage spikes detected.")
+        return None
 
 
-    def generate_structured_insights(self, period_start: datetime.date, period_end: datetime.date): # Renamed from generate_insights
-        """ Orchestrates the generation of all insights for a given period. """
+    def generate_structured_insights(self, period_start: datetime.date, period_end: datetime.date) -> List[Dict]: # Renamed from generate_insights
+        """
+        Orchestrates the generation of all insights for a given period in three
+        round trips: one query for the insights that already exist, the data
+        fetches the missing ones need (run concurrently), and one insert for
+        everything generated. Returns the stored insights.
+        """
         logger.info(
             f"Starting structured insight generation for workspace {self.workspace_id} from {period_start} to {period_end}"
         )
 
-        daily_stats = self._query_daily_stats(period_start, period_end)
-        usage_events = self._query_usage_events(period_start, period_end)
-
-        self._generate_conversation_volume_trend(daily_stats, period_start, period_end)
-        self._generate_top_agent_channel_usage(daily_stats, period_start, period_end)
-        self._generate_message_to_order_conversion(daily_stats, period_start, period_end)
-        self._generate_usage_spike_detection(usage_events, period_start, period_end)
+        pending = set(STRUCTURED_INSIGHT_TYPES) - self._gated(lambda: self._existing_insight_types(period_start, period_end))
+        if not pending:
+            logger.info(f"All structured insights already exist for workspace {self.workspace_id} from {period_start} to {period_end}")
+            return []
+
+        fetches = {}
+        if pending & {"conversation_volume_trend", "message_to_order_conversion"}:
+            fetches["daily_stats"] = lambda: self._query_daily_stats(period_start, period_end)
+        if "top_agent_channel_usage" in pending:
+            for breakdown_by in ("agent", "channel"):
+                fetches[f"{breakdown_by}_breakdown"] = lambda breakdown_by=breakdown_by: self.analytics_repo.get_breakdown_data(
+                    workspace_id=self.workspace_id,
+                    start_date=period_start,
+                    end_date=period_end,
+                    breakdown_by=breakdown_by,
+                    order_by="total_messages",
+                    limit=TOP_BREAKDOWN_LIMIT,
+                )
+        if "usage_spike_detection" in pending:
+            fetches["daily_usage"] = lambda: self._query_usage_buckets(period_start, period_end)
+        data = self._fetch_concurrently(fetches, optional=("agent_breakdown", "channel_breakdown"))
+
+        generated = []
+        if "conversation_volume_trend" in pending:
+            generated.append(self._generate_conversation_volume_trend(data["daily_stats"], period_start, period_end))
+        if "top_agent_channel_usage" in pending:
+            generated.append(self._generate_top_agent_channel_usage(data["agent_breakdown"], data["channel_breakdown"], period_start, period_end))
+        if "message_to_order_conversion" in pending:
+            generated.append(self._generate_message_to_order_conversion(data["daily_stats"], period_start, period_end))
+        if "usage_spike_detection" in pending:
+            generated.append(self._generate_usage_spike_detection(data["daily_usage"], period_start, period_end))
+
+        insights = [insight for insight in generated if insight]
+        stored = self._gated(lambda: self._store_insights(insights)) if insights else []
 
         logger.info(
-            f"Finished structured insight generation for workspace {self.workspace_id} from {period_start} to {period_end}"
+            f"Finished structured insight generation for workspace {self.workspace_id} from {period_start} to {period_end}: "
+            f"{len(stored)} insights stored"
         )
-    
+        return stored
+
     def generate_insight(self, question: str, context: Dict[str, Any], agent_id: Optional[uuid.UUID] = None) -> Dict[str, Any]:
         """
         Placeholder for AI-powered insight generation.
@@ -0,0 +1,40 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from analytics.rollup import (
+    ANALYTICS_ROLLUP_MAX_WINDOW_HOURS,
+    ANALYTICS_ROLLUP_POLL_SECONDS,
+    ANALYTICS_ROLLUP_REWIND_SECONDS,
+    AnalyticsRollupWorker,
+)
+
+
+class Command(BaseCommand):
+    help = "Keeps analytics_daily_rollup current by re-aggregating only the days that received new messages or usage."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--poll-interval", type=float, default=ANALYTICS_ROLLUP_POLL_SECONDS)
+        parser.add_argument("--rewind-seconds", type=float, default=ANALYTICS_ROLLUP_REWIND_SECONDS,
+                            help="How far behind the high-water mark each step rescans, for late commits.")
+        parser.add_argument("--max-window-hours", type=float, default=ANALYTICS_ROLLUP_MAX_WINDOW_HOURS,
+                            help="Largest span of changes rolled up in one transaction.")
+        parser.add_argument("--once", action="store_true", help="Exit once the rollup has caught up.")
+
+    def handle(self, *args, **options):
+        worker = AnalyticsRollupWorker(
+            poll_interval=options["poll_interval"],
+            rewind_seconds=options["rewind_seconds"],
+            max_window_hours=options["max_window_hours"],
+        )
+
+        def _shutdown(signum, frame):
+            self.stdout.write("Analytics rollup worker stopping after the current step...")
+            worker.stop()
+
+        signal.signal(signal.SIGTERM, _shutdown)
+        signal.signal(signal.SIGINT, _shutdown)
+
+        self.stdout.write("Analytics rollup worker started.")
+        slices = worker.run(once=options["once"])
+        self.stdout.write(self.style.SUCCESS(f"Analytics rollup worker refreshed {slices} workspace-days."))
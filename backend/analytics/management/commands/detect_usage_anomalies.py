@@ -0,0 +1,32 @@
+import datetime
+import json
+
+from django.core.management.base import BaseCommand
+
+from analytics import anomaly_job
+from analytics.anomaly import EWMA_ALPHA, Z_THRESHOLD
+
+
+class Command(BaseCommand):
+    help = "Scores every workspace's daily usage in one vectorized pass and stores usage_anomaly insights."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--end-date", type=datetime.date.fromisoformat,
+                            help="Last day to score, YYYY-MM-DD (default: yesterday, UTC).")
+        parser.add_argument("--history-days", type=int, default=anomaly_job.ANOMALY_HISTORY_DAYS)
+        parser.add_argument("--report-days", type=int, default=anomaly_job.ANOMALY_REPORT_DAYS,
+                            help="Only anomalies in this many trailing days become insights.")
+        parser.add_argument("--alpha", type=float, default=EWMA_ALPHA, help="EWMA smoothing factor.")
+        parser.add_argument("--z-threshold", type=float, default=Z_THRESHOLD)
+        parser.add_argument("--dry-run", action="store_true", help="Score and report without storing insights.")
+
+    def handle(self, *args, **options):
+        stats = anomaly_job.run(
+            end_date=options["end_date"],
+            history_days=options["history_days"],
+            report_days=options["report_days"],
+            alpha=options["alpha"],
+            z_threshold=options["z_threshold"],
+            dry_run=options["dry_run"],
+        )
+        self.stdout.write(json.dumps(stats, indent=2))
@@ -0,0 +1,37 @@
+import datetime
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics import insight_fleet
+
+
+class Command(BaseCommand):
+    help = "Generates structured insights for every workspace with a sharded process pool; resumes interrupted runs."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--period-start", type=datetime.date.fromisoformat,
+                            help="YYYY-MM-DD (default: Monday of the last full week, UTC).")
+        parser.add_argument("--period-end", type=datetime.date.fromisoformat,
+                            help="YYYY-MM-DD (default: Sunday of the last full week, UTC).")
+        parser.add_argument("--processes", type=int, default=insight_fleet.INSIGHT_FLEET_PROCESSES)
+        parser.add_argument("--shards", type=int, default=insight_fleet.INSIGHT_FLEET_SHARDS,
+                            help="Keep this fixed between a run and its resume; checkpoints are per shard layout.")
+        parser.add_argument("--supabase-concurrency", type=int, default=insight_fleet.INSIGHT_FLEET_SUPABASE_CONCURRENCY,
+                            help="Maximum concurrent Supabase calls across all processes.")
+        parser.add_argument("--restart", action="store_true", help="Discard this period's checkpoints and start over.")
+
+    def handle(self, *args, **options):
+        if (options["period_start"] is None) != (options["period_end"] is None):
+            raise CommandError("--period-start and --period-end must be given together.")
+        if min(options["processes"], options["shards"], options["supabase_concurrency"]) < 1:
+            raise CommandError("--processes, --shards and --supabase-concurrency must be positive.")
+        report = insight_fleet.run(
+            period_start=options["period_start"],
+            period_end=options["period_end"],
+            processes=options["processes"],
+            shard_count=options["shards"],
+            supabase_concurrency=options["supabase_concurrency"],
+            restart=options["restart"],
+        )
+        self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,216 @@
+"""
+Incremental maintenance of analytics_daily_rollup.
+
+The worker keeps a high-water mark in analytics_rollup_state. Each step takes
+the window [mark - rewind, until) of chat_messages and usage_events, collects
+the (workspace, day) slices those rows touch, and in one transaction replaces
+the rollup rows of exactly those slices with a fresh aggregate of the
+analytics views (every agent and channel of the slice, so rows that vanish
+from the views vanish from the rollup too). It also bumps the workspaces'
+analytics_watermarks.data_changed_at, which the API's conditional GETs use.
+The API's tile cache reads the mark (analytics_rollup_mark) and only caches
+days the rollup is done with.
+Untouched days are never re-aggregated, so a step costs the size of the
+change, not of the history.
+
+The rewind re-covers rows committed late with an earlier created_at;
+re-aggregating a slice is idempotent, so the overlap is harmless. Changes the
+window cannot see (updates, deletes, rows inserted behind the mark, sentiment
+written onto conversations later) are recorded by triggers in
+analytics_rollup_dirty, and each step claims those slices as well. Windows are
+capped at `max_window` so the first run backfills in bounded transactions.
+The state row is locked for the duration of a step, so concurrent workers
+take turns instead of racing.
+
+Like the other workers, this goes through Django's database connection, so it
+reads every workspace regardless of RLS. The overview RPCs read only the
+rollup, so the worker has to have caught up once before they serve traffic.
+"""
+import datetime
+import logging
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+from django.db import close_old_connections, connection, transaction
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_NAME = "analytics_daily_rollup"
+ANALYTICS_ROLLUP_POLL_SECONDS = float(os.getenv("ANALYTICS_ROLLUP_POLL_SECONDS", "30"))
+ANALYTICS_ROLLUP_REWIND_SECONDS = float(os.getenv("ANALYTICS_ROLLUP_REWIND_SECONDS", "300"))
+ANALYTICS_ROLLUP_MAX_WINDOW_HOURS = float(os.getenv("ANALYTICS_ROLLUP_MAX_WINDOW_HOURS", "24"))
+
+_AFFECTED_SQL = """
+    CREATE TEMP TABLE analytics_rollup_affected ON COMMIT DROP AS
+    SELECT DISTINCT workspace_id, (created_at AT TIME ZONE 'UTC')::date AS day
+    FROM (
+        SELECT workspace_id, created_at FROM public.chat_messages WHERE created_at >= %s AND created_at < %s
+        UNION ALL
+        SELECT workspace_id, created_at FROM public.usage_events WHERE created_at >= %s AND created_at < %s
+    ) AS changed
+    WHERE workspace_id IS NOT NULL
+"""
+
+# Re-rolling a past day changes tiles the API has cached for good; history_changed_at retires them.
+_DIRTY_SQL = """
+    WITH claimed AS (DELETE FROM public.analytics_rollup_dirty RETURNING workspace_id, day),
+    history AS (
+        INSERT INTO public.analytics_watermarks (workspace_id, history_changed_at)
+        SELECT DISTINCT workspace_id, now() FROM claimed WHERE day < (now() AT TIME ZONE 'UTC')::date
+        ON CONFLICT (workspace_id) DO UPDATE SET history_changed_at = excluded.history_changed_at
+    )
+    INSERT INTO analytics_rollup_affected (workspace_id, day)
+    SELECT DISTINCT c.workspace_id, c.day FROM claimed c
+    WHERE NOT EXISTS (
+        SELECT 1 FROM analytics_rollup_affected a WHERE a.workspace_id = c.workspace_id AND a.day = c.day
+    )
+"""
+
+_DELETE_SQL = """
+    DELETE FROM public.analytics_daily_rollup r
+    USING analytics_rollup_affected a
+    WHERE r.workspace_id = a.workspace_id AND r.date = a.day
+"""
+
+_WATERMARK_SQL = """
+    INSERT INTO public.analytics_watermarks (workspace_id, data_changed_at)
+    SELECT DISTINCT workspace_id, now() FROM analytics_rollup_affected
+    ON CONFLICT (workspace_id) DO UPDATE SET data_changed_at = excluded.data_changed_at
+"""
+
+_INSERT_SQL = """
+    INSERT INTO public.analytics_daily_rollup
+        (workspace_id, agent_id, channel, date, total_messages, ai_responses, avg_response_time_sum,
+         positive_count, neutral_count, negative_count, refreshed_at)
+    WITH summary AS (
+        SELECT s.workspace_id, s.agent_id, s.channel, s.date,
+               sum(s.total_messages) AS total_messages,
+               sum(s.ai_responses) AS ai_responses,
+               sum(s.avg_response_time_sum * s.total_messages) / nullif(sum(s.total_messages), 0) AS avg_response_time_sum
+        FROM public.analytics_daily_summary s
+        JOIN analytics_rollup_affected a ON a.workspace_id = s.workspace_id AND a.day = s.date
+        GROUP BY 1, 2, 3, 4
+    ),
+    sentiment AS (
+        SELECT m.workspace_id, m.agent_id, m.channel, m.date,
+               sum(m.positive_count) AS positive_count,
+               sum(m.neutral_count) AS neutral_count,
+               sum(m.negative_count) AS negative_count
+        FROM public.analytics_message_sentiment m
+        JOIN analytics_rollup_affected a ON a.workspace_id = m.workspace_id AND a.day = m.date
+        GROUP BY 1, 2, 3, 4
+    )
+    SELECT coalesce(s.workspace_id, m.workspace_id), coalesce(s.agent_id, m.agent_id),
+           coalesce(s.channel, m.channel), coalesce(s.date, m.date),
+           coalesce(s.total_messages, 0), coalesce(s.ai_responses, 0), s.avg_response_time_sum,
+           coalesce(m.positive_count, 0), coalesce(m.neutral_count, 0), coalesce(m.negative_count, 0), now()
+    FROM summary s
+    FULL OUTER JOIN sentiment m
+      ON m.workspace_id = s.workspace_id
+     AND m.date = s.date
+     AND m.agent_id IS NOT DISTINCT FROM s.agent_id
+     AND m.channel IS NOT DISTINCT FROM s.channel
+"""
+
+
+def next_window(mark: Optional[datetime.datetime], now: datetime.datetime, rewind: datetime.timedelta,
+                max_window: datetime.timedelta) -> Tuple[datetime.datetime, datetime.datetime]:
+    """
+    Returns (since, until) for the step after `mark`; `until` becomes the new
+    mark. Assumes `mark` is set (the first step starts at the oldest change).
+    """
+    return mark - rewind, min(now, mark + max_window)
+
+
+def refresh_step(rewind: datetime.timedelta, max_window: datetime.timedelta) -> Optional[Dict]:
+    """
+    Rolls up one window past the high-water mark. Returns the step stats, or
+    None when the mark is already current.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT high_water_mark, clock_timestamp() FROM public.analytics_rollup_state WHERE name = %s FOR UPDATE",
+            [ROLLUP_NAME],
+        )
+        row = cursor.fetchone()
+        if row is None:
+            raise ValueError(f"analytics_rollup_state has no '{ROLLUP_NAME}' row; apply the rollup migration.")
+        mark, now = row
+        if mark is None:
+            cursor.execute(
+                "SELECT least((SELECT min(created_at) FROM public.chat_messages), (SELECT min(created_at) FROM public.usage_events))"
+            )
+            mark = cursor.fetchone()[0] or now
+        if mark >= now:
+            return None
+
+        since, until = next_window(mark, now, rewind, max_window)
+        cursor.execute(_AFFECTED_SQL, [since, until, since, until])
+        slices = cursor.rowcount
+        cursor.execute(_DIRTY_SQL)
+        dirty = cursor.rowcount
+        slices += dirty
+        cursor.execute(_DELETE_SQL)
+        deleted = cursor.rowcount
+        cursor.execute(_INSERT_SQL)
+        inserted = cursor.rowcount
+        cursor.execute(_WATERMARK_SQL)
+        cursor.execute(
+            "UPDATE public.analytics_rollup_state SET high_water_mark = %s, updated_at = now() WHERE name = %s",
+            [until, ROLLUP_NAME],
+        )
+    return {
+        "since": since.isoformat(),
+        "until": until.isoformat(),
+        "slices": slices,
+        "dirty_slices": dirty,
+        "rows_deleted": deleted,
+        "rows_inserted": inserted,
+        "caught_up": until >= now,
+    }
+
+
+class AnalyticsRollupWorker:
+    def __init__(self, poll_interval: float = ANALYTICS_ROLLUP_POLL_SECONDS,
+                 rewind_seconds: float = ANALYTICS_ROLLUP_REWIND_SECONDS,
+                 max_window_hours: float = ANALYTICS_ROLLUP_MAX_WINDOW_HOURS):
+        self.poll_interval = poll_interval
+        self.rewind = datetime.timedelta(seconds=rewind_seconds)
+        self.max_window = datetime.timedelta(hours=max_window_hours)
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def catch_up(self) -> int:
+        """Runs steps until the mark reaches the present. Returns the number of slices refreshed."""
+        slices = 0
+        while not self._stop.is_set():
+            stats = refresh_step(self.rewind, self.max_window)
+            if stats is None:
+                break
+            logger.info(f"Analytics rollup step: {stats}")
+            slices += stats["slices"]
+            if stats["caught_up"]:
+                break
+        return slices
+
+    def run(self, once: bool = False) -> int:
+        """
+        Keeps the rollup current until stop() is called (or, with `once`, until
+        it has caught up). Returns the number of slices refreshed.
+        """
+        slices = 0
+        while not self._stop.is_set():
+            close_old_connections()
+            try:
+                slices += self.catch_up()
+            except Exception as e:
+                if once:
+                    raise
+                logger.error(f"Analytics rollup step failed: {e}", exc_info=True)
+            if once:
+                break
+            self._stop.wait(self.poll_interval)
+        return slices
@@ -1,6 +1,7 @@
 from rest_framework import serializers
 import uuid
 import datetime
+from analytics.supabase_repo import BREAKDOWN_ORDER_BY_METRICS
 
 class AnalyticsQuerySerializer(serializers.Serializer):
     """
@@ -17,6 +18,25 @@ class AnalyticsQuerySerializer(serializers.Serializer):
             raise serializers.ValidationError("start_date cannot be after end_date.")
         return data
 
+class BreakdownQuerySerializer(AnalyticsQuerySerializer):
+    """
+    Serializer for breakdown query parameters. Giving `order_by` or `limit`
+    returns a ranked top-N with an "other" bucket instead of per-day rows.
+    """
+    breakdown_by = serializers.ChoiceField(choices=list(BREAKDOWN_ORDER_BY_METRICS))
+    order_by = serializers.ChoiceField(
+        choices=sorted({metric for metrics in BREAKDOWN_ORDER_BY_METRICS.values() for metric in metrics}),
+        required=False,
+    )
+    limit = serializers.IntegerField(required=False, min_value=1, max_value=100)
+
+    def validate(self, data):
+        data = super().validate(data)
+        order_by = data.get('order_by')
+        if order_by and order_by not in BREAKDOWN_ORDER_BY_METRICS[data['breakdown_by']]:
+            raise serializers.ValidationError({'order_by': f"{order_by} is not a metric of the {data['breakdown_by']} breakdown."})
+        return data
+
 class InsightsQuestionSerializer(serializers.Serializer):
     """
     Serializer for the Insights Engine POST request body, for AI-powered questions.
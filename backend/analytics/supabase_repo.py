@@ -1,11 +1,19 @@
 import os
 import uuid
+import logging
+import threading
+import time
+import redis
 from supabase import create_client, Client
 from django.conf import settings
 from rest_framework import exceptions
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 import datetime
 from core.errors import SupabaseUnavailableError
+from analytics.rollup import ANALYTICS_ROLLUP_REWIND_SECONDS
+from analytics.tiles import DailyTileCache, LocalTileStore, RedisTileStore, combine_daily_overview
+
+logger = logging.getLogger(__name__)
 
 # --- Supabase Client Initialization ---
 SUPABASE_URL = os.getenv("SUPABASE_URL", settings.SUPABASE_URL)
@@ -16,6 +24,53 @@ if not SUPABASE_URL or not SUPABASE_ANON_KEY:
         "SUPABASE_URL and SUPABASE_ANON_KEY must be configured in environment variables or Django settings."
     )
 
+# PostgREST's max_rows; range reads page through results in steps of this size.
+POSTGREST_PAGE_SIZE = int(os.getenv("POSTGREST_PAGE_SIZE", "1000"))
+
+# Maintained incrementally by the rollup worker (see analytics.rollup); replaces
+# reading analytics_daily_summary / analytics_message_sentiment per request.
+ANALYTICS_ROLLUP_TABLE = "analytics_daily_rollup"
+
+# Numeric metric columns of each breakdown view that top-N breakdowns can rank by;
+# analytics_breakdown_top accepts the same lists.
+DEFAULT_BREAKDOWN_ORDER_BY = "total_messages"
+BREAKDOWN_ORDER_BY_METRICS = {
+    "agent": ("total_messages", "ai_responses"),
+    "channel": ("total_messages", "ai_responses"),
+    "topic": ("total_messages",),
+}
+
+# Date-tiled cache for overview/timeseries/breakdown reads (see analytics.tiles).
+ANALYTICS_TILE_CACHE = os.getenv("ANALYTICS_TILE_CACHE", "true").lower() == "true"
+ANALYTICS_OPEN_TILE_TTL_SECONDS = float(os.getenv("ANALYTICS_OPEN_TILE_TTL_SECONDS", "60"))
+# How long after midnight (UTC) a day keeps accepting late events before its tiles are cached for good.
+# Rollup-backed tiles measure it from the rollup's high-water mark, and never less than the worker's
+# rewind: a day the rewind can still reach may yet be rewritten.
+ANALYTICS_DAY_CLOSE_GRACE_MINUTES = float(os.getenv("ANALYTICS_DAY_CLOSE_GRACE_MINUTES", "60"))
+# The rollup mark is global and only moves forward, so a slightly stale copy just closes days later.
+ANALYTICS_ROLLUP_MARK_TTL_SECONDS = float(os.getenv("ANALYTICS_ROLLUP_MARK_TTL_SECONDS", "30"))
+
+try:
+    _tile_store = RedisTileStore(redis.StrictRedis.from_url(
+        settings.REDIS_URL,
+        decode_responses=True,
+        socket_connect_timeout=1,
+        socket_timeout=1,
+    ))
+except AttributeError:  # settings.REDIS_URL might not be configured
+    logger.error("REDIS_URL not found in Django settings. Analytics tiles are cached per process.")
+    _tile_store = LocalTileStore()
+
+analytics_tiles = DailyTileCache(
+    _tile_store,
+    open_ttl=ANALYTICS_OPEN_TILE_TTL_SECONDS,
+    closed_after=max(datetime.timedelta(minutes=ANALYTICS_DAY_CLOSE_GRACE_MINUTES),
+                     datetime.timedelta(seconds=ANALYTICS_ROLLUP_REWIND_SECONDS)),
+) if ANALYTICS_TILE_CACHE else None
+
+_rollup_mark_lock = threading.Lock()
+_rollup_mark_cache = (0.0, None)  # (expires_at monotonic, high-water mark)
+
 class AnalyticsSupabaseRepo:
     """
     Repository for reading analytics data from Supabase views.
@@ -27,51 +82,100 @@ class AnalyticsSupabaseRepo:
     def _get_view(self, view_name: str):
         return self._client.from_(view_name) # Use .from_() for views/functions
 
+    def _fetch_all(self, query) -> List[Dict[str, Any]]:
+        """
+        Executes an ordered select page by page so PostgREST's max_rows never truncates it.
+        """
+        rows = []
+        while True:
+            page = query.range(len(rows), len(rows) + POSTGREST_PAGE_SIZE - 1).execute().data or []
+            rows.extend(page)
+            if len(page) < POSTGREST_PAGE_SIZE:
+                return rows
+
+    def _rollup_mark(self) -> Optional[datetime.datetime]:
+        """
+        Returns the point analytics_daily_rollup is complete up to (None before
+        the worker's first step), cached per process for a few seconds.
+        """
+        global _rollup_mark_cache
+        with _rollup_mark_lock:
+            expires_at, mark = _rollup_mark_cache
+            if expires_at > time.monotonic():
+                return mark
+        value = self._client.rpc("analytics_rollup_mark", {}).execute().data
+        mark = datetime.datetime.fromisoformat(value.replace("Z", "+00:00")) if value else None
+        with _rollup_mark_lock:
+            _rollup_mark_cache = (time.monotonic() + ANALYTICS_ROLLUP_MARK_TTL_SECONDS, mark)
+        return mark
+
+    def _rollup_tile_scope(self, workspace_id, agent_id, channel) -> tuple:
+        """
+        Tile scope for reads of the rollup: past days re-rolled from dirty
+        slices (see analytics.rollup) move history_changed_at, which retires
+        the workspace's tiles that were cached for good.
+        """
+        return workspace_id, agent_id, channel, self.get_watermark(workspace_id).get("history_changed_at")
+
     def get_overview_metrics(self, workspace_id: uuid.UUID, start_date: datetime.date, end_date: datetime.date, agent_id: uuid.UUID = None, channel: str = None) -> Dict[str, Any]:
         """
-        Fetches overview metrics from a Supabase analytics view (e.g., analytics_daily_summary).
+        Fetches overview metrics aggregated in the database. With the tile cache
+        the range is composed from per-day `analytics_daily_overview` rows, of
+        which only uncached days and today are queried; otherwise the
+        `analytics_overview` RPC aggregates the whole range in one row.
         """
         try:
-            query = self._get_view("analytics_daily_summary").select("*") \
-                        .eq("workspace_id", str(workspace_id)) \
-                        .gte("date", str(start_date)) \
-                        .lte("date", str(end_date))
-            
-            if agent_id:
-                query = query.eq("agent_id", str(agent_id))
-            if channel:
-                query = query.eq("channel", channel)
-            
-            response = query.execute()
-            if response.data:
-                # Aggregate data from view results (minimal aggregation in Django)
-                total_messages = sum(row.get("total_messages", 0) for row in response.data)
-                total_ai_responses = sum(row.get("ai_responses", 0) for row in response.data)
-                ai_response_rate = total_ai_responses / total_messages if total_messages > 0 else 0
-                
-                sentiment_summary = self.get_sentiment_summary(workspace_id, start_date, end_date, agent_id, channel)
-                
-                return {
-                    "total_messages": total_messages,
-                    "ai_response_rate": round(ai_response_rate, 2),
-                    "avg_response_time": self._get_avg_response_time(response.data),
-                    "sentiment": sentiment_summary,
-                }
-            return {
-                "total_messages": 0,
-                "ai_response_rate": 0,
-                "avg_response_time": 0,
-                "sentiment": {"positive": 0, "neutral": 0, "negative": 0},
-            }
+            if analytics_tiles is not None:
+                rows = analytics_tiles.get_range(
+                    "overview", self._rollup_tile_scope(workspace_id, agent_id, channel), start_date, end_date,
+                    lambda start, end: self._get_daily_overview(workspace_id, start, end, agent_id, channel),
+                    settled=self._rollup_mark,
+                )
+                return combine_daily_overview(rows)
+
+            response = self._client.rpc("analytics_overview", self._overview_params(workspace_id, start_date, end_date, agent_id, channel)).execute()
         except Exception as e:
             raise SupabaseUnavailableError(detail=f"Failed to fetch overview metrics from Supabase: {e}")
 
+        row = (response.data or [{}])[0]
+        total_messages = row.get("total_messages") or 0
+        total_ai_responses = row.get("ai_responses") or 0
+        return {
+            "total_messages": total_messages,
+            "ai_response_rate": round(total_ai_responses / total_messages, 2) if total_messages > 0 else 0,
+            "avg_response_time": float(row.get("avg_response_time") or 0),
+            "response_time": {
+                "avg": float(row.get("avg_response_time") or 0),
+                "min_daily": float(row.get("min_daily_response_time") or 0),
+                "max_daily": float(row.get("max_daily_response_time") or 0),
+            },
+            "sentiment": {
+                "positive": row.get("positive_count") or 0,
+                "neutral": row.get("neutral_count") or 0,
+                "negative": row.get("negative_count") or 0,
+            },
+        }
+
+    @staticmethod
+    def _overview_params(workspace_id, start_date, end_date, agent_id, channel) -> Dict[str, Any]:
+        return {
+            "p_workspace_id": str(workspace_id),
+            "p_start_date": str(start_date),
+            "p_end_date": str(end_date),
+            "p_agent_id": str(agent_id) if agent_id else None,
+            "p_channel": channel,
+        }
+
+    def _get_daily_overview(self, workspace_id, start_date, end_date, agent_id, channel) -> List[Dict[str, Any]]:
+        response = self._client.rpc("analytics_daily_overview", self._overview_params(workspace_id, start_date, end_date, agent_id, channel)).execute()
+        return response.data or []
+
     def get_sentiment_summary(self, workspace_id: uuid.UUID, start_date: datetime.date, end_date: datetime.date, agent_id: uuid.UUID = None, channel: str = None) -> Dict[str, int]:
         """
-        Fetches message sentiment summary from analytics_message_sentiment view.
+        Fetches the message sentiment summary from the daily rollup.
         """
         try:
-            query = self._get_view("analytics_message_sentiment").select("*") \
+            query = self._get_view(ANALYTICS_ROLLUP_TABLE).select("positive_count, neutral_count, negative_count") \
                         .eq("workspace_id", str(workspace_id)) \
                         .gte("date", str(start_date)) \
                         .lte("date", str(end_date))
@@ -81,11 +185,11 @@ class AnalyticsSupabaseRepo:
             if channel:
                 query = query.eq("channel", channel)
             
-            response = query.execute()
+            rows = self._fetch_all(query.order("date.asc"))
             
             sentiment_counts = {"positive": 0, "neutral": 0, "negative": 0}
-            if response.data:
-                for row in response.data:
+            if rows:
+                for row in rows:
                     sentiment_counts["positive"] += row.get("positive_count", 0)
                     sentiment_counts["neutral"] += row.get("neutral_count", 0)
                     sentiment_counts["negative"] += row.get("negative_count", 0)
@@ -95,60 +199,102 @@ class AnalyticsSupabaseRepo:
 
     def get_timeseries_data(self, workspace_id: uuid.UUID, start_date: datetime.date, end_date: datetime.date, agent_id: uuid.UUID = None, channel: str = None) -> List[Dict[str, Any]]:
         """
-        Fetches time-series analytics data (e.g., daily message counts) from a Supabase view.
+        Fetches time-series analytics data (daily message counts) from the daily rollup.
         """
-        try:
-            query = self._get_view("analytics_daily_summary").select("date, total_messages, ai_responses") \
+        def fetch(start: datetime.date, end: datetime.date) -> List[Dict[str, Any]]:
+            query = self._get_view(ANALYTICS_ROLLUP_TABLE).select("date, total_messages, ai_responses") \
                         .eq("workspace_id", str(workspace_id)) \
-                        .gte("date", str(start_date)) \
-                        .lte("date", str(end_date))
-            
+                        .gte("date", str(start)) \
+                        .lte("date", str(end))
+
             if agent_id:
                 query = query.eq("agent_id", str(agent_id))
             if channel:
                 query = query.eq("channel", channel)
-            
-            response = query.order("date.asc").execute()
-            return response.data if response.data else []
+
+            return self._fetch_all(query.order("date.asc"))
+
+        try:
+            if analytics_tiles is not None:
+                return analytics_tiles.get_range("timeseries", self._rollup_tile_scope(workspace_id, agent_id, channel), start_date, end_date, fetch,
+                                                 settled=self._rollup_mark)
+            return fetch(start_date, end_date)
         except Exception as e:
             raise SupabaseUnavailableError(detail=f"Failed to fetch time-series data from Supabase: {e}")
 
-    def get_breakdown_data(self, workspace_id: uuid.UUID, start_date: datetime.date, end_date: datetime.date, breakdown_by: str, agent_id: uuid.UUID = None, channel: str = None) -> List[Dict[str, Any]]:
+    def get_breakdown_data(self, workspace_id: uuid.UUID, start_date: datetime.date, end_date: datetime.date, breakdown_by: str, agent_id: uuid.UUID = None, channel: str = None,
+                           order_by: str = None, limit: int = None) -> List[Dict[str, Any]]:
         """
         Fetches breakdown data (e.g., by agent, by channel, by topic) from a Supabase view.
+
+        Without `order_by`/`limit` this returns the view's per-day rows. With
+        either, the `analytics_breakdown_top` RPC ranks dimension values by the
+        summed `order_by` metric (default total_messages) and returns rows of
+        {"key", "label", "value", "rank", "is_other", "members"}: the top `limit`
+        values plus one "other" row folding the rest.
         """
-        try:
-            view_map = {
-                "agent": "analytics_agent_performance",
-                "channel": "analytics_channel_usage",
-                "topic": "analytics_message_topic_breakdown",
-            }
-            view_name = view_map.get(breakdown_by)
-            if not view_name:
-                raise exceptions.ValidationError(f"Invalid breakdown_by parameter: {breakdown_by}")
+        view_map = {
+            "agent": "analytics_agent_performance",
+            "channel": "analytics_channel_usage",
+            "topic": "analytics_message_topic_breakdown",
+        }
+        view_name = view_map.get(breakdown_by)
+        if not view_name:
+            raise exceptions.ValidationError(f"Invalid breakdown_by parameter: {breakdown_by}")
+        # The breakdown dimension itself is never filtered on.
+        agent_id = agent_id if breakdown_by != "agent" else None
+        channel = channel if breakdown_by != "channel" else None
 
+        if order_by is not None or limit is not None:
+            order_by = order_by or DEFAULT_BREAKDOWN_ORDER_BY
+            if order_by not in BREAKDOWN_ORDER_BY_METRICS[breakdown_by]:
+                raise exceptions.ValidationError(f"Invalid order_by parameter for {breakdown_by} breakdown: {order_by}")
+            if limit is not None and limit < 1:
+                raise exceptions.ValidationError("limit must be a positive integer.")
+            params = self._overview_params(workspace_id, start_date, end_date, agent_id, channel)
+            params.update({"p_breakdown_by": breakdown_by, "p_order_by": order_by, "p_limit": limit})
+            try:
+                response = self._client.rpc("analytics_breakdown_top", params).execute()
+            except Exception as e:
+                raise SupabaseUnavailableError(detail=f"Failed to fetch top breakdown from Supabase: {e}")
+            return response.data or []
+
+        def fetch(start: datetime.date, end: datetime.date) -> List[Dict[str, Any]]:
             query = self._get_view(view_name).select("*") \
                         .eq("workspace_id", str(workspace_id)) \
-                        .gte("date", str(start_date)) \
-                        .lte("date", str(end_date))
-            
-            if agent_id and breakdown_by != "agent":
+                        .gte("date", str(start)) \
+                        .lte("date", str(end))
+
+            if agent_id:
                 query = query.eq("agent_id", str(agent_id))
-            if channel and breakdown_by != "channel":
+            if channel:
                 query = query.eq("channel", channel)
-            
-            response = query.execute()
-            return response.data if response.data else []
-        except exceptions.ValidationError:
-            raise
+
+            return self._fetch_all(query.order("date.asc"))
+
+        try:
+            if analytics_tiles is not None:
+                return analytics_tiles.get_range(f"breakdown:{breakdown_by}", (workspace_id, agent_id, channel), start_date, end_date, fetch)
+            return fetch(start_date, end_date)
         except Exception as e:
             raise SupabaseUnavailableError(detail=f"Failed to fetch breakdown data from Supabase: {e}")
-    
-    def _get_avg_response_time(self, data: List[Dict]) -> float:
-        """Helper to calculate average response time from daily summary data."""
-        total_time = sum(row.get("avg_response_time_sum", 0) * row.get("total_messages", 0) for row in data)
-        total_msgs = sum(row.get("total_messages", 0) for row in data)
-        return round(total_time / total_msgs, 2) if total_msgs > 0 else 0
+
+    def get_watermark(self, workspace_id: uuid.UUID) -> Dict[str, Any]:
+        """
+        Returns the workspace's analytics change watermarks
+        ({"data_changed_at", "insights_changed_at", "history_changed_at"}, ISO timestamps or None).
+        """
+        try:
+            response = self._client.from_("analytics_watermarks").select("data_changed_at, insights_changed_at, history_changed_at") \
+                        .eq("workspace_id", str(workspace_id)).limit(1).execute()
+        except Exception as e:
+            raise SupabaseUnavailableError(detail=f"Failed to fetch analytics watermark from Supabase: {e}")
+        row = (response.data or [{}])[0]
+        return {
+            "data_changed_at": row.get("data_changed_at"),
+            "insights_changed_at": row.get("insights_changed_at"),
+            "history_changed_at": row.get("history_changed_at"),
+        }
 
     def get_insights(self, workspace_id: uuid.UUID, start_date: datetime.date = None, end_date: datetime.date = None, insight_type: str = None) -> List[Dict[str, Any]]:
         """
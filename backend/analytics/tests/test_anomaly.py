@@ -0,0 +1,57 @@
+import datetime
+import unittest
+
+import numpy as np
+
+from analytics.anomaly import anomaly_reports, build_usage_matrix, detect_anomalies
+
+
+class BuildUsageMatrixTest(unittest.TestCase):
+
+    def test_rows_are_summed_per_workspace_and_day(self):
+        ids, usage = build_usage_matrix(["b", "a", "b", "b"], [0, 1, 0, 2], [1, 2, 3, 4], num_days=3)
+        self.assertEqual(ids, ["a", "b"])
+        self.assertEqual(usage.dtype, np.float32)
+        np.testing.assert_array_equal(usage, [[0, 2, 0], [4, 0, 4]])
+
+
+class DetectAnomaliesTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        weekly = np.tile([100, 100, 100, 100, 100, 40, 40], 9)[:60]  # quiet weekends
+        self.usage = np.vstack([
+            weekly + rng.normal(0, 5, 60),
+            np.full(60, 50.0),
+            np.zeros(60),
+        ]).astype(np.float32)
+        self.usage[0, 43] = 400   # spike on a weekday
+        self.usage[1, 30] = 150
+
+    def test_flags_spikes_in_every_workspace_at_once(self):
+        result = detect_anomalies(self.usage)
+        self.assertEqual(set(zip(*np.nonzero(result["anomalies"]))), {(0, 43), (1, 30)})
+
+    def test_weekly_seasonality_is_not_flagged(self):
+        usage = self.usage.copy()
+        usage[0, 43] = usage[0, 36]  # same weekday, one week earlier
+        flagged = detect_anomalies(usage)["anomalies"][0]
+        self.assertFalse(flagged.any())
+
+    def test_warmup_days_are_never_flagged(self):
+        usage = self.usage.copy()
+        usage[1, 5] = 1000
+        result = detect_anomalies(usage, warmup=14)
+        self.assertFalse(result["anomalies"][:, :14].any())
+        self.assertTrue(np.isnan(result["z"][:, :14]).all())
+
+    def test_reports_group_days_by_workspace(self):
+        result = detect_anomalies(self.usage)
+        reports = anomaly_reports(["w0", "w1", "w2"], datetime.date(2025, 11, 1), self.usage, result)
+        self.assertEqual([(report["workspace_id"], [day["date"] for day in report["days"]]) for report in reports],
+                         [("w0", ["2025-12-14"]), ("w1", ["2025-12-01"])])
+        self.assertEqual(reports[1]["days"][0]["quantity"], 150.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
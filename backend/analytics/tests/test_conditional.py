@@ -0,0 +1,77 @@
+import unittest
+
+from django.test import RequestFactory
+
+from analytics.conditional import evaluate, watermark_etag
+
+WORKSPACE_ID = "5f0c4a4e-2b1f-4c9a-9d3e-1f2a3b4c5d6e"
+CHANGED_AT = "2025-12-29T10:00:00+00:00"
+PARAMS = {"start_date": "2025-12-01", "end_date": "2025-12-28"}
+
+
+class FakeRepo:
+
+    def __init__(self, watermark=None, error=None):
+        self.watermark = watermark or {}
+        self.error = error
+
+    def get_watermark(self, workspace_id):
+        if self.error:
+            raise self.error
+        return self.watermark
+
+
+class WatermarkEtagTest(unittest.TestCase):
+
+    def test_etag_changes_with_watermark_resource_and_params(self):
+        etag = watermark_etag("overview", WORKSPACE_ID, PARAMS, CHANGED_AT)
+        self.assertEqual(etag, watermark_etag("overview", WORKSPACE_ID, dict(reversed(list(PARAMS.items()))), CHANGED_AT))
+        self.assertNotEqual(etag, watermark_etag("overview", WORKSPACE_ID, PARAMS, "2025-12-29T10:05:00+00:00"))
+        self.assertNotEqual(etag, watermark_etag("timeseries", WORKSPACE_ID, PARAMS, CHANGED_AT))
+        self.assertNotEqual(etag, watermark_etag("overview", WORKSPACE_ID, {**PARAMS, "channel": "web"}, CHANGED_AT))
+        self.assertTrue(etag.startswith('"') and etag.endswith('"'))
+
+
+class EvaluateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def get(self, **headers):
+        request = self.factory.get("/api/v1/analytics/overview", **headers)
+        request.workspace_id = WORKSPACE_ID
+        return request
+
+    def test_full_response_carries_validators(self):
+        not_modified, headers = evaluate(self.get(), FakeRepo({"data_changed_at": CHANGED_AT}), "overview", PARAMS)
+        self.assertIsNone(not_modified)
+        self.assertEqual(headers["ETag"], watermark_etag("overview", WORKSPACE_ID, PARAMS, CHANGED_AT))
+        self.assertIn("Last-Modified", headers)
+
+    def test_matching_etag_is_not_modified(self):
+        etag = watermark_etag("overview", WORKSPACE_ID, PARAMS, CHANGED_AT)
+        not_modified, _ = evaluate(self.get(HTTP_IF_NONE_MATCH=etag), FakeRepo({"data_changed_at": CHANGED_AT}), "overview", PARAMS)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified["ETag"], etag)
+
+    def test_watermark_bump_serves_a_new_etag(self):
+        etag = watermark_etag("overview", WORKSPACE_ID, PARAMS, CHANGED_AT)
+        repo = FakeRepo({"data_changed_at": "2025-12-29T10:05:00+00:00"})
+        not_modified, headers = evaluate(self.get(HTTP_IF_NONE_MATCH=etag), repo, "overview", PARAMS)
+        self.assertIsNone(not_modified)
+        self.assertNotEqual(headers["ETag"], etag)
+
+    def test_unreadable_watermark_serves_without_validators(self):
+        not_modified, headers = evaluate(self.get(HTTP_IF_NONE_MATCH='"anything"'), FakeRepo(error=RuntimeError("down")), "overview", PARAMS)
+        self.assertIsNone(not_modified)
+        self.assertEqual(headers, {})
+
+    def test_insights_use_their_own_watermark(self):
+        repo = FakeRepo({"data_changed_at": CHANGED_AT, "insights_changed_at": None})
+        _, headers = evaluate(self.get(), repo, "insights", PARAMS, watermark_field="insights_changed_at")
+        self.assertEqual(headers["ETag"], watermark_etag("insights", WORKSPACE_ID, PARAMS, None))
+        self.assertNotIn("Last-Modified", headers)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+import datetime
+import gzip
+import json
+import random
+import unittest
+import uuid
+
+from analytics.export import encode_ndjson_gzip
+
+
+class EncodeNdjsonGzipTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        rows = [
+            {"date": datetime.date(2025, 12, 28), "agent_id": uuid.UUID(int=1), "channel": "web", "total_messages": 3},
+            {"date": datetime.date(2025, 12, 29), "agent_id": None, "channel": "واتساب", "total_messages": 0},
+        ]
+        data = gzip.decompress(b"".join(encode_ndjson_gzip(rows)))
+        self.assertEqual([json.loads(line) for line in data.decode("utf-8").splitlines()], [
+            {"date": "2025-12-28", "agent_id": str(uuid.UUID(int=1)), "channel": "web", "total_messages": 3},
+            {"date": "2025-12-29", "agent_id": None, "channel": "واتساب", "total_messages": 0},
+        ])
+
+    def test_large_exports_are_streamed_in_several_chunks(self):
+        rng = random.Random(7)
+        rows = [{"id": i, "payload": "%032x" % rng.getrandbits(128)} for i in range(5000)]
+        chunks = list(encode_ndjson_gzip(rows, flush_bytes=16 * 1024))
+        self.assertGreater(len(chunks), 2)
+        self.assertEqual(len(gzip.decompress(b"".join(chunks)).splitlines()), 5000)
+
+    def test_empty_export_is_a_valid_gzip_stream(self):
+        chunks = list(encode_ndjson_gzip([]))
+        self.assertEqual(len(chunks), 1)
+        self.assertEqual(gzip.decompress(chunks[0]), b"")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+import datetime
+import unittest
+
+from analytics.rollup import next_window
+
+MARK = datetime.datetime(2025, 12, 29, 9, 0, tzinfo=datetime.timezone.utc)
+REWIND = datetime.timedelta(minutes=5)
+MAX_WINDOW = datetime.timedelta(hours=24)
+
+
+class NextWindowTest(unittest.TestCase):
+
+    def test_window_rewinds_behind_the_mark_and_ends_now(self):
+        now = MARK + datetime.timedelta(seconds=30)
+        self.assertEqual(next_window(MARK, now, REWIND, MAX_WINDOW), (MARK - REWIND, now))
+
+    def test_backfill_is_capped_at_max_window(self):
+        now = MARK + datetime.timedelta(days=10)
+        since, until = next_window(MARK, now, REWIND, MAX_WINDOW)
+        self.assertEqual((since, until), (MARK - REWIND, MARK + MAX_WINDOW))
+        # The next step continues from the new mark, overlapping the previous window by the rewind.
+        self.assertEqual(next_window(until, now, REWIND, MAX_WINDOW)[0], MARK + MAX_WINDOW - REWIND)
+
+    def test_consecutive_windows_cover_every_instant(self):
+        now = MARK + datetime.timedelta(hours=60)
+        mark, covered_until = MARK, MARK
+        while mark < now:
+            since, until = next_window(mark, now, REWIND, MAX_WINDOW)
+            self.assertLessEqual(since, covered_until)
+            covered_until, mark = until, until
+        self.assertEqual(mark, now)
+
+
+if __name__ == "__main__":
+    unittest.main()
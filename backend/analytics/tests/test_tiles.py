@@ -0,0 +1,115 @@
+import datetime
+import unittest
+
+from analytics.tiles import DailyTileCache, LocalTileStore, combine_daily_overview
+
+NOW = datetime.datetime(2025, 12, 29, 12, 0, tzinfo=datetime.timezone.utc)
+TODAY = NOW.date()
+
+
+def day(offset):
+    return TODAY + datetime.timedelta(days=offset)
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class DailyTileCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = DailyTileCache(LocalTileStore(clock=self.clock), open_ttl=60, now=lambda: NOW)
+        self.calls = []
+
+    def fetch(self, start, end):
+        self.calls.append((start, end))
+        rows = []
+        current = start
+        while current <= end:
+            if current != day(-3):  # a day without activity
+                rows.append({"date": current.isoformat(), "total_messages": 10})
+            current += datetime.timedelta(days=1)
+        return rows
+
+    def test_closed_days_are_fetched_once_and_today_live(self):
+        rows = self.cache.get_range("timeseries", ("ws", None, None), day(-6), day(0), self.fetch)
+        self.assertEqual([row["date"] for row in rows], [day(offset).isoformat() for offset in (-6, -5, -4, -2, -1, 0)])
+        self.assertEqual(self.calls, [(day(-6), day(-1)), (day(0), day(0))])
+
+        self.calls.clear()
+        again = self.cache.get_range("timeseries", ("ws", None, None), day(-9), day(0), self.fetch)
+        self.assertEqual(self.calls, [(day(-9), day(-7))])  # today's tile is still fresh
+        self.assertEqual(again[3:], rows)
+
+        self.calls.clear()
+        self.clock.now = 61
+        self.cache.get_range("timeseries", ("ws", None, None), day(-9), day(0), self.fetch)
+        self.assertEqual(self.calls, [(day(0), day(0))])
+
+    def test_only_runs_of_missing_days_are_fetched(self):
+        self.cache.get_range("timeseries", ("ws", None, None), day(-5), day(-4), self.fetch)
+        self.calls.clear()
+        rows = self.cache.get_range("timeseries", ("ws", None, None), day(-7), day(-1), self.fetch)
+        self.assertEqual(self.calls, [(day(-7), day(-6)), (day(-3), day(-1))])
+        self.assertEqual(len(rows), 6)
+
+    def test_scopes_do_not_share_tiles(self):
+        self.cache.get_range("timeseries", ("ws", None, None), day(-2), day(-1), self.fetch)
+        self.cache.get_range("timeseries", ("ws", "agent", None), day(-2), day(-1), self.fetch)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_yesterday_stays_open_during_grace_period(self):
+        cache = DailyTileCache(LocalTileStore(), closed_after=datetime.timedelta(hours=13), now=lambda: NOW)
+        self.assertTrue(cache.is_closed(day(-2)))
+        self.assertFalse(cache.is_closed(day(-1)))
+        self.assertFalse(cache.is_closed(day(0)))
+
+    def test_days_close_behind_the_settled_mark(self):
+        lagging = NOW - datetime.timedelta(days=2)
+        rows = self.cache.get_range("overview", ("ws", None, None), day(-4), day(-1), self.fetch, settled=lambda: lagging)
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(self.calls, [(day(-4), day(-3)), (day(-2), day(-1))])
+
+        self.calls.clear()
+        self.clock.now = 61
+        self.cache.get_range("overview", ("ws", None, None), day(-4), day(-1), self.fetch, settled=lambda: NOW)
+        self.assertEqual(self.calls, [(day(-2), day(-1))])  # closed now, so cached for good
+
+        self.calls.clear()
+        self.cache.get_range("overview", ("ws", None, None), day(-4), day(-1), self.fetch, settled=lambda: None)
+        self.assertEqual(self.calls, [])
+
+    def test_nothing_closes_before_the_first_rollup(self):
+        self.cache.get_range("overview", ("ws", None, None), day(-3), day(-2), self.fetch, settled=lambda: None)
+        self.clock.now = 61
+        self.cache.get_range("overview", ("ws", None, None), day(-3), day(-2), self.fetch, settled=lambda: None)
+        self.assertEqual(len(self.calls), 2)
+
+
+class CombineDailyOverviewTest(unittest.TestCase):
+
+    def test_weighted_average_and_sums(self):
+        overview = combine_daily_overview([
+            {"total_messages": 10, "ai_responses": 8, "response_time_weighted": 20, "min_daily_response_time": 1.5,
+             "max_daily_response_time": 3, "positive_count": 2, "neutral_count": 1, "negative_count": 0},
+            {"total_messages": 30, "ai_responses": 22, "response_time_weighted": 150, "min_daily_response_time": 4,
+             "max_daily_response_time": 6, "positive_count": 1, "neutral_count": 0, "negative_count": 3},
+        ])
+        self.assertEqual(overview["total_messages"], 40)
+        self.assertEqual(overview["ai_response_rate"], 0.75)
+        self.assertEqual(overview["avg_response_time"], 4.25)
+        self.assertEqual(overview["response_time"], {"avg": 4.25, "min_daily": 1.5, "max_daily": 6.0})
+        self.assertEqual(overview["sentiment"], {"positive": 3, "neutral": 1, "negative": 3})
+
+    def test_empty_range(self):
+        self.assertEqual(combine_daily_overview([])["avg_response_time"], 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
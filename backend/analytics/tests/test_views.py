@@ -13,3 +13,33 @@ class AnalyticsOverviewAPITest(TestCase):
         """
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, 401)
+
+
+class AnalyticsExportAPITest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.url = reverse('analytics_export')
+
+    def test_analytics_export_api_no_token(self):
+        """
+        Ensure that the analytics export API returns 401 Unauthorized when no token is provided.
+        """
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 401)
+
+
+class BreakdownQuerySerializerTest(TestCase):
+    def test_order_by_must_be_a_metric_of_the_breakdown(self):
+        """
+        Ensure that order_by only accepts the numeric metrics of the requested breakdown view.
+        """
+        from analytics.serializers import BreakdownQuerySerializer
+
+        self.assertTrue(BreakdownQuerySerializer(data={'breakdown_by': 'agent', 'order_by': 'ai_responses'}).is_valid())
+        for order_by in ('agent_name', 'date', 'workspace_id'):
+            serializer = BreakdownQuerySerializer(data={'breakdown_by': 'agent', 'order_by': order_by})
+            self.assertFalse(serializer.is_valid())
+            self.assertIn('order_by', serializer.errors)
+        serializer = BreakdownQuerySerializer(data={'breakdown_by': 'topic', 'order_by': 'ai_responses'})
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('order_by', serializer.errors)
@@ -0,0 +1,200 @@
+"""
+Date-tiled cache for analytics reads.
+
+Dashboards reload the overview, timeseries and breakdown for overlapping
+ranges. Every analytics view is already keyed by day, so a range is cached as
+one tile per (kind, workspace, agent filter, channel filter, date), where a
+tile is the list of view rows for that day:
+
+- Closed days (ended more than `closed_after` ago) cannot change any more and
+  are cached without expiry. Missing closed days are fetched with a single
+  range query spanning them. For kinds read from a table that is maintained
+  behind the clock (the daily rollup), get_range takes the point the table is
+  complete up to (`settled`) and days close relative to it instead of now, so
+  a lagging worker never gets a half-built day cached for good. Changes to
+  days that are already closed must change the scope (the rollup tiles carry
+  the workspace's history watermark for this).
+- Open days (today, and yesterday during the grace period) are fetched live
+  and cached for `open_ttl` seconds only.
+
+A range request therefore costs at most one query for the closed days that
+are not cached yet plus one for the open days. The composed rows are the same
+rows the uncached range query returns, in date order.
+
+- LocalTileStore: in-process, for tests and a single web process.
+- RedisTileStore: shared by all web processes; falls back to a local store
+  whenever Redis errors, so a Redis outage only costs cache hits.
+"""
+import datetime
+import json
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from core.metrics import inc_counter
+
+logger = logging.getLogger(__name__)
+
+Rows = List[Dict[str, Any]]
+RangeFetcher = Callable[[datetime.date, datetime.date], Rows]
+SettledAt = Callable[[], Optional[datetime.datetime]]
+
+
+def _utcnow() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+class LocalTileStore:
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._tiles: Dict[str, Tuple[Rows, Optional[float]]] = {}  # key -> (rows, expires_at)
+
+    def get_many(self, keys: List[str]) -> Dict[str, Rows]:
+        now = self._clock()
+        found = {}
+        with self._lock:
+            for key in keys:
+                tile = self._tiles.get(key)
+                if tile is None:
+                    continue
+                rows, expires_at = tile
+                if expires_at is not None and expires_at <= now:
+                    del self._tiles[key]
+                    continue
+                found[key] = rows
+        return found
+
+    def set_many(self, tiles: Dict[str, Rows], ttl: Optional[float]) -> None:
+        expires_at = self._clock() + ttl if ttl is not None else None
+        with self._lock:
+            for key, rows in tiles.items():
+                self._tiles[key] = (rows, expires_at)
+
+
+class RedisTileStore:
+    def __init__(self, client, fallback: Optional[LocalTileStore] = None):
+        self.client = client
+        self.fallback = fallback or LocalTileStore()
+
+    def get_many(self, keys: List[str]) -> Dict[str, Rows]:
+        if not keys:
+            return {}
+        try:
+            values = self.client.mget(keys)
+        except Exception as e:
+            logger.warning(f"Redis analytics tiles unavailable, using local tiles: {e}")
+            return self.fallback.get_many(keys)
+        return {key: json.loads(value) for key, value in zip(keys, values) if value is not None}
+
+    def set_many(self, tiles: Dict[str, Rows], ttl: Optional[float]) -> None:
+        if not tiles:
+            return
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for key, rows in tiles.items():
+                pipe.set(key, json.dumps(rows, default=str), ex=int(ttl) if ttl is not None else None)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Could not store analytics tiles in Redis: {e}")
+            self.fallback.set_many(tiles, ttl)
+
+
+class DailyTileCache:
+    def __init__(self, store, open_ttl: float = 60.0, closed_after: datetime.timedelta = datetime.timedelta(hours=1),
+                 prefix: str = "analytics_tile:v1", now: Callable[[], datetime.datetime] = _utcnow):
+        self.store = store
+        self.open_ttl = open_ttl
+        self.closed_after = closed_after
+        self.prefix = prefix
+        self._now = now
+
+    def is_closed(self, day: datetime.date, settled_at: Optional[datetime.datetime] = None) -> bool:
+        day_end = datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time(), datetime.timezone.utc)
+        return day_end + self.closed_after <= (min(self._now(), settled_at) if settled_at is not None else self._now())
+
+    def key(self, kind: str, scope: Iterable[Any], day: datetime.date) -> str:
+        scope_key = ":".join(str(part) if part is not None else "-" for part in scope)
+        return f"{self.prefix}:{kind}:{scope_key}:{day.isoformat()}"
+
+    def get_range(self, kind: str, scope: Iterable[Any], start_date: datetime.date, end_date: datetime.date,
+                  fetch: RangeFetcher, date_field: str = "date", settled: Optional[SettledAt] = None) -> Rows:
+        """
+        Returns the rows for every day from `start_date` to `end_date`, in date
+        order, fetching only days that are not cached (one `fetch` per run of
+        consecutive missing days). `fetch(start, end)` must
+        return every row of that inclusive range, each with `date_field` set.
+        `settled()`, called only when days are missing, returns the point the
+        fetched data is complete up to; None means nothing is, so no day closes.
+        """
+        scope = tuple(scope)
+        days = [start_date + datetime.timedelta(days=offset) for offset in range((end_date - start_date).days + 1)]
+        keys = {day: self.key(kind, scope, day) for day in days}
+        tiles = self.store.get_many(list(keys.values()))
+
+        missing = [day for day in days if keys[day] not in tiles]
+        if missing and settled is not None:
+            settled_at = settled()
+            closed = [day for day in missing if settled_at is not None and self.is_closed(day, settled_at)]
+        else:
+            closed = [day for day in missing if self.is_closed(day)]
+        opened = [day for day in missing if day not in closed]
+        inc_counter('analytics_tiles', {'result': 'hit'}, len(days) - len(closed) - len(opened))
+        for missing, ttl, result in ((closed, None, 'miss'), (opened, self.open_ttl, 'live')):
+            if not missing:
+                continue
+            inc_counter('analytics_tiles', {'result': result}, len(missing))
+            for run in self._consecutive_runs(missing):
+                fetched = self._group_by_day(fetch(run[0], run[-1]), date_field)
+                new_tiles = {keys[day]: fetched.get(day.isoformat(), []) for day in run}
+                self.store.set_many(new_tiles, ttl)
+                tiles.update(new_tiles)
+
+        return [row for day in days for row in tiles[keys[day]]]
+
+    @staticmethod
+    def _consecutive_runs(days: List[datetime.date]) -> List[List[datetime.date]]:
+        """ Splits ascending `days` into runs of consecutive days. """
+        runs: List[List[datetime.date]] = []
+        for day in days:
+            if runs and day - runs[-1][-1] == datetime.timedelta(days=1):
+                runs[-1].append(day)
+            else:
+                runs.append([day])
+        return runs
+
+    @staticmethod
+    def _group_by_day(rows: Rows, date_field: str) -> Dict[str, Rows]:
+        grouped: Dict[str, Rows] = {}
+        for row in rows:
+            grouped.setdefault(str(row[date_field])[:10], []).append(row)
+        return grouped
+
+
+def combine_daily_overview(rows: Rows) -> Dict[str, Any]:
+    """
+    Folds per-day `analytics_daily_overview` rows into the overview payload
+    (same shape as AnalyticsSupabaseRepo.get_overview_metrics).
+    """
+    total_messages = sum(row.get("total_messages") or 0 for row in rows)
+    ai_responses = sum(row.get("ai_responses") or 0 for row in rows)
+    weighted_response_time = sum(float(row.get("response_time_weighted") or 0) for row in rows)
+    daily_minimums = [float(row["min_daily_response_time"]) for row in rows if row.get("min_daily_response_time") is not None]
+    daily_maximums = [float(row["max_daily_response_time"]) for row in rows if row.get("max_daily_response_time") is not None]
+    avg_response_time = round(weighted_response_time / total_messages, 2) if total_messages > 0 else 0.0
+    return {
+        "total_messages": total_messages,
+        "ai_response_rate": round(ai_responses / total_messages, 2) if total_messages > 0 else 0,
+        "avg_response_time": avg_response_time,
+        "response_time": {
+            "avg": avg_response_time,
+            "min_daily": min(daily_minimums) if daily_minimums else 0.0,
+            "max_daily": max(daily_maximums) if daily_maximums else 0.0,
+        },
+        "sentiment": {
+            "positive": sum(row.get("positive_count") or 0 for row in rows),
+            "neutral": sum(row.get("neutral_count") or 0 for row in rows),
+            "negative": sum(row.get("negative_count") or 0 for row in rows),
+        },
+    }
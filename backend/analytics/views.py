@@ -1,5 +1,6 @@
 import datetime
 import uuid
+from django.http import StreamingHttpResponse
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
@@ -7,9 +8,11 @@ from rest_framework import exceptions
 
 from core.auth import SupabaseJWTAuthentication
 from core.permissions import IsWorkspaceMember
-from analytics.serializers import AnalyticsQuerySerializer, InsightsQuestionSerializer, StructuredInsightRequestSerializer # Import new serializer
+from analytics.serializers import AnalyticsQuerySerializer, BreakdownQuerySerializer, InsightsQuestionSerializer, StructuredInsightRequestSerializer # Import new serializer
 from analytics.supabase_repo import AnalyticsSupabaseRepo
 from analytics.insights import InsightsEngine # Ensure this is the correct InsightsEngine class
+from analytics.export import encode_ndjson_gzip, iter_rollup_rows
+from analytics import conditional
 
 import logging
 from core.errors import SupabaseUnavailableError, AIAProviderError
@@ -43,7 +46,10 @@ class AnalyticsOverviewAPIView(APIView):
         )
         try:
             repo = AnalyticsSupabaseRepo(user_jwt)
-            
+            not_modified, validators = conditional.evaluate(request, repo, "overview", serializer.validated_data)
+            if not_modified is not None:
+                return not_modified
+
             overview_data = repo.get_overview_metrics(
                 workspace_id=workspace_id,
                 start_date=serializer.validated_data['start_date'],
@@ -51,7 +57,7 @@ class AnalyticsOverviewAPIView(APIView):
                 agent_id=serializer.validated_data.get('agent_id'),
                 channel=serializer.validated_data.get('channel')
             )
-            return Response(overview_data, status=status.HTTP_200_OK)
+            return Response(overview_data, status=status.HTTP_200_OK, headers=validators)
         except Exception as e:
             logger.error(
                 "Error fetching analytics overview",
@@ -88,7 +94,10 @@ class AnalyticsTimeseriesAPIView(APIView):
         )
         try:
             repo = AnalyticsSupabaseRepo(user_jwt)
-            
+            not_modified, validators = conditional.evaluate(request, repo, "timeseries", serializer.validated_data)
+            if not_modified is not None:
+                return not_modified
+
             timeseries_data = repo.get_timeseries_data(
                 workspace_id=workspace_id,
                 start_date=serializer.validated_data['start_date'],
@@ -96,7 +105,7 @@ class AnalyticsTimeseriesAPIView(APIView):
                 agent_id=serializer.validated_data.get('agent_id'),
                 channel=serializer.validated_data.get('channel')
             )
-            return Response(timeseries_data, status=status.HTTP_200_OK)
+            return Response(timeseries_data, status=status.HTTP_200_OK, headers=validators)
         except Exception as e:
             logger.error(
                 "Error fetching analytics timeseries",
@@ -110,17 +119,16 @@ class AnalyticsBreakdownAPIView(APIView):
     """
     API endpoint for retrieving analytics data broken down by a specific dimension.
     GET /api/v1/analytics/breakdown?breakdown_by=agent
+    GET /api/v1/analytics/breakdown?breakdown_by=agent&order_by=total_messages&limit=5 (top 5 + "other")
     """
     authentication_classes = [SupabaseJWTAuthentication]
     permission_classes = [IsWorkspaceMember]
 
     def get(self, request, *args, **kwargs):
-        serializer = AnalyticsQuerySerializer(data=request.query_params)
+        serializer = BreakdownQuerySerializer(data=request.query_params)
         serializer.is_valid(raise_exception=True)
 
-        breakdown_by = request.query_params.get('breakdown_by')
-        if not breakdown_by:
-            raise exceptions.ValidationError("Query parameter 'breakdown_by' is required (e.g., 'agent', 'channel', 'topic').")
+        breakdown_by = serializer.validated_data['breakdown_by']
 
         workspace_id = request.workspace_id
         user_jwt = request.auth
@@ -132,19 +140,23 @@ class AnalyticsBreakdownAPIView(APIView):
                 "breakdown_by": breakdown_by,
                 "start_date": serializer.validated_data['start_date'],
                 "end_date": serializer.validated_data['end_date'],
+                "order_by": serializer.validated_data.get('order_by'),
+                "limit": serializer.validated_data.get('limit'),
             },
         )
 
         try:
+            # No conditional GET here: the breakdown views are read live, not from the watermarked rollup.
             repo = AnalyticsSupabaseRepo(user_jwt)
-            
             breakdown_data = repo.get_breakdown_data(
                 workspace_id=workspace_id,
                 start_date=serializer.validated_data['start_date'],
                 end_date=serializer.validated_data['end_date'],
                 breakdown_by=breakdown_by,
                 agent_id=serializer.validated_data.get('agent_id'),
-                channel=serializer.validated_data.get('channel')
+                channel=serializer.validated_data.get('channel'),
+                order_by=serializer.validated_data.get('order_by'),
+                limit=serializer.validated_data.get('limit'),
             )
             return Response(breakdown_data, status=status.HTTP_200_OK)
         except Exception as e:
@@ -156,6 +168,44 @@ class AnalyticsBreakdownAPIView(APIView):
             raise SupabaseUnavailableError(detail=f"Could not fetch analytics breakdown: {e}")
 
 
+class AnalyticsExportAPIView(APIView):
+    """
+    API endpoint for exporting per-day, per-agent, per-channel analytics as gzipped NDJSON.
+    GET /api/v1/analytics/export?start_date=2025-01-01&end_date=2025-12-31
+    """
+    authentication_classes = [SupabaseJWTAuthentication]
+    permission_classes = [IsWorkspaceMember]
+
+    def get(self, request, *args, **kwargs):
+        serializer = AnalyticsQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+
+        workspace_id = request.workspace_id
+        start_date = serializer.validated_data['start_date']
+        end_date = serializer.validated_data['end_date']
+
+        logger.info(
+            "Exporting analytics",
+            extra={
+                "workspace_id": workspace_id,
+                "start_date": start_date,
+                "end_date": end_date,
+                "agent_id": serializer.validated_data.get('agent_id'),
+                "channel": serializer.validated_data.get('channel'),
+            },
+        )
+        rows = iter_rollup_rows(
+            workspace_id=workspace_id,
+            start_date=start_date,
+            end_date=end_date,
+            agent_id=serializer.validated_data.get('agent_id'),
+            channel=serializer.validated_data.get('channel'),
+        )
+        response = StreamingHttpResponse(encode_ndjson_gzip(rows), content_type='application/gzip')
+        response['Content-Disposition'] = f'attachment; filename="analytics_{start_date}_{end_date}.ndjson.gz"'
+        return response
+
+
 class InsightsAPIView(APIView):
     """
     API endpoint for generating AI-powered insights from analytics data,
@@ -188,13 +238,18 @@ class InsightsAPIView(APIView):
         )
         try:
             repo = AnalyticsSupabaseRepo(user_jwt)
+            not_modified, validators = conditional.evaluate(
+                request, repo, "insights", serializer.validated_data, watermark_field="insights_changed_at",
+            )
+            if not_modified is not None:
+                return not_modified
             insights = repo.get_insights(
                 workspace_id=workspace_id,
                 start_date=start_date,
                 end_date=end_date,
                 insight_type=insight_type
             )
-            return Response(insights, status=status.HTTP_200_OK)
+            return Response(insights, status=status.HTTP_200_OK, headers=validators)
         except Exception as e:
             logger.error(
                 "Error fetching insights",
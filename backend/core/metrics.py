@@ -17,8 +17,16 @@ _METRICS = {
     'ai_latency': defaultdict(list),
     'rate_limit_hits': defaultdict(int),
     'audit_log': defaultdict(int),
+    'context_tokens': defaultdict(int),
+    'retrieval_k': defaultdict(int),
+    'retrieval_top_similarity': defaultdict(list),
+    'retrieval_score_gap': defaultdict(list),
+    'analytics_tiles': defaultdict(int),
 }
 
+# Metrics stored as lists of observations and reported as averages.
+_AVERAGED_METRICS = {'avg_latency', 'ai_latency', 'retrieval_top_similarity', 'retrieval_score_gap'}
+
 def metric_name(name, labels=None):
     """Creates a unique metric name from a name and labels."""
     if labels:
@@ -41,6 +49,10 @@ def record_latency(name, labels=None, latency=0.0):
     # histogram or summary object would be better.
     _METRICS[name][full_name].append(latency)
 
+def record_value(name, labels=None, value=0.0):
+    """Records an observation (e.g. a retrieval score) for averaging."""
+    record_latency(name, labels, value)
+
 def get_metrics():
     """
     Returns a dictionary of all current metric values.
@@ -48,7 +60,7 @@ def get_metrics():
     """
     snapshot = {}
     for name, labels_map in _METRICS.items():
-        if name in ['avg_latency', 'ai_latency']:
+        if name in _AVERAGED_METRICS:
             for full_name, values in labels_map.items():
                 if values:
                     avg = sum(values) / len(values)
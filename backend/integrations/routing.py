@@ -2,6 +2,7 @@ import uuid
 from typing import Dict, Any, Literal, List
 from knowledge.chunking import TextChunker
 from knowledge.embedding import EmbeddingGenerator
+from knowledge.throttle import BACKGROUND
 from knowledge.supabase_repo import KnowledgeSupabaseRepo
 from analytics.supabase_repo import AnalyticsSupabaseRepo
 from concurrent.futures import ThreadPoolExecutor
@@ -90,7 +91,7 @@ class IntegrationsRouter:
                         "canonical_record_id": record.get("id"),
                     })
                     
-                    embedding = self.embedding_generator.generate_embedding(chunk["content"])
+                    embedding = self.embedding_generator.generate_embedding(chunk["content"], priority=BACKGROUND)
                     
                     if embedding:
                         background_executor.submit(self.knowledge_repo.store_embedding, {
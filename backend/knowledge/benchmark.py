@@ -0,0 +1,169 @@
+"""
+Offline benchmark for hybrid knowledge search fusion.
+
+Builds a synthetic labeled corpus, runs the lexical leg (the real BM25 index)
+and a brute-force vector leg over deterministic embeddings, and reports
+recall@k and per-query latency for each leg alone and for every fusion method.
+
+Usage (from backend/):
+    python -m knowledge.benchmark --docs 2000 --queries 300 --top-k 5
+"""
+import argparse
+import json
+import math
+import random
+import statistics
+import time
+from typing import Dict, List, Sequence, Tuple
+
+from knowledge.fusion import FUSION_METHODS, candidate_pool_size, fuse
+from knowledge.lexical import BM25Index
+
+FILLER_WORDS = [
+    "customer", "order", "store", "please", "thanks", "item", "service", "team",
+    "support", "message", "price", "available", "online", "today", "week", "size",
+]
+
+
+def _normalize(vector: List[float]) -> List[float]:
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+def _noisy(base: Sequence[float], rng: random.Random, noise: float) -> List[float]:
+    return _normalize([v + rng.gauss(0.0, noise) for v in base])
+
+
+def build_corpus(num_docs: int, num_queries: int, num_topics: int = 50, dims: int = 64, seed: int = 7) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Returns (documents, queries). Every query is labeled with the one document it was drawn from.
+
+    Documents share topic vocabulary and topic-level embedding directions, so
+    neither leg alone can separate documents within a topic: the lexical leg
+    needs the document's unique SKU term (present in half of the queries),
+    while the vector leg sees a noisy copy of the document's embedding.
+    """
+    rng = random.Random(seed)
+    topic_terms = [[f"topic{t}term{j}" for j in range(8)] for t in range(num_topics)]
+    topic_vectors = [_normalize([rng.gauss(0.0, 1.0) for _ in range(dims)]) for _ in range(num_topics)]
+
+    documents = []
+    for doc_index in range(num_docs):
+        topic = doc_index % num_topics
+        words = rng.sample(topic_terms[topic], 3) + rng.sample(FILLER_WORDS, 6) + [f"sku{doc_index}"]
+        rng.shuffle(words)
+        documents.append({
+            "id": str(doc_index),
+            "source_id": f"source{topic}",
+            "content": " ".join(words),
+            "topic": topic,
+            "embedding": _noisy(topic_vectors[topic], rng, 0.35),
+        })
+
+    queries = []
+    for _ in range(num_queries):
+        target = rng.choice(documents)
+        words = rng.sample(target["content"].split(), 2)
+        if rng.random() < 0.5:
+            words.append(f"sku{target['id']}")
+        queries.append({
+            "text": " ".join(words),
+            "relevant_id": target["id"],
+            "embedding": _noisy(target["embedding"], rng, 0.2),
+        })
+    return documents, queries
+
+
+def _vector_search(documents: List[Dict], query_embedding: List[float], limit: int) -> List[Dict]:
+    scored = [
+        {**doc, "score": sum(a * b for a, b in zip(doc["embedding"], query_embedding))}
+        for doc in documents
+    ]
+    scored.sort(key=lambda item: item["score"], reverse=True)
+    return scored[:limit]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """
+    Nearest-rank percentile of `values` (0.0 when empty).
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def latency_summary(latencies: List[float]) -> Dict:
+    """
+    p50/p95 of per-query latencies in milliseconds, as reported by every knowledge benchmark.
+    """
+    return {
+        "latency_ms_p50": round(statistics.median(latencies), 3) if latencies else 0.0,
+        "latency_ms_p95": round(percentile(latencies, 95), 3),
+    }
+
+
+def run(num_docs: int = 2000, num_queries: int = 300, top_k: int = 5, seed: int = 7,
+        keyword_weight: float = 0.3, vector_weight: float = 0.7, rrf_k: int = 60) -> Dict:
+    documents, queries = build_corpus(num_docs, num_queries, seed=seed)
+
+    index = BM25Index()
+    for doc in documents:
+        index.add_document(doc["id"], doc["source_id"], doc["content"])
+
+    pool = candidate_pool_size(top_k, len(index))
+    strategies = ["lexical", "vector", *FUSION_METHODS]
+    hits = {name: 0 for name in strategies}
+    latencies: Dict[str, List[float]] = {name: [] for name in strategies}
+
+    for query in queries:
+        started = time.perf_counter()
+        lexical = index.search(query["text"], limit=pool)
+        lexical_ms = (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        vector = _vector_search(documents, query["embedding"], pool)
+        vector_ms = (time.perf_counter() - started) * 1000
+
+        rankings = {"lexical": lexical, "vector": vector}
+        latencies["lexical"].append(lexical_ms)
+        latencies["vector"].append(vector_ms)
+        for method in FUSION_METHODS:
+            started = time.perf_counter()
+            rankings[method] = fuse([lexical, vector], [keyword_weight, vector_weight], method=method, rrf_k=rrf_k)
+            # A fused query pays for the slower leg (legs run concurrently) plus fusion itself.
+            latencies[method].append(max(lexical_ms, vector_ms) + (time.perf_counter() - started) * 1000)
+
+        for name, ranking in rankings.items():
+            if query["relevant_id"] in (str(item["id"]) for item in ranking[:top_k]):
+                hits[name] += 1
+
+    return {
+        "corpus": {"documents": num_docs, "queries": num_queries, "seed": seed},
+        "top_k": top_k,
+        "candidate_pool": pool,
+        "strategies": {
+            name: {
+                f"recall@{top_k}": round(hits[name] / num_queries, 4),
+                **latency_summary(latencies[name]),
+            }
+            for name in strategies
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark hybrid knowledge search fusion on a synthetic corpus.")
+    parser.add_argument("--docs", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--rrf-k", type=int, default=60)
+    args = parser.parse_args()
+    report = run(num_docs=args.docs, num_queries=args.queries, top_k=args.top_k, seed=args.seed, rrf_k=args.rrf_k)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,69 +1,217 @@
-import re
-from typing import List, Dict
+from collections import deque
+from itertools import chain
+from typing import Dict, Generator, Iterable, Iterator, List, Sequence, Tuple
+import os
 import uuid
 
+from knowledge.tokens import CHARS_PER_WORD_TOKEN, iter_token_pieces, piece_tokens
+
+# Pieces that end a sentence (Latin and Arabic question mark).
+SENTENCE_TERMINALS = frozenset({".", "!", "?", "؟", "…"})
+
+# Small-to-big retrieval: children are embedded and searched, parents are sent to the model.
+KNOWLEDGE_PARENT_TOKENS = int(os.getenv("KNOWLEDGE_PARENT_TOKENS", "1024"))
+KNOWLEDGE_CHILD_TOKENS = int(os.getenv("KNOWLEDGE_CHILD_TOKENS", "256"))
+KNOWLEDGE_CHILD_OVERLAP = int(os.getenv("KNOWLEDGE_CHILD_OVERLAP", "0"))
+
+
 class TextChunker:
     """
-    Splits text into semantic chunks suitable for embedding and RAG.
-    This is a simplified implementation for Stage 3.
+    Splits text into token-sized chunks suitable for embedding and RAG.
+
+    The text is walked once, piece by piece (see knowledge.tokens), keeping only
+    the offsets of the current chunk. A chunk is cut at the last paragraph break
+    once it is at least half full, otherwise at the last sentence end, otherwise
+    mid-sentence. Consecutive chunks share up to `overlap` tokens: less when the
+    full overlap would push the next chunk past `max_tokens`. A single piece
+    longer than a chunk (e.g. a base64 blob) is split every
+    `max_tokens * CHARS_PER_WORD_TOKEN` characters.
     """
-    def __init__(self, max_chunk_size: int = 500, overlap: int = 50):
-        self.max_chunk_size = max_chunk_size
-        self.overlap = overlap
+    def __init__(self, max_tokens: int = 256, overlap: int = 32):
+        if max_tokens < 2:
+            raise ValueError("max_tokens must be at least 2.")
+        self.max_tokens = max_tokens
+        self.overlap = max(0, min(overlap, max_tokens // 2))
 
     def chunk_text(self, text: str, source_id: str = None) -> List[Dict]:
         """
-        Splits text into chunks, attempting to maintain semantic boundaries.
-        Returns a list of dictionaries, where each dict is a chunk.
+        Returns all chunks of `text` as a list. Prefer iter_chunks for large inputs.
+        """
+        return list(self.iter_chunks(text, source_id))
+
+    def iter_chunks(self, text: str, source_id: str = None) -> Iterator[Dict]:
+        """
+        Lazily yields chunk dicts for `text` in order.
+        """
+        return self.iter_chunks_from_segments([text], source_id)
+
+    def iter_chunks_from_segments(self, segments: Iterable[str], source_id: str = None) -> Iterator[Dict]:
+        """
+        Lazily yields chunk dicts for a stream of text segments (e.g. extracted pages).
+
+        Segments are treated as separate paragraphs. Only the unfinished tail of
+        the previous segment is carried over, together with its token pieces, so
+        memory is bounded by one segment plus one chunk and every segment is
+        tokenized once. Offsets refer to the segments joined by blank lines.
         """
-        # Simple splitting by paragraphs or sentences
-        # For more advanced splitting, libraries like NLTK or spaCy would be used.
-        paragraphs = [p.strip() for p in text.split('\n\n') if p.strip()]
-        chunks = []
-        current_chunk_text = ""
         chunk_num = 0
+        carry = ""
+        carry_pieces: List[Tuple[int, int, int]] = []
+        stream_length = 0  # length of the joined stream consumed so far
+        segments = iter(segments)
+        segment = next(segments, None)
+        while segment is not None:
+            next_segment = next(segments, None)
+            final = next_segment is None
+            separator = "\n\n" if stream_length else ""
+            text = f"{carry}{separator}{segment}"
+            text_offset = stream_length - len(carry)
+            stream_length += len(separator) + len(segment)
+
+            scanner = self._scan(text, final, carry_pieces)
+            while True:
+                try:
+                    start, end, token_count = next(scanner)
+                except StopIteration as stop:
+                    carry_start, carry_pieces = stop.value
+                    carry = text[carry_start:]
+                    break
+                yield self._create_chunk(text[start:end], text_offset + start, text_offset + end, token_count, source_id, chunk_num)
+                chunk_num += 1
+            segment = next_segment
+
+    def _scan(self, text: str, final: bool = True, carried: Sequence[Tuple[int, int, int]] = ()
+              ) -> Generator[Tuple[int, int, int], None, Tuple[int, List[Tuple[int, int, int]]]]:
+        """
+        Yields (start, end, token_count) for each complete chunk of `text`.
+        `carried` are the token pieces of a held-back chunk that `text` starts
+        with; only the rest of `text` is tokenized. Returns the start offset of
+        the held-back last chunk (unless `final`) and its pieces, relative to it.
+        """
+        pieces = deque()   # (start offset, running token total before the piece, end offset, tokens) of the current chunk
+        chunk_start = 0    # offset where the current chunk begins
+        chunk_total = 0    # running token total at chunk_start
+        total = 0          # running token total over the whole text
+        prev_end = None
+        prev_terminal = False
+        last_paragraph = None  # (offset, running total) of the latest paragraph break in the chunk
+        last_sentence = None   # (offset, running total) of the latest sentence end in the chunk
+
+        resume_at = carried[-1][1] if carried else 0
+        for start, end, tokens in chain(carried, self._bounded_pieces(text, resume_at)):
+            if prev_end is not None:
+                gap = text[prev_end:start]
+                if "\n\n" in gap:
+                    last_paragraph = (prev_end, total)
+                elif prev_terminal or "\n" in gap:
+                    last_sentence = (prev_end, total)
+
+            while pieces and total + tokens - chunk_total > self.max_tokens:
+                cut_offset, cut_total = self._pick_break(last_paragraph, last_sentence, chunk_total, prev_end, total)
+                yield chunk_start, cut_offset, cut_total - chunk_total
 
-        for paragraph in paragraphs:
-            if len(current_chunk_text) + len(paragraph) + 2 < self.max_chunk_size: # +2 for newline
-                current_chunk_text += (paragraph + "\n\n")
-            else:
-                if current_chunk_text:
-                    chunks.append(self._create_chunk(current_chunk_text, source_id, chunk_num))
-                    chunk_num += 1
-                current_chunk_text = paragraph + "\n\n" # Start new chunk with current paragraph
-
-        if current_chunk_text:
-            chunks.append(self._create_chunk(current_chunk_text, source_id, chunk_num))
-
-        # Further refine large chunks if any are still too big (e.g., very long paragraphs)
-        final_chunks = []
-        for chunk in chunks:
-            if len(chunk['content']) > self.max_chunk_size:
-                sentences = re.split(r'(?<=[.!?])\s+', chunk['content'])
-                sub_chunk_text = ""
-                sub_chunk_num = 0
-                for sentence in sentences:
-                    if len(sub_chunk_text) + len(sentence) + 1 < self.max_chunk_size:
-                        sub_chunk_text += (sentence + " ")
-                    else:
-                        if sub_chunk_text:
-                            final_chunks.append(self._create_chunk(sub_chunk_text, source_id, f"{chunk['chunk_id']}-{sub_chunk_num}"))
-                            sub_chunk_num += 1
-                        sub_chunk_text = sentence + " "
-                if sub_chunk_text:
-                    final_chunks.append(self._create_chunk(sub_chunk_text, source_id, f"{chunk['chunk_id']}-{sub_chunk_num}"))
-            else:
-                final_chunks.append(chunk)
-
-        return final_chunks
-
-    def _create_chunk(self, content: str, source_id: str, chunk_num) -> Dict:
+                # Carry the last `overlap` tokens before the cut into the next chunk,
+                # fewer if they would not fit with the rest of it and this piece.
+                overlap_from = cut_total - self.overlap
+                while pieces and (pieces[0][1] < overlap_from or pieces[0][1] <= chunk_total):
+                    pieces.popleft()
+                while pieces and pieces[0][0] < cut_offset and total + tokens - pieces[0][1] > self.max_tokens:
+                    pieces.popleft()
+                chunk_start, chunk_total = pieces[0][:2] if pieces else (start, total)
+                if last_paragraph and last_paragraph[0] <= chunk_start:
+                    last_paragraph = None
+                if last_sentence and last_sentence[0] <= chunk_start:
+                    last_sentence = None
+
+            if not pieces:
+                chunk_start, chunk_total = start, total
+            pieces.append((start, total, end, tokens))
+            total += tokens
+            prev_end = end
+            prev_terminal = text[start:end] in SENTENCE_TERMINALS
+
+        if not pieces:
+            return len(text), []
+        if not final:
+            return chunk_start, [(start - chunk_start, end - chunk_start, tokens) for start, _, end, tokens in pieces]
+        yield chunk_start, prev_end, total - chunk_total
+        return len(text), []
+
+    def _bounded_pieces(self, text: str, pos: int) -> Iterator[Tuple[int, int, int]]:
+        """
+        iter_token_pieces, with pieces of more than `max_tokens` split so each fits in a chunk.
+        """
+        max_chars = self.max_tokens * CHARS_PER_WORD_TOKEN
+        for start, end, tokens in iter_token_pieces(text, pos):
+            if tokens <= self.max_tokens:
+                yield start, end, tokens
+                continue
+            for piece_start in range(start, end, max_chars):
+                piece_end = min(piece_start + max_chars, end)
+                yield piece_start, piece_end, piece_tokens(piece_end - piece_start)
+
+    def _pick_break(self, last_paragraph, last_sentence, chunk_total: int, prev_end: int, total: int):
+        min_total = chunk_total + self.max_tokens // 2
+        if last_paragraph and last_paragraph[1] >= min_total:
+            return last_paragraph
+        if last_sentence and last_sentence[1] >= min_total:
+            return last_sentence
+        return prev_end, total
+
+    def _create_chunk(self, content: str, start: int, end: int, token_count: int, source_id: str, chunk_num) -> Dict:
         return {
             "chunk_id": f"{source_id}_{chunk_num}" if source_id else str(uuid.uuid4()),
             "content": content.strip(),
             "metadata": {
                 "source_id": source_id,
                 "chunk_number": chunk_num,
-                # Add other metadata as needed
+                "start_offset": start,
+                "end_offset": end,
+                "token_count": token_count,
             }
         }
+
+
+class HierarchicalChunker:
+    """
+    Two-level chunking for small-to-big retrieval.
+
+    Text is first cut into parent sections of up to `parent_tokens` (preferring
+    paragraph breaks), then each parent is cut into child chunks of up to
+    `child_tokens`. Only children are embedded and searched; at prompt time a
+    hit is replaced by its parent section (see knowledge.packing.expand_to_parents).
+    Children need no overlap since the parent supplies the surrounding context.
+
+    Yields child chunk dicts like TextChunker, numbered across the whole text,
+    with the parent chunk dict under "parent" (shared by its siblings) and its
+    number in metadata["parent_number"].
+    """
+    def __init__(self, parent_tokens: int = KNOWLEDGE_PARENT_TOKENS, child_tokens: int = KNOWLEDGE_CHILD_TOKENS,
+                 child_overlap: int = KNOWLEDGE_CHILD_OVERLAP):
+        if child_tokens > parent_tokens:
+            raise ValueError("child_tokens must not exceed parent_tokens.")
+        self.parents = TextChunker(max_tokens=parent_tokens, overlap=0)
+        self.children = TextChunker(max_tokens=child_tokens, overlap=child_overlap)
+
+    def chunk_text(self, text: str, source_id: str = None) -> List[Dict]:
+        return list(self.iter_chunks_from_segments([text], source_id))
+
+    def iter_chunks(self, text: str, source_id: str = None) -> Iterator[Dict]:
+        return self.iter_chunks_from_segments([text], source_id)
+
+    def iter_chunks_from_segments(self, segments: Iterable[str], source_id: str = None) -> Iterator[Dict]:
+        child_num = 0
+        for parent in self.parents.iter_chunks_from_segments(segments, source_id):
+            parent_number = parent["metadata"]["chunk_number"]
+            parent["chunk_id"] = f"{source_id}_p{parent_number}" if source_id else str(uuid.uuid4())
+            parent_start = parent["metadata"]["start_offset"]
+            for child in self.children.iter_chunks(parent["content"], source_id):
+                metadata = child["metadata"]
+                child["chunk_id"] = f"{source_id}_{child_num}" if source_id else child["chunk_id"]
+                metadata["chunk_number"] = child_num
+                metadata["start_offset"] += parent_start
+                metadata["end_offset"] += parent_start
+                metadata["parent_number"] = parent_number
+                child["parent"] = parent
+                child_num += 1
+                yield child
@@ -0,0 +1,74 @@
+"""
+Adaptive result cut-off for hybrid knowledge search.
+
+Instead of always sending a fixed top_k, the fused ranking is cut where the
+evidence runs out:
+
+- Vector hits below KNOWLEDGE_MIN_SIMILARITY are dropped as noise (lexical-only
+  hits have no similarity and are kept; BM25 already required a term match).
+- If the best hit is confidently similar and clearly ahead of the next one,
+  only `min_k` chunks are sent.
+- Otherwise the list is cut at the largest drop in relative fused score that
+  exceeds KNOWLEDGE_SCORE_GAP. With RRF this typically separates chunks both
+  legs agree on from chunks only one leg found.
+- The result never exceeds `max_k`.
+"""
+import os
+from typing import Dict, List, Tuple
+
+KNOWLEDGE_MIN_K = int(os.getenv("KNOWLEDGE_MIN_K", "1"))
+KNOWLEDGE_MAX_K = int(os.getenv("KNOWLEDGE_MAX_K", "8"))
+KNOWLEDGE_MIN_SIMILARITY = float(os.getenv("KNOWLEDGE_MIN_SIMILARITY", "0.3"))
+KNOWLEDGE_CONFIDENT_SIMILARITY = float(os.getenv("KNOWLEDGE_CONFIDENT_SIMILARITY", "0.85"))
+KNOWLEDGE_SCORE_GAP = float(os.getenv("KNOWLEDGE_SCORE_GAP", "0.3"))
+
+
+def adaptive_cutoff(
+    items: List[Dict],
+    max_k: int = KNOWLEDGE_MAX_K,
+    min_k: int = KNOWLEDGE_MIN_K,
+    min_similarity: float = KNOWLEDGE_MIN_SIMILARITY,
+    confident_similarity: float = KNOWLEDGE_CONFIDENT_SIMILARITY,
+    score_gap: float = KNOWLEDGE_SCORE_GAP,
+) -> Tuple[List[Dict], Dict]:
+    """
+    Cuts fused, score-ordered `items` (dicts with `score` and optional
+    `similarity`). Returns (kept items, score profile for metrics and logs).
+    """
+    supported_all = [
+        item for item in items
+        if item.get("similarity") is None or item["similarity"] >= min_similarity
+    ]
+    supported = supported_all[:max_k]
+    profile = {
+        "k": 0,
+        "candidates": len(items),
+        "supported": len(supported_all),
+        "reason": "empty",
+        "top_similarity": None,
+        "gap": 0.0,
+        "relative_scores": [],
+    }
+    if not supported:
+        return [], profile
+
+    top_score = supported[0]["score"] or 1.0
+    relative = [item["score"] / top_score for item in supported]
+    gaps = [relative[i - 1] - relative[i] for i in range(1, len(relative))]
+    top_similarity = supported[0].get("similarity")
+    profile["top_similarity"] = round(top_similarity, 4) if top_similarity is not None else None
+    profile["relative_scores"] = [round(value, 4) for value in relative]
+
+    min_k = max(1, min(min_k, len(supported)))
+    k, reason, gap = len(supported), "cap" if len(supported_all) > max_k else "exhausted", 0.0
+
+    if top_similarity is not None and top_similarity >= confident_similarity and (not gaps or gaps[0] >= score_gap):
+        k, reason, gap = min_k, "confident", gaps[0] if gaps else 1.0
+    else:
+        # Cut after the largest qualifying drop, but never below min_k.
+        best = max(range(len(gaps)), key=lambda i: gaps[i], default=None)
+        if best is not None and gaps[best] >= score_gap:
+            k, reason, gap = max(best + 1, min_k), "gap", gaps[best]
+
+    profile.update({"k": k, "reason": reason, "gap": round(gap, 4)})
+    return supported[:k], profile
@@ -0,0 +1,143 @@
+"""
+Near-duplicate chunk detection with MinHash and banded LSH.
+
+Sits between TextChunker and the embedding stage (see knowledge.indexing):
+each chunk is reduced to a MinHash signature over its word 3-shingles, and
+the signature is split into bands that are hashed into buckets. Only chunks
+that share at least one bucket are compared, so a whole job is deduplicated
+in linear time. Exact repeats (after case/whitespace folding) are caught by a
+content digest before any MinHash work.
+
+With the defaults (64 hashes, 16 bands of 4 rows) pairs above ~0.6 Jaccard
+similarity almost always share a bucket; candidates are then confirmed
+against `threshold` using the estimated Jaccard similarity.
+"""
+import hashlib
+import os
+import random
+import re
+import zlib
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+DEDUP_THRESHOLD = float(os.getenv("KNOWLEDGE_DEDUP_THRESHOLD", "0.85"))
+
+SHINGLE_SIZE = 3
+_MERSENNE_PRIME = (1 << 61) - 1
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _permutations(num_perm: int, seed: int = 1) -> List[Tuple[int, int]]:
+    rng = random.Random(seed)
+    return [(rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME)) for _ in range(num_perm)]
+
+
+def shingle_hashes(words: List[str], size: int = SHINGLE_SIZE) -> set:
+    if len(words) < size:
+        return {zlib.crc32(" ".join(words).encode("utf-8"))} if words else set()
+    return {zlib.crc32(" ".join(words[i:i + size]).encode("utf-8")) for i in range(len(words) - size + 1)}
+
+
+class ChunkDeduplicator:
+    """
+    Remembers every distinct chunk it has seen during one job and reports
+    later chunks that are exact or near duplicates of an earlier one.
+
+    It also tracks the embedding id each kept chunk was stored under, so the
+    indexing stage can point duplicates at the stored copy. A kept chunk that
+    could not be stored is discard()ed: it stops matching, and the duplicates
+    already reported against it are reconsider()ed so one of them is kept.
+    """
+    def __init__(self, threshold: float = DEDUP_THRESHOLD, num_perm: int = 64, bands: int = 16):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands.")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self._perms = _permutations(num_perm)
+        self._exact: Dict[bytes, str] = {}
+        self._buckets: List[Dict[Tuple[int, ...], List[int]]] = [{} for _ in range(bands)]
+        self._keys: List[str] = []
+        self._signatures: List[array] = []
+        self._stored_ids: Dict[str, str] = {}
+        self._registered: Dict[str, Tuple[int, bytes]] = {}  # key -> (index, digest)
+        self.seen = 0
+        self.duplicates = 0
+
+    @property
+    def ratio(self) -> float:
+        """Share of checked chunks that were dropped as duplicates."""
+        return self.duplicates / self.seen if self.seen else 0.0
+
+    def signature(self, words: List[str]) -> array:
+        hashes = shingle_hashes(words)
+        if not hashes:
+            return array("Q", [0] * self.num_perm)
+        return array("Q", (min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in self._perms))
+
+    def check(self, key: str, content: str) -> Optional[str]:
+        """
+        Returns the key of an earlier chunk that `content` duplicates, or
+        registers `key` as a new distinct chunk and returns None.
+        """
+        self.seen += 1
+        words = _WORD_RE.findall(content.casefold())
+        digest = hashlib.blake2b(" ".join(words).encode("utf-8"), digest_size=16).digest()
+        canonical = self._exact.get(digest)
+        if canonical is not None:
+            self.duplicates += 1
+            return canonical
+
+        signature = self.signature(words)
+        band_keys = [tuple(signature[i * self.rows:(i + 1) * self.rows]) for i in range(self.bands)]
+
+        candidates = set()
+        for band, band_key in enumerate(band_keys):
+            candidates.update(self._buckets[band].get(band_key, ()))
+        for index in sorted(candidates):
+            if self._keys[index] is None:  # discarded
+                continue
+            if self._similarity(signature, self._signatures[index]) >= self.threshold:
+                self.duplicates += 1
+                return self._keys[index]
+
+        index = len(self._keys)
+        self._keys.append(key)
+        self._signatures.append(signature)
+        self._exact[digest] = key
+        self._registered[key] = (index, digest)
+        for band, band_key in enumerate(band_keys):
+            self._buckets[band].setdefault(band_key, []).append(index)
+        return None
+
+    def record_stored(self, key: str, embedding_id: str):
+        self._stored_ids[key] = embedding_id
+
+    def stored_id(self, key: str) -> Optional[str]:
+        return self._stored_ids.get(key)
+
+    def discard(self, key: str):
+        """Unregisters a kept chunk that was not stored, so nothing is matched against it any more."""
+        registered = self._registered.pop(key, None)
+        if registered is None:
+            return
+        index, digest = registered
+        self._keys[index] = None
+        if self._exact.get(digest) == key:
+            del self._exact[digest]
+
+    def is_discarded(self, key: str) -> bool:
+        return key not in self._registered
+
+    def reconsider(self, key: str, content: str) -> Optional[str]:
+        """
+        Checks again a chunk that was reported as a duplicate of a discarded
+        chunk, without counting it twice. Same result as check().
+        """
+        self.seen -= 1
+        self.duplicates -= 1
+        return self.check(key, content)
+
+    def _similarity(self, left: array, right: array) -> float:
+        return sum(1 for a, b in zip(left, right) if a == b) / self.num_perm
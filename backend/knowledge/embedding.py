@@ -14,6 +14,11 @@ if not OPENAI_API_KEY:
 import time
 import logging
 from core.errors import AIAProviderError
+from core.metrics import inc_counter, record_latency
+from knowledge.throttle import BACKGROUND, INTERACTIVE, EmbeddingThrottle, LocalBucketStore, RedisBucketStore, ThrottleTimeout
+from knowledge.tokens import estimate_tokens
+
+import redis
 
 logger = logging.getLogger(__name__)
 
@@ -46,15 +51,104 @@ class CircuitBreaker:
 
 openai_circuit_breaker = CircuitBreaker()
 
+# --- Embedding rate governor ---
+# Provider limits for the embedding model; keep slightly below the account's real limits.
+OPENAI_EMBEDDING_RPM = int(os.getenv("OPENAI_EMBEDDING_RPM", "3000"))
+OPENAI_EMBEDDING_TPM = int(os.getenv("OPENAI_EMBEDDING_TPM", "1000000"))
+# Share of both budgets that background (ingestion) embeddings leave for live queries.
+EMBEDDING_BACKGROUND_RESERVE = float(os.getenv("EMBEDDING_BACKGROUND_RESERVE", "0.2"))
+EMBEDDING_INTERACTIVE_MAX_WAIT = float(os.getenv("EMBEDDING_INTERACTIVE_MAX_WAIT", "5"))
+EMBEDDING_BACKGROUND_MAX_WAIT = float(os.getenv("EMBEDDING_BACKGROUND_MAX_WAIT", "300"))
+EMBEDDING_MAX_ATTEMPTS = int(os.getenv("EMBEDDING_MAX_ATTEMPTS", "4"))
+
+try:
+    _throttle_store = RedisBucketStore(redis.StrictRedis.from_url(
+        settings.REDIS_URL,
+        decode_responses=True,
+        socket_connect_timeout=1,
+        socket_timeout=1,
+    ))
+except AttributeError:  # settings.REDIS_URL might not be configured
+    logger.error("REDIS_URL not found in Django settings. Embedding budgets are per process.")
+    _throttle_store = LocalBucketStore()
+
+_throttles = {}
+
+
+def get_embedding_throttle(model: str) -> EmbeddingThrottle:
+    """
+    Returns the process-wide throttle for `model`; budgets are shared through Redis.
+    """
+    if model not in _throttles:
+        _throttles[model] = EmbeddingThrottle(
+            key=f"openai:{model}",
+            rpm=OPENAI_EMBEDDING_RPM,
+            tpm=OPENAI_EMBEDDING_TPM,
+            store=_throttle_store,
+            background_reserve=EMBEDDING_BACKGROUND_RESERVE,
+            max_wait={INTERACTIVE: EMBEDDING_INTERACTIVE_MAX_WAIT, BACKGROUND: EMBEDDING_BACKGROUND_MAX_WAIT},
+        )
+    return _throttles[model]
+
+
+def _retry_after(error: openai.RateLimitError):
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
 class EmbeddingGenerator:
     """
     Generates vector embeddings for text using OpenAI's embedding model.
+
+    Every call goes through the model's EmbeddingThrottle. Query embeddings
+    default to interactive priority and batches (ingestion) to background.
+    Provider 429s are retried after the provider's retry-after and do not
+    count towards the circuit breaker.
     """
     def __init__(self, model: str = "text-embedding-ada-002"):
-        self.client = openai.OpenAI(api_key=OPENAI_API_KEY)
+        # Retries are handled in _create so 429s go through the throttle.
+        self.client = openai.OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
         self.model = model
-
-    def generate_embedding(self, text: str) -> List[float]:
+        self.throttle = get_embedding_throttle(model)
+
+    def _create(self, texts: List[str], priority: str, timeout: float):
+        tokens = sum(estimate_tokens(text) for text in texts)
+        for attempt in range(1, EMBEDDING_MAX_ATTEMPTS + 1):
+            try:
+                waited = self.throttle.acquire(tokens, priority)
+            except ThrottleTimeout as e:
+                inc_counter('rate_limit_hits', {'scope': 'embedding_budget', 'priority': priority})
+                raise AIAProviderError(detail=str(e))
+            if waited:
+                record_latency('ai_latency', {'scope': 'embedding_throttle_wait', 'priority': priority}, waited)
+
+            try:
+                return self.client.embeddings.create(input=texts, model=self.model, timeout=timeout)
+            except openai.RateLimitError as e:
+                if getattr(e, "code", None) == "insufficient_quota":
+                    raise  # Not a rate limit; the account cannot serve requests.
+                retry_after = _retry_after(e)
+                self.throttle.penalize(retry_after)
+                inc_counter('rate_limit_hits', {'scope': 'embedding_provider', 'priority': priority})
+                logger.warning(f"Embedding provider rate limited {priority} call (attempt {attempt}/{EMBEDDING_MAX_ATTEMPTS}, retry after {retry_after}s).")
+                if attempt == EMBEDDING_MAX_ATTEMPTS:
+                    raise AIAProviderError(detail="AI provider is rate limiting embedding requests. Please retry shortly.")
+                if priority == INTERACTIVE:
+                    # Background calls wait out the shared cooldown in acquire(); queries only briefly.
+                    time.sleep(min(retry_after or 1.0, EMBEDDING_INTERACTIVE_MAX_WAIT))
+            except (openai.APIConnectionError, openai.InternalServerError):
+                if attempt == EMBEDDING_MAX_ATTEMPTS:
+                    raise
+                time.sleep(0.5 * 2 ** (attempt - 1))
+
+    def generate_embedding(self, text: str, priority: str = INTERACTIVE) -> List[float]:
         """
         Generates a single embedding for the given text.
         """
@@ -65,13 +159,11 @@ class EmbeddingGenerator:
             raise AIAProviderError("AI provider is currently unavailable for embeddings (Circuit Breaker is open).")
 
         try:
-            response = self.client.embeddings.create(
-                input=[text],
-                model=self.model,
-                timeout=30.0,
-            )
+            response = self._create([text], priority, timeout=30.0)
             openai_circuit_breaker.record_success()
             return response.data[0].embedding
+        except AIAProviderError:
+            raise
         except openai.APIError as e:
             openai_circuit_breaker.record_failure()
             logger.error("OpenAI API error during embedding generation", exc_info=True)
@@ -81,7 +173,7 @@ class EmbeddingGenerator:
             logger.error("Failed to generate embedding", exc_info=True)
             raise AIAProviderError(detail=f"Failed to generate embedding: {e}")
 
-    def generate_embeddings_batch(self, texts: List[str]) -> List[List[float]]:
+    def generate_embeddings_batch(self, texts: List[str], priority: str = BACKGROUND) -> List[List[float]]:
         """
         Generates embeddings for a list of texts in a batch.
         """
@@ -96,16 +188,14 @@ class EmbeddingGenerator:
             raise AIAProviderError("AI provider is currently unavailable for embeddings (Circuit Breaker is open).")
 
         try:
-            response = self.client.embeddings.create(
-                input=non_empty_texts,
-                model=self.model,
-                timeout=60.0,
-            )
+            response = self._create(non_empty_texts, priority, timeout=60.0)
             openai_circuit_breaker.record_success()
 
             embeddings_map = {text: embed.embedding for text, embed in zip(non_empty_texts, response.data)}
             result = [embeddings_map.get(text, []) for text in texts]
             return result
+        except AIAProviderError:
+            raise
         except openai.APIError as e:
             openai_circuit_breaker.record_failure()
             logger.error("OpenAI API error during batch embedding generation", exc_info=True)
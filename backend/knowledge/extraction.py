@@ -0,0 +1,254 @@
+"""
+Text extraction for file knowledge sources (PDF, DOCX, TXT).
+
+Files are streamed from Supabase Storage to a temp file, never held in memory
+whole. Parsing runs in a separate worker process under an address-space cap:
+the worker memory-maps the input, extracts text page by page and appends each
+page to an output file separated by form feeds. The caller then memory-maps
+that output and yields one page at a time into TextChunker.
+
+This module must stay importable without Django: the worker processes are
+spawned and only import what they need to parse.
+"""
+import codecs
+import logging
+import mmap
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterator
+from xml.etree.ElementTree import iterparse
+
+logger = logging.getLogger(__name__)
+
+MAX_FILE_BYTES = int(os.getenv("KNOWLEDGE_MAX_FILE_MB", "50")) * 1024 * 1024
+EXTRACTION_MEMORY_LIMIT_BYTES = int(os.getenv("KNOWLEDGE_EXTRACTION_MEMORY_MB", "512")) * 1024 * 1024
+EXTRACTION_TIMEOUT_SECONDS = int(os.getenv("KNOWLEDGE_EXTRACTION_TIMEOUT", "300"))
+EXTRACTION_WORKERS = int(os.getenv("KNOWLEDGE_EXTRACTION_WORKERS", "2"))
+
+PAGE_SEPARATOR = "\f"
+TEXT_BLOCK_BYTES = 1024 * 1024
+DOCX_PARAGRAPHS_PER_PAGE = 50
+
+FILE_TYPES = {
+    ".pdf": "pdf",
+    ".docx": "docx",
+    ".txt": "txt",
+    ".md": "txt",
+    ".csv": "txt",
+}
+
+_WORD_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class ExtractionError(Exception):
+    """Raised when a file cannot be extracted (unsupported, too large, corrupt)."""
+
+
+class UnsupportedFileTypeError(ExtractionError):
+    """The file's extension is not one of FILE_TYPES; retrying cannot help."""
+
+
+def detect_file_type(file_path: str) -> str:
+    extension = os.path.splitext(file_path.lower())[1]
+    file_type = FILE_TYPES.get(extension)
+    if not file_type:
+        raise UnsupportedFileTypeError(f"Unsupported file type: {extension or file_path}")
+    return file_type
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Spawned (not forked) workers: the parent is a threaded Django process.
+            _executor = ProcessPoolExecutor(
+                max_workers=EXTRACTION_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _executor
+
+
+def _discard_executor(executor: ProcessPoolExecutor):
+    """
+    Kills the pool's worker processes and makes the next extraction start a
+    new pool. Used when a parse hangs past the timeout (its process would hold
+    a pool slot forever) or a worker died (the pool is broken for good).
+    Extractions still running in the same pool fail and are retried by their jobs.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    for process in list((getattr(executor, "_processes", None) or {}).values()):
+        if process.is_alive():
+            process.terminate()
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+# --- Worker side -------------------------------------------------------------
+
+def _limit_memory(limit_bytes: int):
+    try:
+        import resource
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        soft = limit_bytes if hard == resource.RLIM_INFINITY else min(limit_bytes, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (soft, hard))
+    except (ImportError, ValueError, OSError):
+        # Not enforceable on this platform; the file size cap still applies.
+        pass
+
+
+def _write_page(out, text: str):
+    out.write(text.replace(PAGE_SEPARATOR, " ").strip())
+    out.write(PAGE_SEPARATOR)
+
+
+def _extract_pdf(source, out) -> int:
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise ExtractionError("PDF extraction requires the 'pypdf' package.")
+    reader = PdfReader(source)
+    pages = 0
+    for page in reader.pages:
+        _write_page(out, page.extract_text() or "")
+        pages += 1
+    return pages
+
+
+def _extract_docx(source, out) -> int:
+    import zipfile
+    pages = 0
+    paragraphs = []
+    with zipfile.ZipFile(source) as archive, archive.open("word/document.xml") as document:
+        # iterparse streams the XML; elements are cleared as soon as they are read.
+        for _, element in iterparse(document, events=("end",)):
+            if element.tag == f"{_WORD_NS}p":
+                text = "".join(node.text or "" for node in element.iter(f"{_WORD_NS}t"))
+                page_break = any(
+                    node.get(f"{_WORD_NS}type") == "page" for node in element.iter(f"{_WORD_NS}br")
+                )
+                if text.strip():
+                    paragraphs.append(text)
+                if paragraphs and (page_break or len(paragraphs) >= DOCX_PARAGRAPHS_PER_PAGE):
+                    _write_page(out, "\n\n".join(paragraphs))
+                    pages += 1
+                    paragraphs = []
+                element.clear()
+    if paragraphs:
+        _write_page(out, "\n\n".join(paragraphs))
+        pages += 1
+    return pages
+
+
+def _extract_txt(source, out) -> int:
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    pages = 0
+    tail = ""
+    while True:
+        block = source.read(TEXT_BLOCK_BYTES)
+        text = tail + decoder.decode(block, final=not block)
+        if not block:
+            if text.strip():
+                _write_page(out, text)
+                pages += 1
+            return pages
+        # Cut each page at the last line break so words are never split across pages.
+        cut = text.rfind("\n")
+        if cut == -1:
+            tail = text
+            continue
+        _write_page(out, text[:cut])
+        pages += 1
+        tail = text[cut + 1:]
+
+
+_EXTRACTORS = {
+    "pdf": _extract_pdf,
+    "docx": _extract_docx,
+    "txt": _extract_txt,
+}
+
+
+def extract_to_text_file(input_path: str, file_type: str, output_path: str, memory_limit_bytes: int) -> int:
+    """
+    Worker entry point: extracts `input_path` into `output_path`, one page per
+    form-feed-terminated record. Returns the number of pages written.
+    """
+    _limit_memory(memory_limit_bytes)
+    try:
+        with open(input_path, "rb") as raw, open(output_path, "w", encoding="utf-8") as out:
+            if os.fstat(raw.fileno()).st_size == 0:
+                return 0
+            if file_type == "docx":
+                # zipfile needs a seekable() file object, which mmap lacks before 3.13;
+                # it still only inflates word/document.xml, streaming.
+                return _extract_docx(raw, out)
+            with mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ) as source:
+                return _EXTRACTORS[file_type](source, out)
+    except MemoryError:
+        raise ExtractionError(f"Extraction exceeded the {memory_limit_bytes // (1024 * 1024)} MB memory cap.")
+
+
+# --- Caller side -------------------------------------------------------------
+
+def iter_pages(text_path: str) -> Iterator[str]:
+    """
+    Memory-maps an extracted text file and yields its pages one by one.
+    """
+    if os.path.getsize(text_path) == 0:
+        return
+    with open(text_path, "rb") as handle, mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        separator = PAGE_SEPARATOR.encode("utf-8")
+        position = 0
+        while position < len(data):
+            end = data.find(separator, position)
+            if end == -1:
+                end = len(data)
+            page = data[position:end].decode("utf-8", errors="replace")
+            if page.strip():
+                yield page
+            position = end + len(separator)
+
+
+def iter_file_pages(knowledge_repo, file_path: str) -> Iterator[str]:
+    """
+    Streams a stored knowledge file to disk, extracts it in a worker process
+    and yields its text page by page. Temp files are removed when the
+    generator is exhausted or closed.
+    """
+    file_type = detect_file_type(file_path)
+    with tempfile.TemporaryDirectory(prefix="tamm-extract-") as workdir:
+        input_path = os.path.join(workdir, "source")
+        output_path = os.path.join(workdir, "text")
+
+        with open(input_path, "wb") as destination:
+            knowledge_repo.download_file_to(file_path, destination, max_bytes=MAX_FILE_BYTES)
+
+        executor = _get_executor()
+        try:
+            future = executor.submit(
+                extract_to_text_file, input_path, file_type, output_path, EXTRACTION_MEMORY_LIMIT_BYTES
+            )
+            pages = future.result(timeout=EXTRACTION_TIMEOUT_SECONDS)
+        except ExtractionError:
+            raise
+        except FutureTimeoutError:
+            # Kill the hung parse before the temp directory (still open in it) is removed.
+            _discard_executor(executor)
+            raise ExtractionError(f"Extraction of {file_path} timed out after {EXTRACTION_TIMEOUT_SECONDS}s.")
+        except BrokenProcessPool as e:
+            _discard_executor(executor)
+            raise ExtractionError(f"Extraction worker for {file_path} died: {e}")
+        except Exception as e:
+            raise ExtractionError(f"Failed to extract {file_path}: {e}")
+        logger.info(f"Extracted {pages} pages from {file_path}")
+
+        yield from iter_pages(output_path)
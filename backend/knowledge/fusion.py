@@ -0,0 +1,81 @@
+"""
+Rank fusion for hybrid (lexical + vector) knowledge search.
+
+Each retrieval leg returns its own ranked list of chunk dicts carrying at least
+`id` and `score`. Fusion merges them into one list ordered by a fused `score`:
+
+- "rrf": reciprocal-rank fusion, sum(weight / (k + rank)). Only ranks matter,
+  so BM25 scores and cosine similarities never need to be put on one scale.
+- "weighted": min-max normalize each leg's scores to [0, 1] and take the
+  weighted sum. Keeps score magnitudes, at the cost of being sensitive to outliers.
+"""
+import math
+from typing import Dict, List, Sequence
+
+FUSION_METHODS = ("rrf", "weighted")
+
+
+def _merge_fields(entry: Dict, item: Dict):
+    # Keep leg-specific fields (e.g. the vector leg's `similarity`) whichever leg saw the chunk first.
+    for field, value in item.items():
+        entry.setdefault(field, value)
+
+
+def reciprocal_rank_fusion(ranked_lists: Sequence[List[Dict]], weights: Sequence[float], k: int = 60) -> List[Dict]:
+    fused: Dict[str, Dict] = {}
+    for results, weight in zip(ranked_lists, weights):
+        for rank, item in enumerate(results, start=1):
+            key = str(item["id"])
+            entry = fused.get(key)
+            if entry is None:
+                entry = fused[key] = {**item, "score": 0.0}
+            else:
+                _merge_fields(entry, item)
+            entry["score"] += weight / (k + rank)
+    return sorted(fused.values(), key=lambda x: x["score"], reverse=True)
+
+
+def weighted_score_fusion(ranked_lists: Sequence[List[Dict]], weights: Sequence[float]) -> List[Dict]:
+    fused: Dict[str, Dict] = {}
+    for results, weight in zip(ranked_lists, weights):
+        if not results:
+            continue
+        scores = [item["score"] for item in results]
+        low, high = min(scores), max(scores)
+        spread = high - low
+        for item in results:
+            # A leg with a single score (or all ties) counts every hit as a full match.
+            normalized = (item["score"] - low) / spread if spread > 0 else 1.0
+            key = str(item["id"])
+            entry = fused.get(key)
+            if entry is None:
+                entry = fused[key] = {**item, "score": 0.0}
+            else:
+                _merge_fields(entry, item)
+            entry["score"] += weight * normalized
+    return sorted(fused.values(), key=lambda x: x["score"], reverse=True)
+
+
+def fuse(ranked_lists: Sequence[List[Dict]], weights: Sequence[float], method: str = "rrf", rrf_k: int = 60) -> List[Dict]:
+    """
+    Fuses per-leg ranked lists with the configured method.
+    """
+    if method == "rrf":
+        return reciprocal_rank_fusion(ranked_lists, weights, k=rrf_k)
+    if method == "weighted":
+        return weighted_score_fusion(ranked_lists, weights)
+    raise ValueError(f"Unknown fusion method: {method}. Expected one of {FUSION_METHODS}.")
+
+
+def candidate_pool_size(top_k: int, corpus_size: int, floor: int = 10, cap: int = 100) -> int:
+    """
+    Number of candidates each leg should fetch before fusion.
+
+    Fusion only helps if both legs reach past the final cut-off, and the depth
+    needed grows with the corpus: a 50-chunk FAQ never needs more than its whole
+    corpus, while a 50k-chunk catalogue needs a deeper pool for the legs to overlap.
+    """
+    if corpus_size <= 0:
+        return max(top_k, floor)
+    depth = top_k * (2 + int(math.log10(max(corpus_size, 1))))
+    return min(corpus_size, max(floor, min(cap, depth)))
@@ -0,0 +1,209 @@
+"""
+Streaming embed-and-store stage shared by source ingestion and agent retrains.
+
+Chunks arrive lazily from TextChunker.iter_chunks and are embedded and
+inserted in fixed-size batches, so only one batch of chunks and vectors is in
+memory at a time regardless of document size, and each batch costs one
+embeddings call and one insert instead of one of each per chunk.
+
+Near-duplicate chunks (knowledge.dedup) are not embedded at all; each one is
+recorded in agent_chunk_refs against the stored copy so its source can still
+be cited. If the original turns out not to be stored (no embedding, or its
+batch insert failed), its duplicates are checked again and the first of them
+is embedded in its place.
+
+Each chunk's lexical search terms (knowledge.lexical.tokenize, which applies
+the Arabic normalization in knowledge.normalize) are computed once here and
+stored with it, so lexical indexes are rebuilt without re-normalizing text.
+
+Chunks from HierarchicalChunker carry their parent section; parents are stored
+(once, in agent_parent_chunks) with the first batch that contains one of their
+embedded children, and each child row links to its parent.
+"""
+import logging
+import os
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from knowledge.dedup import ChunkDeduplicator
+from knowledge.lexical import TOKENIZER_VERSION, encode_terms, lexical_indexes, tokenize
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+
+
+def index_chunks(
+    chunks: Iterable[Dict],
+    agent_id,
+    source_id,
+    source_type: str,
+    knowledge_repo,
+    embedding_generator,
+    router,
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+    deduplicator: Optional[ChunkDeduplicator] = None,
+    progress: Optional[Callable[[int, int, int], None]] = None,
+) -> Tuple[int, int, int]:
+    """
+    Routes, deduplicates, embeds and stores `chunks` in batches of `batch_size`.
+    Pass the same `deduplicator` across calls to deduplicate across sources.
+    `progress(seen, stored, duplicates)` receives the counts added since its
+    previous call after every stored batch.
+    Returns (chunks seen, chunks stored, duplicates skipped).
+    """
+    deduplicator = deduplicator or ChunkDeduplicator()
+    seen = 0
+    stored = 0
+    duplicates = 0
+    batch: List[Dict] = []
+    pending_refs: List[Tuple[str, Dict]] = []  # (canonical chunk_id, duplicate chunk)
+    parent_ids: Dict[str, str] = {}  # parent chunk_id -> stored id, for parents spanning batches
+    reported = (0, 0, 0)
+
+    def report():
+        nonlocal reported
+        if progress is not None and (seen, stored, duplicates) != reported:
+            progress(seen - reported[0], stored - reported[1], duplicates - reported[2])
+            reported = (seen, stored, duplicates)
+
+    def flush():
+        nonlocal batch, pending_refs, stored, duplicates
+        while True:
+            if batch:
+                stored += _embed_and_store(batch, agent_id, source_id, knowledge_repo, embedding_generator, deduplicator, parent_ids)
+                _forget_finished_parents(parent_ids, batch[-1])
+                batch = []
+            pending_refs, orphans = _store_references(pending_refs, agent_id, source_id, knowledge_repo, deduplicator)
+            # The original of these was not stored: check them again so one of each group gets embedded.
+            for _, chunk in orphans:
+                canonical = deduplicator.reconsider(chunk["chunk_id"], chunk["content"])
+                if canonical is None:
+                    duplicates -= 1
+                    batch.append(chunk)
+                else:
+                    pending_refs.append((canonical, chunk))
+            if not batch:
+                break
+        report()
+
+    for chunk in chunks:
+        seen += 1
+        chunk["metadata"]["source_type"] = source_type
+        if "rag_vectors" not in router.route_knowledge_chunk(chunk):
+            continue
+        canonical = deduplicator.check(chunk["chunk_id"], chunk["content"])
+        if canonical is not None:
+            duplicates += 1
+            pending_refs.append((canonical, chunk))
+            continue
+        batch.append(chunk)
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+    if pending_refs:
+        logger.warning(f"Dropped {len(pending_refs)} duplicate references for source {source_id}: original chunks were not stored.")
+    return seen, stored, duplicates
+
+
+def indexing_stats(chunks: int, embedded: int, duplicates: int) -> Dict:
+    """
+    Per-job counters stored on kb_jobs.stats.
+    """
+    return {
+        "chunks": chunks,
+        "embedded": embedded,
+        "duplicates": duplicates,
+        "dedup_ratio": round(duplicates / chunks, 4) if chunks else 0.0,
+    }
+
+
+def _embed_and_store(batch: List[Dict], agent_id, source_id, knowledge_repo, embedding_generator, deduplicator: ChunkDeduplicator,
+                     parent_ids: Dict[str, str]) -> int:
+    embeddings = embedding_generator.generate_embeddings_batch([chunk["content"] for chunk in batch])
+    kept = []
+    for chunk, embedding in zip(batch, embeddings):
+        if not embedding:
+            logger.warning(f"Could not generate embedding for chunk {chunk['chunk_id']} from source {source_id}. Skipping.")
+            deduplicator.discard(chunk["chunk_id"])
+            continue
+        kept.append((chunk, embedding))
+
+    _store_parents([chunk for chunk, _ in kept], agent_id, source_id, knowledge_repo, parent_ids)
+    terms = [tokenize(chunk["content"]) for chunk, _ in kept]
+    rows = [{
+        "agent_id": agent_id,
+        "source_id": source_id,
+        "content": chunk["content"],
+        "embedding": embedding,
+        "parent_id": parent_ids.get(chunk["parent"]["chunk_id"]) if chunk.get("parent") else None,
+        "search_tokens": encode_terms(chunk_terms),
+        "search_version": TOKENIZER_VERSION,
+    } for (chunk, embedding), chunk_terms in zip(kept, terms)]
+
+    try:
+        embedding_ids = knowledge_repo.store_embeddings_batch(rows)
+    except Exception:
+        # A retrain moves on to the next source with the same deduplicator; nothing may reference these.
+        for chunk, _ in kept:
+            deduplicator.discard(chunk["chunk_id"])
+        raise
+    for embedding_id, (chunk, _), row, chunk_terms in zip(embedding_ids, kept, rows, terms):
+        deduplicator.record_stored(chunk["chunk_id"], embedding_id)
+        lexical_indexes.add_chunk(agent_id, embedding_id, source_id, row["content"], chunk_terms)
+    return len(rows)
+
+
+def _store_parents(chunks: List[Dict], agent_id, source_id, knowledge_repo, parent_ids: Dict[str, str]):
+    """
+    Stores the parent sections of `chunks` that are not stored yet and records their ids in `parent_ids`.
+    """
+    new_parents = {}
+    for chunk in chunks:
+        parent = chunk.get("parent")
+        if parent and parent["chunk_id"] not in parent_ids:
+            new_parents.setdefault(parent["chunk_id"], parent)
+    if not new_parents:
+        return
+    stored_ids = knowledge_repo.store_parent_chunks_batch([{
+        "agent_id": agent_id,
+        "source_id": source_id,
+        "parent_number": parent["metadata"]["chunk_number"],
+        "content": parent["content"],
+        "token_count": parent["metadata"]["token_count"],
+    } for parent in new_parents.values()])
+    parent_ids.update(zip(new_parents.keys(), stored_ids))
+
+
+def _forget_finished_parents(parent_ids: Dict[str, str], last_chunk: Dict):
+    """
+    Children arrive in order, so only the last chunk's parent can still receive children.
+    """
+    current = last_chunk.get("parent", {}).get("chunk_id")
+    for chunk_id in [key for key in parent_ids if key != current]:
+        del parent_ids[chunk_id]
+
+
+def _store_references(pending: List[Tuple[str, Dict]], agent_id, source_id, knowledge_repo,
+                      deduplicator: ChunkDeduplicator) -> Tuple[List[Tuple[str, Dict]], List[Tuple[str, Dict]]]:
+    """
+    Stores references for duplicates whose original chunk has been stored.
+    Returns (duplicates still waiting for their original, duplicates whose
+    original was discarded).
+    """
+    rows = []
+    waiting = []
+    orphans = []
+    for canonical, chunk in pending:
+        embedding_id = deduplicator.stored_id(canonical)
+        if embedding_id is None:
+            (orphans if deduplicator.is_discarded(canonical) else waiting).append((canonical, chunk))
+            continue
+        rows.append({
+            "agent_id": str(agent_id),
+            "embedding_id": str(embedding_id),
+            "source_id": str(source_id),
+            "chunk_number": chunk["metadata"]["chunk_number"],
+        })
+    if rows:
+        knowledge_repo.store_chunk_references_batch(rows)
+    return waiting, orphans
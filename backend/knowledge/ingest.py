@@ -3,23 +3,44 @@ import json
 from django.conf import settings
 from rest_framework import exceptions # Keep for potential internal exceptions
 from knowledge.supabase_repo import KnowledgeSupabaseRepo
-from knowledge.chunking import TextChunker
+from knowledge.chunking import HierarchicalChunker
 from knowledge.embedding import EmbeddingGenerator
 from knowledge.routing import KnowledgeRouter
+from knowledge.indexing import index_chunks, indexing_stats
+from knowledge.extraction import UnsupportedFileTypeError, detect_file_type, iter_file_pages
+from knowledge.lexical import lexical_indexes
+from knowledge.job_queue import JobScopeError, PermanentJobError
 
 import logging
 
 logger = logging.getLogger(__name__)
 
+
+def _check_source_scope(source: dict, source_id: uuid.UUID, agent_id: uuid.UUID, workspace_id: uuid.UUID):
+    """
+    Workers run with the service-role key, so RLS does not stop a job from
+    naming another tenant's source; only sources of the job's own agent and
+    workspace may be read or indexed.
+    """
+    if str(source.get('workspace_id')) != str(workspace_id) or str(source.get('agent_id')) != str(agent_id):
+        raise JobScopeError(f"Knowledge source {source_id} does not belong to agent {agent_id} in workspace {workspace_id}.")
+
 # Renamed and refactored from KnowledgeIngestAPIView's post method
-def trigger_ingestion_job(source_id: uuid.UUID, agent_id: uuid.UUID, workspace_id: uuid.UUID, user_jwt: str):
+def trigger_ingestion_job(source_id: uuid.UUID, agent_id: uuid.UUID, workspace_id: uuid.UUID, user_jwt: str,
+                          chunk_progress=None):
     """
     Triggers the knowledge ingestion process for a given source.
     This function will fetch the source details, extract content, chunk, embed,
     and store the knowledge.
+
+    Runs inside a kb_worker process for an 'ingest' kb_job. Invalid sources are
+    marked failed here; unexpected errors are raised so the queue can retry, and
+    the worker marks the source failed once the job runs out of attempts.
+    Returns the job's indexing stats (see knowledge.indexing.indexing_stats);
+    `chunk_progress` receives per-batch chunk counts (see index_chunks).
     """
     knowledge_repo = KnowledgeSupabaseRepo(user_jwt)
-    chunker = TextChunker()
+    chunker = HierarchicalChunker() # Small children are embedded, parent sections go into prompts
     embedding_generator = EmbeddingGenerator()
     router = KnowledgeRouter()
 
@@ -30,10 +51,12 @@ def trigger_ingestion_job(source_id: uuid.UUID, agent_id: uuid.UUID, workspace_i
             logger.error(f"Ingestion failed: Knowledge source {source_id} not found.")
             knowledge_repo.update_knowledge_source_status(source_id, "failed")
             return
+        _check_source_scope(source, source_id, agent_id, workspace_id)
 
         source_type = source.get('type')
         payload = source.get('payload', {})
         extracted_text = ""
+        segments = None
 
         # --- Content Extraction Logic ---
         if source_type == 'file':
@@ -44,21 +67,14 @@ def trigger_ingestion_job(source_id: uuid.UUID, agent_id: uuid.UUID, workspace_i
                 knowledge_repo.update_knowledge_source_status(source_id, "failed")
                 return
             
-            # Simulate file content retrieval (in a real scenario, you'd download from storage)
-            # For now, let's assume `file_path` contains enough info to mock content
-            # This part needs actual implementation to download and extract text from files
-            # For this task, we will simulate text extraction.
-            if ".pdf" in file_path.lower():
-                extracted_text = f"Simulated text from PDF: {file_path}. Content sample for agent {agent_id}."
-            elif ".docx" in file_path.lower():
-                extracted_text = f"Simulated text from DOCX: {file_path}. Content sample for agent {agent_id}."
-            elif ".txt" in file_path.lower():
-                extracted_text = f"Simulated text from TXT: {file_path}. Content sample for agent {agent_id}."
-            else:
-                extracted_text = f"Simulated text from unknown file type: {file_path}. Content sample for agent {agent_id}."
-            
-            # In a real system, you'd integrate a library here for parsing files (e.g., pdfminer, docx2txt)
-            logger.info(f"Simulated text extraction for file source {source_id}")
+            try:
+                detect_file_type(file_path)
+            except UnsupportedFileTypeError as e:
+                # Fails the job without retries; the worker then marks the source failed.
+                raise PermanentJobError(f"Ingestion failed for source {source_id}: {e}") from e
+
+            # Downloaded to a temp file and parsed page by page in a worker process
+            segments = iter_file_pages(knowledge_repo, file_path)
 
         elif source_type == 'url':
             url = payload.get("url")
@@ -90,41 +106,61 @@ def trigger_ingestion_job(source_id: uuid.UUID, agent_id: uuid.UUID, workspace_i
             knowledge_repo.update_knowledge_source_status(source_id, "failed")
             return
 
-        if not extracted_text:
-            logger.error(f"Ingestion failed for source {source_id}: No text extracted.")
-            knowledge_repo.update_knowledge_source_status(source_id, "failed")
-            return
+        if segments is None:
+            if not extracted_text:
+                logger.error(f"Ingestion failed for source {source_id}: No text extracted.")
+                knowledge_repo.update_knowledge_source_status(source_id, "failed")
+                return
+            segments = [extracted_text]
+
+        # 2. Chunk lazily and 3. embed + store in streaming batches
+        chunk_count, stored_count, duplicate_count = index_chunks(
+            chunker.iter_chunks_from_segments(segments, source_id=str(source_id)),
+            agent_id=agent_id,
+            source_id=source_id,
+            source_type=source_type,
+            knowledge_repo=knowledge_repo,
+            embedding_generator=embedding_generator,
+            router=router,
+            progress=chunk_progress,
+        )
 
-        # 2. Split text into semantic chunks
-        chunks = chunker.chunk_text(extracted_text, source_id=str(source_id))
-        
         # If no chunks, mark as failed
-        if not chunks:
+        if not chunk_count:
             logger.warning(f"No chunks generated for source {source_id}.")
             knowledge_repo.update_knowledge_source_status(source_id, "failed")
             return
 
-
-        # 3. Process each chunk
-        for chunk in chunks:
-            # Generate and store embeddings (if routed for RAG)
-            routing_destinations = router.route_knowledge_chunk(chunk) # Assuming chunk has metadata needed for routing
-            if "rag_vectors" in routing_destinations:
-                embedding = embedding_generator.generate_embedding(chunk["content"])
-                if embedding:
-                    knowledge_repo.store_embedding({
-                        "agent_id": agent_id,
-                        "source_id": source_id,
-                        "content": chunk["content"], # The actual text chunk
-                        "embedding": embedding
-                    })
-                else:
-                    logger.warning(f"Could not generate embedding for chunk from source {source_id}. Skipping.")
-        
         # 4. Update source status to 'active' on success
         knowledge_repo.update_knowledge_source_status(source_id, "active")
-        logger.info(f"Successfully ingested knowledge for source {source_id}. Chunks: {len(chunks)}")
+        stats = indexing_stats(chunk_count, stored_count, duplicate_count)
+        logger.info(f"Successfully ingested knowledge for source {source_id}. Chunks: {chunk_count}, embedded: {stored_count}, duplicates: {duplicate_count} (dedup ratio {stats['dedup_ratio']:.1%})")
+        return stats
 
     except Exception as e:
         logger.error(f"Error during ingestion job for source {source_id}: {e}", exc_info=True)
-        knowledge_repo.update_knowledge_source_status(source_id, "failed")
\ No newline at end of file
+        raise
+
+
+def reindex_source(source_id: uuid.UUID, agent_id: uuid.UUID, workspace_id: uuid.UUID, user_jwt: str, reembed: bool = True,
+                   chunk_progress=None):
+    """
+    Replaces one source's chunks without touching the rest of the agent: its
+    stored chunks are deleted in bulk and, with `reembed`, the source is
+    re-extracted and re-embedded (see trigger_ingestion_job). Runs inside a
+    kb_worker process for a 'reindex' kb_job. Returns the indexing stats plus
+    the number of chunks deleted and moved to other sources.
+    """
+    knowledge_repo = KnowledgeSupabaseRepo(user_jwt)
+    source = knowledge_repo.get_knowledge_source(source_id)
+    if source:
+        _check_source_scope(source, source_id, agent_id, workspace_id)
+    removed = knowledge_repo.delete_source_embeddings(agent_id, source_id)
+    if removed["moved"]:
+        lexical_indexes.invalidate(agent_id) # Moved chunks changed source; rebuild on next search
+    else:
+        lexical_indexes.remove_source(agent_id, source_id)
+    logger.info(f"Deleted {removed['deleted']} chunks of source {source_id} ({removed['moved']} shared chunks moved to other sources).")
+
+    stats = trigger_ingestion_job(source_id, agent_id, workspace_id, user_jwt, chunk_progress=chunk_progress) if reembed else None
+    return {**(stats or indexing_stats(0, 0, 0)), **removed}
@@ -0,0 +1,326 @@
+"""
+Durable kb_jobs queue backed by Postgres.
+
+Jobs are rows in public.kb_jobs. Views insert them as 'queued' with the
+service-role key after checking that the job's agent and source belong to the
+caller's workspace (members can only read kb_jobs); standalone workers (`manage.py kb_worker`) claim
+them with FOR UPDATE SKIP LOCKED, so any number of worker processes can poll
+the same table without handing out a job twice.
+
+- Concurrency: a job is only claimed while its workspace has fewer than
+  KB_JOB_WORKSPACE_CONCURRENCY jobs processing.
+- Retries: a failed attempt is re-queued with exponential backoff (run_after)
+  until max_attempts is reached, then marked 'failed'.
+- Permanent failures: handlers raise PermanentJobError for failures a retry
+  cannot fix; the job is failed on that attempt.
+- Leases: the owning worker refreshes heartbeat_at in the background. Jobs whose
+  heartbeat is older than KB_JOB_STALE_SECONDS (worker crashed or was killed)
+  are re-queued or failed by whichever worker sweeps next.
+- Progress: handlers report progress to an in-memory JobProgress; it is written
+  together with the heartbeat, at most once per KB_JOB_HEARTBEAT_SECONDS, and
+  published live (coalesced) to `progress_broker` for the SSE endpoint.
+"""
+import json
+import logging
+import os
+import random
+import threading
+from typing import Any, Dict, Optional
+
+import redis
+from django.conf import settings
+from django.db import connection, transaction
+
+from knowledge.progress import LocalProgressBroker, ProgressPublisher, RedisProgressBroker
+
+logger = logging.getLogger(__name__)
+
+
+class PermanentJobError(Exception):
+    """Raised by a job handler when retrying the job cannot succeed."""
+
+
+class JobScopeError(PermanentJobError):
+    """The job references an agent or source outside its workspace; nothing of theirs is touched."""
+
+KB_JOB_WORKSPACE_CONCURRENCY = int(os.getenv("KB_JOB_WORKSPACE_CONCURRENCY", "2"))
+KB_JOB_HEARTBEAT_SECONDS = float(os.getenv("KB_JOB_HEARTBEAT_SECONDS", "10"))
+KB_JOB_STALE_SECONDS = float(os.getenv("KB_JOB_STALE_SECONDS", "120"))
+KB_JOB_BACKOFF_BASE_SECONDS = float(os.getenv("KB_JOB_BACKOFF_BASE_SECONDS", "30"))
+KB_JOB_BACKOFF_MAX_SECONDS = float(os.getenv("KB_JOB_BACKOFF_MAX_SECONDS", "900"))
+
+KB_JOB_PROGRESS_INTERVAL_SECONDS = float(os.getenv("KB_JOB_PROGRESS_INTERVAL_SECONDS", "1"))
+
+try:
+    progress_broker = RedisProgressBroker(redis.StrictRedis.from_url(
+        settings.REDIS_URL,
+        decode_responses=True,
+        socket_connect_timeout=1,
+    ))
+except AttributeError:  # settings.REDIS_URL might not be configured
+    logger.error("REDIS_URL not found in Django settings. kb_jobs progress is only streamed within this process.")
+    progress_broker = LocalProgressBroker()
+
+# Serializes claims so the per-workspace running count cannot be raced past the limit.
+_CLAIM_LOCK_KEY = 0x6B625F6A6F6273  # "kb_jobs"
+
+_CLAIM_SQL = """
+    WITH running AS (
+        SELECT workspace_id, count(*) AS n
+        FROM public.kb_jobs
+        WHERE status = 'processing'
+        GROUP BY workspace_id
+    ), candidate AS (
+        SELECT j.id
+        FROM public.kb_jobs j
+        LEFT JOIN running r ON r.workspace_id = j.workspace_id
+        WHERE j.status = 'queued'
+          AND j.run_after <= now()
+          AND coalesce(r.n, 0) < %s
+        ORDER BY j.run_after, j.created_at
+        LIMIT 1
+        FOR UPDATE OF j SKIP LOCKED
+    )
+    UPDATE public.kb_jobs j
+    SET status = 'processing',
+        attempts = j.attempts + 1,
+        locked_by = %s,
+        locked_at = now(),
+        heartbeat_at = now(),
+        error = NULL,
+        updated_at = now()
+    FROM candidate
+    WHERE j.id = candidate.id
+    RETURNING j.id, j.workspace_id, j.agent_id, j.kind, j.payload, j.attempts, j.max_attempts
+"""
+
+
+def backoff_seconds(attempts: int) -> float:
+    """
+    Exponential backoff with +/-20% jitter for the retry after attempt number `attempts`.
+    """
+    delay = min(KB_JOB_BACKOFF_MAX_SECONDS, KB_JOB_BACKOFF_BASE_SECONDS * (2 ** max(0, attempts - 1)))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def claim_next_job(worker_id: str, workspace_concurrency: int = KB_JOB_WORKSPACE_CONCURRENCY) -> Optional[Dict[str, Any]]:
+    """
+    Atomically claims the next runnable job for `worker_id`, or returns None.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", [_CLAIM_LOCK_KEY])
+        cursor.execute(_CLAIM_SQL, [workspace_concurrency, worker_id])
+        row = cursor.fetchone()
+    if not row:
+        return None
+    job_id, workspace_id, agent_id, kind, payload, attempts, max_attempts = row
+    if isinstance(payload, str):
+        payload = json.loads(payload)
+    return {
+        "id": str(job_id),
+        "workspace_id": str(workspace_id),
+        "agent_id": str(agent_id) if agent_id else None,
+        "kind": kind,
+        "payload": payload or {},
+        "attempts": attempts,
+        "max_attempts": max_attempts,
+    }
+
+
+def heartbeat(job_id: str, worker_id: str, processed: Optional[int] = None, total: Optional[int] = None) -> bool:
+    """
+    Extends the lease on a job and writes pending progress in the same statement.
+    Returns False if the job is no longer owned by `worker_id`.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE public.kb_jobs
+            SET heartbeat_at = now(),
+                processed_sources = coalesce(%s, processed_sources),
+                total_sources = coalesce(%s, total_sources),
+                updated_at = now()
+            WHERE id = %s AND locked_by = %s AND status = 'processing'
+            """,
+            [processed, total, job_id, worker_id],
+        )
+        return cursor.rowcount == 1
+
+
+def complete_job(job_id: str, worker_id: str, processed: Optional[int] = None, total: Optional[int] = None,
+                 stats: Optional[Dict[str, Any]] = None):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE public.kb_jobs
+            SET status = 'done',
+                processed_sources = coalesce(%s, processed_sources),
+                total_sources = coalesce(%s, total_sources),
+                stats = coalesce(%s::jsonb, stats),
+                locked_by = NULL,
+                finished_at = now(),
+                updated_at = now()
+            WHERE id = %s AND locked_by = %s
+            """,
+            [processed, total, json.dumps(stats) if stats else None, job_id, worker_id],
+        )
+
+
+def fail_job(job_id: str, worker_id: str, error: str, attempts: int, max_attempts: int) -> bool:
+    """
+    Records a failed attempt. Re-queues the job with backoff while attempts
+    remain and returns True; otherwise marks it 'failed' and returns False.
+    """
+    will_retry = attempts < max_attempts
+    with connection.cursor() as cursor:
+        if will_retry:
+            cursor.execute(
+                """
+                UPDATE public.kb_jobs
+                SET status = 'queued',
+                    run_after = now() + make_interval(secs => %s),
+                    locked_by = NULL,
+                    error = %s,
+                    updated_at = now()
+                WHERE id = %s AND locked_by = %s
+                """,
+                [backoff_seconds(attempts), error[:2000], job_id, worker_id],
+            )
+        else:
+            cursor.execute(
+                """
+                UPDATE public.kb_jobs
+                SET status = 'failed',
+                    locked_by = NULL,
+                    error = %s,
+                    finished_at = now(),
+                    updated_at = now()
+                WHERE id = %s AND locked_by = %s
+                """,
+                [error[:2000], job_id, worker_id],
+            )
+    return will_retry
+
+
+def recover_stale_jobs(stale_seconds: float = KB_JOB_STALE_SECONDS) -> int:
+    """
+    Re-queues (or fails, if out of attempts) processing jobs whose worker
+    stopped heartbeating. Returns the number of jobs recovered.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE public.kb_jobs
+            SET status = CASE WHEN attempts < max_attempts THEN 'queued' ELSE 'failed' END,
+                run_after = now(),
+                locked_by = NULL,
+                error = 'Worker heartbeat lost (' || coalesce(locked_by, 'unknown') || ')',
+                finished_at = CASE WHEN attempts < max_attempts THEN NULL ELSE now() END,
+                updated_at = now()
+            WHERE status = 'processing'
+              AND coalesce(heartbeat_at, locked_at, updated_at) < now() - make_interval(secs => %s)
+            """,
+            [stale_seconds],
+        )
+        recovered = cursor.rowcount
+    if recovered:
+        logger.warning(f"Recovered {recovered} stale kb_jobs.")
+    return recovered
+
+
+class JobProgress:
+    """
+    In-memory progress for the running job. Handlers call update() and
+    add_chunks() as often as they like; JobLease writes the latest source
+    counts with its next heartbeat and `publisher` coalesces live events.
+    """
+    def __init__(self, publisher: Optional[ProgressPublisher] = None):
+        self._lock = threading.Lock()
+        self.processed: Optional[int] = None
+        self.total: Optional[int] = None
+        self.chunks_seen = 0
+        self.chunks_embedded = 0
+        self.cache_hits = 0
+        self.publisher = publisher
+
+    def update(self, processed: int, total: int):
+        with self._lock:
+            self.processed = processed
+            self.total = total
+            self._publish("processing")
+
+    def add_chunks(self, seen: int, embedded: int, duplicates: int):
+        """
+        Adds chunk counts for a stored batch; duplicates reused an existing embedding.
+        """
+        with self._lock:
+            self.chunks_seen += seen
+            self.chunks_embedded += embedded
+            self.cache_hits += duplicates
+            self._publish("processing")
+
+    def flush(self):
+        with self._lock:
+            self._publish("processing")
+
+    def finish(self, status: str, error: Optional[str] = None):
+        with self._lock:
+            self._publish(status, error=error, force=True)
+
+    def snapshot(self):
+        with self._lock:
+            return self.processed, self.total
+
+    def _publish(self, status: str, error: Optional[str] = None, force: bool = False):
+        if self.publisher is None:
+            return
+        try:
+            self.publisher.update(
+                status, self.processed, self.total, self.chunks_seen, self.chunks_embedded, self.cache_hits,
+                error=error, force=force,
+            )
+        except Exception as e:
+            logger.warning(f"Failed to publish kb_job progress: {e}")
+
+
+class JobLease:
+    """
+    Keeps a claimed job alive: a daemon thread heartbeats every `interval`
+    seconds (flushing progress) until stop() is called. `lost` is set if the
+    job was taken away, e.g. recovered as stale by another worker.
+    """
+    def __init__(self, job_id: str, worker_id: str, progress: JobProgress, interval: float = KB_JOB_HEARTBEAT_SECONDS):
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.progress = progress
+        self.interval = interval
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"kb-job-heartbeat-{job_id}", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=self.interval)
+
+    def _run(self):
+        try:
+            while not self._stop.wait(self.interval):
+                self.progress.flush()  # Publishes chunk counts coalesced since the last update
+                processed, total = self.progress.snapshot()
+                try:
+                    if not heartbeat(self.job_id, self.worker_id, processed, total):
+                        logger.warning(f"Lost lease on kb_job {self.job_id}.")
+                        self.lost.set()
+                        return
+                except Exception as e:
+                    logger.error(f"Heartbeat failed for kb_job {self.job_id}: {e}")
+        finally:
+            connection.close()  # The heartbeat thread has its own DB connection.
@@ -1,44 +1,58 @@
 import uuid
 import logging
-from django.db import transaction
+from typing import Callable, Optional
 
 from knowledge.supabase_repo import KnowledgeSupabaseRepo
-from knowledge.chunking import TextChunker
+from knowledge.chunking import HierarchicalChunker
 from knowledge.embedding import EmbeddingGenerator
 from knowledge.routing import KnowledgeRouter # If needed for routing
+from knowledge.lexical import lexical_indexes
+from knowledge.dedup import ChunkDeduplicator
+from knowledge.indexing import index_chunks, indexing_stats
+from knowledge.extraction import iter_file_pages
 from agents.supabase_repo import SupabaseRepo as AgentSupabaseRepo # For updating trained_at
 
 logger = logging.getLogger(__name__)
 
-async def retrain_agent_knowledge(agent_id: uuid.UUID, workspace_id: uuid.UUID, user_jwt: str, job_id: uuid.UUID):
+def retrain_agent_knowledge(agent_id: uuid.UUID, workspace_id: uuid.UUID, user_jwt: str,
+                            progress: Optional[Callable[[int, int], None]] = None,
+                            chunk_progress: Optional[Callable[[int, int, int], None]] = None):
     """
-    Asynchronously retrains an agent's knowledge base.
-    This involves re-chunking and re-embedding all associated knowledge sources.
+    Retrains an agent's knowledge base by re-chunking and re-embedding all of
+    its knowledge sources. Runs inside a kb_worker process (see
+    knowledge.worker), which owns the kb_jobs row: progress is reported through
+    `progress(processed, total)`, chunk counts through `chunk_progress` (see
+    index_chunks), and unrecoverable errors are raised so the queue can retry
+    the job. Returns the job's indexing stats; duplicates are
+    detected across all of the agent's sources.
     """
     knowledge_repo = KnowledgeSupabaseRepo(user_jwt)
     agent_repo = AgentSupabaseRepo(user_jwt) # Use for updating agent.trained_at
-    chunker = TextChunker()
+    chunker = HierarchicalChunker() # Small children are embedded, parent sections go into prompts
     embedding_generator = EmbeddingGenerator()
     router = KnowledgeRouter() # Initialize if routing is part of chunking/embedding
+    deduplicator = ChunkDeduplicator() # Shared by all sources so cross-source boilerplate is embedded once
+    chunk_total = stored_total = 0
+
+    report = progress or (lambda processed, total: None)
 
     try:
-        # 1. Update kb_job status to 'processing'
-        knowledge_repo.update_kb_job_status(job_id, "processing")
-        
-        # 2. Delete existing embeddings for this agent
+        # 1. Delete existing embeddings for this agent
         knowledge_repo.delete_agent_embeddings(agent_id)
+        lexical_indexes.invalidate(agent_id) # Rebuilt from the fresh embeddings on next search
         logger.info(f"Deleted existing embeddings for agent {agent_id}.")
 
-        # 3. Fetch all active knowledge sources for the agent
+        # 2. Fetch all active knowledge sources for the agent
         sources = knowledge_repo.get_agent_knowledge_sources(agent_id)
         if not sources:
             logger.info(f"No knowledge sources found for agent {agent_id}. Retrain complete (no sources).")
-            knowledge_repo.update_kb_job_status(job_id, "done")
+            report(0, 0)
             agent_repo.update_agent_trained_at(agent_id)
-            return
+            return indexing_stats(0, 0, 0)
 
         total_sources = len(sources)
         processed_count = 0
+        report(processed_count, total_sources)
 
         for source in sources:
             try:
@@ -47,6 +61,7 @@ async def retrain_agent_knowledge(agent_id: uuid.UUID, workspace_id: uuid.UUID,
                 source_type = source.get('type')
                 payload = source.get('payload', {})
                 extracted_text = ""
+                segments = None
 
                 # --- Content Extraction Logic (Duplicated from ingest.py, consider refactoring) ---
                 if source_type == 'file':
@@ -54,12 +69,7 @@ async def retrain_agent_knowledge(agent_id: uuid.UUID, workspace_id: uuid.UUID,
                     if not file_path:
                         logger.error(f"Retrain: File path missing for source {source.get('id')}.")
                         continue
-                    # Simulate file content retrieval
-                    if ".pdf" in file_path.lower():
-                        extracted_text = f"Simulated text from PDF: {file_path}. Content sample for agent {agent_id}."
-                    # ... other file types
-                    else:
-                        extracted_text = f"Simulated text from file: {file_path}. Content sample for agent {agent_id}."
+                    segments = iter_file_pages(knowledge_repo, file_path)
 
                 elif source_type == 'url':
                     url = payload.get("url")
@@ -83,44 +93,46 @@ async def retrain_agent_knowledge(agent_id: uuid.UUID, workspace_id: uuid.UUID,
                         continue
                     extracted_text = f"Question: {question}\nAnswer: {answer}"
                 
-                if not extracted_text:
-                    logger.warning(f"Retrain: No text extracted for source {source.get('id')}. Skipping.")
-                    continue
-
-                # 4. Re-chunk text
-                chunks = chunker.chunk_text(extracted_text, source_id=str(source.get('id')))
-
-                if not chunks:
+                if segments is None:
+                    if not extracted_text:
+                        logger.warning(f"Retrain: No text extracted for source {source.get('id')}. Skipping.")
+                        continue
+                    segments = [extracted_text]
+
+                # 3. Re-chunk lazily and 4. re-embed + store in streaming batches
+                source_id = uuid.UUID(source.get('id')) # Ensure source_id is UUID
+                chunk_count, stored_count, _ = index_chunks(
+                    chunker.iter_chunks_from_segments(segments, source_id=str(source_id)),
+                    agent_id=agent_id,
+                    source_id=source_id,
+                    source_type=source_type,
+                    knowledge_repo=knowledge_repo,
+                    embedding_generator=embedding_generator,
+                    router=router,
+                    deduplicator=deduplicator,
+                    progress=chunk_progress,
+                )
+                chunk_total += chunk_count
+                stored_total += stored_count
+
+                if not chunk_count:
                     logger.warning(f"Retrain: No chunks generated for source {source.get('id')}. Skipping.")
                     continue
 
-                # 5. Re-embed and store
-                for chunk in chunks:
-                    routing_destinations = router.route_knowledge_chunk(chunk)
-                    if "rag_vectors" in routing_destinations:
-                        embedding = embedding_generator.generate_embedding(chunk["content"])
-                        if embedding:
-                            knowledge_repo.store_embedding({
-                                "agent_id": agent_id,
-                                "source_id": uuid.UUID(source.get('id')), # Ensure source_id is UUID
-                                "content": chunk["content"],
-                                "embedding": embedding
-                            })
-                        else:
-                            logger.warning(f"Retrain: Could not generate embedding for chunk from source {source.get('id')}. Skipping.")
-                
                 processed_count += 1
-                knowledge_repo.update_kb_job_progress(job_id, processed_count, total_sources) # Update progress
+                report(processed_count, total_sources) # Flushed to kb_jobs with the next heartbeat
 
             except Exception as e:
                 logger.error(f"Error processing source {source.get('id')} during retrain: {e}", exc_info=True)
                 # Continue with other sources even if one fails
 
-        # 6. Update agent.trained_at and kb_job status
-        knowledge_repo.update_kb_job_status(job_id, "done")
+        # 5. Update agent.trained_at; the worker marks the kb_job done
         agent_repo.update_agent_trained_at(agent_id)
-        logger.info(f"Agent {agent_id} knowledge retraining completed. Processed {processed_count}/{total_sources} sources.")
+        stats = indexing_stats(chunk_total, stored_total, deduplicator.duplicates)
+        logger.info(f"Agent {agent_id} knowledge retraining completed. Processed {processed_count}/{total_sources} sources, "
+                    f"{stored_total}/{chunk_total} chunks embedded (dedup ratio {stats['dedup_ratio']:.1%}).")
+        return stats
 
     except Exception as e:
         logger.error(f"Unhandled error during agent knowledge retraining for agent {agent_id}: {e}", exc_info=True)
-        knowledge_repo.update_kb_job_status(job_id, "failed", str(e))
\ No newline at end of file
+        raise
\ No newline at end of file
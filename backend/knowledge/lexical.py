@@ -0,0 +1,450 @@
+"""
+Lexical retrieval for agent knowledge using an in-process BM25 inverted index.
+
+Each agent gets its own index, built lazily from `agent_embeddings` (using the
+search terms stored with each chunk at ingestion) and kept up to date
+incrementally: directly by the process that ingests a chunk, and in every
+other process by loading only the chunks stored since its last revalidation. Postings are stored in
+`array` buffers (document ids and term frequencies) instead of Python lists of
+objects, so a few hundred thousand chunks stay within a few megabytes of
+posting data and a query only touches the postings of its own terms.
+
+Built indexes are also written to a per-agent snapshot file (knowledge.snapshot)
+under the persistent KNOWLEDGE_SNAPSHOT_DIR so a restarted or freshly scaled worker memory-maps the index instead of
+re-reading and re-tokenizing every chunk from Supabase.
+"""
+import heapq
+import logging
+import math
+import os
+import threading
+import time
+from array import array
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from knowledge.normalize import normalize_text
+from knowledge.snapshot import SnapshotStore
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever tokenize() changes output (including the knowledge.normalize table);
+# snapshots and stored search tokens from another version are rebuilt.
+TOKENIZER_VERSION = 2
+
+# Share of tombstoned documents past which an index compacts its postings.
+COMPACT_DEAD_FRACTION = float(os.getenv("LEXICAL_INDEX_COMPACT_DEAD_FRACTION", "0.3"))
+
+_STOPWORDS = {
+    # English
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from",
+    "has", "have", "how", "i", "if", "in", "is", "it", "its", "me", "my", "of", "on", "or",
+    "our", "so", "that", "the", "their", "there", "this", "to", "was", "we", "what", "when",
+    "where", "which", "who", "will", "with", "you", "your",
+    # Arabic (MSA and common Egyptian)
+    "في", "من", "على", "الى", "إلى", "عن", "مع", "هو", "هي", "ده", "دي", "دا", "اللي", "الذي",
+    "التي", "ما", "لا", "هل", "او", "أو", "ثم", "كان", "انا", "أنا", "انت", "إنت", "احنا",
+    "ايه", "إيه", "فيه", "عند", "كده", "بس", "يعني",
+}
+# Stored in normalized form so they match normalized tokens ("على" -> "علي").
+STOPWORDS = frozenset(normalize_text(word) for word in _STOPWORDS)
+
+# Leading Arabic definite-article forms stripped as a light stem ("بالشحن" -> "شحن").
+_ARABIC_ARTICLES = ("وال", "بال", "كال", "فال", "لل", "ال")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Splits English/Arabic text into normalized search terms.
+    Normalizes with knowledge.normalize (casefold, diacritics, tatweel,
+    alef/hamza/ya/ta marbuta variants, Arabic-Indic digits, punctuation) in a
+    single translate pass, strips the definite article from longer Arabic words
+    and removes stopwords.
+    """
+    if not text:
+        return []
+    terms = []
+    for token in normalize_text(text).split():
+        if token in STOPWORDS:
+            continue
+        for article in _ARABIC_ARTICLES:
+            if token.startswith(article) and len(token) - len(article) >= 2:
+                token = token[len(article):]
+                break
+        if len(token) > 1 or token.isdigit():
+            terms.append(token)
+    return terms
+
+
+def encode_terms(terms: List[str]) -> str:
+    """
+    Serializes tokenize() output for agent_embeddings.search_tokens.
+    """
+    return " ".join(terms)
+
+
+def stored_terms(row: Dict) -> Optional[List[str]]:
+    """
+    Returns the search terms stored with a chunk row at ingestion, or None if
+    the row has none or they came from another TOKENIZER_VERSION.
+    """
+    if row.get("search_tokens") is None or row.get("search_version") != TOKENIZER_VERSION:
+        return None
+    return row["search_tokens"].split()
+
+
+class BM25Index:
+    """
+    Append-only BM25 inverted index over the chunks of a single agent.
+
+    Documents are addressed internally by a dense integer id, so postings for a
+    term are two parallel `array('I')` buffers (doc ids ascending, term
+    frequencies). Removing (or re-adding) a document only flips its tombstone;
+    maybe_compact() drops tombstoned documents from the postings once they pass
+    COMPACT_DEAD_FRACTION of the index, and before a snapshot is written.
+    """
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._term_ids: Dict[str, int] = {}
+        self._postings_docs: List[array] = []
+        self._postings_tfs: List[array] = []
+        self._doc_lengths = array("I")
+        self._alive = bytearray()
+        self._doc_keys: List[str] = []
+        self._doc_sources: List[str] = []
+        self._doc_contents: List[str] = []
+        self._key_to_doc: Optional[Dict[str, int]] = {}
+        self._total_length = 0
+        self._live_docs = 0
+        self._lock = threading.RLock()
+        self.built_at = time.monotonic()
+
+    def __len__(self) -> int:
+        return self._live_docs
+
+    def add_document(self, doc_key: str, source_id: str, content: str, terms: Optional[List[str]] = None) -> None:
+        """
+        Adds a chunk to the index. Re-adding an existing key replaces it.
+        Pass `terms` when the chunk's tokenize() output is already known (stored at ingestion).
+        """
+        if terms is None:
+            terms = tokenize(content)
+        frequencies: Dict[str, int] = {}
+        for term in terms:
+            frequencies[term] = frequencies.get(term, 0) + 1
+
+        with self._lock:
+            key_to_doc = self._key_index()
+            if doc_key in key_to_doc:
+                self.remove_document(doc_key)
+            if not isinstance(self._doc_lengths, array):
+                # Loaded from a snapshot: the lengths are a read-only view of the map.
+                self._doc_lengths = array("I", self._doc_lengths)
+
+            doc_id = len(self._doc_keys)
+            self._doc_keys.append(doc_key)
+            self._doc_sources.append(source_id)
+            self._doc_contents.append(content)
+            self._doc_lengths.append(len(terms))
+            self._alive.append(1)
+            key_to_doc[doc_key] = doc_id
+            self._total_length += len(terms)
+            self._live_docs += 1
+
+            for term, tf in frequencies.items():
+                term_id = self._term_ids.get(term)
+                if term_id is None:
+                    term_id = len(self._postings_docs)
+                    self._term_ids[term] = term_id
+                    self._postings_docs.append(array("I"))
+                    self._postings_tfs.append(array("I"))
+                docs, tfs = self._postings_docs[term_id], self._postings_tfs[term_id]
+                if not isinstance(docs, array):
+                    self._postings_docs[term_id] = docs = array("I", docs)
+                    self._postings_tfs[term_id] = tfs = array("I", tfs)
+                docs.append(doc_id)
+                tfs.append(tf)
+
+    def remove_document(self, doc_key: str) -> bool:
+        """
+        Tombstones a chunk so it no longer matches. Returns False if unknown.
+        """
+        with self._lock:
+            doc_id = self._key_index().pop(doc_key, None)
+            if doc_id is None or not self._alive[doc_id]:
+                return False
+            self._alive[doc_id] = 0
+            self._total_length -= self._doc_lengths[doc_id]
+            self._live_docs -= 1
+            self._doc_contents[doc_id] = ""
+            return True
+
+    def remove_source(self, source_id: str) -> int:
+        """
+        Tombstones every chunk of a knowledge source. Returns how many were removed.
+        """
+        with self._lock:
+            doc_keys = [
+                key for doc_id, key in enumerate(self._doc_keys)
+                if self._alive[doc_id] and self._doc_sources[doc_id] == source_id
+            ]
+            for key in doc_keys:
+                self.remove_document(key)
+            self.maybe_compact()
+            return len(doc_keys)
+
+    def dead_fraction(self) -> float:
+        """
+        Share of document ids that are tombstones.
+        """
+        total = len(self._doc_keys)
+        return (total - self._live_docs) / total if total else 0.0
+
+    def maybe_compact(self, threshold: float = COMPACT_DEAD_FRACTION) -> bool:
+        """
+        Compacts the index if more than `threshold` of its documents are
+        tombstones (0 compacts any). Returns whether it did.
+        """
+        with self._lock:
+            if self.dead_fraction() <= threshold:
+                return False
+            self.compact()
+            return True
+
+    def compact(self) -> None:
+        """
+        Rebuilds the postings and document arrays without tombstoned documents.
+        Live documents keep their relative order, so postings stay ascending.
+        """
+        with self._lock:
+            live = [doc_id for doc_id in range(len(self._doc_keys)) if self._alive[doc_id]]
+            new_ids = {doc_id: new_id for new_id, doc_id in enumerate(live)}
+            term_ids: Dict[str, int] = {}
+            postings_docs: List[array] = []
+            postings_tfs: List[array] = []
+            for term, term_id in self._term_ids.items():
+                docs, tfs = array("I"), array("I")
+                for doc_id, tf in zip(self._postings_docs[term_id], self._postings_tfs[term_id]):
+                    new_id = new_ids.get(doc_id)
+                    if new_id is not None:
+                        docs.append(new_id)
+                        tfs.append(tf)
+                if docs:
+                    term_ids[term] = len(postings_docs)
+                    postings_docs.append(docs)
+                    postings_tfs.append(tfs)
+
+            self._term_ids = term_ids
+            self._postings_docs = postings_docs
+            self._postings_tfs = postings_tfs
+            self._doc_keys = [self._doc_keys[doc_id] for doc_id in live]
+            self._doc_sources = [self._doc_sources[doc_id] for doc_id in live]
+            self._doc_contents = [self._doc_contents[doc_id] for doc_id in live]
+            self._doc_lengths = array("I", (self._doc_lengths[doc_id] for doc_id in live))
+            self._alive = bytearray(b"\x01") * len(live)
+            self._key_to_doc = {key: doc_id for doc_id, key in enumerate(self._doc_keys)}
+
+    def _key_index(self) -> Dict[str, int]:
+        # Snapshot loads leave this unset so searches never decode the keys.
+        if self._key_to_doc is None:
+            self._key_to_doc = {key: doc_id for doc_id, key in enumerate(self._doc_keys) if self._alive[doc_id]}
+        return self._key_to_doc
+
+    def search(self, query: str, limit: int = 10) -> List[Dict]:
+        """
+        Returns up to `limit` chunks ranked by BM25 score, highest first.
+        """
+        query_terms = set(tokenize(query))
+        if not query_terms or limit <= 0:
+            return []
+
+        with self._lock:
+            if not self._live_docs:
+                return []
+            total_docs = self._live_docs
+            avg_length = self._total_length / total_docs if total_docs else 0.0
+            k1, b = self.k1, self.b
+            scores: Dict[int, float] = {}
+
+            for term in query_terms:
+                term_id = self._term_ids.get(term)
+                if term_id is None:
+                    continue
+                docs = self._postings_docs[term_id]
+                tfs = self._postings_tfs[term_id]
+                doc_freq = len(docs)
+                idf = math.log(1.0 + (total_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+                for doc_id, tf in zip(docs, tfs):
+                    if not self._alive[doc_id]:
+                        continue
+                    norm = k1 * (1.0 - b + b * self._doc_lengths[doc_id] / avg_length) if avg_length else k1
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (k1 + 1.0) / (tf + norm)
+
+            top = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+            return [
+                {
+                    "id": self._doc_keys[doc_id],
+                    "source_id": self._doc_sources[doc_id],
+                    "content": self._doc_contents[doc_id],
+                    "score": score,
+                }
+                for doc_id, score in top
+            ]
+
+
+ChunkLoader = Callable[[], Iterable[Dict]]
+DeltaLoader = Callable[[str], Iterable[Dict]]
+Fingerprint = Callable[[], str]
+
+
+def parse_fingerprint(fingerprint: Optional[str]) -> Optional[Tuple[int, Optional[str]]]:
+    """
+    Returns (chunk count, latest created_at) of a "count:latest_created_at:checksum"
+    fingerprint (KnowledgeSupabaseRepo.get_agent_chunk_fingerprint), or None for
+    any other format.
+    """
+    if not fingerprint or fingerprint.count(":") < 2:
+        return None
+    count, rest = fingerprint.split(":", 1)
+    latest = rest.rsplit(":", 1)[0]
+    try:
+        return int(count), (latest if latest not in ("", "None") else None)
+    except ValueError:
+        return None
+
+
+class LexicalIndexRegistry:
+    """
+    Process-wide cache of per-agent BM25 indexes.
+
+    Indexes are built on first use from `loader` and revalidated once older
+    than `max_age` seconds, which also picks up chunks written by other workers.
+    When the caller passes a `fingerprint` (a cheap summary of the agent's
+    stored chunks) and the registry has a snapshot store, an unchanged
+    fingerprint keeps the current index, a matching snapshot is loaded instead
+    of calling `loader`, and every rebuild refreshes the snapshot.
+
+    With a `delta_loader(since)` as well, a changed fingerprint first loads
+    only the chunks created since the index's fingerprint was taken. If the
+    index then holds as many chunks as the new fingerprint counts, nothing was
+    removed behind its back and it is kept; otherwise it is rebuilt. A kept
+    index is compacted before its snapshot is refreshed, so snapshots never
+    carry the tombstones left by re-added chunks.
+    """
+    def __init__(self, max_age: float = 300.0, snapshots: Optional[SnapshotStore] = None):
+        self.max_age = max_age
+        self.snapshots = snapshots
+        self._indexes: Dict[str, BM25Index] = {}
+        self._fingerprints: Dict[str, str] = {}
+        self._build_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _build_lock(self, agent_key: str) -> threading.Lock:
+        with self._lock:
+            return self._build_locks.setdefault(agent_key, threading.Lock())
+
+    def get(self, agent_id, loader: ChunkLoader, fingerprint: Optional[Fingerprint] = None,
+            delta_loader: Optional[DeltaLoader] = None) -> BM25Index:
+        agent_key = str(agent_id)
+        index = self._indexes.get(agent_key)
+        if index is not None and time.monotonic() - index.built_at < self.max_age:
+            return index
+
+        with self._build_lock(agent_key):
+            index = self._indexes.get(agent_key)
+            if index is not None and time.monotonic() - index.built_at < self.max_age:
+                return index
+
+            current = fingerprint() if fingerprint else None
+            if current is not None:
+                if index is not None and self._fingerprints.get(agent_key) == current:
+                    index.built_at = time.monotonic()
+                    return index
+                if self.snapshots is not None:
+                    snapshot = self.snapshots.load(agent_key, current, BM25Index)
+                    if snapshot is not None:
+                        self._store(agent_key, snapshot, current)
+                        return snapshot
+                if index is not None and delta_loader is not None and \
+                        self._apply_delta(index, self._fingerprints.get(agent_key), current, delta_loader):
+                    index.built_at = time.monotonic()
+                    self._store(agent_key, index, current)
+                    if self.snapshots is not None:
+                        index.maybe_compact(threshold=0.0)
+                        self.snapshots.save(agent_key, index, current)
+                    else:
+                        index.maybe_compact()
+                    return index
+
+            index = BM25Index()
+            for row in loader():
+                index.add_document(str(row["id"]), str(row["source_id"]), row["content"], stored_terms(row))
+            self._store(agent_key, index, current)
+            if current is not None and self.snapshots is not None:
+                self.snapshots.save(agent_key, index, current)
+            return index
+
+    @staticmethod
+    def _apply_delta(index: BM25Index, previous: Optional[str], current: str, delta_loader: DeltaLoader) -> bool:
+        """
+        Adds the chunks created since `previous` was taken. Returns whether the
+        index now holds the `current` chunk count.
+        """
+        since, now = parse_fingerprint(previous), parse_fingerprint(current)
+        if since is None or now is None or since[1] is None:
+            return False
+        # Inclusive: rows committed late with the same created_at are re-added, not missed.
+        for row in delta_loader(since[1]):
+            index.add_document(str(row["id"]), str(row["source_id"]), row["content"], stored_terms(row))
+        return len(index) == now[0]
+
+    def _store(self, agent_key: str, index: BM25Index, fingerprint: Optional[str]) -> None:
+        self._indexes[agent_key] = index
+        if fingerprint is None:
+            self._fingerprints.pop(agent_key, None)
+        else:
+            self._fingerprints[agent_key] = fingerprint
+
+    def peek(self, agent_id) -> Optional[BM25Index]:
+        """
+        Returns the agent's index if this process already holds one, without building it.
+        """
+        return self._indexes.get(str(agent_id))
+
+    def add_chunk(self, agent_id, doc_key, source_id, content: str, terms: Optional[List[str]] = None) -> None:
+        """
+        Incrementally indexes a freshly stored chunk if this process holds the agent's index.
+        The index keeps its old fingerprint; the next revalidation's delta re-adds the chunk harmlessly.
+        """
+        index = self._indexes.get(str(agent_id))
+        if index is not None:
+            index.add_document(str(doc_key), str(source_id), content, terms)
+            index.maybe_compact()
+
+    def remove_source(self, agent_id, source_id) -> None:
+        """
+        Drops a deleted source's chunks from this process's index, if it holds one.
+        The next revalidation's chunk count check confirms the database agrees.
+        """
+        index = self._indexes.get(str(agent_id))
+        if index is not None:
+            index.remove_source(str(source_id))
+
+    def invalidate(self, agent_id) -> None:
+        agent_key = str(agent_id)
+        self._indexes.pop(agent_key, None)
+        self._fingerprints.pop(agent_key, None)
+        if self.snapshots is not None:
+            self.snapshots.delete(agent_key)
+
+
+# Must point at a volume that survives redeploys (a temp dir is wiped with the
+# container, so every new worker would rebuild from Supabase). Unset disables snapshots.
+KNOWLEDGE_SNAPSHOT_DIR = os.getenv("KNOWLEDGE_SNAPSHOT_DIR", "")
+if not KNOWLEDGE_SNAPSHOT_DIR:
+    logger.warning("KNOWLEDGE_SNAPSHOT_DIR is not set; lexical index snapshots are disabled")
+
+lexical_indexes = LexicalIndexRegistry(
+    max_age=float(os.getenv("LEXICAL_INDEX_MAX_AGE", "300")),
+    snapshots=SnapshotStore(KNOWLEDGE_SNAPSHOT_DIR, TOKENIZER_VERSION) if KNOWLEDGE_SNAPSHOT_DIR else None,
+)
@@ -0,0 +1,44 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from knowledge import retrieval_benchmark
+
+
+class Command(BaseCommand):
+    help = "Runs the offline retrieval benchmark (fixture corpus, deterministic embeddings) and prints a JSON report."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sources", type=int, default=20, help="Product catalog sources to generate.")
+        parser.add_argument("--products-per-source", type=int, default=25)
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--top-k", type=int, default=5)
+        parser.add_argument("--token-budget", type=int, default=None,
+                            help="Prompt token budget for retrieve_context (default: KNOWLEDGE_CONTEXT_TOKEN_BUDGET).")
+        parser.add_argument("--dims", type=int, default=128, help="Dimensions of the hashing embeddings.")
+        parser.add_argument("--seed", type=int, default=7)
+        parser.add_argument("--output", help="Also write the report to this file.")
+        parser.add_argument("--baseline", help="A previous report to compare against; changed metrics are printed.")
+
+    def handle(self, *args, **options):
+        report = retrieval_benchmark.run(
+            num_sources=options["sources"],
+            products_per_source=options["products_per_source"],
+            num_queries=options["queries"],
+            top_k=options["top_k"],
+            token_budget=options["token_budget"],
+            dims=options["dims"],
+            seed=options["seed"],
+        )
+        rendered = json.dumps(report, indent=2, sort_keys=True, ensure_ascii=False)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as output:
+                output.write(rendered + "\n")
+        self.stdout.write(rendered)
+
+        if options["baseline"]:
+            with open(options["baseline"], encoding="utf-8") as baseline:
+                changes = retrieval_benchmark.diff_reports(json.load(baseline), report)
+            for key, change in changes.items():
+                self.stdout.write(f"{key}: {change['baseline']} -> {change['current']} ({change['delta']:+})"
+                                  if change["delta"] is not None else f"{key}: {change['baseline']} -> {change['current']}")
@@ -0,0 +1,35 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from knowledge import job_queue
+from knowledge.worker import KB_WORKER_POLL_SECONDS, KnowledgeJobWorker
+
+
+class Command(BaseCommand):
+    help = "Runs a kb_jobs worker that processes queued knowledge ingestion and retrain jobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--worker-id", help="Identifier recorded in kb_jobs.locked_by (default: host:pid).")
+        parser.add_argument("--poll-interval", type=float, default=KB_WORKER_POLL_SECONDS)
+        parser.add_argument("--workspace-concurrency", type=int, default=job_queue.KB_JOB_WORKSPACE_CONCURRENCY,
+                            help="Maximum jobs processing at once per workspace, across all workers.")
+        parser.add_argument("--once", action="store_true", help="Exit once no runnable job is left.")
+
+    def handle(self, *args, **options):
+        worker = KnowledgeJobWorker(
+            worker_id=options["worker_id"],
+            poll_interval=options["poll_interval"],
+            workspace_concurrency=options["workspace_concurrency"],
+        )
+
+        def _shutdown(signum, frame):
+            self.stdout.write(f"Worker {worker.worker_id} stopping after the current job...")
+            worker.stop()
+
+        signal.signal(signal.SIGTERM, _shutdown)
+        signal.signal(signal.SIGINT, _shutdown)
+
+        self.stdout.write(f"Worker {worker.worker_id} started.")
+        processed = worker.run(once=options["once"])
+        self.stdout.write(self.style.SUCCESS(f"Worker {worker.worker_id} processed {processed} jobs."))
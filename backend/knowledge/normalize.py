@@ -0,0 +1,68 @@
+"""
+Arabic-aware text normalization for lexical search.
+
+Everything is folded into one translation table built at import time, so
+normalizing a query or a chunk is a single `str.translate` pass instead of a
+chain of regex substitutions:
+
+- Arabic diacritics (harakat, tanween, shadda, sukun, superscript alef) and
+  tatweel are removed.
+- Alef variants (أ إ آ ٱ) become ا, alef maqsura ى becomes ي, ta marbuta ة
+  becomes ه, and hamza carriers ؤ/ئ become و/ي. This covers the common
+  Egyptian spelling variation.
+- Arabic-Indic and Extended Arabic-Indic digits become ASCII digits.
+- Every other character that is not a letter, digit or underscore becomes a
+  space, so tokens can be split off with `str.split()` (same token boundaries
+  as `\\w+`).
+
+Bump knowledge.lexical.TOKENIZER_VERSION whenever the table changes: stored
+search tokens (agent_embeddings.search_tokens) and index snapshots are only
+reused when their version matches.
+"""
+
+_ARABIC_MARKS = list(range(0x064B, 0x0653)) + [0x0670, 0x0640]
+
+_LETTER_VARIANTS = {
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا",
+    "ى": "ي",
+    "ة": "ه",
+    "ؤ": "و", "ئ": "ي",
+}
+
+_DIGITS = {
+    **{0x0660 + i: str(i) for i in range(10)},  # ٠-٩
+    **{0x06F0 + i: str(i) for i in range(10)},  # ۰-۹
+}
+
+
+class _NormalizationTable(dict):
+    """
+    Translation table for `str.translate`. Code points not precomputed are
+    classified on first sight and cached, so the table only ever holds the
+    characters actually seen.
+    """
+    def __missing__(self, code: int):
+        char = chr(code)
+        value = code if char.isalnum() or char == "_" or char.isspace() else " "
+        self[code] = value
+        return value
+
+
+def _build_table() -> _NormalizationTable:
+    table = _NormalizationTable()
+    for code in range(0x0800):  # Latin, Greek, Cyrillic, Hebrew, Arabic up front
+        table[code]
+    table.update(dict.fromkeys(_ARABIC_MARKS))
+    table.update({ord(variant): base for variant, base in _LETTER_VARIANTS.items()})
+    table.update(_DIGITS)
+    return table
+
+
+NORMALIZATION_TABLE = _build_table()
+
+
+def normalize_text(text: str) -> str:
+    """
+    Returns the casefolded, normalized form of `text` used for lexical matching.
+    """
+    return text.translate(NORMALIZATION_TABLE).casefold() if text else ""
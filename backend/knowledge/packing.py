@@ -0,0 +1,177 @@
+"""
+Token-budgeted context packing for retrieved knowledge.
+
+Candidates from hybrid search are reordered with maximal marginal relevance
+(MMR): each pick maximizes `mmr_lambda * relevance - (1 - mmr_lambda) *
+similarity to what is already packed`, so near-identical chunks stop crowding
+out different ones. Picks are added until the token budget is used; a pick
+that does not fit whole is trimmed to its sentences that best match the query.
+
+Chunk-to-chunk similarity comes from the caller (cosine over the stored
+embeddings, see KnowledgeSupabaseRepo.get_embedding_similarities); pairs it
+does not cover fall back to term overlap.
+
+With hierarchical chunking, hits are first expanded to their parent sections
+(expand_to_parents): children are small enough to match precisely, parents
+give the model the surrounding context, and sibling hits collapse into one
+parent so its text is only packed once.
+
+Every item carries `source_ids`: its own source plus the sources whose
+duplicate chunks were not embedded but point at it (agent_chunk_refs, see
+attach_references), so citations still name every source holding the text.
+"""
+import math
+import re
+from typing import Dict, List, Optional, Tuple
+
+from knowledge.lexical import tokenize
+from knowledge.tokens import estimate_tokens
+
+MMR_LAMBDA = 0.7
+MIN_FRAGMENT_TOKENS = 24
+REDUNDANT_SIMILARITY = 0.95
+
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?؟…])\s+|\n+")
+
+SimilarityMap = Dict[Tuple[str, str], float]
+
+
+def pair_key(left_id, right_id) -> Tuple[str, str]:
+    left_id, right_id = str(left_id), str(right_id)
+    return (left_id, right_id) if left_id <= right_id else (right_id, left_id)
+
+
+def split_sentences(text: str) -> List[str]:
+    return [sentence.strip() for sentence in _SENTENCE_END_RE.split(text) if sentence.strip()]
+
+
+def _term_similarity(left: set, right: set) -> float:
+    if not left or not right:
+        return 0.0
+    return len(left & right) / math.sqrt(len(left) * len(right))
+
+
+def trim_to_budget(content: str, query_terms: set, budget_tokens: int) -> str:
+    """
+    Keeps the sentences of `content` that share the most terms with the query
+    and fit in `budget_tokens`, in their original order. Returns "" if nothing fits.
+    """
+    sentences = split_sentences(content)
+    costs = [estimate_tokens(sentence) for sentence in sentences]
+    ranked = sorted(
+        range(len(sentences)),
+        key=lambda i: (-len(query_terms & set(tokenize(sentences[i]))), i),
+    )
+    chosen = []
+    remaining = budget_tokens
+    for i in ranked:
+        if costs[i] <= remaining:
+            chosen.append(i)
+            remaining -= costs[i]
+    return " ".join(sentences[i] for i in sorted(chosen))
+
+
+def attach_references(candidates: List[Dict], references: Dict[str, List[str]]) -> List[Dict]:
+    """
+    Sets `source_ids` on each candidate: its own source first, then the sources
+    of duplicates stored as references to it ({embedding id: [source_id, ...]}).
+    """
+    for item in candidates:
+        source_ids = [str(item["source_id"])]
+        for source_id in references.get(str(item["id"]), []):
+            if str(source_id) not in source_ids:
+                source_ids.append(str(source_id))
+        item["source_ids"] = source_ids
+    return candidates
+
+
+def expand_to_parents(candidates: List[Dict], parents: Dict[str, Dict]) -> List[Dict]:
+    """
+    Replaces each score-ordered child hit by its parent section from `parents`
+    ({child id: {"id", "content", ...}}). Hits sharing a parent collapse into
+    one item at the best child's rank and score, with `children` counting them.
+    Hits without a parent are kept as they are.
+    """
+    expanded = []
+    by_parent: Dict[str, Dict] = {}
+    for item in candidates:
+        parent = parents.get(str(item["id"]))
+        if parent is None:
+            expanded.append(item)
+            continue
+        merged = by_parent.get(parent["id"])
+        if merged is not None:
+            merged["children"] += 1
+            for source_id in item.get("source_ids", ()):
+                if source_id not in merged["source_ids"]:
+                    merged["source_ids"].append(source_id)
+            continue
+        merged = {**item, "content": parent["content"], "parent_id": parent["id"], "children": 1,
+                  "source_ids": list(item.get("source_ids", [str(item["source_id"])]))}
+        by_parent[parent["id"]] = merged
+        expanded.append(merged)
+    return expanded
+
+
+def pack_context(
+    query: str,
+    candidates: List[Dict],
+    budget_tokens: int,
+    similarities: Optional[SimilarityMap] = None,
+    mmr_lambda: float = MMR_LAMBDA,
+    min_fragment_tokens: int = MIN_FRAGMENT_TOKENS,
+) -> Dict:
+    """
+    Selects and orders `candidates` (dicts with id, source_id, content, score)
+    to fit `budget_tokens`. Returns {"items", "tokens", "candidate_tokens"}
+    where each item also carries its token count and whether it was trimmed.
+    """
+    similarities = similarities or {}
+    candidate_tokens = [estimate_tokens(item["content"]) for item in candidates]
+    result = {"items": [], "tokens": 0, "candidate_tokens": sum(candidate_tokens)}
+    if not candidates or budget_tokens <= 0:
+        return result
+
+    top_score = max(item.get("score") or 0.0 for item in candidates) or 1.0
+    relevance = [(item.get("score") or 0.0) / top_score for item in candidates]
+    terms = [set(tokenize(item["content"])) for item in candidates]
+    query_terms = set(tokenize(query))
+
+    def similarity(i: int, j: int) -> float:
+        key = pair_key(candidates[i]["id"], candidates[j]["id"])
+        if key in similarities:
+            return similarities[key]
+        return _term_similarity(terms[i], terms[j])
+
+    remaining = budget_tokens
+    pending = list(range(len(candidates)))
+    max_similarity = [0.0] * len(candidates)  # to anything packed so far
+    while pending and remaining >= min_fragment_tokens:
+        pick = max(pending, key=lambda i: mmr_lambda * relevance[i] - (1 - mmr_lambda) * max_similarity[i])
+        pending.remove(pick)
+        if max_similarity[pick] >= REDUNDANT_SIMILARITY:
+            continue
+
+        content = candidates[pick]["content"]
+        tokens = candidate_tokens[pick]
+        trimmed = tokens > remaining
+        if trimmed:
+            content = trim_to_budget(content, query_terms, remaining)
+            tokens = estimate_tokens(content)
+            if not content or tokens < min_fragment_tokens:
+                continue
+
+        result["items"].append({
+            "id": candidates[pick]["id"],
+            "source_id": candidates[pick]["source_id"],
+            "source_ids": candidates[pick].get("source_ids", [str(candidates[pick]["source_id"])]),
+            "content": content,
+            "score": candidates[pick].get("score"),
+            "tokens": tokens,
+            "trimmed": trimmed,
+        })
+        result["tokens"] += tokens
+        remaining -= tokens
+        for i in pending:
+            max_similarity[i] = max(max_similarity[i], similarity(i, pick))
+    return result
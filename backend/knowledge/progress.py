@@ -0,0 +1,169 @@
+"""
+Live kb_jobs progress events for the SSE endpoint.
+
+The worker running a job publishes progress snapshots (sources processed,
+chunks seen/embedded, cache hits, ETA) to a broker; SSE connections subscribe
+to the job's channel. Brokers keep only the latest snapshot per job, so a slow
+or late subscriber always gets the current state rather than a backlog.
+
+- LocalProgressBroker: in-process, for a worker and web server sharing a
+  process (tests, `kb_worker --once` in development).
+- RedisProgressBroker: Redis pub/sub plus a short-lived "latest" key, so any
+  web process can stream a job running in any kb_worker.
+
+ProgressPublisher coalesces updates on the producer side: status and source
+changes are published immediately, chunk-level changes at most once per
+`interval`. A job therefore emits at most (duration / interval + sources + 2)
+events no matter how many chunks it embeds.
+"""
+import json
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = frozenset({"done", "failed"})
+
+
+class LocalProgressBroker:
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._latest: Dict[str, Dict] = {}
+        self._versions: Dict[str, int] = {}
+
+    def publish(self, job_id: str, event: Dict) -> None:
+        with self._condition:
+            self._latest[job_id] = event
+            self._versions[job_id] = self._versions.get(job_id, 0) + 1
+            self._condition.notify_all()
+
+    def latest(self, job_id: str) -> Optional[Dict]:
+        with self._condition:
+            return self._latest.get(job_id)
+
+    def subscribe(self, job_id: str, timeout: float) -> Iterator[Optional[Dict]]:
+        """
+        Yields each new snapshot for `job_id`, or None after `timeout` seconds
+        without one (so the caller can send keep-alives). Runs until closed.
+        """
+        with self._condition:
+            seen = self._versions.get(job_id, 0)
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._versions.get(job_id, 0) != seen, timeout=timeout)
+                version = self._versions.get(job_id, 0)
+                event = self._latest.get(job_id) if version != seen else None
+                seen = version
+            yield event
+
+
+class RedisProgressBroker:
+    """
+    Publishes to `kb_job_progress:<job_id>` and keeps the latest snapshot
+    under `kb_job_progress:<job_id>:latest` for `ttl` seconds.
+    """
+    def __init__(self, client, prefix: str = "kb_job_progress", ttl: int = 3600):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def publish(self, job_id: str, event: Dict) -> None:
+        payload = json.dumps(event)
+        try:
+            pipe = self.client.pipeline()
+            pipe.set(f"{self.prefix}:{job_id}:latest", payload, ex=self.ttl)
+            pipe.publish(f"{self.prefix}:{job_id}", payload)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Could not publish progress for kb_job {job_id}: {e}")
+
+    def latest(self, job_id: str) -> Optional[Dict]:
+        try:
+            payload = self.client.get(f"{self.prefix}:{job_id}:latest")
+        except Exception as e:
+            logger.warning(f"Could not read progress for kb_job {job_id}: {e}")
+            return None
+        return json.loads(payload) if payload else None
+
+    def subscribe(self, job_id: str, timeout: float) -> Iterator[Optional[Dict]]:
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(f"{self.prefix}:{job_id}")
+        try:
+            while True:
+                message = pubsub.get_message(timeout=timeout)
+                if message is None:
+                    yield None
+                    continue
+                # Skip to the newest snapshot if several queued up while we were sending.
+                while True:
+                    newer = pubsub.get_message(timeout=0)
+                    if newer is None:
+                        break
+                    message = newer
+                yield json.loads(message["data"])
+        finally:
+            pubsub.close()
+
+
+class ProgressPublisher:
+    """
+    Builds and coalesces progress snapshots for one job.
+    """
+    def __init__(self, job_id: str, broker, interval: float = 1.0, clock: Callable[[], float] = time.monotonic):
+        self.job_id = job_id
+        self.broker = broker
+        self.interval = interval
+        self._clock = clock
+        self._started = clock()
+        self._last_published: Optional[float] = None
+        self._last_key = None
+        self.published = 0
+
+    def snapshot(self, status: str, sources_processed: Optional[int], sources_total: Optional[int],
+                 chunks_seen: int, chunks_embedded: int, cache_hits: int, error: Optional[str] = None) -> Dict:
+        elapsed = self._clock() - self._started
+        eta = None
+        if status == "processing" and sources_total and sources_processed:
+            eta = round(elapsed * (sources_total - sources_processed) / sources_processed, 1)
+        elif status in TERMINAL_STATUSES:
+            eta = 0.0
+        event = {
+            "job_id": self.job_id,
+            "status": status,
+            "sources_processed": sources_processed,
+            "sources_total": sources_total,
+            "chunks_seen": chunks_seen,
+            "chunks_embedded": chunks_embedded,
+            "cache_hits": cache_hits,
+            "elapsed_seconds": round(elapsed, 1),
+            "eta_seconds": eta,
+        }
+        if error:
+            event["error"] = error
+        return event
+
+    def update(self, status: str, sources_processed: Optional[int] = None, sources_total: Optional[int] = None,
+               chunks_seen: int = 0, chunks_embedded: int = 0, cache_hits: int = 0,
+               error: Optional[str] = None, force: bool = False) -> bool:
+        """
+        Publishes a snapshot if it is due. Returns True if one was published.
+        """
+        now = self._clock()
+        key = (status, sources_processed, sources_total)
+        due = (
+            force
+            or key != self._last_key
+            or self._last_published is None
+            or now - self._last_published >= self.interval
+        )
+        if not due:
+            return False
+        self.broker.publish(self.job_id, self.snapshot(
+            status, sources_processed, sources_total, chunks_seen, chunks_embedded, cache_hits, error,
+        ))
+        self._last_key = key
+        self._last_published = now
+        self.published += 1
+        return True
@@ -0,0 +1,467 @@
+"""
+Offline end-to-end benchmark for knowledge retrieval.
+
+Unlike knowledge.benchmark (which compares fusion methods on synthetic
+vectors), this harness exercises the production path; both share the
+latency summary in knowledge.benchmark so their reports line up:
+
+1. A labeled fixture corpus (bilingual product catalogs plus a shipping
+   policy, with boilerplate shared across sources) is generated from a seed.
+2. It is ingested through HierarchicalChunker and index_chunks, with
+   deterministic feature-hashing embeddings and an in-memory stand-in for
+   KnowledgeSupabaseRepo, so chunking, dedup, parent storage and stored search
+   tokens all behave as in a real ingestion job.
+3. Labeled queries (English, Egyptian Arabic with spelling variants, and
+   Arabic-Indic digits) are replayed through HybridSearcher.hybrid_knowledge_search
+   and HybridSearcher.retrieve_context.
+
+A result counts as relevant when it contains the query's answer marker
+(a product code or governorate name), so the labels survive changes to chunk
+sizes, ids or the tokenizer.
+
+The report covers recall@k, MRR, p50/p95 latency, packed prompt tokens and
+index memory, serialized with sorted keys and fixed rounding so two runs can be
+diffed directly (or with `diff_reports`). Latencies exclude the network: the
+vector leg is a brute-force scan in this process, so compare them only
+between runs on the same machine.
+
+Usage (from backend/, needs Django settings because HybridSearcher does):
+    python manage.py kb_benchmark --output before.json
+    python manage.py kb_benchmark --output after.json --baseline before.json
+"""
+import asyncio
+import hashlib
+import math
+import os
+import random
+import statistics
+import time
+import tracemalloc
+import uuid
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from knowledge.benchmark import latency_summary, percentile
+from knowledge.chunking import HierarchicalChunker
+from knowledge.dedup import ChunkDeduplicator
+from knowledge.indexing import index_chunks, indexing_stats
+from knowledge.lexical import TOKENIZER_VERSION, lexical_indexes, tokenize
+from knowledge.normalize import normalize_text
+from knowledge.routing import KnowledgeRouter
+
+BENCHMARK_NAMESPACE = uuid.UUID("6f1c2d8e-3b7a-4c55-9a0e-2f4d7c1b9e10")
+BENCHMARK_EPOCH = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+PRODUCTS = [
+    ("hoodie", "هودي"), ("t-shirt", "تيشيرت"), ("jeans", "جينز"), ("sneakers", "كوتشي"),
+    ("jacket", "جاكت"), ("dress", "فستان"), ("abaya", "عباية"), ("backpack", "شنطة ضهر"),
+    ("scarf", "كوفية"), ("pajamas", "بيجامة"),
+]
+COLORS = [
+    ("black", "أسود"), ("white", "أبيض"), ("navy", "كحلي"), ("beige", "بيج"),
+    ("olive", "زيتي"), ("grey", "رمادي"), ("burgundy", "نبيتي"),
+]
+SIZES = ["S-XL", "M-XXL", "38-44", "one size", "XS-L"]
+
+# (English name, Arabic name, a common alternative Egyptian spelling)
+GOVERNORATES = [
+    ("Alexandria", "الإسكندرية", "الاسكندريه"), ("Giza", "الجيزة", "الجيزه"),
+    ("Asyut", "أسيوط", "اسيوط"), ("Ismailia", "الإسماعيلية", "الاسماعيليه"),
+    ("Dakahlia", "الدقهلية", "الدقهليه"), ("Sharqia", "الشرقية", "الشرقيه"),
+    ("Gharbia", "الغربية", "الغربيه"), ("Minya", "المنيا", "المنيا"),
+    ("Sohag", "سوهاج", "سوهاج"), ("Qena", "قنا", "قنا"), ("Luxor", "الأقصر", "الاقصر"),
+    ("Aswan", "أسوان", "اسوان"), ("Faiyum", "الفيوم", "الفيوم"),
+    ("Beni Suef", "بني سويف", "بنى سويف"), ("Port Said", "بورسعيد", "بورسعيد"),
+    ("Suez", "السويس", "السويس"), ("Damietta", "دمياط", "دمياط"),
+    ("Red Sea", "البحر الأحمر", "البحر الاحمر"), ("Matrouh", "مطروح", "مطروح"),
+    ("Monufia", "المنوفية", "المنوفيه"),
+]
+
+FILLER_SENTENCES = [
+    "Our team replies to messages within one business day.",
+    "All items are checked for quality before they are packed.",
+    "Follow our page for new collections every season.",
+    "Prices include VAT unless stated otherwise.",
+    "فريق خدمة العملاء متاح طول أيام الأسبوع ما عدا الجمعة.",
+    "كل المنتجات بتتراجع قبل الشحن عشان نضمن الجودة.",
+    "تابعونا عشان تعرفوا العروض الجديدة أول بأول.",
+    "الأسعار شاملة الضريبة إلا لو مكتوب غير كده.",
+]
+
+SHARED_BOILERPLATE = (
+    "Returns and exchanges are accepted within 14 days of delivery if the item is unused "
+    "and in its original packaging. الاسترجاع والاستبدال خلال ١٤ يوم من الاستلام بشرط إن "
+    "المنتج يكون بحالته وفي الكرتونة بتاعته."
+)
+
+
+def _arabic_digits(text: str) -> str:
+    return text.translate({ord(str(digit)): chr(0x0660 + digit) for digit in range(10)})
+
+
+def build_fixture_corpus(num_sources: int = 20, products_per_source: int = 25, num_queries: int = 200,
+                         seed: int = 7) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Returns (sources, queries). Each source is {"id", "text"}; each query is
+    {"text", "answer", "kind"} where `answer` appears in exactly one fact of the corpus.
+    """
+    rng = random.Random(seed)
+    sources: List[Dict] = []
+    facts: List[Dict] = []
+
+    shipping = []
+    for english, arabic, variant in GOVERNORATES:
+        low = rng.randint(1, 4)
+        fee = rng.choice([45, 55, 60, 70, 85])
+        shipping.append(
+            f"Shipping to {english} governorate takes {low}-{low + 2} business days and costs {fee} EGP. "
+            f"الشحن لمحافظة {arabic} بياخد من {low} ل{low + 2} أيام عمل ومصاريفه {fee} جنيه."
+        )
+        facts.append({"answer": english, "kind": "shipping", "english": english, "arabic": variant})
+    sources.append({"id": str(uuid.uuid5(BENCHMARK_NAMESPACE, "source-shipping")),
+                    "text": "\n\n".join(shipping + [SHARED_BOILERPLATE])})
+
+    for source_index in range(num_sources):
+        paragraphs = []
+        lines = []
+        for product_index in range(products_per_source):
+            item, item_ar = rng.choice(PRODUCTS)
+            color, color_ar = rng.choice(COLORS)
+            code = f"{item[:2].upper()}-{1000 + source_index * products_per_source + product_index}"
+            price = rng.randrange(150, 2500, 5)
+            sizes = rng.choice(SIZES)
+            lines.append(
+                f"The {color} {item} model {code} costs {price} EGP and comes in sizes {sizes}. "
+                f"سعر ال{item_ar} ال{color_ar} موديل {code} {price} جنيه ومتاح مقاسات {sizes}."
+            )
+            facts.append({"answer": code, "kind": "product", "english": f"{item} {code}", "arabic": f"{item_ar} موديل {code}"})
+            if len(lines) == 5:
+                paragraphs.append(" ".join(lines))
+                paragraphs.append(" ".join(rng.sample(FILLER_SENTENCES, 3)))
+                lines = []
+        if lines:
+            paragraphs.append(" ".join(lines))
+        paragraphs.append(SHARED_BOILERPLATE)
+        sources.append({"id": str(uuid.uuid5(BENCHMARK_NAMESPACE, f"source-{source_index}")),
+                        "text": "\n\n".join(paragraphs)})
+
+    queries = []
+    for fact in rng.sample(facts, min(num_queries, len(facts))):
+        language = rng.choice(["en", "ar", "ar_digits"])
+        if fact["kind"] == "shipping":
+            text = (f"how long does shipping to {fact['english']} take?" if language == "en"
+                    else f"الشحن ل{fact['arabic']} بياخد قد ايه؟")
+        else:
+            text = f"how much is the {fact['english']}?" if language == "en" else f"بكام ال{fact['arabic']}؟"
+        if language == "ar_digits":
+            text = _arabic_digits(text)
+        queries.append({"text": text, "answer": fact["answer"], "kind": f"{fact['kind']}_{language}"})
+    return sources, queries
+
+
+class HashingEmbeddingGenerator:
+    """
+    Deterministic stand-in for EmbeddingGenerator: normalized word and character
+    trigram features hashed into `dims` signed buckets and L2-normalized.
+    Texts sharing (normalized) words or word fragments get similar vectors,
+    which is enough to exercise the vector leg without a model call.
+    """
+    def __init__(self, dims: int = 128):
+        self.dims = dims
+        self._buckets: Dict[str, Tuple[int, float]] = {}
+
+    def _bucket(self, feature: str) -> Tuple[int, float]:
+        bucket = self._buckets.get(feature)
+        if bucket is None:
+            digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+            bucket = self._buckets[feature] = (digest % self.dims, 1.0 if digest >> 63 else -1.0)
+        return bucket
+
+    def generate_embedding(self, text: str, priority: Optional[str] = None) -> List[float]:
+        vector = [0.0] * self.dims
+        for term in tokenize(text):
+            index, sign = self._bucket(term)
+            vector[index] += sign
+            padded = f"#{term}#"
+            for start in range(len(padded) - 2):
+                index, sign = self._bucket(padded[start:start + 3])
+                vector[index] += 0.5 * sign
+        norm = math.sqrt(sum(v * v for v in vector))
+        return [v / norm for v in vector] if norm else []
+
+    def generate_embeddings_batch(self, texts: List[str], priority: Optional[str] = None) -> List[List[float]]:
+        return [self.generate_embedding(text) for text in texts]
+
+
+class InMemoryKnowledgeRepo:
+    """
+    The subset of KnowledgeSupabaseRepo used by index_chunks and HybridSearcher,
+    backed by dicts. Row ids and created_at stamps are derived from a counter
+    so runs are reproducible.
+    """
+    def __init__(self):
+        self.embeddings: Dict[str, Dict] = {}
+        self.parents: Dict[str, Dict] = {}
+        self.references: List[Dict] = []
+        self._next_id = 0
+
+    def _new_id(self) -> str:
+        self._next_id += 1
+        return str(uuid.uuid5(BENCHMARK_NAMESPACE, f"row-{self._next_id}"))
+
+    def _created_at(self) -> str:
+        return (BENCHMARK_EPOCH + timedelta(seconds=self._next_id)).isoformat()
+
+    def store_embeddings_batch(self, rows: List[Dict]) -> List[str]:
+        ids = []
+        for row in rows:
+            row_id = self._new_id()
+            self.embeddings[row_id] = {**row, "id": row_id, "agent_id": str(row["agent_id"]),
+                                       "source_id": str(row["source_id"]), "created_at": self._created_at()}
+            ids.append(row_id)
+        return ids
+
+    def store_parent_chunks_batch(self, rows: List[Dict]) -> List[str]:
+        ids = []
+        for row in rows:
+            row_id = self._new_id()
+            self.parents[row_id] = {"id": row_id, "content": row["content"], "token_count": row["token_count"]}
+            ids.append(row_id)
+        return ids
+
+    def store_chunk_references_batch(self, rows: List[Dict]):
+        self.references.extend(rows)
+
+    def get_chunk_references(self, embedding_ids: List[str]) -> Dict[str, List[str]]:
+        wanted = {str(embedding_id) for embedding_id in embedding_ids}
+        references: Dict[str, List[str]] = {}
+        for row in self.references:
+            if row["embedding_id"] in wanted and row["source_id"] not in references.get(row["embedding_id"], []):
+                references.setdefault(row["embedding_id"], []).append(row["source_id"])
+        return references
+
+    def iter_agent_chunks(self, agent_id, page_size: int = 1000, created_since: Optional[str] = None) -> Iterator[Dict]:
+        for row in self.embeddings.values():
+            if row["agent_id"] == str(agent_id) and (not created_since or row["created_at"] >= created_since):
+                yield row
+
+    def get_agent_chunk_fingerprint(self, agent_id) -> str:
+        """
+        Same "count:latest_created_at:checksum" format as the agent_chunk_fingerprint RPC.
+        """
+        rows = list(self.iter_agent_chunks(agent_id))
+        latest = max((row["created_at"] for row in rows), default=None)
+        checksum = sum(zlib.crc32(row["id"].encode("utf-8")) for row in rows)
+        return f"{len(rows)}:{latest}:{checksum}"
+
+    def vector_search_agent_embeddings(self, query_embedding: List[float], agent_id, workspace_id,
+                                       match_count: int = 8, similarity_threshold: float = 0.7) -> List[Dict]:
+        scored = []
+        for row in self.iter_agent_chunks(agent_id):
+            similarity = sum(a * b for a, b in zip(row["embedding"], query_embedding))
+            if similarity >= similarity_threshold:
+                scored.append({"id": row["id"], "source_id": row["source_id"], "content": row["content"],
+                               "similarity": similarity})
+        scored.sort(key=lambda item: item["similarity"], reverse=True)
+        return scored[:match_count]
+
+    def get_parent_chunks(self, embedding_ids: List[str]) -> Dict[str, Dict]:
+        return {
+            embedding_id: self.parents[self.embeddings[embedding_id]["parent_id"]]
+            for embedding_id in map(str, embedding_ids)
+            if self.embeddings.get(embedding_id, {}).get("parent_id") in self.parents
+        }
+
+    def get_embedding_similarities(self, agent_id, embedding_ids: List[str]) -> Dict[tuple, float]:
+        ids = sorted(str(embedding_id) for embedding_id in embedding_ids if str(embedding_id) in self.embeddings)
+        return {
+            (left, right): sum(a * b for a, b in zip(self.embeddings[left]["embedding"], self.embeddings[right]["embedding"]))
+            for position, left in enumerate(ids)
+            for right in ids[position + 1:]
+        }
+
+
+def ingest(sources: List[Dict], agent_id, knowledge_repo, embedding_generator, chunker=None) -> Dict:
+    """
+    Runs every source through the same chunk -> dedup -> embed -> store path as a retrain job.
+    """
+    chunker = chunker or HierarchicalChunker()
+    deduplicator = ChunkDeduplicator()
+    router = KnowledgeRouter()
+    chunks = embedded = 0
+    for source in sources:
+        seen, stored, _ = index_chunks(
+            chunker.iter_chunks(source["text"], source_id=source["id"]),
+            agent_id=agent_id,
+            source_id=source["id"],
+            source_type="file",
+            knowledge_repo=knowledge_repo,
+            embedding_generator=embedding_generator,
+            router=router,
+            deduplicator=deduplicator,
+        )
+        chunks += seen
+        embedded += stored
+    return indexing_stats(chunks, embedded, deduplicator.duplicates)
+
+
+def is_relevant(content: str, answer: str) -> bool:
+    return normalize_text(answer) in normalize_text(content)
+
+
+def first_relevant_rank(results: Sequence[Dict], answer: str) -> Optional[int]:
+    """
+    1-based rank of the first result containing `answer`, or None.
+    """
+    for rank, item in enumerate(results, start=1):
+        if is_relevant(item["content"], answer):
+            return rank
+    return None
+
+
+def ranking_metrics(ranks: Sequence[Optional[int]], top_k: int) -> Dict:
+    if not ranks:
+        return {f"recall@{top_k}": 0.0, "mrr": 0.0, "queries": 0}
+    return {
+        f"recall@{top_k}": round(sum(1 for rank in ranks if rank is not None and rank <= top_k) / len(ranks), 4),
+        "mrr": round(sum(1.0 / rank for rank in ranks if rank is not None and rank <= top_k) / len(ranks), 4),
+        "queries": len(ranks),
+    }
+
+
+def _measure_index(agent_id, knowledge_repo, embedding_dims: int) -> Dict:
+    """
+    Builds the agent's lexical index the way the first search would and measures what it holds.
+    """
+    lexical_indexes.invalidate(agent_id)
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    index = lexical_indexes.get(
+        agent_id,
+        lambda: knowledge_repo.iter_agent_chunks(agent_id),
+        fingerprint=lambda: knowledge_repo.get_agent_chunk_fingerprint(agent_id),
+        delta_loader=lambda since: knowledge_repo.iter_agent_chunks(agent_id, created_since=since),
+    )
+    lexical_bytes = tracemalloc.get_traced_memory()[0] - before
+    if not tracing:
+        tracemalloc.stop()
+
+    snapshot_bytes = 0
+    if lexical_indexes.snapshots is not None:
+        path = lexical_indexes.snapshots.path(str(agent_id))
+        snapshot_bytes = os.path.getsize(path) if os.path.exists(path) else 0
+    chunk_count = len(index)
+    return {
+        "chunks": chunk_count,
+        "lexical_terms": len(index._term_ids),
+        "lexical_bytes": lexical_bytes,
+        "snapshot_bytes": snapshot_bytes,
+        "vector_bytes": chunk_count * embedding_dims * 4,  # float4 per dimension in pgvector
+    }
+
+
+async def _replay(searcher, queries: List[Dict], agent_id, workspace_id, top_k: int, token_budget: int) -> Dict:
+    search_ranks: Dict[str, List[Optional[int]]] = {}
+    search_latencies: List[float] = []
+    context_latencies: List[float] = []
+    prompt_tokens: List[int] = []
+    candidate_tokens: List[int] = []
+    context_hits = 0
+
+    for query in queries:
+        started = time.perf_counter()
+        results = await searcher.hybrid_knowledge_search(query["text"], agent_id, workspace_id, top_k=top_k)
+        search_latencies.append((time.perf_counter() - started) * 1000)
+        search_ranks.setdefault(query["kind"], []).append(first_relevant_rank(results, query["answer"]))
+
+        started = time.perf_counter()
+        packed = await searcher.retrieve_context(query["text"], agent_id, workspace_id, token_budget=token_budget)
+        context_latencies.append((time.perf_counter() - started) * 1000)
+        prompt_tokens.append(packed["tokens"])
+        candidate_tokens.append(packed["candidate_tokens"])
+        if first_relevant_rank(packed["items"], query["answer"]) is not None:
+            context_hits += 1
+
+    all_ranks = [rank for ranks in search_ranks.values() for rank in ranks]
+    return {
+        "search": {
+            **ranking_metrics(all_ranks, top_k),
+            **latency_summary(search_latencies),
+            "by_kind": {kind: ranking_metrics(ranks, top_k) for kind, ranks in search_ranks.items()},
+        },
+        "context": {
+            "recall": round(context_hits / len(queries), 4) if queries else 0.0,
+            "token_budget": token_budget,
+            "prompt_tokens_mean": round(statistics.mean(prompt_tokens), 1) if prompt_tokens else 0.0,
+            "prompt_tokens_p50": statistics.median(prompt_tokens) if prompt_tokens else 0,
+            "prompt_tokens_p95": percentile(prompt_tokens, 95),
+            "candidate_tokens_mean": round(statistics.mean(candidate_tokens), 1) if candidate_tokens else 0.0,
+            **latency_summary(context_latencies),
+        },
+    }
+
+
+def run(num_sources: int = 20, products_per_source: int = 25, num_queries: int = 200, top_k: int = 5,
+        token_budget: Optional[int] = None, dims: int = 128, seed: int = 7, chunker=None) -> Dict:
+    """
+    Builds and ingests the fixture corpus, replays its queries and returns the report.
+    """
+    from knowledge.search import KNOWLEDGE_CONTEXT_TOKEN_BUDGET, HybridSearcher
+
+    chunker = chunker or HierarchicalChunker()
+    token_budget = token_budget or KNOWLEDGE_CONTEXT_TOKEN_BUDGET
+    agent_id = uuid.uuid5(BENCHMARK_NAMESPACE, f"agent-{seed}")
+    workspace_id = uuid.uuid5(BENCHMARK_NAMESPACE, f"workspace-{seed}")
+    sources, queries = build_fixture_corpus(num_sources, products_per_source, num_queries, seed)
+
+    knowledge_repo = InMemoryKnowledgeRepo()
+    embedding_generator = HashingEmbeddingGenerator(dims)
+    lexical_indexes.invalidate(agent_id)
+    try:
+        started = time.perf_counter()
+        ingestion = ingest(sources, agent_id, knowledge_repo, embedding_generator, chunker)
+        ingestion["parents"] = len(knowledge_repo.parents)
+        ingestion["seconds"] = round(time.perf_counter() - started, 3)
+
+        index = _measure_index(agent_id, knowledge_repo, dims)
+        searcher = HybridSearcher(user_jwt="", knowledge_repo=knowledge_repo, embedding_generator=embedding_generator)
+        results = asyncio.run(_replay(searcher, queries, agent_id, workspace_id, top_k, token_budget))
+    finally:
+        lexical_indexes.invalidate(agent_id)  # also removes the benchmark agent's snapshot
+
+    return {
+        "config": {
+            "sources": len(sources),
+            "products_per_source": products_per_source,
+            "queries": len(queries),
+            "seed": seed,
+            "top_k": top_k,
+            "embedding_dims": dims,
+            "parent_tokens": chunker.parents.max_tokens,
+            "child_tokens": chunker.children.max_tokens,
+            "tokenizer_version": TOKENIZER_VERSION,
+        },
+        "ingestion": ingestion,
+        "index": index,
+        **results,
+    }
+
+
+def diff_reports(baseline: Dict, current: Dict, prefix: str = "") -> Dict[str, Dict]:
+    """
+    Returns {"dotted.key": {"baseline", "current", "delta"}} for every numeric
+    value that differs between two reports.
+    """
+    changes = {}
+    for key in sorted(set(baseline) | set(current)):
+        path = f"{prefix}{key}"
+        before, after = baseline.get(key), current.get(key)
+        if isinstance(before, dict) or isinstance(after, dict):
+            changes.update(diff_reports(before or {}, after or {}, f"{path}."))
+        elif before != after and all(isinstance(value, (int, float, type(None))) for value in (before, after)):
+            delta = round(after - before, 4) if before is not None and after is not None else None
+            changes[path] = {"baseline": before, "current": after, "delta": delta}
+    return changes
@@ -1,5 +1,5 @@
 import uuid
-from typing import Dict, Literal
+from typing import Dict, List, Literal
 
 class KnowledgeRouter:
     """
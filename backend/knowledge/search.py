@@ -1,85 +1,179 @@
+import asyncio
+import os
 import uuid
 import logging
 from typing import List, Dict, Any, Optional
 
 from knowledge.supabase_repo import KnowledgeSupabaseRepo
 from knowledge.embedding import EmbeddingGenerator
+from knowledge.lexical import lexical_indexes
+from knowledge.fusion import fuse, candidate_pool_size
+from knowledge.packing import attach_references, expand_to_parents, pack_context
+from knowledge.cutoff import KNOWLEDGE_MAX_K, KNOWLEDGE_MIN_SIMILARITY, adaptive_cutoff
+from core.metrics import inc_counter, record_value
 from knowledge.chunking import TextChunker # Potentially needed for query chunking if query is long
 from agents.supabase_repo import SupabaseRepo as AgentSupabaseRepo # To get agent details if needed for model
 from django.conf import settings # For constants or settings like embedding model
 
 logger = logging.getLogger(__name__)
 
+# Fusion strategy for hybrid search: "rrf" (reciprocal-rank fusion) or "weighted" (normalized scores)
+KNOWLEDGE_FUSION_METHOD = os.getenv("KNOWLEDGE_FUSION_METHOD", "rrf")
+KNOWLEDGE_RRF_K = int(os.getenv("KNOWLEDGE_RRF_K", "60"))
+
+# Default context token budget when the agent's rules do not set `context_token_budget`.
+KNOWLEDGE_CONTEXT_TOKEN_BUDGET = int(os.getenv("KNOWLEDGE_CONTEXT_TOKEN_BUDGET", "1200"))
+KNOWLEDGE_SMALL_TO_BIG = os.getenv("KNOWLEDGE_SMALL_TO_BIG", "true").lower() == "true"
+
 class HybridSearcher:
-    def __init__(self, user_jwt: str):
-        self.knowledge_repo = KnowledgeSupabaseRepo(user_jwt)
-        self.embedding_generator = EmbeddingGenerator()
+    def __init__(self, user_jwt: str, knowledge_repo=None, embedding_generator=None):
+        # Collaborators can be injected for offline runs (see knowledge.retrieval_benchmark).
+        self.knowledge_repo = knowledge_repo or KnowledgeSupabaseRepo(user_jwt)
+        self.embedding_generator = embedding_generator or EmbeddingGenerator()
         # self.agent_repo = AgentSupabaseRepo(user_jwt) # Uncomment if agent data is needed here
 
+    def _keyword_search(self, query: str, agent_id: uuid.UUID, top_k: int) -> List[Dict[str, Any]]:
+        """
+        Lexical leg: BM25 over the agent's in-process inverted index, loaded
+        from its on-disk snapshot or built from agent_embeddings on first use
+        and brought up to date with the chunks stored since.
+        """
+        lexical_index = lexical_indexes.get(
+            agent_id,
+            lambda: self.knowledge_repo.iter_agent_chunks(agent_id),
+            fingerprint=lambda: self.knowledge_repo.get_agent_chunk_fingerprint(agent_id),
+            delta_loader=lambda since: self.knowledge_repo.iter_agent_chunks(agent_id, created_since=since),
+        )
+        return lexical_index.search(query, limit=candidate_pool_size(top_k, len(lexical_index)))
+
+    def _vector_search(self, query: str, agent_id: uuid.UUID, workspace_id: uuid.UUID, match_count: int, similarity_threshold: float) -> List[Dict[str, Any]]:
+        """
+        Vector leg: embeds the query and runs the pgvector similarity RPC.
+        """
+        query_embedding = self.embedding_generator.generate_embedding(query)
+        if not query_embedding:
+            logger.warning("Could not generate embedding for query. Skipping vector search.")
+            return []
+        matches = self.knowledge_repo.vector_search_agent_embeddings(
+            query_embedding=query_embedding,
+            agent_id=agent_id,
+            workspace_id=workspace_id,
+            match_count=match_count,
+            similarity_threshold=similarity_threshold
+        )
+        return [{**match, "score": match["similarity"]} for match in matches]
+
     async def hybrid_knowledge_search(
         self,
         query: str,
         agent_id: uuid.UUID,
         workspace_id: uuid.UUID, # Need workspace_id for RLS and context
         top_k: int = 8,
-        keyword_weight: float = 0.3, # Weight for keyword match score
-        vector_weight: float = 0.7, # Weight for vector similarity score
-        similarity_threshold: float = 0.7 # Minimum similarity for vector results
+        keyword_weight: float = 0.3, # Weight of the lexical leg in fusion
+        vector_weight: float = 0.7, # Weight of the vector leg in fusion
+        similarity_threshold: Optional[float] = None, # Minimum similarity for vector results; defaults to KNOWLEDGE_MIN_SIMILARITY
+        fusion_method: Optional[str] = None, # "rrf" or "weighted"; defaults to KNOWLEDGE_FUSION_METHOD
+        rrf_k: Optional[int] = None,
     ) -> List[Dict[str, Any]]:
         """
         Performs a hybrid search combining keyword and vector similarity.
+        The lexical and vector legs run concurrently and are merged with rank fusion.
         Returns a list of relevant knowledge chunks with their source IDs and content.
         """
-        results: Dict[str, Dict[str, Any]] = {} # Use dict to deduplicate and store best score
+        # Size the vector pool from the agent's corpus if its lexical index is
+        # already loaded; otherwise fall back to the default pool.
+        corpus_size = len(lexical_indexes.peek(agent_id) or ())
+        match_count = candidate_pool_size(top_k, corpus_size)
 
-        # 1. Keyword Search (ILIKE)
-        # Using ILIKE for case-insensitive substring search.
-        # This is a simple keyword search. For full-text search, a more advanced
-        # solution like Supabase's full-text search (tsvector) would be used.
-        keyword_matches = self.knowledge_repo.keyword_search_agent_embeddings(
+        # 1. Run both legs concurrently; the vector leg is dominated by the
+        # embedding call and the RPC round trip, so the lexical leg comes for free.
+        keyword_matches, vector_matches = await asyncio.gather(
+            asyncio.to_thread(self._keyword_search, query, agent_id, top_k),
+            asyncio.to_thread(
+                self._vector_search, query, agent_id, workspace_id, match_count,
+                KNOWLEDGE_MIN_SIMILARITY if similarity_threshold is None else similarity_threshold,
+            ),
+        )
+
+        # 2. Fuse and rank
+        fused = fuse(
+            [keyword_matches, vector_matches],
+            weights=[keyword_weight, vector_weight],
+            method=fusion_method or KNOWLEDGE_FUSION_METHOD,
+            rrf_k=rrf_k or KNOWLEDGE_RRF_K,
+        )
+
+        return [
+            {
+                "id": item["id"],
+                "source_id": item["source_id"],
+                "content": item["content"],
+                "score": item["score"],
+                "similarity": item.get("similarity"), # None for lexical-only hits
+            }
+            for item in fused[:top_k]
+        ]
+
+    async def retrieve_context(
+        self,
+        query: str,
+        agent_id: uuid.UUID,
+        workspace_id: uuid.UUID,
+        token_budget: Optional[int] = None,
+        max_k: int = KNOWLEDGE_MAX_K,
+    ) -> Dict[str, Any]:
+        """
+        Runs hybrid search, keeps an adaptive number of chunks (at most `max_k`,
+        see knowledge.cutoff), adds the sources of their deduplicated copies,
+        expands them to their parent sections (small-to-big) and packs them
+        into `token_budget` tokens with MMR (see knowledge.packing).
+        Returns {"items", "tokens", "candidate_tokens", "retrieval"} where
+        "retrieval" is the score profile behind the chosen k.
+        """
+        retrieved = await self.hybrid_knowledge_search(
             query=query,
             agent_id=agent_id,
             workspace_id=workspace_id,
-            limit=top_k * 2 # Fetch more to allow for ranking
+            top_k=max_k,
         )
-        for match in keyword_matches:
-            match_id = str(match["id"])
-            results[match_id] = {
-                "id": match["id"],
-                "source_id": match["source_id"],
-                "content": match["content"],
-                "score": keyword_weight * 0.9 # Assign a base score for keyword matches
-            }
+        retrieved, profile = adaptive_cutoff(retrieved, max_k=max_k)
+        inc_counter('retrieval_k', {'k': profile["k"], 'reason': profile["reason"]})
+        if profile["top_similarity"] is not None:
+            record_value('retrieval_top_similarity', None, profile["top_similarity"])
+        record_value('retrieval_score_gap', None, profile["gap"])
 
-        # 2. Vector Similarity Search
-        query_embedding = self.embedding_generator.generate_embedding(query)
-        if query_embedding:
-            vector_matches = self.knowledge_repo.vector_search_agent_embeddings(
-                query_embedding=query_embedding,
-                agent_id=agent_id,
-                workspace_id=workspace_id,
-                match_count=top_k * 2, # Fetch more to allow for ranking
-                similarity_threshold=similarity_threshold
-            )
-            for match in vector_matches:
-                match_id = str(match["id"])
-                current_score = results.get(match_id, {}).get("score", 0)
-                # Combine scores if already present, or add new
-                results[match_id] = {
-                    "id": match["id"],
-                    "source_id": match["source_id"],
-                    "content": match["content"],
-                    "score": current_score + vector_weight * match["similarity"]
-                }
-        else:
-            logger.warning("Could not generate embedding for query. Skipping vector search.")
+        references = {}
+        if retrieved:
+            try:
+                references = await asyncio.to_thread(
+                    self.knowledge_repo.get_chunk_references,
+                    [item["id"] for item in retrieved],
+                )
+            except Exception as e:
+                logger.warning(f"Chunk references unavailable for agent {agent_id}, citing stored sources only: {e}")
+        retrieved = attach_references(retrieved, references)
 
-        # 3. Merge and Rank Results
-        # Convert dict values to list, sort by combined score, and take top_k
-        final_results = sorted(
-            results.values(),
-            key=lambda x: x["score"],
-            reverse=True
-        )[:top_k]
+        if KNOWLEDGE_SMALL_TO_BIG and retrieved:
+            try:
+                parents = await asyncio.to_thread(
+                    self.knowledge_repo.get_parent_chunks,
+                    [item["id"] for item in retrieved],
+                )
+                retrieved = expand_to_parents(retrieved, parents)
+            except Exception as e:
+                logger.warning(f"Parent sections unavailable for agent {agent_id}, packing child chunks: {e}")
 
-        return final_results
+        similarities = {}
+        if len(retrieved) > 1:
+            try:
+                similarities = await asyncio.to_thread(
+                    self.knowledge_repo.get_embedding_similarities,
+                    agent_id,
+                    [item["id"] for item in retrieved],
+                )
+            except Exception as e:
+                # Packing still works on term overlap; don't fail the turn over diversification.
+                logger.warning(f"Embedding similarities unavailable for agent {agent_id}, using term overlap: {e}")
+        packed = pack_context(query, retrieved, token_budget or KNOWLEDGE_CONTEXT_TOKEN_BUDGET, similarities)
+        packed["retrieval"] = profile
+        return packed
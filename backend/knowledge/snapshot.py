@@ -0,0 +1,334 @@
+"""
+On-disk snapshots of per-agent lexical indexes for warm starts.
+
+A snapshot is a single file: a fixed preamble, a JSON header and a series of
+8-byte aligned binary sections. Integer sections are raw native-endian arrays,
+string sections are one UTF-8 blob plus an offsets array, so loading never
+parses or re-tokenizes text:
+
+    b"TKIX" | u16 format version | u16 reserved | u32 header length | header JSON | sections
+
+The header records the format version, the tokenizer version, the byte order
+and the data fingerprint the index was built from; any mismatch makes the
+loader return None and the caller rebuilds from Supabase. Loading copies
+nothing but the tombstone bytes: postings, document lengths and string offsets
+are memoryviews over the map, terms are stored sorted and binary-searched in
+place, and keys, sources and contents are decoded only when read.
+
+This module only knows the index's storage layout; see knowledge.lexical for
+how snapshots are written and loaded.
+"""
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from typing import Callable, Dict, Iterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT_VERSION = 2
+SNAPSHOT_MAGIC = b"TKIX"
+_PREAMBLE = struct.Struct("<4sHHI")
+_ALIGN = 8
+
+
+class MappedStrings:
+    """
+    List-like view of UTF-8 strings stored in a memory map. Supports the
+    operations BM25Index needs: indexing, iteration, overwriting (tombstones)
+    and appending.
+    """
+    def __init__(self, data: mmap.mmap, blob_offset: int, offsets: memoryview):
+        self._data = data
+        self._blob_offset = blob_offset
+        self._offsets = offsets
+        self._base = len(offsets) - 1
+        self._overrides: Dict[int, str] = {}
+        self._appended: List[str] = []
+
+    def __len__(self) -> int:
+        return self._base + len(self._appended)
+
+    def __getitem__(self, index: int) -> str:
+        if index >= self._base:
+            return self._appended[index - self._base]
+        if index in self._overrides:
+            return self._overrides[index]
+        start = self._blob_offset + self._offsets[index]
+        end = self._blob_offset + self._offsets[index + 1]
+        return self._data[start:end].decode("utf-8")
+
+    def __setitem__(self, index: int, value: str):
+        if index >= self._base:
+            self._appended[index - self._base] = value
+        else:
+            self._overrides[index] = value
+
+    def __iter__(self) -> Iterator[str]:
+        for index in range(len(self)):
+            yield self[index]
+
+    def append(self, value: str):
+        self._appended.append(value)
+
+
+class MappedTermIds:
+    """
+    Dict-like term -> term id lookup over the sorted term section of a memory
+    map. A lookup binary-searches the UTF-8 bytes (whose order matches str
+    order), so no term is decoded until the index is written again; terms
+    added after loading are kept in a small dict.
+    """
+    def __init__(self, data: mmap.mmap, blob_offset: int, offsets: memoryview, term_ids: memoryview):
+        self._data = data
+        self._blob_offset = blob_offset
+        self._offsets = offsets
+        self._ids = term_ids
+        self._added: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._ids) + len(self._added)
+
+    def _term_bytes(self, position: int) -> bytes:
+        start = self._blob_offset + self._offsets[position]
+        return self._data[start:self._blob_offset + self._offsets[position + 1]]
+
+    def get(self, term: str, default=None):
+        if term in self._added:
+            return self._added[term]
+        encoded = term.encode("utf-8")
+        low, high = 0, len(self._ids)
+        while low < high:
+            middle = (low + high) // 2
+            if self._term_bytes(middle) < encoded:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self._ids) and self._term_bytes(low) == encoded:
+            return self._ids[low]
+        return default
+
+    def __setitem__(self, term: str, term_id: int):
+        self._added[term] = term_id
+
+    def items(self) -> Iterator[Tuple[str, int]]:
+        for position in range(len(self._ids)):
+            yield self._term_bytes(position).decode("utf-8"), self._ids[position]
+        yield from self._added.items()
+
+
+class MappedPostings:
+    """
+    List-like view of per-term postings slices over one memory-mapped `I`
+    section. Each item is a zero-copy memoryview; BM25Index replaces it with
+    an `array('I')` the first time it appends to that term.
+    """
+    def __init__(self, values: memoryview, offsets: memoryview):
+        self._values = values
+        self._offsets = offsets
+        self._base = len(offsets) - 1
+        self._overrides: Dict[int, array] = {}
+        self._appended: List[array] = []
+
+    def __len__(self) -> int:
+        return self._base + len(self._appended)
+
+    def __getitem__(self, index: int):
+        if index >= self._base:
+            return self._appended[index - self._base]
+        if index in self._overrides:
+            return self._overrides[index]
+        return self._values[self._offsets[index]:self._offsets[index + 1]]
+
+    def __setitem__(self, index: int, value: array):
+        if index >= self._base:
+            self._appended[index - self._base] = value
+        else:
+            self._overrides[index] = value
+
+    def __iter__(self) -> Iterator:
+        for index in range(len(self)):
+            yield self[index]
+
+    def append(self, value: array):
+        self._appended.append(value)
+
+
+def _encode_strings(values) -> Tuple[bytes, array]:
+    offsets = array("Q", [0])
+    parts = []
+    total = 0
+    for value in values:
+        encoded = value.encode("utf-8")
+        parts.append(encoded)
+        total += len(encoded)
+        offsets.append(total)
+    return b"".join(parts), offsets
+
+
+def write_snapshot(path: str, index, fingerprint: str, tokenizer_version: int) -> None:
+    """
+    Atomically writes `index` (a knowledge.lexical.BM25Index) to `path`.
+    """
+    with index._lock:
+        terms = sorted(index._term_ids.items())
+        posting_offsets = array("Q", [0])
+        posting_docs = array("I")
+        posting_tfs = array("I")
+        for docs, tfs in zip(index._postings_docs, index._postings_tfs):
+            posting_docs.extend(docs)
+            posting_tfs.extend(tfs)
+            posting_offsets.append(len(posting_docs))
+        term_blob, term_offsets = _encode_strings(term for term, _ in terms)
+        term_ids = array("I", (term_id for _, term_id in terms))
+        key_blob, key_offsets = _encode_strings(index._doc_keys)
+        source_blob, source_offsets = _encode_strings(index._doc_sources)
+        content_blob, content_offsets = _encode_strings(index._doc_contents[i] for i in range(len(index._doc_keys)))
+
+        sections = [
+            ("doc_lengths", index._doc_lengths.tobytes()),
+            ("alive", bytes(index._alive)),
+            ("term_offsets", term_offsets.tobytes()),
+            ("terms", term_blob),
+            ("term_ids", term_ids.tobytes()),
+            ("posting_offsets", posting_offsets.tobytes()),
+            ("posting_docs", posting_docs.tobytes()),
+            ("posting_tfs", posting_tfs.tobytes()),
+            ("key_offsets", key_offsets.tobytes()),
+            ("keys", key_blob),
+            ("source_offsets", source_offsets.tobytes()),
+            ("sources", source_blob),
+            ("content_offsets", content_offsets.tobytes()),
+            ("contents", content_blob),
+        ]
+        header = {
+            "format_version": SNAPSHOT_FORMAT_VERSION,
+            "tokenizer_version": tokenizer_version,
+            "byteorder": sys.byteorder,
+            "fingerprint": fingerprint,
+            "k1": index.k1,
+            "b": index.b,
+            "docs": len(index._doc_keys),
+            "live_docs": index._live_docs,
+            "total_length": index._total_length,
+            "sections": {},
+        }
+
+    # Section offsets are relative to the end of the (padded) header.
+    position = 0
+    for name, payload in sections:
+        header["sections"][name] = [position, len(payload)]
+        position += len(payload) + (-len(payload)) % _ALIGN
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    header_bytes += b" " * ((-(_PREAMBLE.size + len(header_bytes))) % _ALIGN)
+
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            out.write(_PREAMBLE.pack(SNAPSHOT_MAGIC, SNAPSHOT_FORMAT_VERSION, 0, len(header_bytes)))
+            out.write(header_bytes)
+            for _, payload in sections:
+                out.write(payload)
+                out.write(b"\0" * ((-len(payload)) % _ALIGN))
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def read_snapshot(path: str, fingerprint: str, tokenizer_version: int, index_factory: Callable):
+    """
+    Memory-maps the snapshot at `path` and returns an index built by
+    `index_factory(k1=..., b=...)`, or None if the file is missing, corrupt,
+    from another format/tokenizer version or built from different data.
+    """
+    try:
+        with open(path, "rb") as handle:
+            data = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    try:
+        magic, version, _, header_length = _PREAMBLE.unpack_from(data, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(f"unsupported snapshot format {magic!r} v{version}")
+        header = json.loads(data[_PREAMBLE.size:_PREAMBLE.size + header_length])
+        if header["tokenizer_version"] != tokenizer_version or header["byteorder"] != sys.byteorder:
+            raise ValueError("tokenizer version or byte order mismatch")
+        if header["fingerprint"] != fingerprint:
+            data.close()
+            return None
+        base = _PREAMBLE.size + header_length
+
+        def section(name: str) -> Tuple[int, int]:
+            offset, length = header["sections"][name]
+            return base + offset, length
+
+        view = memoryview(data)
+
+        def int_view(name: str, typecode: str) -> memoryview:
+            offset, length = section(name)
+            return view[offset:offset + length].cast(typecode)
+
+        alive_offset, alive_length = section("alive")
+        index = index_factory(k1=header["k1"], b=header["b"])
+        index._term_ids = MappedTermIds(
+            data, section("terms")[0], int_view("term_offsets", "Q"), int_view("term_ids", "I")
+        )
+        posting_offsets = int_view("posting_offsets", "Q")
+        index._postings_docs = MappedPostings(int_view("posting_docs", "I"), posting_offsets)
+        index._postings_tfs = MappedPostings(int_view("posting_tfs", "I"), posting_offsets)
+        index._doc_lengths = int_view("doc_lengths", "I")
+        index._alive = bytearray(data[alive_offset:alive_offset + alive_length])
+        index._doc_keys = MappedStrings(data, section("keys")[0], int_view("key_offsets", "Q"))
+        index._doc_sources = MappedStrings(data, section("sources")[0], int_view("source_offsets", "Q"))
+        index._doc_contents = MappedStrings(data, section("contents")[0], int_view("content_offsets", "Q"))
+        index._key_to_doc = None
+        index._total_length = header["total_length"]
+        index._live_docs = header["live_docs"]
+        if len(index._doc_keys) != header["docs"] or len(index._doc_lengths) != header["docs"]:
+            raise ValueError("document count mismatch")
+        return index
+    except Exception as e:
+        try:
+            data.close()
+        except BufferError:
+            # Views created before the failure still pin the map; it is
+            # released with them.
+            pass
+        logger.warning(f"Ignoring unreadable index snapshot {path}: {e}")
+        return None
+
+
+class SnapshotStore:
+    """
+    One snapshot file per agent under `directory`.
+    """
+    def __init__(self, directory: str, tokenizer_version: int):
+        self.directory = directory
+        self.tokenizer_version = tokenizer_version
+
+    def path(self, agent_id) -> str:
+        return os.path.join(self.directory, f"{agent_id}.tkix")
+
+    def load(self, agent_id, fingerprint: str, index_factory: Callable):
+        return read_snapshot(self.path(agent_id), fingerprint, self.tokenizer_version, index_factory)
+
+    def save(self, agent_id, index, fingerprint: str) -> None:
+        try:
+            write_snapshot(self.path(agent_id), index, fingerprint, self.tokenizer_version)
+        except OSError as e:
+            logger.warning(f"Could not write index snapshot for agent {agent_id}: {e}")
+
+    def delete(self, agent_id) -> None:
+        try:
+            os.unlink(self.path(agent_id))
+        except FileNotFoundError:
+            pass
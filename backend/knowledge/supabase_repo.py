@@ -1,7 +1,8 @@
 import os
 import uuid
 import mimetypes
-from typing import List, Dict, Any
+import urllib.request
+from typing import List, Dict, Any, Iterator, Optional
 from supabase import create_client, Client
 from django.conf import settings
 from rest_framework import exceptions
@@ -15,7 +16,7 @@ if not SUPABASE_URL or not SUPABASE_ANON_KEY:
         "SUPABASE_URL and SUPABASE_ANON_KEY must be configured in environment variables or Django settings."
     )
 
-from core.errors import SupabaseUnavailableError
+from core.errors import PayloadTooLargeError, SupabaseUnavailableError
 
 class KnowledgeSupabaseRepo:
     """
@@ -35,20 +36,59 @@ class KnowledgeSupabaseRepo:
     def upload_file_to_storage(self, file_object, file_name: str, folder: str = "raw_knowledge") -> str:
         """
         Uploads a file object to Supabase Storage.
+        Large uploads that Django spooled to disk are streamed from their temp file
+        instead of being read into memory.
         """
         try:
             bucket_name = "knowledge-files"
             file_path = f"{folder}/{file_name}"
             content_type = mimetypes.guess_type(file_name)[0] or "application/octet-stream"
+            if hasattr(file_object, "temporary_file_path"):
+                file_body = file_object.temporary_file_path()
+            else:
+                file_body = file_object.read()
             response = self._get_storage_bucket(bucket_name).upload(
                 path=file_path,
-                file=file_object.read(),
+                file=file_body,
                 file_options={"content-type": content_type}
             )
             return response.get('path')
         except Exception as e:
             raise SupabaseUnavailableError(detail=f"Failed to upload file to Supabase Storage: {e}")
 
+    def download_file_to(self, file_path: str, destination, max_bytes: int, bucket_name: str = "knowledge-files", block_size: int = 1024 * 1024):
+        """
+        Streams a stored file into the writable binary `destination` in fixed-size
+        blocks through a short-lived signed URL. Raises PayloadTooLargeError once
+        more than `max_bytes` have been received.
+        """
+        try:
+            signed = self._get_storage_bucket(bucket_name).create_signed_url(file_path, 60)
+            signed_url = signed.get("signedURL") or signed.get("signedUrl")
+            if not signed_url:
+                raise SupabaseUnavailableError(detail=f"No signed URL returned for {file_path}.")
+            if signed_url.startswith("/"):
+                signed_url = f"{SUPABASE_URL.rstrip('/')}/storage/v1{signed_url}"
+
+            received = 0
+            with urllib.request.urlopen(signed_url, timeout=30) as response:
+                declared = int(response.headers.get("Content-Length") or 0)
+                if declared > max_bytes:
+                    raise PayloadTooLargeError(detail=f"File {file_path} is {declared} bytes; the limit is {max_bytes}.")
+                while True:
+                    block = response.read(block_size)
+                    if not block:
+                        break
+                    received += len(block)
+                    if received > max_bytes:
+                        raise PayloadTooLargeError(detail=f"File {file_path} exceeds the {max_bytes} byte limit.")
+                    destination.write(block)
+            return received
+        except (PayloadTooLargeError, SupabaseUnavailableError):
+            raise
+        except Exception as e:
+            raise SupabaseUnavailableError(detail=f"Failed to download {file_path} from Supabase Storage: {e}")
+
     def get_knowledge_source(self, source_id: uuid.UUID) -> dict | None:
         """
         Fetches a knowledge source by its ID from public.agent_sources.
@@ -70,14 +110,16 @@ class KnowledgeSupabaseRepo:
         except Exception as e:
             raise SupabaseUnavailableError(detail=f"Failed to update knowledge source status: {e}")
 
-    def store_embedding(self, embedding_data: Dict):
+    def store_embedding(self, embedding_data: Dict) -> str:
         """
         Stores an embedding vector along with its corresponding content in the agent_embeddings table.
         The agent_embeddings table combines the chunk content and its vector.
+        Returns the id of the new row.
         """
         try:
+            embedding_id = str(uuid.uuid4()) # Unique ID for this embedding entry
             response = self._get_table("agent_embeddings").insert({
-                "id": str(uuid.uuid4()), # Unique ID for this embedding entry
+                "id": embedding_id,
                 "agent_id": str(embedding_data["agent_id"]),
                 "source_id": str(embedding_data["source_id"]), # Link to the original knowledge source
                 "content": embedding_data["content"], # The actual text chunk
@@ -85,27 +127,139 @@ class KnowledgeSupabaseRepo:
             }).execute()
             if not response.data:
                 raise SupabaseUnavailableError("Failed to store embedding.")
+            return embedding_id
         except Exception as e:
             raise SupabaseUnavailableError(detail=f"Failed to store embedding: {e}")
 
-    def keyword_search_agent_embeddings(self, query: str, agent_id: uuid.UUID, workspace_id: uuid.UUID, limit: int = 10) -> List[Dict[str, Any]]:
+    def store_embeddings_batch(self, rows: List[Dict]) -> List[str]:
         """
-        Performs a keyword search on the content of agent embeddings for a specific agent.
-        Uses ILIKE for case-insensitive matching.
+        Stores several chunks and their embeddings with a single multi-row insert.
+        Each row carries agent_id, source_id, content, embedding and optionally
+        parent_id (see store_parent_chunks_batch) and the chunk's normalized
+        search_tokens/search_version. Returns the new row ids in order.
         """
+        if not rows:
+            return []
         try:
-            response = self._get_table("agent_embeddings").select("id, source_id, content").eq(
-                "agent_id", str(agent_id)
-            ).ilike(
-                "content", f"%{query}%"
-            ).limit(limit).execute()
-            # Note: RLS should handle workspace_id filtering, but explicitly adding it here
-            # to ensure results are restricted to the current agent's workspace.
-            # This is implicitly handled by the RLS policy on agent_embeddings table
-            # that joins through agents table.
-            return response.data if response.data else []
+            payload = [{
+                "id": str(uuid.uuid4()),
+                "agent_id": str(row["agent_id"]),
+                "source_id": str(row["source_id"]),
+                "content": row["content"],
+                "embedding": row["embedding"],
+                "parent_id": str(row["parent_id"]) if row.get("parent_id") else None,
+                "search_tokens": row.get("search_tokens"),
+                "search_version": row.get("search_version"),
+            } for row in rows]
+            response = self._get_table("agent_embeddings").insert(payload).execute()
+            if not response.data:
+                raise SupabaseUnavailableError("Failed to store embeddings batch.")
+            return [item["id"] for item in payload]
         except Exception as e:
-            raise SupabaseUnavailableError(detail=f"Failed to perform keyword search: {e}")
+            raise SupabaseUnavailableError(detail=f"Failed to store embeddings batch: {e}")
+
+    def store_parent_chunks_batch(self, rows: List[Dict]) -> List[str]:
+        """
+        Stores parent sections (agent_id, source_id, parent_number, content,
+        token_count) for small-to-big retrieval. Returns the new row ids in order.
+        """
+        if not rows:
+            return []
+        try:
+            payload = [{
+                "id": str(uuid.uuid4()),
+                "agent_id": str(row["agent_id"]),
+                "source_id": str(row["source_id"]),
+                "parent_number": row["parent_number"],
+                "content": row["content"],
+                "token_count": row["token_count"],
+            } for row in rows]
+            response = self._get_table("agent_parent_chunks").insert(payload).execute()
+            if not response.data:
+                raise SupabaseUnavailableError("Failed to store parent chunks.")
+            return [item["id"] for item in payload]
+        except Exception as e:
+            raise SupabaseUnavailableError(detail=f"Failed to store parent chunks: {e}")
+
+    def get_parent_chunks(self, embedding_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Maps each given chunk id to its parent section {"id", "content", "token_count"}.
+        Chunks stored without a parent are left out.
+        """
+        if not embedding_ids:
+            return {}
+        try:
+            response = self._get_table("agent_embeddings") \
+                .select("id, agent_parent_chunks(id, content, token_count)") \
+                .in_("id", [str(embedding_id) for embedding_id in embedding_ids]) \
+                .execute()
+        except Exception as e:
+            raise SupabaseUnavailableError(detail=f"Failed to fetch parent chunks: {e}")
+        return {
+            row["id"]: row["agent_parent_chunks"]
+            for row in response.data or []
+            if row.get("agent_parent_chunks")
+        }
+
+    def store_chunk_references_batch(self, rows: List[Dict]):
+        """
+        Records duplicate chunks that were not embedded: each row points a
+        (source_id, chunk_number) at the agent_embeddings row holding the same text.
+        """
+        if not rows:
+            return
+        try:
+            response = self._get_table("agent_chunk_refs").insert(rows).execute()
+            if not response.data:
+                raise SupabaseUnavailableError("Failed to store chunk references.")
+        except Exception as e:
+            raise SupabaseUnavailableError(detail=f"Failed to store chunk references: {e}")
+
+    def get_chunk_references(self, embedding_ids: List[str]) -> Dict[str, List[str]]:
+        """
+        Returns {embedding_id: [source_id, ...]} for the other sources that contain
+        the same text as each stored chunk.
+        """
+        if not embedding_ids:
+            return {}
+        try:
+            response = self._get_table("agent_chunk_refs").select("embedding_id, source_id") \
+                .in_("embedding_id", [str(embedding_id) for embedding_id in embedding_ids]) \
+                .execute()
+        except Exception as e:
+            raise SupabaseUnavailableError(detail=f"Failed to fetch chunk references: {e}")
+        references: Dict[str, List[str]] = {}
+        for row in response.data or []:
+            sources = references.setdefault(row["embedding_id"], [])
+            if row["source_id"] not in sources:
+                sources.append(row["source_id"])
+        return references
+
+    def iter_agent_chunks(self, agent_id: uuid.UUID, page_size: int = 1000,
+                          created_since: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Yields the id, source_id, content and stored search tokens of every chunk stored for an agent
+        (only those created at or after `created_since`, if given).
+        Pages through agent_embeddings by id so PostgREST's max_rows cap never truncates the scan.
+        Used to (re)build the agent's in-process lexical index and to load its deltas.
+        """
+        last_id = None
+        while True:
+            try:
+                query = self._get_table("agent_embeddings").select("id, source_id, content, search_tokens, search_version") \
+                    .eq("agent_id", str(agent_id))
+                if created_since:
+                    query = query.gte("created_at", created_since)
+                if last_id:
+                    query = query.gt("id", last_id)
+                response = query.order("id").limit(page_size).execute()
+            except Exception as e:
+                raise SupabaseUnavailableError(detail=f"Failed to fetch chunks for agent {agent_id}: {e}")
+            rows = response.data or []
+            yield from rows
+            if len(rows) < page_size:
+                return
+            last_id = rows[-1]["id"]
 
     def vector_search_agent_embeddings(
         self,
@@ -141,6 +295,40 @@ class KnowledgeSupabaseRepo:
         except Exception as e:
             raise SupabaseUnavailableError(detail=f"Failed to perform vector search: {e}")
 
+    def get_embedding_similarities(self, agent_id: uuid.UUID, embedding_ids: List[str]) -> Dict[tuple, float]:
+        """
+        Returns the pairwise cosine similarity of the given stored chunks as
+        {(smaller_id, larger_id): similarity}, computed in the database so the
+        vectors themselves never leave it.
+        """
+        if len(embedding_ids) < 2:
+            return {}
+        try:
+            response = self._client.rpc(
+                "agent_embedding_similarities",
+                {"p_agent_id": str(agent_id), "p_ids": [str(embedding_id) for embedding_id in embedding_ids]}
+            ).execute()
+        except Exception as e:
+            raise SupabaseUnavailableError(detail=f"Failed to fetch embedding similarities: {e}")
+        return {
+            (row["left_id"], row["right_id"]): row["similarity"]
+            for row in response.data or []
+        }
+
+    def get_agent_chunk_fingerprint(self, agent_id: uuid.UUID) -> str:
+        """
+        Returns a cheap summary of an agent's stored chunks (row count, latest
+        insert, id checksum) that changes whenever chunks are added or removed.
+        Used to decide whether a cached or snapshotted lexical index is current,
+        and parsed by knowledge.lexical.parse_fingerprint to load only new chunks.
+        """
+        try:
+            response = self._client.rpc("agent_chunk_fingerprint", {"p_agent_id": str(agent_id)}).execute()
+        except Exception as e:
+            raise SupabaseUnavailableError(detail=f"Failed to fetch chunk fingerprint for agent {agent_id}: {e}")
+        row = (response.data or [{}])[0]
+        return f"{row.get('chunk_count', 0)}:{row.get('latest_created_at')}:{row.get('id_checksum')}"
+
     def update_kb_job_status(self, job_id: uuid.UUID, status: str, error: str = None):
         """
         Updates the status of a kb_jobs entry.
@@ -172,14 +360,42 @@ class KnowledgeSupabaseRepo:
 
     def delete_agent_embeddings(self, agent_id: uuid.UUID):
         """
-        Deletes all embeddings associated with a given agent from public.agent_embeddings.
+        Deletes all embeddings associated with a given agent from public.agent_embeddings,
+        along with their parent sections.
         """
         try:
             response = self._get_table("agent_embeddings").delete().eq("agent_id", str(agent_id)).execute()
+            self._get_table("agent_parent_chunks").delete().eq("agent_id", str(agent_id)).execute()
             # Supabase delete doesn't return data, just status
         except Exception as e:
             raise SupabaseUnavailableError(detail=f"Failed to delete embeddings for agent {agent_id}: {e}")
             
+    def delete_source_embeddings(self, agent_id: uuid.UUID, source_id: uuid.UUID) -> Dict[str, int]:
+        """
+        Deletes the chunks stored for one knowledge source in a single statement.
+        Chunks other sources reference as near-duplicates are moved to one of
+        those sources instead. Returns {"deleted": n, "moved": n}.
+        """
+        try:
+            response = self._client.rpc(
+                "delete_source_embeddings",
+                {"p_agent_id": str(agent_id), "p_source_id": str(source_id)}
+            ).execute()
+        except Exception as e:
+            raise SupabaseUnavailableError(detail=f"Failed to delete embeddings for source {source_id}: {e}")
+        row = (response.data or [{}])[0]
+        return {"deleted": row.get("deleted") or 0, "moved": row.get("moved") or 0}
+
+    def agent_in_workspace(self, agent_id: uuid.UUID, workspace_id: uuid.UUID) -> bool:
+        """
+        Whether the agent exists (and is visible to this client) in the workspace.
+        """
+        try:
+            response = self._get_table("agents").select("id").eq("id", str(agent_id)).eq("workspace_id", str(workspace_id)).limit(1).execute()
+        except Exception as e:
+            raise SupabaseUnavailableError(detail=f"Failed to fetch agent {agent_id}: {e}")
+        return bool(response.data)
+
     def get_agent_knowledge_sources(self, agent_id: uuid.UUID) -> List[Dict[str, Any]]:
         """
         Fetches all knowledge sources associated with a given agent from public.agent_sources.
@@ -190,15 +406,19 @@ class KnowledgeSupabaseRepo:
         except Exception as e:
             raise SupabaseUnavailableError(detail=f"Failed to fetch knowledge sources for agent {agent_id}: {e}")
 
-    def get_active_kb_job(self, agent_id: uuid.UUID, job_type: str) -> Dict[str, Any] | None:
+    def get_active_kb_job(self, agent_id: uuid.UUID, job_type: str, source_id: uuid.UUID = None) -> Dict[str, Any] | None:
         """
-        Fetches an active (queued or processing) kb_job for a given agent and type.
+        Fetches an active (queued or processing) kb_job for a given agent and type,
+        optionally only one whose payload targets `source_id`.
         """
         try:
-            response = self._get_table("kb_jobs").select("*") \
+            query = self._get_table("kb_jobs").select("*") \
                 .eq("agent_id", str(agent_id)) \
                 .eq("kind", job_type) \
-                .in_("status", ["queued", "processing"]) \
+                .in_("status", ["queued", "processing"])
+            if source_id:
+                query = query.eq("payload->>source_id", str(source_id))
+            response = query \
                 .order("created_at", { "ascending": False }) \
                 .limit(1) \
                 .maybe_single() \
@@ -207,21 +427,34 @@ class KnowledgeSupabaseRepo:
         except Exception as e:
             raise SupabaseUnavailableError(detail=f"Failed to get active kb_job for agent {agent_id}: {e}")
 
-    def create_kb_job(self, agent_id: uuid.UUID, job_type: str, status: str) -> uuid.UUID:
+    def get_kb_job(self, job_id: uuid.UUID) -> Dict[str, Any] | None:
         """
-        Creates a new kb_job entry and returns its ID.
+        Fetches a kb_job (status, progress and stats) visible to the caller.
+        """
+        try:
+            response = self._get_table("kb_jobs").select(
+                "id, agent_id, kind, status, payload, processed_sources, total_sources, stats, error, "
+                "attempts, max_attempts, created_at, updated_at, finished_at"
+            ).eq("id", str(job_id)).limit(1).execute()
+        except Exception as e:
+            raise SupabaseUnavailableError(detail=f"Failed to fetch kb_job {job_id}: {e}")
+        return response.data[0] if response.data else None
+
+    def create_kb_job(self, agent_id: uuid.UUID, job_type: str, status: str, workspace_id: uuid.UUID, payload: Dict[str, Any] = None) -> uuid.UUID:
+        """
+        Creates a new kb_job entry and returns its ID. Queued jobs are picked up
+        by the kb_worker processes (see knowledge.job_queue).
         """
         try:
             response = self._get_table("kb_jobs").insert({
                 "agent_id": str(agent_id),
-                "workspace_id": str(self._client.from_('current_workspace_id').select('id').single().execute().data['id']), # Assuming current_workspace_id function/view
+                "workspace_id": str(workspace_id),
                 "kind": job_type,
                 "status": status,
-            }).select("id").single().execute()
+                "payload": payload or {},
+            }).execute()
             if not response.data:
                 raise SupabaseUnavailableError("Failed to create kb_job.")
-            return uuid.UUID(response.data["id"])
+            return uuid.UUID(response.data[0]["id"])
         except Exception as e:
             raise SupabaseUnavailableError(detail=f"Failed to create kb_job: {e}")
-
-
@@ -0,0 +1,118 @@
+import random
+import types
+import unittest
+from unittest import mock
+
+from knowledge.chunking import HierarchicalChunker, TextChunker
+from knowledge.tokens import estimate_tokens, iter_token_pieces
+
+
+class TextChunkerTest(unittest.TestCase):
+
+    def test_iter_chunks_is_lazy(self):
+        chunks = TextChunker().iter_chunks("Hello world.", source_id="s1")
+        self.assertIsInstance(chunks, types.GeneratorType)
+        self.assertEqual(next(chunks)["chunk_id"], "s1_0")
+
+    def test_chunks_respect_token_budget(self):
+        text = "\n\n".join("Sentence number %d is here. Another one follows." % i for i in range(200))
+        chunker = TextChunker(max_tokens=40, overlap=0)
+        for chunk in chunker.iter_chunks(text):
+            self.assertLessEqual(chunk["metadata"]["token_count"], 40)
+            self.assertLessEqual(estimate_tokens(chunk["content"]), 40)
+
+    def test_prefers_paragraph_breaks(self):
+        text = "Alpha beta gamma delta epsilon zeta.\n\nEta theta iota kappa lambda mu."
+        chunks = TextChunker(max_tokens=10, overlap=0).chunk_text(text)
+        self.assertEqual(chunks[0]["content"], "Alpha beta gamma delta epsilon zeta.")
+        self.assertEqual(chunks[1]["content"], "Eta theta iota kappa lambda mu.")
+
+    def test_overlap_is_shared_between_chunks(self):
+        text = " ".join("w%d" % i for i in range(100))
+        chunks = TextChunker(max_tokens=20, overlap=5).chunk_text(text)
+        first, second = chunks[0]["content"].split(), chunks[1]["content"].split()
+        self.assertEqual(first[-5:], second[:5])
+
+    def test_offsets_cover_text_without_overlap(self):
+        text = " ".join("word%d." % i for i in range(300))
+        chunks = TextChunker(max_tokens=30, overlap=0).chunk_text(text)
+        rebuilt = " ".join(chunk["content"] for chunk in chunks)
+        self.assertEqual(rebuilt.split(), text.split())
+        for previous, current in zip(chunks, chunks[1:]):
+            self.assertLessEqual(previous["metadata"]["end_offset"], current["metadata"]["start_offset"])
+
+    def test_segments_match_joined_text(self):
+        pages = ["Page %d talks about shipping and returns. " % i * 8 for i in range(12)]
+        chunker = TextChunker(max_tokens=50, overlap=8)
+        streamed = list(chunker.iter_chunks_from_segments(iter(pages), source_id="s1"))
+        joined = chunker.chunk_text("\n\n".join(pages), source_id="s1")
+        self.assertEqual([c["content"] for c in streamed], [c["content"] for c in joined])
+        self.assertEqual([c["metadata"]["start_offset"] for c in streamed], [c["metadata"]["start_offset"] for c in joined])
+        self.assertEqual(streamed[-1]["chunk_id"], "s1_%d" % (len(streamed) - 1))
+
+    def test_small_segments_match_joined_text_and_are_tokenized_once(self):
+        pages = ["Short page %d." % i for i in range(60)]
+        chunker = TextChunker(max_tokens=50, overlap=8)
+        scanned = []
+
+        def counting_pieces(text, pos=0):
+            scanned.append(len(text) - pos)
+            return iter_token_pieces(text, pos)
+
+        with mock.patch("knowledge.chunking.iter_token_pieces", counting_pieces):
+            streamed = list(chunker.iter_chunks_from_segments(iter(pages)))
+        joined = chunker.chunk_text("\n\n".join(pages))
+        self.assertEqual([c["content"] for c in streamed], [c["content"] for c in joined])
+        self.assertEqual([c["metadata"]["end_offset"] for c in streamed], [c["metadata"]["end_offset"] for c in joined])
+        # Every segment (and its separator) is scanned once, however long the carried tail grows.
+        self.assertLessEqual(sum(scanned), len("\n\n".join(pages)) + len(pages))
+
+    def test_large_overlap_never_exceeds_budget(self):
+        rng = random.Random(4)
+        text = " ".join("word%d%s" % (i, "." if rng.random() < 0.08 else "") for i in range(3000))
+        chunks = TextChunker(max_tokens=40, overlap=20).chunk_text(text)
+        self.assertTrue(all(chunk["metadata"]["token_count"] <= 40 for chunk in chunks))
+        self.assertTrue(all(estimate_tokens(chunk["content"]) <= 40 for chunk in chunks))
+        for previous, current in zip(chunks, chunks[1:]):
+            self.assertLessEqual(current["metadata"]["start_offset"], previous["metadata"]["end_offset"])
+
+    def test_oversized_piece_is_split(self):
+        chunks = TextChunker(max_tokens=256, overlap=32).chunk_text("x" * 200000)
+        self.assertTrue(all(chunk["metadata"]["token_count"] <= 256 for chunk in chunks))
+        self.assertTrue(all(estimate_tokens(chunk["content"]) <= 256 for chunk in chunks))
+        self.assertEqual("".join(chunk["content"] for chunk in chunks), "x" * 200000)
+
+    def test_empty_text(self):
+        self.assertEqual(TextChunker().chunk_text("   \n\n "), [])
+
+
+
+class HierarchicalChunkerTest(unittest.TestCase):
+
+    def test_children_nest_inside_parents(self):
+        text = "\n\n".join("Section %d covers delivery times and fees. It also lists branches." % i for i in range(40))
+        chunks = HierarchicalChunker(parent_tokens=120, child_tokens=30).chunk_text(text, source_id="s1")
+
+        self.assertEqual([c["metadata"]["chunk_number"] for c in chunks], list(range(len(chunks))))
+        self.assertEqual(chunks[-1]["chunk_id"], "s1_%d" % (len(chunks) - 1))
+        parents = {c["parent"]["chunk_id"]: c["parent"] for c in chunks}
+        self.assertGreater(len(chunks), len(parents))
+        for chunk in chunks:
+            self.assertLessEqual(chunk["metadata"]["token_count"], 30)
+            self.assertIn(chunk["content"], chunk["parent"]["content"])
+            self.assertEqual(text[chunk["metadata"]["start_offset"]:chunk["metadata"]["end_offset"]], chunk["content"])
+        for parent in parents.values():
+            self.assertLessEqual(parent["metadata"]["token_count"], 120)
+
+    def test_children_do_not_overlap_by_default(self):
+        text = " ".join("w%d" % i for i in range(500))
+        chunks = HierarchicalChunker(parent_tokens=100, child_tokens=25).chunk_text(text)
+        self.assertEqual(" ".join(c["content"] for c in chunks).split(), text.split())
+
+    def test_rejects_children_larger_than_parents(self):
+        with self.assertRaises(ValueError):
+            HierarchicalChunker(parent_tokens=64, child_tokens=128)
+
+
+if __name__ == '__main__':
+    unittest.main()
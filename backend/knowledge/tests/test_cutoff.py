@@ -0,0 +1,45 @@
+import unittest
+
+from knowledge.cutoff import adaptive_cutoff
+
+
+def _items(scores, similarities=None):
+    similarities = similarities or [None] * len(scores)
+    return [{"id": str(i), "score": score, "similarity": sim} for i, (score, sim) in enumerate(zip(scores, similarities))]
+
+
+class AdaptiveCutoffTest(unittest.TestCase):
+
+    def test_confident_single_answer(self):
+        kept, profile = adaptive_cutoff(_items([0.033, 0.016, 0.015], [0.91, 0.6, 0.55]))
+        self.assertEqual(len(kept), 1)
+        self.assertEqual(profile["reason"], "confident")
+
+    def test_cuts_at_largest_score_gap(self):
+        # Three chunks both legs agree on, then single-leg hits.
+        kept, profile = adaptive_cutoff(_items([0.0328, 0.0320, 0.0312, 0.0164, 0.0161], [0.7, 0.68, 0.66, 0.5, None]))
+        self.assertEqual([item["id"] for item in kept], ["0", "1", "2"])
+        self.assertEqual(profile["reason"], "gap")
+        self.assertEqual(profile["k"], 3)
+
+    def test_flat_ambiguous_scores_go_up_to_cap(self):
+        kept, profile = adaptive_cutoff(_items([1.0 - i * 0.01 for i in range(12)]), max_k=6)
+        self.assertEqual(len(kept), 6)
+        self.assertEqual(profile["reason"], "cap")
+
+    def test_low_similarity_hits_are_dropped(self):
+        kept, profile = adaptive_cutoff(_items([0.03, 0.029], [0.1, 0.05]))
+        self.assertEqual(kept, [])
+        self.assertEqual(profile["reason"], "empty")
+
+    def test_lexical_only_hits_are_kept(self):
+        kept, _ = adaptive_cutoff(_items([0.016, 0.0159]))
+        self.assertEqual(len(kept), 2)
+
+    def test_min_k_is_respected(self):
+        kept, _ = adaptive_cutoff(_items([1.0, 0.2, 0.19], [0.6, 0.5, 0.5]), min_k=2)
+        self.assertEqual(len(kept), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
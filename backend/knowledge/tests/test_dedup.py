@@ -0,0 +1,65 @@
+import random
+import unittest
+
+from knowledge.dedup import ChunkDeduplicator
+
+WORDS = [
+    "order", "refund", "shipping", "policy", "customer", "store", "delivery", "days",
+    "return", "item", "payment", "card", "support", "hours", "weekend", "branch",
+]
+
+
+def _paragraph(rng, length=60):
+    return " ".join(rng.choice(WORDS) + str(rng.randrange(50)) for _ in range(length))
+
+
+class ChunkDeduplicatorTest(unittest.TestCase):
+
+    def test_exact_repeat_is_duplicate_regardless_of_case_and_spacing(self):
+        dedup = ChunkDeduplicator()
+        self.assertIsNone(dedup.check("a", "Returns accepted within 14 days."))
+        self.assertEqual(dedup.check("b", "returns   ACCEPTED within 14 days"), "a")
+
+    def test_near_duplicate_points_at_first_copy(self):
+        rng = random.Random(3)
+        footer = _paragraph(rng)
+        edited = footer.split()
+        edited[10] = "changed"
+        dedup = ChunkDeduplicator()
+        self.assertIsNone(dedup.check("a", footer))
+        self.assertEqual(dedup.check("b", " ".join(edited)), "a")
+
+    def test_distinct_chunks_are_kept(self):
+        rng = random.Random(5)
+        dedup = ChunkDeduplicator()
+        for i in range(200):
+            self.assertIsNone(dedup.check(str(i), _paragraph(rng)))
+        self.assertEqual(dedup.duplicates, 0)
+
+    def test_ratio(self):
+        dedup = ChunkDeduplicator()
+        for i in range(4):
+            dedup.check(str(i), "same boilerplate footer text")
+        self.assertEqual(dedup.seen, 4)
+        self.assertEqual(dedup.ratio, 0.75)
+
+    def test_stored_ids(self):
+        dedup = ChunkDeduplicator()
+        dedup.record_stored("a", "emb-1")
+        self.assertEqual(dedup.stored_id("a"), "emb-1")
+        self.assertIsNone(dedup.stored_id("b"))
+
+    def test_discarded_chunk_stops_matching(self):
+        dedup = ChunkDeduplicator()
+        self.assertIsNone(dedup.check("a", "same boilerplate footer text"))
+        self.assertEqual(dedup.check("b", "same boilerplate footer text"), "a")
+        dedup.discard("a")
+        self.assertTrue(dedup.is_discarded("a"))
+        self.assertIsNone(dedup.reconsider("b", "same boilerplate footer text"))
+        self.assertFalse(dedup.is_discarded("b"))
+        self.assertEqual(dedup.check("c", "same boilerplate footer text"), "b")
+        self.assertEqual((dedup.seen, dedup.duplicates), (3, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
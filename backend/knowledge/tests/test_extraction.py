@@ -0,0 +1,125 @@
+import os
+import tempfile
+import unittest
+import zipfile
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from unittest import mock
+
+from knowledge import extraction
+from knowledge.extraction import (
+    ExtractionError,
+    UnsupportedFileTypeError,
+    detect_file_type,
+    extract_to_text_file,
+    iter_file_pages,
+    iter_pages,
+)
+
+WORD_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+
+
+class ExtractionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.workdir.cleanup)
+
+    def _path(self, name):
+        return os.path.join(self.workdir.name, name)
+
+    def _extract(self, input_path, file_type):
+        output_path = self._path("out")
+        extract_to_text_file(input_path, file_type, output_path, extraction.EXTRACTION_MEMORY_LIMIT_BYTES)
+        return list(iter_pages(output_path))
+
+    def test_detect_file_type(self):
+        self.assertEqual(detect_file_type("raw_knowledge/Guide.PDF"), "pdf")
+        self.assertEqual(detect_file_type("notes.md"), "txt")
+        with self.assertRaises(UnsupportedFileTypeError):
+            detect_file_type("archive.zip")
+
+    def test_text_is_split_into_pages_on_line_breaks(self):
+        path = self._path("a.txt")
+        with open(path, "w", encoding="utf-8") as handle:
+            handle.write("سطر عربي and text\n" * 5000)
+        with mock.patch.object(extraction, "TEXT_BLOCK_BYTES", 4096):
+            pages = self._extract(path, "txt")
+        self.assertGreater(len(pages), 1)
+        for page in pages:
+            for line in page.split("\n"):
+                self.assertEqual(line, "سطر عربي and text")
+        self.assertEqual(sum(page.count("\n") + 1 for page in pages), 5000)
+
+    def test_docx_pages_follow_page_breaks(self):
+        paragraphs = []
+        for i in range(4):
+            page_break = '<w:r><w:br w:type="page"/></w:r>' if i == 1 else ""
+            paragraphs.append(f"<w:p><w:r><w:t>Paragraph {i}</w:t></w:r>{page_break}</w:p>")
+        document = f'<w:document xmlns:w="{WORD_NS}"><w:body>{"".join(paragraphs)}</w:body></w:document>'
+        path = self._path("a.docx")
+        with zipfile.ZipFile(path, "w") as archive:
+            archive.writestr("word/document.xml", document)
+
+        pages = self._extract(path, "docx")
+        self.assertEqual(pages, ["Paragraph 0\n\nParagraph 1", "Paragraph 2\n\nParagraph 3"])
+
+    def test_empty_file_yields_no_pages(self):
+        path = self._path("empty.txt")
+        open(path, "w").close()
+        self.assertEqual(self._extract(path, "txt"), [])
+
+
+
+class _FakeProcess:
+    def __init__(self):
+        self.terminated = False
+
+    def is_alive(self):
+        return not self.terminated
+
+    def terminate(self):
+        self.terminated = True
+
+
+class _FailingExecutor:
+    """Stands in for the process pool; every submitted extraction fails with `error`."""
+
+    def __init__(self, error):
+        self.error = error
+        self.process = _FakeProcess()
+        self._processes = {1: self.process}
+        self.shut_down = False
+
+    def submit(self, *args):
+        future = mock.Mock()
+        future.result.side_effect = self.error
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.shut_down = True
+
+
+class ExtractionPoolRecoveryTest(unittest.TestCase):
+
+    def _run(self, error):
+        executor = _FailingExecutor(error)
+        repo = mock.Mock()
+        with mock.patch.object(extraction, "_executor", executor):
+            with self.assertRaises(ExtractionError):
+                list(iter_file_pages(repo, "raw_knowledge/a.pdf"))
+            self.assertIsNone(extraction._executor)
+        return executor
+
+    def test_timeout_kills_the_pool_and_resets_it(self):
+        executor = self._run(FutureTimeoutError())
+        self.assertTrue(executor.process.terminated)
+        self.assertTrue(executor.shut_down)
+
+    def test_broken_pool_is_replaced(self):
+        executor = self._run(BrokenProcessPool("worker died"))
+        self.assertTrue(executor.shut_down)
+
+
+if __name__ == "__main__":
+    unittest.main()
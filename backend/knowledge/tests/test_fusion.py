@@ -0,0 +1,55 @@
+import unittest
+
+from knowledge.fusion import candidate_pool_size, fuse
+
+
+class FuseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.lexical = [{"id": "a", "score": 12.0}, {"id": "b", "score": 3.0}]
+        self.vector = [{"id": "b", "score": 0.91}, {"id": "c", "score": 0.80}]
+
+    def test_rrf_rewards_agreement_between_legs(self):
+        fused = fuse([self.lexical, self.vector], [1.0, 1.0], method="rrf", rrf_k=60)
+        self.assertEqual([item["id"] for item in fused], ["b", "a", "c"])
+        self.assertAlmostEqual(fused[0]["score"], 1 / 62 + 1 / 61)
+
+    def test_weighted_normalizes_each_leg(self):
+        fused = fuse([self.lexical, self.vector], [0.3, 0.7], method="weighted")
+        scores = {item["id"]: item["score"] for item in fused}
+        self.assertAlmostEqual(scores["a"], 0.3)
+        self.assertAlmostEqual(scores["b"], 0.7)
+        self.assertAlmostEqual(scores["c"], 0.0)
+
+    def test_empty_leg(self):
+        fused = fuse([[], self.vector], [0.3, 0.7], method="weighted")
+        self.assertEqual([item["id"] for item in fused], ["b", "c"])
+
+    def test_keeps_vector_similarity_when_lexical_leg_saw_chunk_first(self):
+        vector = [{"id": "b", "score": 0.91, "similarity": 0.91}]
+        for method in ("rrf", "weighted"):
+            fused = fuse([self.lexical, vector], [0.3, 0.7], method=method)
+            by_id = {item["id"]: item for item in fused}
+            self.assertEqual(by_id["b"]["similarity"], 0.91)
+            self.assertNotIn("similarity", by_id["a"])
+
+    def test_unknown_method(self):
+        with self.assertRaises(ValueError):
+            fuse([self.lexical], [1.0], method="borda")
+
+
+class CandidatePoolSizeTest(unittest.TestCase):
+
+    def test_small_corpus_is_capped_at_corpus(self):
+        self.assertEqual(candidate_pool_size(5, 7), 7)
+
+    def test_grows_with_corpus(self):
+        self.assertLess(candidate_pool_size(5, 500), candidate_pool_size(5, 50000))
+        self.assertLessEqual(candidate_pool_size(50, 10 ** 7), 100)
+
+    def test_unknown_corpus_size_uses_floor(self):
+        self.assertEqual(candidate_pool_size(5, 0), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
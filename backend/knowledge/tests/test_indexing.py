@@ -0,0 +1,79 @@
+import unittest
+
+from knowledge.dedup import ChunkDeduplicator
+from knowledge.indexing import index_chunks
+
+
+class FakeRouter:
+
+    def route_knowledge_chunk(self, chunk):
+        return ["rag_vectors"]
+
+
+class FakeEmbedder:
+
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+
+    def generate_embeddings_batch(self, texts):
+        return [None if text in self.fail else [0.1, 0.2] for text in texts]
+
+
+class FakeRepo:
+
+    def __init__(self, fail_batches=0):
+        self.fail_batches = fail_batches
+        self.rows = []
+        self.refs = []
+
+    def store_embeddings_batch(self, rows):
+        if self.fail_batches:
+            self.fail_batches -= 1
+            raise RuntimeError("insert failed")
+        start = len(self.rows)
+        self.rows.extend(rows)
+        return [f"emb-{i}" for i in range(start, len(self.rows))]
+
+    def store_chunk_references_batch(self, rows):
+        self.refs.extend(rows)
+
+
+def _chunks(prefix, contents):
+    return [{"chunk_id": f"{prefix}-{i}", "content": content, "metadata": {"chunk_number": i}}
+            for i, content in enumerate(contents)]
+
+
+class IndexChunksTest(unittest.TestCase):
+
+    def test_duplicates_reference_the_stored_copy(self):
+        repo = FakeRepo()
+        counts = index_chunks(_chunks("s", ["footer text", "body", "footer text"]), "agent", "src", "text",
+                              repo, FakeEmbedder(), FakeRouter(), batch_size=2)
+        self.assertEqual(counts, (3, 2, 1))
+        self.assertEqual([ref["embedding_id"] for ref in repo.refs], ["emb-0"])
+
+    def test_duplicate_is_embedded_when_original_has_no_embedding(self):
+        repo = FakeRepo()
+        embedder = FakeEmbedder(fail=["footer text"])
+        contents = ["footer text", "Footer  text", "body", "footer  TEXT"]
+        counts = index_chunks(_chunks("s", contents), "agent", "src", "text",
+                              repo, embedder, FakeRouter(), batch_size=3)
+        self.assertEqual(counts, (4, 2, 1))
+        self.assertEqual([row["content"] for row in repo.rows], ["body", "Footer  text"])
+        self.assertEqual([(ref["embedding_id"], ref["chunk_number"]) for ref in repo.refs], [("emb-1", 3)])
+
+    def test_duplicates_of_a_failed_batch_are_embedded_by_a_later_source(self):
+        repo = FakeRepo(fail_batches=1)
+        dedup = ChunkDeduplicator()
+        with self.assertRaises(RuntimeError):
+            index_chunks(_chunks("a", ["footer text", "body"]), "agent", "src-a", "text",
+                         repo, FakeEmbedder(), FakeRouter(), batch_size=2, deduplicator=dedup)
+        counts = index_chunks(_chunks("b", ["footer text", "footer text"]), "agent", "src-b", "text",
+                              repo, FakeEmbedder(), FakeRouter(), batch_size=2, deduplicator=dedup)
+        self.assertEqual(counts, (2, 1, 1))
+        self.assertEqual([row["content"] for row in repo.rows], ["footer text"])
+        self.assertEqual([ref["source_id"] for ref in repo.refs], ["src-b"])
+
+
+if __name__ == "__main__":
+    unittest.main()
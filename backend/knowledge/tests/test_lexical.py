@@ -0,0 +1,173 @@
+import tempfile
+import unittest
+
+from knowledge.lexical import TOKENIZER_VERSION, BM25Index, LexicalIndexRegistry, encode_terms, parse_fingerprint, stored_terms, tokenize
+from knowledge.snapshot import SnapshotStore
+
+
+class TokenizeTest(unittest.TestCase):
+
+    def test_english_casefold_and_stopwords(self):
+        self.assertEqual(tokenize("What is the Return POLICY?"), ["return", "policy"])
+
+    def test_arabic_diacritics_tatweel_and_article(self):
+        # "الشَّحْــن" (vocalized, with tatweel) and "بالشحن" both reduce to "شحن"
+        self.assertEqual(tokenize("الشَّحْــن"), ["شحن"])
+        self.assertEqual(tokenize("بالشحن"), ["شحن"])
+
+    def test_keeps_digits(self):
+        self.assertIn("7", tokenize("delivery in 7 days"))
+
+    def test_arabic_letter_variants_and_digits(self):
+        # Hamza/alef, alef maqsura and ta marbuta spellings match; Arabic-Indic digits become ASCII.
+        self.assertEqual(tokenize("أسعار الإستبدال مجانية إلى ٥٠٠"), tokenize("اسعار الاستبدال مجانيه الي 500"))
+        self.assertIn("500", tokenize("فوق ٥٠٠ جنيه"))
+
+    def test_punctuation_and_symbols_split_tokens(self):
+        self.assertEqual(tokenize("e-mail: sales@shop.eg 😀"), ["mail", "sales", "shop", "eg"])
+
+    def test_stored_terms_require_current_version(self):
+        row = {"search_tokens": encode_terms(["شحن", "مجاني"]), "search_version": TOKENIZER_VERSION}
+        self.assertEqual(stored_terms(row), ["شحن", "مجاني"])
+        self.assertIsNone(stored_terms({**row, "search_version": TOKENIZER_VERSION - 1}))
+        self.assertIsNone(stored_terms({"search_tokens": None}))
+
+
+class BM25IndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = BM25Index()
+        self.index.add_document("1", "s1", "Shipping takes 3 days inside Cairo.")
+        self.index.add_document("2", "s1", "Returns are accepted within 14 days of delivery.")
+        self.index.add_document("3", "s2", "الشحن مجاني للطلبات فوق ٥٠٠ جنيه")
+
+    def test_multi_word_question_matches(self):
+        results = self.index.search("how many days does shipping take to Cairo?")
+        self.assertEqual(results[0]["id"], "1")
+        self.assertEqual(results[0]["source_id"], "s1")
+
+    def test_arabic_query(self):
+        results = self.index.search("هل الشحن مجاني؟")
+        self.assertEqual([r["id"] for r in results], ["3"])
+
+    def test_no_match_returns_empty(self):
+        self.assertEqual(self.index.search("warranty"), [])
+
+    def test_remove_document(self):
+        self.assertTrue(self.index.remove_document("1"))
+        self.assertFalse(self.index.remove_document("1"))
+        self.assertNotIn("1", [r["id"] for r in self.index.search("shipping days")])
+        self.assertEqual(len(self.index), 2)
+
+    def test_readd_replaces_document(self):
+        self.index.add_document("2", "s1", "Exchanges only, no refunds.")
+        self.assertEqual(self.index.search("returns accepted"), [])
+        self.assertEqual(self.index.search("refunds")[0]["id"], "2")
+
+    def test_remove_source(self):
+        self.assertEqual(self.index.remove_source("s1"), 2)
+        self.assertEqual(self.index.search("shipping returns days"), [])
+        self.assertEqual(len(self.index), 1)
+        self.assertEqual(self.index.remove_source("s1"), 0)
+
+    def test_compaction_drops_tombstones(self):
+        self.index.add_document("2", "s1", "Exchanges only, no refunds.")
+        self.index.remove_document("3")
+        before = {query: self.index.search(query) for query in ("shipping cairo", "refunds", "returns", "الشحن")}
+
+        self.assertFalse(self.index.maybe_compact(threshold=0.5))
+        self.assertTrue(self.index.maybe_compact())
+        self.assertEqual(self.index.dead_fraction(), 0.0)
+        self.assertEqual(len(self.index._doc_keys), 2)
+        self.assertIsNone(self.index._term_ids.get(tokenize("الشحن")[0]))
+        self.assertEqual({query: self.index.search(query) for query in before}, before)
+
+        self.index.add_document("4", "s3", "Warranty covers two years.")
+        self.index.remove_document("1")
+        self.assertEqual(sorted(r["id"] for r in self.index.search("warranty refunds")), ["2", "4"])
+
+
+class LexicalIndexRegistryTest(unittest.TestCase):
+
+    def test_builds_once_and_adds_incrementally(self):
+        calls = []
+
+        def loader():
+            calls.append(1)
+            return [{"id": "1", "source_id": "s1", "content": "cash on delivery"}]
+
+        registry = LexicalIndexRegistry(max_age=60)
+        registry.add_chunk("agent", "0", "s0", "ignored until the index exists")
+        index = registry.get("agent", loader)
+        registry.add_chunk("agent", "2", "s1", "card payments via instapay")
+
+        self.assertIs(registry.get("agent", loader), index)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(index.search("instapay")[0]["id"], "2")
+        self.assertEqual(len(index), 2)
+
+    def test_changed_fingerprint_loads_only_new_chunks(self):
+        rows = [{"id": "1", "source_id": "s1", "content": "cash on delivery", "created_at": "2025-12-28T10:00:00+00:00"}]
+        loads, deltas = [], []
+        loader = lambda: loads.append(1) or list(rows)
+
+        def delta_loader(since):
+            deltas.append(since)
+            return [row for row in rows if row["created_at"] >= since]
+
+        def fingerprint():
+            return f"{len(rows)}:{max(row['created_at'] for row in rows)}:0"
+
+        registry = LexicalIndexRegistry(max_age=0)
+        index = registry.get("agent", loader, fingerprint=fingerprint, delta_loader=delta_loader)
+        rows.append({"id": "2", "source_id": "s1", "content": "card payments via instapay", "created_at": "2025-12-28T11:00:00+00:00"})
+
+        self.assertIs(registry.get("agent", loader, fingerprint=fingerprint, delta_loader=delta_loader), index)
+        self.assertEqual((len(loads), deltas), (1, ["2025-12-28T10:00:00+00:00"]))
+        self.assertEqual(index.search("instapay")[0]["id"], "2")
+        self.assertEqual(len(index), 2)
+
+    def test_removed_chunks_force_rebuild_after_delta(self):
+        rows = [{"id": str(i), "source_id": "s1", "content": f"chunk {i}", "created_at": "2025-12-28T10:00:00+00:00"} for i in range(3)]
+        loads = []
+        loader = lambda: loads.append(1) or list(rows)
+        fingerprint = lambda: f"{len(rows)}:2025-12-28T10:00:00+00:00:{len(rows)}"
+
+        registry = LexicalIndexRegistry(max_age=0)
+        registry.get("agent", loader, fingerprint=fingerprint, delta_loader=lambda since: [])
+        del rows[0]
+        index = registry.get("agent", loader, fingerprint=fingerprint, delta_loader=lambda since: [])
+        self.assertEqual((len(loads), len(index)), (2, 2))
+
+    def test_delta_compacts_before_snapshot(self):
+        rows = [{"id": str(i), "source_id": "s1", "content": f"chunk {i}", "created_at": "2025-12-28T10:00:00+00:00"} for i in range(3)]
+        fingerprint = lambda: f"{len(rows)}:{rows[-1]['created_at']}:{len(rows)}"
+        delta_loader = lambda since: [row for row in rows if row["created_at"] >= since]
+
+        with tempfile.TemporaryDirectory() as directory:
+            registry = LexicalIndexRegistry(max_age=0, snapshots=SnapshotStore(directory, TOKENIZER_VERSION))
+            index = registry.get("agent", lambda: list(rows), fingerprint=fingerprint, delta_loader=delta_loader)
+            rows.append({"id": "3", "source_id": "s1", "content": "chunk 3", "created_at": "2025-12-28T11:00:00+00:00"})
+            self.assertIs(registry.get("agent", lambda: list(rows), fingerprint=fingerprint, delta_loader=delta_loader), index)
+
+            snapshot = registry.snapshots.load("agent", fingerprint(), BM25Index)
+            self.assertEqual((len(snapshot), snapshot.dead_fraction()), (4, 0.0))
+
+    def test_parse_fingerprint(self):
+        self.assertEqual(parse_fingerprint("12:2025-12-28T10:00:00.5+00:00:-77"), (12, "2025-12-28T10:00:00.5+00:00"))
+        self.assertEqual(parse_fingerprint("0:None:0"), (0, None))
+        self.assertIsNone(parse_fingerprint("v1"))
+        self.assertIsNone(parse_fingerprint(None))
+
+    def test_invalidate_forces_rebuild(self):
+        calls = []
+        registry = LexicalIndexRegistry(max_age=60)
+        loader = lambda: calls.append(1) or []
+        registry.get("agent", loader)
+        registry.invalidate("agent")
+        registry.get("agent", loader)
+        self.assertEqual(len(calls), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+
+from knowledge.packing import attach_references, expand_to_parents, pack_context, pair_key, split_sentences, trim_to_budget
+from knowledge.tokens import estimate_tokens
+
+
+def _candidate(doc_id, content, score):
+    return {"id": doc_id, "source_id": "s-" + doc_id, "content": content, "score": score}
+
+
+class PackContextTest(unittest.TestCase):
+
+    def test_respects_budget(self):
+        candidates = [_candidate(str(i), "Shipping takes three days to Cairo. " * 10, 1.0 - i / 10) for i in range(6)]
+        packed = pack_context("shipping cairo", candidates, budget_tokens=100)
+        self.assertLessEqual(packed["tokens"], 100)
+        self.assertEqual(packed["tokens"], sum(item["tokens"] for item in packed["items"]))
+        self.assertEqual(packed["candidate_tokens"], sum(estimate_tokens(c["content"]) for c in candidates))
+
+    def test_mmr_skips_redundant_chunk_for_a_different_one(self):
+        refund = "Refunds are issued to the original card within five business days of approval."
+        candidates = [
+            _candidate("a", refund, 0.9),
+            _candidate("b", refund.replace("five", "5"), 0.89),
+            _candidate("c", "Exchanges are possible in any branch with the original receipt and tags.", 0.6),
+        ]
+        similarities = {pair_key("a", "b"): 0.99, pair_key("a", "c"): 0.2, pair_key("b", "c"): 0.2}
+        packed = pack_context("refund card", candidates, budget_tokens=40, similarities=similarities, min_fragment_tokens=5)
+        self.assertEqual([item["id"] for item in packed["items"]], ["a", "c"])
+
+    def test_chunk_that_does_not_fit_is_trimmed_to_matching_sentences(self):
+        content = "Our store opens at nine. Delivery to Giza costs 50 pounds. We love our customers."
+        packed = pack_context("delivery giza cost", [_candidate("a", content, 1.0)], budget_tokens=10, min_fragment_tokens=3)
+        self.assertEqual(len(packed["items"]), 1)
+        self.assertTrue(packed["items"][0]["trimmed"])
+        self.assertEqual(packed["items"][0]["content"], "Delivery to Giza costs 50 pounds.")
+
+    def test_empty_candidates(self):
+        self.assertEqual(pack_context("q", [], 100), {"items": [], "tokens": 0, "candidate_tokens": 0})
+
+
+class SentenceTrimTest(unittest.TestCase):
+
+    def test_split_sentences_handles_arabic_question_mark(self):
+        self.assertEqual(split_sentences("كم السعر؟ السعر ١٠٠ جنيه.\nشكرا"), ["كم السعر؟", "السعر ١٠٠ جنيه.", "شكرا"])
+
+    def test_trim_keeps_original_order(self):
+        text = "Alpha one. Beta refund. Gamma refund policy."
+        self.assertEqual(trim_to_budget(text, {"refund"}, 100), text)
+        self.assertEqual(trim_to_budget(text, {"refund", "policy"}, 4), "Gamma refund policy.")
+
+
+
+class ExpandToParentsTest(unittest.TestCase):
+
+    def test_siblings_collapse_into_one_parent(self):
+        candidates = [_candidate("a", "child a", 0.9), _candidate("b", "child b", 0.8), _candidate("c", "child c", 0.7)]
+        parents = {
+            "a": {"id": "p1", "content": "parent one"},
+            "c": {"id": "p1", "content": "parent one"},
+        }
+        expanded = expand_to_parents(candidates, parents)
+
+        self.assertEqual([item["id"] for item in expanded], ["a", "b"])
+        self.assertEqual(expanded[0]["content"], "parent one")
+        self.assertEqual(expanded[0]["parent_id"], "p1")
+        self.assertEqual(expanded[0]["children"], 2)
+        self.assertEqual(expanded[0]["score"], 0.9)
+        self.assertEqual(expanded[1]["content"], "child b")
+
+    def test_siblings_merge_their_referenced_sources(self):
+        candidates = attach_references(
+            [_candidate("a", "child a", 0.9), _candidate("c", "child c", 0.7)],
+            {"a": ["s2"], "c": ["s3", "s2"]},
+        )
+        expanded = expand_to_parents(candidates, {"a": {"id": "p1", "content": "parent"}, "c": {"id": "p1", "content": "parent"}})
+        self.assertEqual(expanded[0]["source_ids"], ["s-a", "s2", "s-c", "s3"])
+        self.assertEqual(pack_context("parent", expanded, 100)["items"][0]["source_ids"], expanded[0]["source_ids"])
+
+
+if __name__ == "__main__":
+    unittest.main()
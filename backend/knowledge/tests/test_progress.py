@@ -0,0 +1,60 @@
+import threading
+import unittest
+
+from knowledge.progress import LocalProgressBroker, ProgressPublisher
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class ProgressPublisherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.broker = LocalProgressBroker()
+        self.publisher = ProgressPublisher("job", self.broker, interval=1.0, clock=self.clock)
+
+    def test_chunk_updates_are_coalesced(self):
+        self.publisher.update("processing", 0, 1)
+        for chunk in range(1, 10001):
+            self.clock.now = chunk * 0.001  # 10k chunks over 10 seconds
+            self.publisher.update("processing", 0, 1, chunks_seen=chunk, chunks_embedded=chunk)
+        self.publisher.update("done", 1, 1, chunks_seen=10000, chunks_embedded=10000, force=True)
+
+        self.assertLessEqual(self.publisher.published, 10 + 2)
+        latest = self.broker.latest("job")
+        self.assertEqual(latest["status"], "done")
+        self.assertEqual(latest["chunks_embedded"], 10000)
+        self.assertEqual(latest["eta_seconds"], 0.0)
+
+    def test_source_changes_publish_immediately_with_eta(self):
+        self.publisher.update("processing", 0, 4)
+        self.clock.now = 10.0
+        self.publisher.update("processing", 1, 4)
+        self.clock.now = 10.1
+        self.assertTrue(self.publisher.update("processing", 2, 4))
+        self.assertAlmostEqual(self.broker.latest("job")["eta_seconds"], 10.1)
+
+
+class LocalProgressBrokerTest(unittest.TestCase):
+
+    def test_subscriber_receives_latest_and_timeouts(self):
+        broker = LocalProgressBroker()
+        events = broker.subscribe("job", timeout=0.01)
+        self.assertIsNone(next(events))
+
+        timer = threading.Timer(0.05, broker.publish, args=("job", {"status": "done"}))
+        timer.start()
+        received = next(event for event in events if event is not None)
+        timer.join()
+        self.assertEqual(received, {"status": "done"})
+
+
+if __name__ == "__main__":
+    unittest.main()
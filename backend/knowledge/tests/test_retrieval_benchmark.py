@@ -0,0 +1,112 @@
+import unittest
+
+from knowledge.lexical import LexicalIndexRegistry, lexical_indexes, parse_fingerprint
+from knowledge.packing import attach_references, expand_to_parents, pack_context
+from knowledge.retrieval_benchmark import (
+    HashingEmbeddingGenerator,
+    InMemoryKnowledgeRepo,
+    build_fixture_corpus,
+    diff_reports,
+    first_relevant_rank,
+    ingest,
+    ranking_metrics,
+)
+
+
+class FixtureCorpusTest(unittest.TestCase):
+
+    def test_corpus_is_deterministic_and_answers_are_unique(self):
+        sources, queries = build_fixture_corpus(num_sources=3, products_per_source=10, num_queries=20, seed=3)
+        self.assertEqual((sources, queries), build_fixture_corpus(num_sources=3, products_per_source=10, num_queries=20, seed=3))
+        paragraphs = [paragraph for source in sources for paragraph in source["text"].split("\n\n")]
+        for query in queries:
+            self.assertEqual(sum(query["answer"] in paragraph for paragraph in paragraphs), 1, query)
+
+    def test_hashing_embeddings_are_normalized_and_stable(self):
+        generator = HashingEmbeddingGenerator(dims=32)
+        vector = generator.generate_embedding("الشحن لمحافظة الإسكندرية")
+        self.assertAlmostEqual(sum(v * v for v in vector), 1.0)
+        self.assertEqual(vector, HashingEmbeddingGenerator(dims=32).generate_embedding("الشحن لمحافظه الاسكندريه"))
+
+
+class IngestionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.agent_id = "benchmark-test-agent"
+        lexical_indexes.invalidate(self.agent_id)
+
+    def tearDown(self):
+        lexical_indexes.invalidate(self.agent_id)
+
+    def test_ingest_stores_children_parents_and_search_tokens(self):
+        sources, queries = build_fixture_corpus(num_sources=3, products_per_source=10, num_queries=10)
+        repo = InMemoryKnowledgeRepo()
+        stats = ingest(sources, self.agent_id, repo, HashingEmbeddingGenerator(dims=32))
+
+        self.assertEqual(stats["embedded"], len(repo.embeddings))
+        self.assertEqual(len(repo.references), stats["duplicates"])
+        self.assertTrue(repo.parents)
+        self.assertTrue(all(row["search_tokens"] for row in repo.embeddings.values()))
+
+        query = queries[0]
+        embedding = HashingEmbeddingGenerator(dims=32).generate_embedding(query["text"])
+        matches = repo.vector_search_agent_embeddings(embedding, self.agent_id, None, match_count=len(repo.embeddings), similarity_threshold=-1)
+        self.assertIsNotNone(first_relevant_rank(matches, query["answer"]))
+        self.assertEqual(set(repo.get_parent_chunks([matches[0]["id"]])), {matches[0]["id"]})
+
+    def test_deduplicated_source_is_still_cited(self):
+        policy = "Returns are accepted within 14 days of delivery with the original receipt."
+        sources = [{"id": "s1", "text": policy}, {"id": "s2", "text": policy.upper()}]
+        repo = InMemoryKnowledgeRepo()
+        ingest(sources, self.agent_id, repo, HashingEmbeddingGenerator(dims=32))
+        self.assertEqual([row["source_id"] for row in repo.embeddings.values()], ["s1"])
+
+        stored = [{**row, "score": 1.0} for row in repo.embeddings.values()]
+        candidates = attach_references(stored, repo.get_chunk_references([row["id"] for row in stored]))
+        packed = pack_context("returns", expand_to_parents(candidates, repo.get_parent_chunks([row["id"] for row in stored])), 200)
+        self.assertIn("s2", {source_id for item in packed["items"] for source_id in item["source_ids"]})
+
+
+    def test_fingerprint_drives_the_delta_path(self):
+        sources, _ = build_fixture_corpus(num_sources=2, products_per_source=10, num_queries=1)
+        repo = InMemoryKnowledgeRepo()
+        generator = HashingEmbeddingGenerator(dims=32)
+        ingest(sources[:1], self.agent_id, repo, generator)
+        loads = []
+
+        def loader():
+            loads.append(1)
+            return repo.iter_agent_chunks(self.agent_id)
+
+        registry = LexicalIndexRegistry(max_age=0)
+        kwargs = {
+            "fingerprint": lambda: repo.get_agent_chunk_fingerprint(self.agent_id),
+            "delta_loader": lambda since: repo.iter_agent_chunks(self.agent_id, created_since=since),
+        }
+        index = registry.get(self.agent_id, loader, **kwargs)
+        self.assertEqual(parse_fingerprint(repo.get_agent_chunk_fingerprint(self.agent_id))[0], len(index))
+
+        ingest(sources[1:], self.agent_id, repo, generator)
+        updated = registry.get(self.agent_id, loader, **kwargs)
+
+        self.assertIs(updated, index)
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(len(updated), len(repo.embeddings))
+
+
+class MetricsTest(unittest.TestCase):
+
+    def test_rank_and_ranking_metrics(self):
+        results = [{"content": "Shipping to Giza takes 2 days"}, {"content": "موديل HO-١٠٣١ متاح"}]
+        self.assertEqual(first_relevant_rank(results, "HO-1031"), 2)
+        self.assertIsNone(first_relevant_rank(results, "Aswan"))
+        self.assertEqual(ranking_metrics([1, 2, None, 6], top_k=5), {"recall@5": 0.5, "mrr": 0.375, "queries": 4})
+
+    def test_diff_reports_lists_changed_numbers_only(self):
+        baseline = {"search": {"mrr": 0.5, "by_kind": {"a": {"mrr": 1.0}}}, "config": {"seed": 7}}
+        current = {"search": {"mrr": 0.75, "by_kind": {"a": {"mrr": 1.0}}}, "config": {"seed": 7}}
+        self.assertEqual(diff_reports(baseline, current), {"search.mrr": {"baseline": 0.5, "current": 0.75, "delta": 0.25}})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+import os
+import tempfile
+import unittest
+
+from knowledge.lexical import TOKENIZER_VERSION, BM25Index, LexicalIndexRegistry
+from knowledge.snapshot import SnapshotStore, read_snapshot, write_snapshot
+
+ROWS = [
+    {"id": "1", "source_id": "s1", "content": "Shipping takes 3 days inside Cairo."},
+    {"id": "2", "source_id": "s1", "content": "Returns are accepted within 14 days of delivery."},
+    {"id": "3", "source_id": "s2", "content": "الشحن مجاني للطلبات فوق ٥٠٠ جنيه"},
+]
+
+
+def build_index(rows=ROWS):
+    index = BM25Index()
+    for row in rows:
+        index.add_document(row["id"], row["source_id"], row["content"])
+    return index
+
+
+class SnapshotFormatTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "agent.tkix")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip_matches_original(self):
+        original = build_index()
+        original.remove_document("2")
+        write_snapshot(self.path, original, "fp", TOKENIZER_VERSION)
+        loaded = read_snapshot(self.path, "fp", TOKENIZER_VERSION, BM25Index)
+
+        self.assertEqual(len(loaded), 2)
+        for query in ("shipping to cairo", "هل الشحن مجاني؟", "returns"):
+            self.assertEqual(loaded.search(query), original.search(query))
+
+    def test_loaded_index_accepts_updates(self):
+        write_snapshot(self.path, build_index(), "fp", TOKENIZER_VERSION)
+        loaded = read_snapshot(self.path, "fp", TOKENIZER_VERSION, BM25Index)
+        loaded.add_document("4", "s3", "Warranty covers two years.")
+        loaded.add_document("1", "s1", "Shipping is free this week.")
+
+        self.assertEqual(loaded.search("warranty")[0]["content"], "Warranty covers two years.")
+        self.assertEqual(loaded.search("shipping")[0]["content"], "Shipping is free this week.")
+
+    def test_loaded_index_reads_the_map_without_copying(self):
+        write_snapshot(self.path, build_index(), "fp", TOKENIZER_VERSION)
+        loaded = read_snapshot(self.path, "fp", TOKENIZER_VERSION, BM25Index)
+        term_id = loaded._term_ids.get("shipping")
+
+        self.assertIsInstance(loaded._postings_docs[term_id], memoryview)
+        self.assertIsInstance(loaded._doc_lengths, memoryview)
+        self.assertIsNone(loaded._term_ids.get("warranty"))
+        self.assertEqual(loaded.search("shipping")[0]["id"], "1")
+        self.assertIsNone(loaded._key_to_doc)
+
+    def test_resaved_loaded_index_round_trips(self):
+        write_snapshot(self.path, build_index(), "fp", TOKENIZER_VERSION)
+        loaded = read_snapshot(self.path, "fp", TOKENIZER_VERSION, BM25Index)
+        loaded.add_document("4", "s3", "Warranty covers shipping damage.")
+        loaded.remove_document("2")
+        second_path = os.path.join(self.directory.name, "second.tkix")
+        write_snapshot(second_path, loaded, "fp2", TOKENIZER_VERSION)
+        reloaded = read_snapshot(second_path, "fp2", TOKENIZER_VERSION, BM25Index)
+
+        self.assertEqual(len(reloaded), 3)
+        for query in ("warranty", "shipping", "returns", "هل الشحن مجاني؟"):
+            self.assertEqual(reloaded.search(query), loaded.search(query))
+
+    def test_mismatches_return_none(self):
+        write_snapshot(self.path, build_index(), "fp", TOKENIZER_VERSION)
+        self.assertIsNone(read_snapshot(self.path, "other", TOKENIZER_VERSION, BM25Index))
+        self.assertIsNone(read_snapshot(self.path, "fp", TOKENIZER_VERSION + 1, BM25Index))
+        self.assertIsNone(read_snapshot(os.path.join(self.directory.name, "missing"), "fp", TOKENIZER_VERSION, BM25Index))
+
+    def test_corrupt_file_returns_none(self):
+        with open(self.path, "wb") as handle:
+            handle.write(b"TKIX\x01\x00\x00\x00garbage")
+        self.assertIsNone(read_snapshot(self.path, "fp", TOKENIZER_VERSION, BM25Index))
+
+
+class RegistrySnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = SnapshotStore(self.directory.name, TOKENIZER_VERSION)
+        self.loads = 0
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def loader(self):
+        self.loads += 1
+        return ROWS
+
+    def test_second_process_loads_snapshot_instead_of_rebuilding(self):
+        LexicalIndexRegistry(snapshots=self.store).get("a", self.loader, fingerprint=lambda: "v1")
+        index = LexicalIndexRegistry(snapshots=self.store).get("a", self.loader, fingerprint=lambda: "v1")
+
+        self.assertEqual(self.loads, 1)
+        self.assertEqual(index.search("cairo")[0]["id"], "1")
+
+    def test_changed_fingerprint_rebuilds(self):
+        LexicalIndexRegistry(snapshots=self.store).get("a", self.loader, fingerprint=lambda: "v1")
+        LexicalIndexRegistry(snapshots=self.store).get("a", self.loader, fingerprint=lambda: "v2")
+        self.assertEqual(self.loads, 2)
+
+    def test_expired_index_with_unchanged_fingerprint_is_kept(self):
+        registry = LexicalIndexRegistry(max_age=0, snapshots=self.store)
+        first = registry.get("a", self.loader, fingerprint=lambda: "v1")
+        second = registry.get("a", self.loader, fingerprint=lambda: "v1")
+        self.assertIs(first, second)
+        self.assertEqual(self.loads, 1)
+
+    def test_invalidate_deletes_snapshot(self):
+        registry = LexicalIndexRegistry(snapshots=self.store)
+        registry.get("a", self.loader, fingerprint=lambda: "v1")
+        self.assertTrue(os.path.exists(self.store.path("a")))
+        registry.invalidate("a")
+        self.assertFalse(os.path.exists(self.store.path("a")))
+
+
+if __name__ == "__main__":
+    unittest.main()
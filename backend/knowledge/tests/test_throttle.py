@@ -0,0 +1,60 @@
+import unittest
+
+from knowledge.throttle import BACKGROUND, INTERACTIVE, EmbeddingThrottle, LocalBucketStore, ThrottleTimeout
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class EmbeddingThrottleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.store = LocalBucketStore(clock=self.clock)
+
+    def throttle(self, rpm=60, tpm=6000, **kwargs):
+        return EmbeddingThrottle("test", rpm=rpm, tpm=tpm, store=self.store, sleep=self.clock.sleep, **kwargs)
+
+    def test_waits_for_token_budget_to_refill(self):
+        throttle = self.throttle(background_reserve=0.0)
+        self.assertEqual(throttle.acquire(6000, BACKGROUND), 0.0)
+        # 600 tokens refill in 6 seconds at 6000 TPM.
+        self.assertAlmostEqual(throttle.acquire(600, BACKGROUND), 6.0)
+
+    def test_background_leaves_reserve_for_interactive(self):
+        throttle = self.throttle(background_reserve=0.5, max_wait={BACKGROUND: 0.0})
+        throttle.acquire(3000, BACKGROUND)
+        with self.assertRaises(ThrottleTimeout):
+            throttle.acquire(100, BACKGROUND)
+        self.assertEqual(throttle.acquire(2500, INTERACTIVE), 0.0)
+
+    def test_rpm_limits_small_requests(self):
+        throttle = self.throttle(rpm=2, max_wait={INTERACTIVE: 1.0})
+        throttle.acquire(1)
+        throttle.acquire(1)
+        with self.assertRaises(ThrottleTimeout) as raised:
+            throttle.acquire(1)
+        self.assertAlmostEqual(raised.exception.wait_seconds, 30.0)
+
+    def test_oversized_batch_is_clamped_to_usable_budget(self):
+        throttle = self.throttle(background_reserve=0.2)
+        self.assertEqual(throttle.acquire(50000, BACKGROUND), 0.0)
+
+    def test_penalty_pauses_background_only(self):
+        throttle = self.throttle()
+        throttle.penalize(retry_after=4.0)
+        self.assertEqual(throttle.acquire(10, INTERACTIVE), 0.0)
+        self.assertAlmostEqual(throttle.acquire(10, BACKGROUND), 4.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,196 @@
+"""
+Rate governor for embedding calls to the model provider.
+
+Two token buckets per provider/model, refilled continuously over a minute:
+one for requests (RPM) and one for input tokens (TPM). Every embedding call
+takes from both before it is sent and waits until they can cover it.
+
+- Priority: background work (ingestion, retrains) may only draw the buckets
+  down to `background_reserve` of their capacity, so interactive query
+  embeddings for live chat always find headroom.
+- Provider 429s: instead of counting as an outage, a 429 puts background
+  callers into a shared cooldown for the provider's retry-after.
+- Sharing: with a Redis client, buckets and cooldown live in Redis and are
+  updated atomically by a Lua script, so every web and kb_worker process
+  spends the same budget. Without Redis (or if it fails), each process falls
+  back to local buckets.
+"""
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+_WINDOW_SECONDS = 60.0
+
+
+class ThrottleTimeout(Exception):
+    """
+    Raised when a call could not get budget within its maximum wait.
+    """
+    def __init__(self, priority: str, wait_seconds: float):
+        super().__init__(f"Embedding budget exhausted for {priority} work (next slot in {wait_seconds:.1f}s).")
+        self.priority = priority
+        self.wait_seconds = wait_seconds
+
+
+def _refill(level: float, updated_at: float, capacity: float, now: float) -> float:
+    return min(capacity, level + max(0.0, now - updated_at) * capacity / _WINDOW_SECONDS)
+
+
+class LocalBucketStore:
+    """
+    In-process buckets with the same semantics as the Redis script.
+    """
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, Tuple[float, float, float]] = {}  # key -> (rpm level, tpm level, updated_at)
+        self._cooldowns: Dict[str, float] = {}
+
+    def take(self, key: str, rpm: int, tpm: int, tokens: int, reserve: float, honor_cooldown: bool) -> float:
+        with self._lock:
+            now = self._clock()
+            if honor_cooldown and self._cooldowns.get(key, 0.0) > now:
+                return self._cooldowns[key] - now
+            rpm_level, tpm_level, updated_at = self._buckets.get(key, (rpm, tpm, now))
+            rpm_level = _refill(rpm_level, updated_at, rpm, now)
+            tpm_level = _refill(tpm_level, updated_at, tpm, now)
+            wait = max(
+                (1 + reserve * rpm - rpm_level) * _WINDOW_SECONDS / rpm,
+                (tokens + reserve * tpm - tpm_level) * _WINDOW_SECONDS / tpm,
+                0.0,
+            )
+            if wait <= 0:
+                rpm_level -= 1
+                tpm_level -= tokens
+            self._buckets[key] = (rpm_level, tpm_level, now)
+            return wait
+
+    def cool_down(self, key: str, seconds: float) -> None:
+        with self._lock:
+            until = self._clock() + seconds
+            self._cooldowns[key] = max(self._cooldowns.get(key, 0.0), until)
+
+
+# KEYS: bucket hash, cooldown key. ARGV: rpm, tpm, tokens, reserve, honor_cooldown.
+# Returns the wait in seconds as a string (Lua numbers are truncated to integers on return).
+_TAKE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local rpm, tpm = tonumber(ARGV[1]), tonumber(ARGV[2])
+local tokens, reserve = tonumber(ARGV[3]), tonumber(ARGV[4])
+if ARGV[5] == '1' then
+  local until_ts = tonumber(redis.call('GET', KEYS[2]) or '0')
+  if until_ts > now then return tostring(until_ts - now) end
+end
+local b = redis.call('HMGET', KEYS[1], 'rpm', 'tpm', 'ts')
+local ts = tonumber(b[3]) or now
+local elapsed = math.max(0, now - ts)
+local r = math.min(rpm, (tonumber(b[1]) or rpm) + elapsed * rpm / 60)
+local k = math.min(tpm, (tonumber(b[2]) or tpm) + elapsed * tpm / 60)
+local wait = math.max((1 + reserve * rpm - r) * 60 / rpm, (tokens + reserve * tpm - k) * 60 / tpm, 0)
+if wait <= 0 then
+  r = r - 1
+  k = k - tokens
+end
+redis.call('HSET', KEYS[1], 'rpm', r, 'tpm', k, 'ts', now)
+redis.call('EXPIRE', KEYS[1], 120)
+return tostring(wait)
+"""
+
+_COOL_DOWN_SCRIPT = """
+local t = redis.call('TIME')
+local until_ts = tonumber(t[1]) + tonumber(t[2]) / 1000000 + tonumber(ARGV[1])
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+if until_ts > current then
+  redis.call('SET', KEYS[1], tostring(until_ts), 'EX', math.ceil(tonumber(ARGV[1])) + 1)
+end
+return 1
+"""
+
+
+class RedisBucketStore:
+    """
+    Buckets shared by all processes through Redis. Falls back to `fallback`
+    (local buckets) whenever Redis errors, so a Redis outage never blocks embeddings.
+    """
+    def __init__(self, client, prefix: str = "embedding_throttle", fallback: Optional[LocalBucketStore] = None):
+        self.client = client
+        self.prefix = prefix
+        self.fallback = fallback or LocalBucketStore()
+        self._take = client.register_script(_TAKE_SCRIPT)
+        self._cool_down = client.register_script(_COOL_DOWN_SCRIPT)
+
+    def take(self, key: str, rpm: int, tpm: int, tokens: int, reserve: float, honor_cooldown: bool) -> float:
+        try:
+            wait = self._take(
+                keys=[f"{self.prefix}:{key}:buckets", f"{self.prefix}:{key}:cooldown"],
+                args=[rpm, tpm, tokens, reserve, "1" if honor_cooldown else "0"],
+            )
+            return float(wait)
+        except Exception as e:
+            logger.warning(f"Redis embedding throttle unavailable, using local buckets: {e}")
+            return self.fallback.take(key, rpm, tpm, tokens, reserve, honor_cooldown)
+
+    def cool_down(self, key: str, seconds: float) -> None:
+        self.fallback.cool_down(key, seconds)
+        try:
+            self._cool_down(keys=[f"{self.prefix}:{key}:cooldown"], args=[seconds])
+        except Exception as e:
+            logger.warning(f"Could not share embedding cooldown through Redis: {e}")
+
+
+class EmbeddingThrottle:
+    """
+    Blocks embedding calls until the shared RPM/TPM budget allows them.
+    """
+    def __init__(
+        self,
+        key: str,
+        rpm: int,
+        tpm: int,
+        store=None,
+        background_reserve: float = 0.2,
+        max_wait: Optional[Dict[str, float]] = None,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.key = key
+        self.rpm = max(1, rpm)
+        self.tpm = max(1, tpm)
+        self.store = store or LocalBucketStore()
+        self.background_reserve = background_reserve
+        self.max_wait = {INTERACTIVE: 5.0, BACKGROUND: 300.0, **(max_wait or {})}
+        self._sleep = sleep
+
+    def acquire(self, tokens: int, priority: str = INTERACTIVE) -> float:
+        """
+        Waits until `tokens` input tokens and one request fit the budget for
+        `priority` and takes them. Returns the seconds spent waiting; raises
+        ThrottleTimeout if that would exceed the priority's max wait.
+        """
+        background = priority == BACKGROUND
+        reserve = self.background_reserve if background else 0.0
+        # A single batch larger than the usable budget would never fit; let it
+        # through once the bucket is as full as it can get.
+        tokens = min(max(1, tokens), int(self.tpm * (1 - reserve)))
+        waited = 0.0
+        while True:
+            wait = self.store.take(self.key, self.rpm, self.tpm, tokens, reserve, background)
+            if wait <= 0:
+                return waited
+            if waited + wait > self.max_wait[priority]:
+                raise ThrottleTimeout(priority, wait)
+            self._sleep(wait)
+            waited += wait
+
+    def penalize(self, retry_after: Optional[float]) -> None:
+        """
+        Records a provider 429: background callers pause for `retry_after`
+        seconds (default one second) across all processes sharing the store.
+        """
+        self.store.cool_down(self.key, retry_after if retry_after and retry_after > 0 else 1.0)
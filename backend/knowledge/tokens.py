@@ -0,0 +1,32 @@
+"""
+Cheap, dependency-free token estimates for chunk sizing and prompt budgets.
+
+Counts follow the shape of OpenAI's BPE closely enough for budgeting: every
+punctuation mark is a token and words cost one token per ~6 characters
+(English words are usually one token, long or Arabic words split into several).
+"""
+import re
+from typing import Iterator, Tuple
+
+TOKEN_PIECE_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+CHARS_PER_WORD_TOKEN = 6
+
+
+def piece_tokens(piece_length: int) -> int:
+    return 1 + (piece_length - 1) // CHARS_PER_WORD_TOKEN
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    return sum(piece_tokens(m.end() - m.start()) for m in TOKEN_PIECE_RE.finditer(text))
+
+
+def iter_token_pieces(text: str, pos: int = 0) -> Iterator[Tuple[int, int, int]]:
+    """
+    Yields (start, end, tokens) for every word/punctuation piece of `text` from `pos`.
+    """
+    for match in TOKEN_PIECE_RE.finditer(text, pos):
+        start, end = match.span()
+        yield start, end, piece_tokens(end - start)
@@ -1,9 +1,12 @@
 from django.urls import path
-from knowledge.views import KnowledgeIngestView, RetrainKnowledgeView # Corrected import
+from knowledge.views import KnowledgeIngestView, RetrainKnowledgeView, KnowledgeSourceEmbeddingsView, KbJobStatusView, KbJobEventsView
 
 urlpatterns = [
     path('v1/knowledge/ingest', KnowledgeIngestView.as_view(), name='knowledge_ingest'),
     path('v1/knowledge/retrain', RetrainKnowledgeView.as_view(), name='knowledge_retrain'), # Added retrain endpoint
+    path('v1/knowledge/sources/<uuid:source_id>/embeddings', KnowledgeSourceEmbeddingsView.as_view(), name='knowledge_source_embeddings'),
+    path('v1/knowledge/jobs/<uuid:job_id>', KbJobStatusView.as_view(), name='knowledge_job_status'),
+    path('v1/knowledge/jobs/<uuid:job_id>/events', KbJobEventsView.as_view(), name='knowledge_job_events'),
 ]
 
 
@@ -2,17 +2,37 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework import exceptions
+from rest_framework import serializers
+from django.core.exceptions import ImproperlyConfigured
+from django.http import StreamingHttpResponse
 
 from core.auth import SupabaseJWTAuthentication
 from core.permissions import IsWorkspaceMember
-from knowledge.ingest import trigger_ingestion_job # Import the new function
 from knowledge.supabase_repo import KnowledgeSupabaseRepo # Renamed from SupabaseRepo
+from knowledge.job_queue import progress_broker
+from knowledge.progress import TERMINAL_STATUSES
 
+import os
+import time
 import uuid
+import json
 import logging
 
 logger = logging.getLogger(__name__)
 
+# kb_jobs rows are written with the service-role key only (members can read them),
+# after the view has checked the job's agent/source against the caller's workspace.
+SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+
+KB_JOB_STREAM_KEEPALIVE_SECONDS = float(os.getenv("KB_JOB_STREAM_KEEPALIVE_SECONDS", "15"))
+KB_JOB_STREAM_MAX_SECONDS = float(os.getenv("KB_JOB_STREAM_MAX_SECONDS", "900"))
+
+def _kb_job_repo() -> KnowledgeSupabaseRepo:
+    if not SUPABASE_SERVICE_ROLE_KEY:
+        raise ImproperlyConfigured("SUPABASE_SERVICE_ROLE_KEY is required to queue kb_jobs.")
+    return KnowledgeSupabaseRepo(SUPABASE_SERVICE_ROLE_KEY)
+
+
 class KnowledgeIngestView(APIView):
     """
     API endpoint to trigger knowledge ingestion for a given source.
@@ -48,20 +68,16 @@ class KnowledgeIngestView(APIView):
             if agent_id and str(source.get('agent_id')) != str(agent_id):
                  return Response({"detail": "Knowledge source does not belong to this agent."}, status=status.HTTP_403_FORBIDDEN)
 
-            # Trigger the ingestion job (now a function)
-            # This should ideally be async/background task for long-running ingestions
-            trigger_ingestion_job(
-                source_id=uuid.UUID(source_id),
-                agent_id=uuid.UUID(agent_id), # Ensure agent_id is passed as UUID
-                workspace_id=workspace_id,
-                user_jwt=user_jwt
-            )
-            
-            # Update source status to 'processing' immediately (moved from ingest.py)
-            repo.update_knowledge_source_status(uuid.UUID(source_id), "processing")
+            if not agent_id:
+                agent_id = source.get('agent_id')
 
+            # Queue the ingestion; a kb_worker process picks it up (see knowledge.worker)
+            repo.update_knowledge_source_status(uuid.UUID(source_id), "processing")
+            job_id = _kb_job_repo().create_kb_job(
+                uuid.UUID(str(agent_id)), 'ingest', 'queued', workspace_id, payload={"source_id": str(source_id)}
+            )
 
-            return Response({"message": "Ingestion job triggered successfully.", "source_id": source_id}, status=status.HTTP_202_ACCEPTED)
+            return Response({"message": "Ingestion job queued successfully.", "source_id": source_id, "job_id": str(job_id)}, status=status.HTTP_202_ACCEPTED)
         except ValueError:
             return Response({"detail": "Invalid UUID format for source_id or agent_id."}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
@@ -96,27 +112,173 @@ class RetrainKnowledgeView(APIView):
         repo = KnowledgeSupabaseRepo(user_jwt=user_jwt)
 
         try:
+            if not repo.agent_in_workspace(agent_id, workspace_id):
+                return Response({"detail": "Agent not found in this workspace."}, status=status.HTTP_404_NOT_FOUND)
+
             # Concurrency Guard: Check for active retrain jobs for this agent
-            active_job = repo.get_active_kb_job(agent_id, 'retrain') # Need to implement get_active_kb_job
+            active_job = repo.get_active_kb_job(agent_id, 'retrain')
             if active_job:
                 return Response(
                     {"detail": f"Retrain job for agent {agent_id} is already in {active_job['status']} state.", "job_id": str(active_job['id'])},
                     status=status.HTTP_409_CONFLICT # 409 Conflict
                 )
             
-            # Create kb_jobs entry
-            job_id = repo.create_kb_job(agent_id, 'retrain', 'queued') # Need to implement create_kb_job
-
-            # Trigger the asynchronous retrain job in the background
-            # Note: The `retrain_agent_knowledge` function itself is async.
-            # Using ThreadPoolExecutor's submit returns a Future object immediately.
-            # The actual async function execution might need a custom async executor or Celery/etc.
-            # For simplicity, we're calling it in a thread.
-            background_executor.submit(
-                lambda: retrain_agent_knowledge(agent_id, workspace_id, user_jwt, job_id)
-            )
+            # Create kb_jobs entry; a kb_worker process picks it up (see knowledge.worker)
+            job_id = _kb_job_repo().create_kb_job(agent_id, 'retrain', 'queued', workspace_id)
 
             return Response({"message": "Retrain job initiated successfully.", "job_id": str(job_id)}, status=status.HTTP_202_ACCEPTED)
         except Exception as e:
             logger.error(f"Error initiating retrain job for agent {agent_id}: {e}", exc_info=True)
-            return Response({"detail": f"Internal server error: {e}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+            return Response({"detail": f"Internal server error: {e}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class KnowledgeSourceEmbeddingsView(APIView):
+    """
+    Source-scoped knowledge maintenance, queued as a 'reindex' kb_job:
+    PUT re-extracts and re-embeds one source, DELETE only removes its chunks.
+    Poll the returned job with KbJobStatusView.
+    """
+    authentication_classes = [SupabaseJWTAuthentication]
+    permission_classes = [IsWorkspaceMember]
+
+    def put(self, request, source_id, *args, **kwargs):
+        return self._queue(request, source_id, reembed=True)
+
+    def delete(self, request, source_id, *args, **kwargs):
+        return self._queue(request, source_id, reembed=False)
+
+    def _queue(self, request, source_id: uuid.UUID, reembed: bool):
+        user_jwt = request.auth
+        workspace_id = request.workspace_id
+
+        if not request.user.user_id or not user_jwt or not workspace_id:
+            raise exceptions.AuthenticationFailed("Authentication or workspace context missing.")
+
+        repo = KnowledgeSupabaseRepo(user_jwt=user_jwt)
+        try:
+            source = repo.get_knowledge_source(source_id)
+            if not source:
+                return Response({"detail": "Knowledge source not found or not accessible."}, status=status.HTTP_404_NOT_FOUND)
+            if str(source.get('workspace_id')) != str(workspace_id):
+                return Response({"detail": "Knowledge source does not belong to this workspace."}, status=status.HTTP_403_FORBIDDEN)
+
+            agent_id = uuid.UUID(str(source.get('agent_id')))
+            active_job = repo.get_active_kb_job(agent_id, 'reindex', source_id=source_id)
+            if active_job:
+                return Response(
+                    {"detail": f"Reindex job for source {source_id} is already in {active_job['status']} state.", "job_id": str(active_job['id'])},
+                    status=status.HTTP_409_CONFLICT
+                )
+
+            if reembed:
+                repo.update_knowledge_source_status(source_id, "processing")
+            job_id = _kb_job_repo().create_kb_job(
+                agent_id, 'reindex', 'queued', workspace_id, payload={"source_id": str(source_id), "reembed": reembed}
+            )
+
+            return Response({"message": "Reindex job queued successfully." if reembed else "Source removal job queued successfully.",
+                             "source_id": str(source_id), "job_id": str(job_id)}, status=status.HTTP_202_ACCEPTED)
+        except Exception as e:
+            logger.error(f"Error queueing reindex job for source {source_id}: {e}", exc_info=True)
+            return Response({"detail": f"Internal server error: {e}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class KbJobStatusView(APIView):
+    """
+    Returns a kb_job's status, progress (processed/total sources) and stats.
+    """
+    authentication_classes = [SupabaseJWTAuthentication]
+    permission_classes = [IsWorkspaceMember]
+
+    def get(self, request, job_id, *args, **kwargs):
+        if not request.auth or not request.workspace_id:
+            raise exceptions.AuthenticationFailed("Authentication or workspace context missing.")
+
+        job = KnowledgeSupabaseRepo(user_jwt=request.auth).get_kb_job(job_id)
+        if not job:
+            return Response({"detail": "Job not found or not accessible."}, status=status.HTTP_404_NOT_FOUND)
+
+        total = job.get("total_sources") or 0
+        processed = job.get("processed_sources") or 0
+        job["progress"] = round(processed / total, 4) if total else (1.0 if job["status"] == "done" else 0.0)
+        return Response(job, status=status.HTTP_200_OK)
+
+
+def _job_row_event(job: dict) -> dict:
+    """
+    Progress event built from a kb_jobs row, for when no live snapshot exists.
+    """
+    stats = job.get("stats") or {}
+    return {
+        "job_id": str(job["id"]),
+        "status": job["status"],
+        "sources_processed": job.get("processed_sources"),
+        "sources_total": job.get("total_sources"),
+        "chunks_seen": stats.get("chunks", 0),
+        "chunks_embedded": stats.get("embedded", 0),
+        "cache_hits": stats.get("duplicates", 0),
+        "elapsed_seconds": None,
+        "eta_seconds": 0.0 if job["status"] in TERMINAL_STATUSES else None,
+        **({"error": job["error"]} if job.get("error") else {}),
+    }
+
+
+def _sse(event: dict) -> str:
+    return f"event: progress\ndata: {json.dumps(event)}\n\n"
+
+
+class KbJobEventsView(APIView):
+    """
+    Streams a kb_job's progress as server-sent `progress` events until it is
+    done or failed, instead of the UI polling kb_jobs. Events come from the
+    worker through knowledge.job_queue.progress_broker and are coalesced there;
+    the kb_jobs row is only read on connect and on keep-alive timeouts.
+    """
+    authentication_classes = [SupabaseJWTAuthentication]
+    permission_classes = [IsWorkspaceMember]
+
+    def get(self, request, job_id, *args, **kwargs):
+        if not request.auth or not request.workspace_id:
+            raise exceptions.AuthenticationFailed("Authentication or workspace context missing.")
+
+        repo = KnowledgeSupabaseRepo(user_jwt=request.auth)
+        job = repo.get_kb_job(job_id)  # Also enforces RLS access to the job
+        if not job:
+            return Response({"detail": "Job not found or not accessible."}, status=status.HTTP_404_NOT_FOUND)
+        job_key = str(job_id)
+
+        def stream_generator():
+            events = progress_broker.subscribe(job_key, timeout=KB_JOB_STREAM_KEEPALIVE_SECONDS)
+            try:
+                event = _job_row_event(job)
+                if job["status"] not in TERMINAL_STATUSES:
+                    event = progress_broker.latest(job_key) or event
+                yield _sse(event)
+                if event["status"] in TERMINAL_STATUSES:
+                    return
+
+                deadline = time.monotonic() + KB_JOB_STREAM_MAX_SECONDS
+                for event in events:
+                    if event is None:
+                        # Nothing published: the job may have finished in a process we cannot hear.
+                        row = repo.get_kb_job(job_id)
+                        if row and row["status"] in TERMINAL_STATUSES:
+                            yield _sse(_job_row_event(row))
+                            return
+                        yield ": keepalive\n\n"
+                    else:
+                        yield _sse(event)
+                        if event["status"] in TERMINAL_STATUSES:
+                            return
+                    if time.monotonic() > deadline:
+                        return  # EventSource clients reconnect
+            except Exception as e:
+                logger.error(f"Error streaming progress for kb_job {job_id}: {e}", exc_info=True)
+                yield f"event: error\ndata: {json.dumps({'message': 'Progress stream interrupted.', 'code': 'STREAM_ERROR'})}\n\n"
+            finally:
+                events.close()
+
+        response = StreamingHttpResponse(stream_generator(), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
@@ -0,0 +1,167 @@
+"""
+Standalone kb_jobs worker. Run one or more with `python manage.py kb_worker`.
+
+Each worker claims one job at a time from the Postgres queue (knowledge.job_queue),
+runs its handler with the service-role key (workers act on behalf of the
+workspace that queued the job, outside any user request) and records the
+outcome. Handlers return the job's stats dict (or None) and raise to request
+a retry.
+"""
+import logging
+import os
+import socket
+import threading
+import uuid
+from typing import Callable, Dict, Optional
+
+from django.db import close_old_connections
+
+from knowledge import job_queue
+from knowledge.ingest import reindex_source, trigger_ingestion_job
+from knowledge.jobs import retrain_agent_knowledge
+from knowledge.progress import ProgressPublisher
+from knowledge.supabase_repo import KnowledgeSupabaseRepo
+
+logger = logging.getLogger(__name__)
+
+SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+KB_WORKER_POLL_SECONDS = float(os.getenv("KB_WORKER_POLL_SECONDS", "2"))
+KB_WORKER_RECOVER_SECONDS = float(os.getenv("KB_WORKER_RECOVER_SECONDS", "30"))
+
+
+def _run_ingest(job: Dict, progress: job_queue.JobProgress):
+    progress.update(0, 1)
+    stats = trigger_ingestion_job(
+        source_id=uuid.UUID(job["payload"]["source_id"]),
+        agent_id=uuid.UUID(job["agent_id"]),
+        workspace_id=uuid.UUID(job["workspace_id"]),
+        user_jwt=SUPABASE_SERVICE_ROLE_KEY,
+        chunk_progress=progress.add_chunks,
+    )
+    progress.update(1, 1)
+    return stats
+
+
+def _give_up_ingest(job: Dict):
+    KnowledgeSupabaseRepo(SUPABASE_SERVICE_ROLE_KEY).update_knowledge_source_status(
+        uuid.UUID(job["payload"]["source_id"]), "failed"
+    )
+
+
+def _run_reindex(job: Dict, progress: job_queue.JobProgress):
+    progress.update(0, 1)
+    stats = reindex_source(
+        source_id=uuid.UUID(job["payload"]["source_id"]),
+        agent_id=uuid.UUID(job["agent_id"]),
+        workspace_id=uuid.UUID(job["workspace_id"]),
+        user_jwt=SUPABASE_SERVICE_ROLE_KEY,
+        reembed=job["payload"].get("reembed", True),
+        chunk_progress=progress.add_chunks,
+    )
+    progress.update(1, 1)
+    return stats
+
+
+def _give_up_reindex(job: Dict):
+    if job["payload"].get("reembed", True):
+        _give_up_ingest(job)
+
+
+def _run_retrain(job: Dict, progress: job_queue.JobProgress):
+    return retrain_agent_knowledge(
+        agent_id=uuid.UUID(job["agent_id"]),
+        workspace_id=uuid.UUID(job["workspace_id"]),
+        user_jwt=SUPABASE_SERVICE_ROLE_KEY,
+        progress=progress.update,
+        chunk_progress=progress.add_chunks,
+    )
+
+
+JOB_HANDLERS: Dict[str, Callable[[Dict, job_queue.JobProgress], Optional[Dict]]] = {
+    "ingest": _run_ingest,
+    "reindex": _run_reindex,
+    "retrain": _run_retrain,
+}
+
+# Called once a job has failed for the last time.
+GIVE_UP_HANDLERS: Dict[str, Callable[[Dict], None]] = {
+    "ingest": _give_up_ingest,
+    "reindex": _give_up_reindex,
+}
+
+
+class KnowledgeJobWorker:
+    def __init__(self, worker_id: str = None, poll_interval: float = KB_WORKER_POLL_SECONDS,
+                 workspace_concurrency: int = job_queue.KB_JOB_WORKSPACE_CONCURRENCY,
+                 recover_interval: float = KB_WORKER_RECOVER_SECONDS):
+        if not SUPABASE_SERVICE_ROLE_KEY:
+            raise ValueError("SUPABASE_SERVICE_ROLE_KEY is required to run kb_jobs workers.")
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.poll_interval = poll_interval
+        self.workspace_concurrency = workspace_concurrency
+        self.recover_interval = recover_interval
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self, once: bool = False) -> int:
+        """
+        Processes jobs until stop() is called (or, with `once`, until the queue
+        has no runnable job). Returns the number of jobs processed.
+        """
+        processed = 0
+        since_recover = self.recover_interval  # sweep on startup
+        while not self._stop.is_set():
+            close_old_connections()
+            if since_recover >= self.recover_interval:
+                job_queue.recover_stale_jobs()
+                since_recover = 0.0
+
+            job = job_queue.claim_next_job(self.worker_id, self.workspace_concurrency)
+            if job is None:
+                if once:
+                    break
+                self._stop.wait(self.poll_interval)
+                since_recover += self.poll_interval
+                continue
+
+            self.process(job)
+            processed += 1
+            since_recover += self.poll_interval
+        return processed
+
+    def process(self, job: Dict):
+        handler = JOB_HANDLERS.get(job["kind"])
+        progress = job_queue.JobProgress(ProgressPublisher(
+            job["id"], job_queue.progress_broker, interval=job_queue.KB_JOB_PROGRESS_INTERVAL_SECONDS,
+        ))
+        logger.info(f"Worker {self.worker_id} running kb_job {job['id']} ({job['kind']}, attempt {job['attempts']}/{job['max_attempts']}).")
+
+        with job_queue.JobLease(job["id"], self.worker_id, progress) as lease:
+            try:
+                if handler is None:
+                    raise ValueError(f"No handler for kb_job kind '{job['kind']}'.")
+                stats = handler(job, progress)
+            except Exception as e:
+                if lease.lost.is_set():
+                    return
+                # Permanent failures use up the remaining attempts now.
+                max_attempts = job["attempts"] if isinstance(e, job_queue.PermanentJobError) else job["max_attempts"]
+                will_retry = job_queue.fail_job(job["id"], self.worker_id, str(e), job["attempts"], max_attempts)
+                progress.finish("queued" if will_retry else "failed", error=str(e))
+                logger.error(f"kb_job {job['id']} failed (attempt {job['attempts']}/{job['max_attempts']}, retry={will_retry}): {e}")
+                # A scope violation names another tenant's source; leave its status alone.
+                if not will_retry and job["kind"] in GIVE_UP_HANDLERS and not isinstance(e, job_queue.JobScopeError):
+                    try:
+                        GIVE_UP_HANDLERS[job["kind"]](job)
+                    except Exception as give_up_error:
+                        logger.error(f"Failed to finalize kb_job {job['id']}: {give_up_error}")
+                return
+
+        if lease.lost.is_set():
+            logger.warning(f"kb_job {job['id']} finished after its lease was lost; result not recorded.")
+            return
+        job_queue.complete_job(job["id"], self.worker_id, *progress.snapshot(), stats=stats)
+        progress.finish("done")
+        logger.info(f"kb_job {job['id']} done: {stats or {}}")
@@ -0,0 +1,26 @@
+-- kb_jobs as a durable work queue: ingest jobs, retry bookkeeping, worker leases.
+-- Workers claim rows with FOR UPDATE SKIP LOCKED and keep them alive with heartbeats.
+
+alter table public.kb_jobs drop constraint if exists kb_jobs_kind_check;
+alter table public.kb_jobs
+  add constraint kb_jobs_kind_check check (kind in ('retrain', 'ingest'));
+
+alter table public.kb_jobs
+  add column if not exists payload jsonb not null default '{}'::jsonb,
+  add column if not exists attempts integer not null default 0,
+  add column if not exists max_attempts integer not null default 3,
+  add column if not exists run_after timestamptz not null default now(),
+  add column if not exists locked_by text,
+  add column if not exists locked_at timestamptz,
+  add column if not exists heartbeat_at timestamptz,
+  add column if not exists finished_at timestamptz;
+
+-- Claim scan: oldest runnable queued job first.
+create index if not exists kb_jobs_claimable_idx
+  on public.kb_jobs (run_after, created_at)
+  where status = 'queued';
+
+-- Per-workspace concurrency check and stale-lease sweep.
+create index if not exists kb_jobs_processing_idx
+  on public.kb_jobs (workspace_id, heartbeat_at)
+  where status = 'processing';
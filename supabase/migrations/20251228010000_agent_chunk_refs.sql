@@ -0,0 +1,42 @@
+-- Chunks skipped at ingestion as near-duplicates of an already embedded chunk.
+-- Each row keeps the duplicate's source so retrieval can still cite every source
+-- that contains the text.
+create table if not exists public.agent_chunk_refs (
+  id uuid primary key default gen_random_uuid(),
+  agent_id uuid not null references public.agents(id) on delete cascade,
+  embedding_id uuid not null references public.agent_embeddings(id) on delete cascade,
+  source_id uuid not null references public.agent_sources(id) on delete cascade,
+  chunk_number integer not null,
+  created_at timestamptz not null default now()
+);
+
+create index if not exists agent_chunk_refs_embedding_idx on public.agent_chunk_refs (embedding_id);
+create index if not exists agent_chunk_refs_source_idx on public.agent_chunk_refs (source_id);
+
+alter table public.agent_chunk_refs enable row level security;
+
+drop policy if exists agent_chunk_refs_select_policy on public.agent_chunk_refs;
+create policy agent_chunk_refs_select_policy
+on public.agent_chunk_refs
+for select
+to authenticated
+using (
+  exists (select 1 from public.agents a where a.id = agent_id and public.is_workspace_member(a.workspace_id))
+);
+
+drop policy if exists agent_chunk_refs_write_policy on public.agent_chunk_refs;
+create policy agent_chunk_refs_write_policy
+on public.agent_chunk_refs
+for all
+to authenticated
+using (
+  exists (select 1 from public.agents a where a.id = agent_id and public.is_admin())
+  and exists (select 1 from public.agents a where a.id = agent_id and public.is_workspace_member(a.workspace_id))
+)
+with check (
+  exists (select 1 from public.agents a where a.id = agent_id and public.is_admin())
+  and exists (select 1 from public.agents a where a.id = agent_id and public.is_workspace_member(a.workspace_id))
+);
+
+-- Per-job outcome counters (chunks, embedded, duplicates, dedup_ratio).
+alter table public.kb_jobs add column if not exists stats jsonb not null default '{}'::jsonb;
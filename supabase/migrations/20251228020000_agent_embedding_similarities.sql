@@ -0,0 +1,26 @@
+-- Pairwise cosine similarity between a handful of an agent's stored chunks.
+-- Used to diversify packed RAG context (MMR) without shipping vectors to the backend.
+-- Rows come back once per unordered pair with left_id < right_id.
+create or replace function public.agent_embedding_similarities(
+  p_agent_id uuid,
+  p_ids uuid[]
+)
+returns table (
+  left_id uuid,
+  right_id uuid,
+  similarity float
+)
+language sql
+stable
+as $$
+  select
+    a.id,
+    b.id,
+    1 - (a.embedding <=> b.embedding) as similarity
+  from public.agent_embeddings a
+  join public.agent_embeddings b
+    on b.agent_id = a.agent_id and a.id < b.id
+  where a.agent_id = p_agent_id
+    and a.id = any(p_ids)
+    and b.id = any(p_ids);
+$$;
@@ -0,0 +1,23 @@
+-- Cheap change detector for an agent's stored chunks.
+-- Backend workers compare it with the fingerprint recorded in their on-disk
+-- lexical index snapshot and only re-read agent_embeddings when it differs.
+-- The id checksum catches a delete and an insert that leave count and max(created_at) unchanged.
+create or replace function public.agent_chunk_fingerprint(p_agent_id uuid)
+returns table (
+  chunk_count bigint,
+  latest_created_at timestamptz,
+  id_checksum bigint
+)
+language sql
+stable
+as $$
+  select
+    count(*),
+    max(created_at),
+    coalesce(sum(hashtext(id::text)::bigint), 0)
+  from public.agent_embeddings
+  where agent_id = p_agent_id;
+$$;
+
+create index if not exists agent_embeddings_agent_id_created_at_idx
+  on public.agent_embeddings (agent_id, created_at);
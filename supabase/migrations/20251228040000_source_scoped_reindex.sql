@@ -0,0 +1,60 @@
+-- Source-scoped deletes and reindex jobs.
+-- Updating or removing one knowledge source only touches that source's chunks
+-- instead of wiping and retraining the whole agent.
+
+alter table public.kb_jobs drop constraint if exists kb_jobs_kind_check;
+alter table public.kb_jobs
+  add constraint kb_jobs_kind_check check (kind in ('retrain', 'ingest', 'reindex'));
+
+-- Bulk delete by (agent_id, source_id).
+create index if not exists agent_embeddings_agent_source_idx
+  on public.agent_embeddings (agent_id, source_id);
+
+-- Deletes the chunks stored for one source.
+-- A chunk that other sources reference as a near-duplicate (agent_chunk_refs)
+-- is kept and moved to one of those sources, so their text stays searchable.
+-- Returns the number of chunks deleted and moved.
+create or replace function public.delete_source_embeddings(
+  p_agent_id uuid,
+  p_source_id uuid
+)
+returns table (
+  deleted integer,
+  moved integer
+)
+language plpgsql
+as $$
+declare
+  v_deleted integer;
+  v_moved integer;
+begin
+  -- This source's own duplicate references.
+  delete from public.agent_chunk_refs
+  where agent_id = p_agent_id and source_id = p_source_id;
+
+  -- Hand shared chunks over to the earliest other source that references them.
+  with heirs as (
+    select distinct on (r.embedding_id) r.id, r.embedding_id, r.source_id
+    from public.agent_chunk_refs r
+    join public.agent_embeddings e on e.id = r.embedding_id
+    where e.agent_id = p_agent_id and e.source_id = p_source_id
+    order by r.embedding_id, r.created_at
+  ), moved_rows as (
+    update public.agent_embeddings e
+    set source_id = h.source_id
+    from heirs h
+    where e.id = h.embedding_id
+    returning h.id
+  )
+  delete from public.agent_chunk_refs r
+  using moved_rows m
+  where r.id = m.id;
+  get diagnostics v_moved = row_count;
+
+  delete from public.agent_embeddings
+  where agent_id = p_agent_id and source_id = p_source_id;
+  get diagnostics v_deleted = row_count;
+
+  return query select v_deleted, v_moved;
+end;
+$$;
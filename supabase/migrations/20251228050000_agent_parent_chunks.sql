@@ -0,0 +1,91 @@
+-- Parent sections for small-to-big retrieval.
+-- Child chunks in agent_embeddings are embedded and searched; the parent
+-- section they belong to is what gets packed into the prompt.
+create table if not exists public.agent_parent_chunks (
+  id uuid primary key default gen_random_uuid(),
+  agent_id uuid not null references public.agents(id) on delete cascade,
+  source_id uuid not null references public.agent_sources(id) on delete cascade,
+  parent_number integer not null,
+  content text not null,
+  token_count integer not null,
+  created_at timestamptz not null default now()
+);
+
+create index if not exists agent_parent_chunks_agent_source_idx
+  on public.agent_parent_chunks (agent_id, source_id);
+
+alter table public.agent_embeddings
+  add column if not exists parent_id uuid references public.agent_parent_chunks(id) on delete set null;
+
+alter table public.agent_parent_chunks enable row level security;
+
+drop policy if exists agent_parent_chunks_select_policy on public.agent_parent_chunks;
+create policy agent_parent_chunks_select_policy
+on public.agent_parent_chunks
+for select
+to authenticated
+using (
+  exists (select 1 from public.agents a where a.id = agent_id and public.is_workspace_member(a.workspace_id))
+);
+
+drop policy if exists agent_parent_chunks_write_policy on public.agent_parent_chunks;
+create policy agent_parent_chunks_write_policy
+on public.agent_parent_chunks
+for all
+to authenticated
+using (
+  exists (select 1 from public.agents a where a.id = agent_id and public.is_admin())
+  and exists (select 1 from public.agents a where a.id = agent_id and public.is_workspace_member(a.workspace_id))
+)
+with check (
+  exists (select 1 from public.agents a where a.id = agent_id and public.is_admin())
+  and exists (select 1 from public.agents a where a.id = agent_id and public.is_workspace_member(a.workspace_id))
+);
+
+-- Source-scoped delete also removes the source's parent sections. Chunks moved
+-- to another source keep their text but lose the (deleted) parent link.
+create or replace function public.delete_source_embeddings(
+  p_agent_id uuid,
+  p_source_id uuid
+)
+returns table (
+  deleted integer,
+  moved integer
+)
+language plpgsql
+as $$
+declare
+  v_deleted integer;
+  v_moved integer;
+begin
+  delete from public.agent_chunk_refs
+  where agent_id = p_agent_id and source_id = p_source_id;
+
+  with heirs as (
+    select distinct on (r.embedding_id) r.id, r.embedding_id, r.source_id
+    from public.agent_chunk_refs r
+    join public.agent_embeddings e on e.id = r.embedding_id
+    where e.agent_id = p_agent_id and e.source_id = p_source_id
+    order by r.embedding_id, r.created_at
+  ), moved_rows as (
+    update public.agent_embeddings e
+    set source_id = h.source_id
+    from heirs h
+    where e.id = h.embedding_id
+    returning h.id
+  )
+  delete from public.agent_chunk_refs r
+  using moved_rows m
+  where r.id = m.id;
+  get diagnostics v_moved = row_count;
+
+  delete from public.agent_embeddings
+  where agent_id = p_agent_id and source_id = p_source_id;
+  get diagnostics v_deleted = row_count;
+
+  delete from public.agent_parent_chunks
+  where agent_id = p_agent_id and source_id = p_source_id;
+
+  return query select v_deleted, v_moved;
+end;
+$$;
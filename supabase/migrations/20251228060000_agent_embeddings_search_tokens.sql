@@ -0,0 +1,9 @@
+-- Normalized lexical search terms, computed once at ingestion.
+-- search_tokens is the space-separated output of the backend tokenizer
+-- (Arabic alef/hamza/ya/ta marbuta variants, diacritics, tatweel and
+-- Arabic-Indic digits normalized; stopwords removed). search_version is the
+-- tokenizer version that produced it; rows from older versions (or NULL) are
+-- re-tokenized when an agent's lexical index is built.
+alter table public.agent_embeddings
+  add column if not exists search_tokens text,
+  add column if not exists search_version smallint;
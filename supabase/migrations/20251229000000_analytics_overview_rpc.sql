@@ -0,0 +1,69 @@
+-- Single-round-trip aggregate for the analytics overview.
+-- Replaces reading every analytics_daily_summary and analytics_message_sentiment
+-- row for the range into the backend (which PostgREST's max_rows silently
+-- truncated on long ranges): totals, response-time stats and sentiment counts
+-- come back as one row whatever the range length.
+-- Runs as the caller, so RLS on the underlying views still applies.
+-- plpgsql so the function can be created before the analytics views exist.
+create or replace function public.analytics_overview(
+  p_workspace_id uuid,
+  p_start_date date,
+  p_end_date date,
+  p_agent_id uuid default null,
+  p_channel text default null
+)
+returns table (
+  total_messages bigint,
+  ai_responses bigint,
+  avg_response_time numeric,
+  min_daily_response_time numeric,
+  max_daily_response_time numeric,
+  positive_count bigint,
+  neutral_count bigint,
+  negative_count bigint
+)
+language plpgsql
+stable
+as $$
+begin
+  return query
+  with summary as (
+    select
+      coalesce(sum(s.total_messages), 0)::bigint as total_messages,
+      coalesce(sum(s.ai_responses), 0)::bigint as ai_responses,
+      -- Per-day averages weighted by that day's message count.
+      sum(s.avg_response_time_sum * s.total_messages)::numeric
+        / nullif(sum(s.total_messages), 0) as avg_response_time,
+      min(s.avg_response_time_sum)::numeric as min_daily_response_time,
+      max(s.avg_response_time_sum)::numeric as max_daily_response_time
+    from public.analytics_daily_summary s
+    where s.workspace_id = p_workspace_id
+      and s.date between p_start_date and p_end_date
+      and (p_agent_id is null or s.agent_id = p_agent_id)
+      and (p_channel is null or s.channel = p_channel)
+  ),
+  sentiment as (
+    select
+      coalesce(sum(m.positive_count), 0)::bigint as positive_count,
+      coalesce(sum(m.neutral_count), 0)::bigint as neutral_count,
+      coalesce(sum(m.negative_count), 0)::bigint as negative_count
+    from public.analytics_message_sentiment m
+    where m.workspace_id = p_workspace_id
+      and m.date between p_start_date and p_end_date
+      and (p_agent_id is null or m.agent_id = p_agent_id)
+      and (p_channel is null or m.channel = p_channel)
+  )
+  select
+    summary.total_messages,
+    summary.ai_responses,
+    round(coalesce(summary.avg_response_time, 0), 2),
+    summary.min_daily_response_time,
+    summary.max_daily_response_time,
+    sentiment.positive_count,
+    sentiment.neutral_count,
+    sentiment.negative_count
+  from summary cross join sentiment;
+end;
+$$;
+
+grant execute on function public.analytics_overview(uuid, date, date, uuid, text) to authenticated;
@@ -0,0 +1,74 @@
+-- Per-day form of analytics_overview, used to fill the backend's date-tiled
+-- analytics cache (analytics/tiles.py). Each row holds the additive parts of
+-- one day's overview, so any range is composed from cached days:
+-- response_time_weighted is sum(daily average * messages), and the range
+-- average is sum(response_time_weighted) / sum(total_messages).
+-- Days without activity have no row.
+create or replace function public.analytics_daily_overview(
+  p_workspace_id uuid,
+  p_start_date date,
+  p_end_date date,
+  p_agent_id uuid default null,
+  p_channel text default null
+)
+returns table (
+  date date,
+  total_messages bigint,
+  ai_responses bigint,
+  response_time_weighted numeric,
+  min_daily_response_time numeric,
+  max_daily_response_time numeric,
+  positive_count bigint,
+  neutral_count bigint,
+  negative_count bigint
+)
+language plpgsql
+stable
+as $$
+begin
+  return query
+  with summary as (
+    select
+      s.date as day,
+      coalesce(sum(s.total_messages), 0)::bigint as total_messages,
+      coalesce(sum(s.ai_responses), 0)::bigint as ai_responses,
+      coalesce(sum(s.avg_response_time_sum * s.total_messages), 0)::numeric as response_time_weighted,
+      min(s.avg_response_time_sum)::numeric as min_daily_response_time,
+      max(s.avg_response_time_sum)::numeric as max_daily_response_time
+    from public.analytics_daily_summary s
+    where s.workspace_id = p_workspace_id
+      and s.date between p_start_date and p_end_date
+      and (p_agent_id is null or s.agent_id = p_agent_id)
+      and (p_channel is null or s.channel = p_channel)
+    group by s.date
+  ),
+  sentiment as (
+    select
+      m.date as day,
+      coalesce(sum(m.positive_count), 0)::bigint as positive_count,
+      coalesce(sum(m.neutral_count), 0)::bigint as neutral_count,
+      coalesce(sum(m.negative_count), 0)::bigint as negative_count
+    from public.analytics_message_sentiment m
+    where m.workspace_id = p_workspace_id
+      and m.date between p_start_date and p_end_date
+      and (p_agent_id is null or m.agent_id = p_agent_id)
+      and (p_channel is null or m.channel = p_channel)
+    group by m.date
+  )
+  select
+    coalesce(summary.day, sentiment.day),
+    coalesce(summary.total_messages, 0),
+    coalesce(summary.ai_responses, 0),
+    coalesce(summary.response_time_weighted, 0),
+    summary.min_daily_response_time,
+    summary.max_daily_response_time,
+    coalesce(sentiment.positive_count, 0),
+    coalesce(sentiment.neutral_count, 0),
+    coalesce(sentiment.negative_count, 0)
+  from summary
+  full outer join sentiment on sentiment.day = summary.day
+  order by 1;
+end;
+$$;
+
+grant execute on function public.analytics_daily_overview(uuid, date, date, uuid, text) to authenticated;
@@ -0,0 +1,45 @@
+-- Server-side bucketing of usage_events for insights (usage spike detection).
+-- Returns one row per (bucket, event_type) instead of every event, so the
+-- payload depends on the number of days/hours in the range, not on traffic.
+-- Buckets are UTC; the range is [p_start, p_end).
+create or replace function public.usage_event_buckets(
+  p_workspace_id uuid,
+  p_start timestamptz,
+  p_end timestamptz,
+  p_bucket text default 'day'
+)
+returns table (
+  bucket timestamptz,
+  event_type text,
+  events bigint,
+  quantity bigint
+)
+language plpgsql
+stable
+as $$
+begin
+  if p_bucket not in ('hour', 'day') then
+    raise exception 'usage_event_buckets: bucket must be hour or day, got %', p_bucket;
+  end if;
+
+  return query
+  select
+    date_trunc(p_bucket, e.created_at at time zone 'UTC') at time zone 'UTC',
+    e.event_type,
+    count(*)::bigint,
+    coalesce(sum(e.quantity), 0)::bigint
+  from public.usage_events e
+  where e.workspace_id = p_workspace_id
+    and e.created_at >= p_start
+    and e.created_at < p_end
+  group by 1, 2
+  order by 1, 2;
+end;
+$$;
+
+grant execute on function public.usage_event_buckets(uuid, timestamptz, timestamptz, text) to authenticated;
+
+-- Keyset pagination over a workspace's events ((created_at, id) > last seen)
+-- for the raw-row fallback.
+create index if not exists usage_events_workspace_created_id_idx
+  on public.usage_events (workspace_id, created_at, id);
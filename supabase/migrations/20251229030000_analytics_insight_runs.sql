@@ -0,0 +1,23 @@
+-- Checkpoints for fleet-wide structured insight runs (analytics.insight_fleet).
+-- One row per (period, shard layout, shard): the last workspace id the shard
+-- finished, so an interrupted run resumes after it instead of starting over.
+-- Written by the worker through the database connection only; RLS is enabled
+-- without policies so the table is invisible to API clients.
+create table if not exists public.analytics_insight_runs (
+  period_start date not null,
+  period_end date not null,
+  shard_count integer not null,
+  shard integer not null,
+  status text not null default 'running' check (status in ('running', 'done')),
+  last_workspace_id uuid,
+  processed integer not null default 0,
+  failed integer not null default 0,
+  insights integer not null default 0,
+  last_error text,
+  started_at timestamptz not null default now(),
+  updated_at timestamptz not null default now(),
+  primary key (period_start, period_end, shard_count, shard),
+  check (shard >= 0 and shard < shard_count)
+);
+
+alter table public.analytics_insight_runs enable row level security;
@@ -0,0 +1,139 @@
+-- Incrementally maintained rollup of analytics_daily_summary and
+-- analytics_message_sentiment at (workspace, agent, channel, day) grain.
+-- Written by the analytics rollup worker (analytics/rollup.py), which
+-- re-aggregates only the (workspace, day) slices that received messages or
+-- usage events since its high-water mark. Dashboard reads (the overview RPCs
+-- and the timeseries) go to this table, so their cost no longer grows with
+-- message volume.
+--
+-- Deploy order: the RPCs below read only the rollup, which is empty until the
+-- worker has run. Run `python manage.py analytics_rollup_worker --once` right
+-- after applying this migration and before web traffic reaches it (then keep
+-- the worker running); until then the overview reports zeros.
+create table if not exists public.analytics_daily_rollup (
+  workspace_id uuid not null references public.workspaces(id) on delete cascade,
+  agent_id uuid,
+  channel text,
+  date date not null,
+  total_messages bigint not null default 0,
+  ai_responses bigint not null default 0,
+  avg_response_time_sum numeric,
+  positive_count bigint not null default 0,
+  neutral_count bigint not null default 0,
+  negative_count bigint not null default 0,
+  refreshed_at timestamptz not null default now()
+);
+
+create unique index if not exists analytics_daily_rollup_key_idx
+  on public.analytics_daily_rollup (
+    workspace_id, date,
+    coalesce(agent_id, '00000000-0000-0000-0000-000000000000'::uuid),
+    coalesce(channel, '')
+  );
+
+alter table public.analytics_daily_rollup enable row level security;
+
+drop policy if exists "analytics_daily_rollup_select_member" on public.analytics_daily_rollup;
+create policy "analytics_daily_rollup_select_member"
+  on public.analytics_daily_rollup for select
+  using (public.is_workspace_member(workspace_id));
+
+-- High-water mark of the rollup worker: every change created before it has
+-- been rolled up. Worker-only; RLS without policies.
+create table if not exists public.analytics_rollup_state (
+  name text primary key,
+  high_water_mark timestamptz,
+  updated_at timestamptz not null default now()
+);
+
+alter table public.analytics_rollup_state enable row level security;
+
+insert into public.analytics_rollup_state (name) values ('analytics_daily_rollup')
+on conflict (name) do nothing;
+
+-- Window scans of the worker.
+create index if not exists chat_messages_created_at_idx on public.chat_messages (created_at);
+create index if not exists usage_events_created_at_idx on public.usage_events (created_at);
+
+-- The overview RPCs now read the rollup; signatures and results are unchanged.
+create or replace function public.analytics_overview(
+  p_workspace_id uuid,
+  p_start_date date,
+  p_end_date date,
+  p_agent_id uuid default null,
+  p_channel text default null
+)
+returns table (
+  total_messages bigint,
+  ai_responses bigint,
+  avg_response_time numeric,
+  min_daily_response_time numeric,
+  max_daily_response_time numeric,
+  positive_count bigint,
+  neutral_count bigint,
+  negative_count bigint
+)
+language plpgsql
+stable
+as $$
+begin
+  return query
+  select
+    coalesce(sum(r.total_messages), 0)::bigint,
+    coalesce(sum(r.ai_responses), 0)::bigint,
+    round(coalesce(sum(r.avg_response_time_sum * r.total_messages) / nullif(sum(r.total_messages), 0), 0), 2),
+    min(r.avg_response_time_sum)::numeric,
+    max(r.avg_response_time_sum)::numeric,
+    coalesce(sum(r.positive_count), 0)::bigint,
+    coalesce(sum(r.neutral_count), 0)::bigint,
+    coalesce(sum(r.negative_count), 0)::bigint
+  from public.analytics_daily_rollup r
+  where r.workspace_id = p_workspace_id
+    and r.date between p_start_date and p_end_date
+    and (p_agent_id is null or r.agent_id = p_agent_id)
+    and (p_channel is null or r.channel = p_channel);
+end;
+$$;
+
+create or replace function public.analytics_daily_overview(
+  p_workspace_id uuid,
+  p_start_date date,
+  p_end_date date,
+  p_agent_id uuid default null,
+  p_channel text default null
+)
+returns table (
+  date date,
+  total_messages bigint,
+  ai_responses bigint,
+  response_time_weighted numeric,
+  min_daily_response_time numeric,
+  max_daily_response_time numeric,
+  positive_count bigint,
+  neutral_count bigint,
+  negative_count bigint
+)
+language plpgsql
+stable
+as $$
+begin
+  return query
+  select
+    r.date,
+    coalesce(sum(r.total_messages), 0)::bigint,
+    coalesce(sum(r.ai_responses), 0)::bigint,
+    coalesce(sum(r.avg_response_time_sum * r.total_messages), 0)::numeric,
+    min(r.avg_response_time_sum)::numeric,
+    max(r.avg_response_time_sum)::numeric,
+    coalesce(sum(r.positive_count), 0)::bigint,
+    coalesce(sum(r.neutral_count), 0)::bigint,
+    coalesce(sum(r.negative_count), 0)::bigint
+  from public.analytics_daily_rollup r
+  where r.workspace_id = p_workspace_id
+    and r.date between p_start_date and p_end_date
+    and (p_agent_id is null or r.agent_id = p_agent_id)
+    and (p_channel is null or r.channel = p_channel)
+  group by r.date
+  order by r.date;
+end;
+$$;
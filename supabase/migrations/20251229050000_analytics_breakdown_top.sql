@@ -0,0 +1,81 @@
+-- Top-N breakdowns aggregated in the database. Sums `p_order_by` per
+-- dimension value (agent, channel or topic) over the range, returns the
+-- `p_limit` largest, and folds the rest into a single "other" row, so the
+-- payload is at most p_limit + 1 rows whatever the number of agents,
+-- channels or days. A null p_limit returns the full ranking without "other".
+-- Runs as the caller, so RLS on the underlying views still applies.
+-- plpgsql so the function can be created before the analytics views exist.
+create or replace function public.analytics_breakdown_top(
+  p_workspace_id uuid,
+  p_start_date date,
+  p_end_date date,
+  p_breakdown_by text,
+  p_order_by text default 'total_messages',
+  p_limit integer default 10,
+  p_agent_id uuid default null,
+  p_channel text default null
+)
+returns table (
+  key text,
+  label text,
+  value numeric,
+  rank integer,
+  is_other boolean,
+  members integer
+)
+language plpgsql
+stable
+as $$
+declare
+  v_view text;
+  v_key text;
+  v_label text;
+begin
+  case p_breakdown_by
+    when 'agent' then v_view := 'analytics_agent_performance'; v_key := 'agent_id'; v_label := 'agent_name';
+    when 'channel' then v_view := 'analytics_channel_usage'; v_key := 'channel'; v_label := 'channel';
+    when 'topic' then v_view := 'analytics_message_topic_breakdown'; v_key := 'topic'; v_label := 'topic';
+    else raise exception 'analytics_breakdown_top: invalid breakdown %', p_breakdown_by;
+  end case;
+  if p_order_by !~ '^[a-z_]{1,63}$' then
+    raise exception 'analytics_breakdown_top: invalid order_by %', p_order_by;
+  end if;
+  if p_limit is not null and p_limit < 1 then
+    raise exception 'analytics_breakdown_top: limit must be positive, got %', p_limit;
+  end if;
+
+  return query execute format($sql$
+    with grouped as (
+      select
+        r->>%2$L as key,
+        max(r->>%3$L) as label,
+        coalesce(sum((r->>%4$L)::numeric), 0) as value
+      from (
+        select to_jsonb(v) as r
+        from public.%1$I v
+        where v.workspace_id = $1
+          and v.date between $2 and $3
+          and ($4::uuid is null or %5$L = 'agent' or v.agent_id = $4)
+          and ($5::text is null or %5$L = 'channel' or v.channel = $5)
+      ) rows
+      group by 1
+    ),
+    ranked as (
+      select g.*, row_number() over (order by g.value desc, g.key) as position
+      from grouped g
+    )
+    select key, label, value, position::integer, false, 1
+    from ranked
+    where $6::integer is null or position <= $6
+    union all
+    select null, 'other', sum(value), null, true, count(*)::integer
+    from ranked
+    where $6::integer is not null and position > $6
+    having count(*) > 0
+    order by 5, 4
+  $sql$, v_view, v_key, v_label, p_order_by, p_breakdown_by)
+  using p_workspace_id, p_start_date, p_end_date, p_agent_id, p_channel, p_limit;
+end;
+$$;
+
+grant execute on function public.analytics_breakdown_top(uuid, date, date, text, text, integer, uuid, text) to authenticated;
@@ -0,0 +1,38 @@
+-- Per-workspace change watermarks for conditional GETs on the analytics API.
+-- data_changed_at moves whenever the rollup worker rewrites any of the
+-- workspace's analytics_daily_rollup slices; insights_changed_at whenever an
+-- insight is inserted for it. The API derives ETag/Last-Modified from these
+-- and answers 304 without running the analytics queries.
+create table if not exists public.analytics_watermarks (
+  workspace_id uuid primary key references public.workspaces(id) on delete cascade,
+  data_changed_at timestamptz,
+  insights_changed_at timestamptz
+);
+
+alter table public.analytics_watermarks enable row level security;
+
+drop policy if exists "analytics_watermarks_select_member" on public.analytics_watermarks;
+create policy "analytics_watermarks_select_member"
+  on public.analytics_watermarks for select
+  using (public.is_workspace_member(workspace_id));
+
+-- Insights are written by API users (RLS) as well as workers, so the bump runs as definer.
+create or replace function public.bump_analytics_insights_watermark()
+returns trigger
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+  insert into public.analytics_watermarks (workspace_id, insights_changed_at)
+  select distinct i.workspace_id, now() from inserted i
+  on conflict (workspace_id) do update set insights_changed_at = excluded.insights_changed_at;
+  return null;
+end;
+$$;
+
+drop trigger if exists analytics_insights_watermark on public.analytics_insights;
+create trigger analytics_insights_watermark
+  after insert on public.analytics_insights
+  referencing new table as inserted
+  for each statement execute function public.bump_analytics_insights_watermark();
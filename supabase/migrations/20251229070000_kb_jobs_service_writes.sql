@@ -0,0 +1,7 @@
+-- kb_jobs are executed by kb_worker with the service-role key, so a row is a
+-- request to act outside RLS. Members may read their workspace's jobs, but
+-- only the backend (service role, after checking the job's agent and source
+-- belong to the workspace) may create or change them.
+drop policy if exists "kb_jobs_write" on public.kb_jobs;
+
+revoke insert, update, delete on public.kb_jobs from anon, authenticated;
@@ -0,0 +1,16 @@
+-- Exposes how far analytics_daily_rollup is complete, so the API only caches
+-- a day's tiles for good once the rollup worker has moved past it.
+-- analytics_rollup_state has no member policies (it is not per workspace),
+-- hence the definer function instead of a select grant.
+create or replace function public.analytics_rollup_mark()
+returns timestamptz
+language sql
+stable
+security definer
+set search_path = public
+as $$
+  select high_water_mark from public.analytics_rollup_state where name = 'analytics_daily_rollup';
+$$;
+
+revoke execute on function public.analytics_rollup_mark() from public;
+grant execute on function public.analytics_rollup_mark() to authenticated;
@@ -0,0 +1,102 @@
+-- Slices of analytics_daily_rollup that changed without a new row inside the
+-- worker's scan window: updated or deleted chat_messages/usage_events rows,
+-- rows inserted back-dated behind the high-water mark, and conversations
+-- whose enrichment (sentiment) was written after their messages were rolled
+-- up. Triggers record the (workspace, day) slices here; each worker step
+-- claims and re-aggregates them together with its window (analytics/rollup.py).
+create table if not exists public.analytics_rollup_dirty (
+  workspace_id uuid not null,
+  day date not null,
+  primary key (workspace_id, day)
+);
+
+alter table public.analytics_rollup_dirty enable row level security;
+
+-- Moves when the worker re-rolls a past day of the workspace from a dirty
+-- slice. The API puts it in the key of closed rollup tiles (analytics.tiles),
+-- which are otherwise cached for good.
+alter table public.analytics_watermarks add column if not exists history_changed_at timestamptz;
+
+create or replace function public.mark_analytics_rollup_dirty_rows()
+returns trigger
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+  if tg_op in ('UPDATE', 'DELETE') then
+    insert into public.analytics_rollup_dirty (workspace_id, day)
+    select distinct o.workspace_id, (o.created_at at time zone 'UTC')::date
+    from old_rows o
+    where o.workspace_id is not null and o.created_at is not null
+    on conflict do nothing;
+  end if;
+  if tg_op = 'UPDATE' then
+    insert into public.analytics_rollup_dirty (workspace_id, day)
+    select distinct n.workspace_id, (n.created_at at time zone 'UTC')::date
+    from new_rows n
+    where n.workspace_id is not null and n.created_at is not null
+    on conflict do nothing;
+  end if;
+  if tg_op = 'INSERT' then
+    -- Rows at or after the mark are picked up by the worker's next window anyway.
+    insert into public.analytics_rollup_dirty (workspace_id, day)
+    select distinct n.workspace_id, (n.created_at at time zone 'UTC')::date
+    from new_rows n
+    where n.workspace_id is not null
+      and n.created_at < (select high_water_mark from public.analytics_rollup_state where name = 'analytics_daily_rollup')
+    on conflict do nothing;
+  end if;
+  return null;
+end;
+$$;
+
+do $$
+declare
+  v_table text;
+begin
+  foreach v_table in array array['chat_messages', 'usage_events'] loop
+    execute format('drop trigger if exists analytics_rollup_dirty_insert on public.%I', v_table);
+    execute format('create trigger analytics_rollup_dirty_insert after insert on public.%I
+      referencing new table as new_rows
+      for each statement execute function public.mark_analytics_rollup_dirty_rows()', v_table);
+    execute format('drop trigger if exists analytics_rollup_dirty_update on public.%I', v_table);
+    execute format('create trigger analytics_rollup_dirty_update after update on public.%I
+      referencing old table as old_rows new table as new_rows
+      for each statement execute function public.mark_analytics_rollup_dirty_rows()', v_table);
+    execute format('drop trigger if exists analytics_rollup_dirty_delete on public.%I', v_table);
+    execute format('create trigger analytics_rollup_dirty_delete after delete on public.%I
+      referencing old table as old_rows
+      for each statement execute function public.mark_analytics_rollup_dirty_rows()', v_table);
+  end loop;
+end;
+$$;
+
+-- Sentiment comes from the conversation (chat session), written by message
+-- enrichment after the fact: dirty every day its messages fall on.
+create or replace function public.mark_analytics_rollup_dirty_conversations()
+returns trigger
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+  insert into public.analytics_rollup_dirty (workspace_id, day)
+  select distinct m.workspace_id, (m.created_at at time zone 'UTC')::date
+  from new_rows n
+  join old_rows o on o.id = n.id
+  join public.chat_messages m on m.session_id = n.id
+  where n.sentiment_score is distinct from o.sentiment_score
+    and m.workspace_id is not null
+  on conflict do nothing;
+  return null;
+end;
+$$;
+
+create index if not exists chat_messages_session_id_idx on public.chat_messages (session_id);
+
+drop trigger if exists analytics_rollup_dirty_enrichment on public.conversations;
+create trigger analytics_rollup_dirty_enrichment
+  after update on public.conversations
+  referencing old table as old_rows new table as new_rows
+  for each statement execute function public.mark_analytics_rollup_dirty_conversations();
@@ -0,0 +1,6 @@
+-- Workspaces whose insights failed in a fleet run (analytics.insight_fleet).
+-- The checkpoint moves past a failed workspace, so its id is kept here; each
+-- run retries the listed workspaces before finishing the shard, removes the
+-- ones that succeed, and leaves the shard 'running' while any remain.
+alter table public.analytics_insight_runs
+  add column if not exists failed_workspace_ids uuid[] not null default '{}';
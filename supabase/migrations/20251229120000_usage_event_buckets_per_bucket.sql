@@ -0,0 +1,51 @@
+-- usage_event_buckets returned one row per (bucket, event_type), so a range
+-- with many event types could pass PostgREST's max_rows (1000) and be cut off
+-- silently. It now returns one row per bucket, with the per-type quantities
+-- folded into by_event_type; callers request at most 1000 buckets per call.
+-- The return type changes, so the function is dropped and recreated.
+drop function if exists public.usage_event_buckets(uuid, timestamptz, timestamptz, text);
+
+create function public.usage_event_buckets(
+  p_workspace_id uuid,
+  p_start timestamptz,
+  p_end timestamptz,
+  p_bucket text default 'day'
+)
+returns table (
+  bucket timestamptz,
+  events bigint,
+  quantity bigint,
+  by_event_type jsonb
+)
+language plpgsql
+stable
+as $$
+begin
+  if p_bucket not in ('hour', 'day') then
+    raise exception 'usage_event_buckets: bucket must be hour or day, got %', p_bucket;
+  end if;
+
+  return query
+  select
+    t.bucket,
+    sum(t.events)::bigint,
+    sum(t.quantity)::bigint,
+    jsonb_object_agg(coalesce(t.event_type, 'unknown'), t.quantity)
+  from (
+    select
+      date_trunc(p_bucket, e.created_at at time zone 'UTC') at time zone 'UTC' as bucket,
+      e.event_type,
+      count(*)::bigint as events,
+      coalesce(sum(e.quantity), 0)::bigint as quantity
+    from public.usage_events e
+    where e.workspace_id = p_workspace_id
+      and e.created_at >= p_start
+      and e.created_at < p_end
+    group by 1, 2
+  ) t
+  group by t.bucket
+  order by t.bucket;
+end;
+$$;
+
+grant execute on function public.usage_event_buckets(uuid, timestamptz, timestamptz, text) to authenticated;